@@ -2,7 +2,163 @@
 Authentication provider for Kachaka MCP Server.
 """
 
-from typing import Dict, List, Optional, Set
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from fnmatch import fnmatchcase
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+from .utils.config import RateLimitConfig
+
+
+# 現在のリクエストのAPIキー（ネットワークトランスポートのミドルウェアが設定する）
+current_api_key: ContextVar[Optional[str]] = ContextVar("current_api_key", default=None)
+
+# APIキーがない場合（stdioや認証なし）に使うキー
+ANONYMOUS_KEY = "anonymous"
+
+# 管理者用のツール名の接頭辞とリソースのスキーム
+ADMIN_TOOL_PREFIX = "admin_"
+ADMIN_RESOURCE_SCHEME = "admin://"
+
+# ツール名・リソースURIのパターンからレート制限のクラスへの対応
+DEFAULT_RATE_LIMIT_CLASSES: Dict[str, str] = {
+    "move_*": "motion",
+    "return_home": "motion",
+    "return_shelf": "motion",
+    "rotate_in_place": "motion",
+    "set_robot_velocity": "motion",
+    "dock_*": "motion",
+    "undock_shelf": "motion",
+    "plan_and_run_deliveries": "motion",
+    "fleet_broadcast": "motion",
+    "dispatch_task": "motion",
+    "sensors://camera/*": "camera",
+}
+
+
+class RateLimitExceeded(Exception):
+    """レート制限・同時実行数の上限に達した"""
+
+    def __init__(self, limit_class: str, reason: str, retry_after: float):
+        self.limit_class = limit_class
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            f"Rate limit exceeded for {limit_class} ({reason}): retry after {retry_after:.1f}s"
+        )
+
+
+class AdminRequired(Exception):
+    """管理者のAPIキーが必要なツール・リソースを管理者以外が呼び出した"""
+
+    def __init__(self, target: str):
+        self.target = target
+        super().__init__(f"{target} requires an admin API key")
+
+
+def is_admin_target(target: str) -> bool:
+    """管理者用のツール名・リソースURIかどうか"""
+    return target.startswith(ADMIN_TOOL_PREFIX) or target.startswith(ADMIN_RESOURCE_SCHEME)
+
+
+class TokenBucket:
+    """トークンバケット"""
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> Tuple[bool, float]:
+        """トークンを1つ取得する
+
+        Returns:
+            取得できたかどうかと、取得できない場合の再試行までの秒数
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_sec)
+        self.updated = now
+
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True, 0.0
+        return False, (1.0 - self.tokens) / self.rate_per_sec
+
+
+class RateLimiter:
+    """APIキーごと・クラスごとのレート制限と同時実行数の制限"""
+
+    def __init__(
+        self,
+        limits: Dict[str, RateLimitConfig],
+        classes: Optional[Dict[str, str]] = None,
+    ):
+        """初期化
+
+        Args:
+            limits: クラスごとのレート制限
+            classes: パターンからクラスへの対応（デフォルトの対応より優先）
+        """
+        self.limits = dict(limits)
+        # 設定のパターンを先に照合し、デフォルトの "move_*" などより優先する
+        self.classes = dict(classes or {})
+        for pattern, limit_class in DEFAULT_RATE_LIMIT_CLASSES.items():
+            self.classes.setdefault(pattern, limit_class)
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._in_flight: Dict[Tuple[str, str], int] = {}
+
+    def classify(self, name: str) -> str:
+        """ツール名・リソースURIをクラスに分類"""
+        for pattern, limit_class in self.classes.items():
+            if fnmatchcase(name, pattern):
+                return limit_class
+        return "default"
+
+    def _check(self, key: Tuple[str, str], limit: RateLimitConfig) -> None:
+        """上限に達していれば RateLimitExceeded を送出"""
+        limit_class = key[1]
+        if limit.max_in_flight and self._in_flight.get(key, 0) >= limit.max_in_flight:
+            # 実行中のリクエストの完了時間は分からないため、補充間隔を目安にする
+            retry_after = 1.0 / limit.rate_per_sec if limit.rate_per_sec > 0 else 1.0
+            raise RateLimitExceeded(limit_class, "too many in-flight requests", retry_after)
+
+        if limit.rate_per_sec > 0:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(limit.rate_per_sec, limit.burst)
+                self._buckets[key] = bucket
+            allowed, retry_after = bucket.try_acquire()
+            if not allowed:
+                raise RateLimitExceeded(limit_class, "rate limit", retry_after)
+
+    @asynccontextmanager
+    async def limit(self, name: str, api_key: Optional[str] = None) -> AsyncIterator[None]:
+        """リクエストの実行枠を確保する
+
+        上限に達している場合は待たずに RateLimitExceeded を送出する。
+
+        Args:
+            name: ツール名またはリソースURI
+            api_key: APIキー（Noneの場合は現在のリクエストのキー）
+        """
+        limit_class = self.classify(name)
+        limit = self.limits.get(limit_class)
+        if limit is None:
+            yield
+            return
+
+        api_key = api_key or current_api_key.get() or ANONYMOUS_KEY
+        key = (api_key, limit_class)
+        self._check(key, limit)
+
+        self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            self._in_flight[key] -= 1
+
 
 # MCP SDKのバージョンによって認証関連のクラスが異なる可能性があるため、
 # 簡易的な認証プロバイダーを実装
@@ -14,7 +170,9 @@ class KachakaAuthProvider:
         from .utils.config import load_config
         self.config = load_config()
         self.api_keys: Set[str] = set(self.config.api_keys)
+        self.admin_api_keys: Set[str] = set(self.config.admin_api_keys)
         self.clients: Dict[str, Dict] = {}
+        self.rate_limiter = RateLimiter(self.config.rate_limits, self.config.rate_limit_classes)
     
     async def validate_client_credentials(self, client_id: str, client_secret: str) -> bool:
         """クライアント認証情報の検証
@@ -27,7 +185,11 @@ class KachakaAuthProvider:
             認証情報が有効かどうか
         """
         # APIキーが設定されていない場合は認証を無効化
-        if not self.api_keys:
+        if not self.api_keys and not self.admin_api_keys:
             return True
         
-        return client_secret in self.api_keys
\ No newline at end of file
+        return client_secret in self.api_keys or client_secret in self.admin_api_keys
+
+    def is_admin(self, api_key: Optional[str]) -> bool:
+        """管理者のAPIキーかどうか"""
+        return api_key is not None and api_key in self.admin_api_keys
\ No newline at end of file
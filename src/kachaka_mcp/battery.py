@@ -0,0 +1,341 @@
+"""
+Battery model for Kachaka MCP Server.
+
+This module samples battery level and odometry in the background, learns how
+much charge the robot uses per metre driven and per minute of operation, and
+checks before a motion or shelf command whether the robot can finish the task
+and still get back to the charger.
+"""
+
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+
+# この時間より間隔の空いたサンプルは学習に使わない（その間に充電した可能性がある）
+MAX_SAMPLE_GAP_SEC = 600.0
+
+# この速度より速い移動は自己位置の修正とみなし、走行距離に含めない（メートル毎秒）
+MAX_ODOMETRY_SPEED = 1.5
+
+T = TypeVar("T")
+
+
+class BatteryRefused(Exception):
+    """電池が持たないためコマンドを送信しなかった"""
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+@dataclass
+class BatterySample:
+    """電池残量と位置のサンプル"""
+    time: float
+    percentage: float
+    position: Tuple[float, float]
+    status: int
+
+
+class BatteryModel:
+    """走行距離と時間あたりの電池の消費量を学習するモデル
+
+    連続する放電中のサンプルの間の電池残量の減少を、走行距離（メートル）と
+    経過時間（分）の線形和として最小二乗法で推定する。初期値を事前分布として
+    扱い、サンプルが少ないうちは初期値に近い値を返す。
+    """
+
+    def __init__(
+        self,
+        per_metre: float = 0.05,
+        per_minute: float = 0.1,
+        charge_per_minute: float = 0.5,
+        prior_weight: float = 20.0,
+        forgetting: float = 0.999,
+    ):
+        """初期化
+
+        Args:
+            per_metre: 1メートルあたりの消費量の初期値（%）
+            per_minute: 1分あたりの消費量の初期値（%）
+            charge_per_minute: 1分あたりの充電量の初期値（%）
+            prior_weight: 初期値の重み（1分・1メートルの観測数相当）
+            forgetting: 古いサンプルの重みを減らす係数（サンプルごと）
+        """
+        self.prior = np.array([per_metre, per_minute], dtype=np.float64)
+        self.prior_weight = prior_weight
+        self.forgetting = forgetting
+        self._xx = np.zeros((2, 2))
+        self._xy = np.zeros(2)
+        self.charge_per_minute = charge_per_minute
+        self.samples = 0
+        self.distance_m = 0.0
+        self.last: Optional[BatterySample] = None
+
+    def add_sample(self, sample: BatterySample) -> None:
+        """サンプルを追加して学習する"""
+        last, self.last = self.last, sample
+        if last is None:
+            return
+        dt = sample.time - last.time
+        if dt <= 0 or dt > MAX_SAMPLE_GAP_SEC:
+            return
+        distance = math.hypot(sample.position[0] - last.position[0], sample.position[1] - last.position[1])
+        if distance > MAX_ODOMETRY_SPEED * dt:
+            distance = 0.0
+        self.distance_m += distance
+        discharging = pb2.PowerSupplyStatus.POWER_SUPPLY_STATUS_DISCHARGING
+        charging = pb2.PowerSupplyStatus.POWER_SUPPLY_STATUS_CHARGING
+
+        if sample.status == discharging and last.status == discharging:
+            x = np.array([distance, dt / 60.0])
+            self._xx = self.forgetting * self._xx + np.outer(x, x)
+            self._xy = self.forgetting * self._xy + x * (last.percentage - sample.percentage)
+            self.samples += 1
+        elif sample.status == charging and last.status == charging and sample.percentage > last.percentage:
+            rate = (sample.percentage - last.percentage) / (dt / 60.0)
+            self.charge_per_minute = 0.9 * self.charge_per_minute + 0.1 * rate
+
+    @property
+    def rates(self) -> Tuple[float, float]:
+        """1メートルあたりと1分あたりの消費量（%）"""
+        penalty = self.prior_weight * np.eye(2)
+        solution = np.linalg.solve(self._xx + penalty, self._xy + penalty @ self.prior)
+        per_metre, per_minute = np.maximum(solution, 0.0)
+        return float(per_metre), float(per_minute)
+
+    def predict(self, distance_m: float, duration_sec: float) -> float:
+        """走行距離と時間から消費量（%）を予測"""
+        per_metre, per_minute = self.rates
+        return per_metre * distance_m + per_minute * duration_sec / 60.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書に変換"""
+        per_metre, per_minute = self.rates
+        return {
+            "drain_per_metre": round(per_metre, 4),
+            "drain_per_minute": round(per_minute, 4),
+            "charge_per_minute": round(self.charge_per_minute, 3),
+            "samples": self.samples,
+            "odometry_m": round(self.distance_m, 1),
+        }
+
+
+class BatteryMonitor:
+    """電池残量を定期的に取得してモデルを学習し、タスクの前に実行できるかを判定する"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        config = context.config
+        self.model = BatteryModel(
+            config.battery_drain_per_metre,
+            config.battery_drain_per_minute,
+            config.battery_charge_per_minute,
+            config.battery_prior_weight,
+        )
+        self.interval_sec = config.battery_sample_interval_sec
+        self._task: Optional[asyncio.Task] = None
+
+    async def sample(self) -> BatterySample:
+        """現在の電池残量と位置を取得して学習する"""
+        client = self.context.kachaka_client
+        pose, (percentage, status) = await asyncio.gather(client.get_robot_pose(), client.get_battery_info())
+        sample = BatterySample(time.monotonic(), float(percentage), (pose.x, pose.y), status)
+        self.model.add_sample(sample)
+        return sample
+
+    def start(self) -> None:
+        """定期的なサンプリングを開始（開始済みの場合は何もしない）"""
+        if self.interval_sec > 0 and (self._task is None or self._task.done()):
+            self._task = self.context.lifecycle.spawn(self._run(), "battery-monitor")
+
+    def stop(self) -> None:
+        """定期的なサンプリングを停止"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        """一定の間隔でサンプリングする"""
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.debug(f"Battery sampling failed: {e}")
+
+    async def route_distance(
+        self,
+        start: Tuple[float, float],
+        waypoints: Sequence[Tuple[float, float]],
+    ) -> Tuple[float, float]:
+        """出発地から経由地を順に回る距離と、最後の経由地から充電器までの距離（メートル）
+
+        地図が使えない場合や到達できない区間は直線距離で代用する。
+        """
+        from .travel import get_travel_model
+        from .world import get_locations
+
+        model = None
+        try:
+            model = await get_travel_model(self.context)
+        except Exception as e:
+            logger.debug(f"No map-based distance for battery check: {e}")
+
+        def length(a, b) -> float:
+            value = model.path_length(a, b) if model is not None else None
+            return math.hypot(b[0] - a[0], b[1] - a[1]) if value is None else value
+
+        locations, _ = await get_locations(self.context)
+        chargers = [
+            (item.pose.x, item.pose.y) for item in locations
+            if item.type == pb2.LocationType.LOCATION_TYPE_CHARGER
+        ]
+        points = [start, *waypoints]
+
+        # キャッシュにない距離場の計算はイベントループを止めないようスレッドで行う
+        def measure() -> Tuple[float, float]:
+            distance = sum(length(a, b) for a, b in zip(points, points[1:]))
+            home = min((length(points[-1], charger) for charger in chargers), default=0.0)
+            return distance, home
+
+        return await asyncio.to_thread(measure)
+
+    async def check(self, waypoints: Sequence[Tuple[float, float]], extra_sec: float = 0.0) -> Dict[str, Any]:
+        """経由地を回って充電器に戻るまで電池が持つかを判定
+
+        Args:
+            waypoints: 順に向かう位置
+            extra_sec: 走行以外にかかる時間（棚のドッキングなど、秒）
+
+        Returns:
+            判定結果（feasible, battery, predicted_drain, remaining_after など）
+        """
+        self.start()
+        config = self.context.config
+        sample = await self.sample()
+        distance, home = await self.route_distance(sample.position, waypoints)
+        total = distance + home
+        duration = total / config.travel_speed + extra_sec
+        drain = self.model.predict(total, duration)
+        remaining = sample.percentage - drain
+        return {
+            "feasible": remaining >= config.battery_reserve,
+            "battery": sample.percentage,
+            "predicted_drain": round(drain, 1),
+            "remaining_after": round(remaining, 1),
+            "reserve": config.battery_reserve,
+            "required": round(drain + config.battery_reserve, 1),
+            "distance_m": round(distance, 1),
+            "return_to_charger_m": round(home, 1),
+            "duration_sec": round(duration),
+        }
+
+    def explain(self, check: Dict[str, Any], description: str) -> str:
+        """判定結果の説明"""
+        shortfall = check["required"] - check["battery"]
+        minutes = shortfall / self.model.charge_per_minute if self.model.charge_per_minute > 0 else math.inf
+        return (
+            f"Battery too low to {description}: {check['battery']:.0f}% now, "
+            f"~{check['predicted_drain']:.0f}% needed for {check['distance_m']:.0f} m "
+            f"plus {check['return_to_charger_m']:.0f} m back to the charger, "
+            f"keeping a {check['reserve']:.0f}% reserve. "
+            f"Charge to {check['required']:.0f}% first (about {minutes:.0f} min on the charger)."
+        )
+
+
+async def battery_gate(
+    context,
+    waypoints: List[Union[str, Tuple[float, float]]],
+    description: str,
+    extra_sec: float = 0.0,
+) -> Optional[str]:
+    """モーション・棚コマンドの前に電池残量を確認する
+
+    battery_policy が "refuse" の場合は実行できないタスクを説明付きで拒否し、
+    "charge" の場合は先に充電器に戻り、battery_charge_wait_sec まで充電を待つ。
+
+    Args:
+        context: KachakaMCPContext
+        waypoints: 順に向かう位置、または場所・棚の名前・ID
+        description: 説明に使うタスクの内容
+        extra_sec: 走行以外にかかる時間（秒）
+
+    Returns:
+        実行しない場合はその理由、実行してよい場合は None
+    """
+    from .travel import resolve_place
+
+    policy = context.config.battery_policy
+    if policy == "off":
+        return None
+    monitor = context.battery_monitor
+    try:
+        waypoints = [
+            (await resolve_place(context, point))[1] if isinstance(point, str) else point
+            for point in waypoints
+        ]
+        check = await monitor.check(waypoints, extra_sec)
+    except Exception as e:
+        # 判定できない場合はコマンドを止めない
+        logger.warning(f"Battery check skipped: {e}")
+        return None
+    if check["feasible"]:
+        return None
+
+    message = monitor.explain(check, description)
+    logger.warning(message)
+    if policy == "warn":
+        return None
+    if policy != "charge":
+        return f"Refused: {message}"
+
+    result = await context.command_deduplicator.run(
+        "return_home", (), lambda: context.command_watcher.return_home()
+    )
+    if not result.success:
+        return f"Refused: {message} Returning to the charger failed (error code {result.error_code})."
+    deadline = time.monotonic() + context.config.battery_charge_wait_sec
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(monitor.interval_sec or 10.0, max(deadline - time.monotonic(), 0.0)))
+        # 充電器の位置から改めて判定する
+        check = await monitor.check(waypoints, extra_sec)
+        if check["feasible"]:
+            logger.info(f"Charged to {check['battery']:.0f}%; continuing with {description}")
+            return None
+        message = monitor.explain(check, description)
+    return f"Returned to the charger instead. {message}"
+
+
+async def battery_gated(
+    context,
+    waypoints: List[Union[str, Tuple[float, float]]],
+    description: str,
+    command: Callable[[], Awaitable[T]],
+    extra_sec: float = 0.0,
+) -> T:
+    """電池残量を確認してからコマンドを実行する
+
+    CommandDeduplicator.run の factory の中で使うことで、同じ冪等キーの再試行は
+    判定をやり直さずに実行中・完了済みのコマンドに結び付く。拒否は例外で
+    返すため、重複の記録には残らず、充電後の再試行は改めて判定される。
+
+    Raises:
+        BatteryRefused: battery_gate が実行しないと判定した場合
+    """
+    refusal = await battery_gate(context, waypoints, description, extra_sec)
+    if refusal:
+        raise BatteryRefused(refusal)
+    return await command()
@@ -0,0 +1,399 @@
+"""
+Concurrent MCP load generator for Kachaka MCP Server.
+
+This module runs N simulated MCP clients, either against a running server
+over SSE / Streamable HTTP or against an in-process server created with
+create_server() and a fake robot client (a synthetic stub with a fixed
+latency, or a recorded gRPC session replayed by kachaka_mcp.replay). Each
+client runs a weighted mix of resource reads and tool calls for a fixed
+duration, and the report covers throughput, latency percentiles, error
+rates and event-loop lag.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+
+# デフォルトの操作（ロボットを動かさない読み込みだけ）
+DEFAULT_MIX = [
+    "robot://status@4",
+    "robot://battery@2",
+    "sensors://laser/summary@2",
+    "world://snapshot@1",
+    "nearest_locations@1",
+    "find_objects@1",
+]
+
+
+@dataclass
+class Operation:
+    """クライアントが実行する1種類の操作"""
+    target: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    weight: float = 1.0
+
+    @property
+    def is_resource(self) -> bool:
+        return "://" in self.target
+
+    @classmethod
+    def parse(cls, spec: str) -> "Operation":
+        """"TARGET[=JSON_ARGS][@WEIGHT]" の形式の操作
+
+        TARGET はリソースのURI（"://" を含む）またはツール名。
+
+        Raises:
+            ValueError: 解釈できない場合
+        """
+        weight = 1.0
+        head, at, tail = spec.rpartition("@")
+        if at:
+            try:
+                weight = float(tail)
+                spec = head
+            except ValueError:
+                pass
+        arguments: Dict[str, Any] = {}
+        if "={" in spec:
+            spec, _, raw = spec.partition("={")
+            arguments = json.loads("{" + raw)
+        if not spec or weight <= 0:
+            raise ValueError(f"Invalid operation '{spec}'")
+        return cls(spec, arguments, weight)
+
+
+@dataclass
+class Sample:
+    """1回の操作の結果"""
+    target: str
+    latency: float
+    ok: bool
+
+
+class SyntheticStub:
+    """どのメソッドにも既定値の応答を一定の時間後に返すロボットのスタブ"""
+
+    def __init__(self, latency_sec: float = 0.005):
+        self.latency_sec = latency_sec
+        self.calls = 0
+        self._command_id = ""
+
+    def __getattr__(self, method: str):
+        from .replay import SERVICE, response_type
+
+        if method.startswith("_") or method not in SERVICE.methods_by_name:
+            raise AttributeError(method)
+        message_type = response_type(method)
+
+        async def call(request, *args, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(self.latency_sec)
+            response = message_type()
+            if hasattr(response, "result"):
+                response.result.success = True
+            # コマンドはすぐに成功したことにする
+            if method == "StartCommand":
+                self._command_id = response.command_id = f"bench-{self.calls}"
+            elif method == "GetLastCommandResult":
+                response.command_id = self._command_id
+            return response
+
+        return call
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    """ミリ秒の分位点"""
+    if not len(values):
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p90, p99 = np.percentile(np.asarray(values) * 1000.0, [50, 90, 99])
+    return {
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(max(values)) * 1000.0, 2),
+    }
+
+
+def is_error(result: Any) -> bool:
+    """ツール・リソースの結果がエラーかどうか（サーバーのエラーメッセージの形式で判定する）"""
+    if getattr(result, "isError", False):
+        return True
+    contents = getattr(result, "content", None) or getattr(result, "contents", None) or []
+    for content in contents[:1]:
+        text = (getattr(content, "text", None) or "").lstrip()
+        if text.startswith(("Error", '{"error"')):
+            return True
+    return False
+
+
+async def measure_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.05) -> None:
+    """イベントループの遅れ（sleep が予定より遅れて戻った時間）を記録する"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def run_client(
+    session,
+    operations: Sequence[Operation],
+    deadline: float,
+    samples: List[Sample],
+    seed: int,
+    think_sec: float = 0.0,
+) -> None:
+    """期限まで操作を重みに従って選んで実行する"""
+    from pydantic import AnyUrl
+
+    rng = random.Random(seed)
+    weights = [operation.weight for operation in operations]
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        started = time.perf_counter()
+        try:
+            if operation.is_resource:
+                result = await session.read_resource(AnyUrl(operation.target))
+            else:
+                result = await session.call_tool(operation.target, operation.arguments)
+            ok = not is_error(result)
+        except Exception as e:
+            logger.debug(f"{operation.target} failed: {e}")
+            ok = False
+        samples.append(Sample(operation.target, time.perf_counter() - started, ok))
+        if think_sec:
+            await asyncio.sleep(think_sec)
+
+
+@asynccontextmanager
+async def in_process_sessions(
+    clients: int,
+    robot_latency_sec: float,
+    replay_path: str = "",
+    replay_speed: float = 1.0,
+) -> AsyncIterator[Dict[str, Any]]:
+    """プロセス内のサーバーに接続したセッション（ロボットは偽のクライアント）"""
+    from contextlib import AsyncExitStack
+
+    from kachaka_api.aio import KachakaApiClient
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    from . import server as server_module
+    from .replay import replay_client
+    from .utils.config import load_config
+
+    workdir = tempfile.TemporaryDirectory()
+    config = load_config()
+    # ベンチマークの呼び出しを本番のジャーナル・状態ファイルに残さない
+    config.journal_dir = f"{workdir.name}/journal"
+    config.shutdown_state_path = f"{workdir.name}/shutdown-state.json"
+    config.camera_record_enabled = False
+    config.grpc_record_path = ""
+    if replay_path:
+        client = replay_client(replay_path, replay_speed)
+    else:
+        client = KachakaApiClient(target="127.0.0.1:26400")
+        client.stub = SyntheticStub(robot_latency_sec)
+    context = server_module.KachakaMCPContext(client, config)
+    server_module.current_context = context
+    server_module.keep_context_alive(True)
+    mcp = server_module.create_server()
+    try:
+        async with AsyncExitStack() as stack:
+            sessions = [
+                await stack.enter_async_context(create_connected_server_and_client_session(mcp._mcp_server))
+                for _ in range(clients)
+            ]
+            yield {"sessions": sessions, "robot": client.stub}
+    finally:
+        server_module.keep_context_alive(False)
+        await context.lifecycle.shutdown(drain_sec=0)
+        server_module._reset_context()
+        workdir.cleanup()
+
+
+@asynccontextmanager
+async def remote_sessions(url: str, clients: int, api_key: str = "") -> AsyncIterator[Dict[str, Any]]:
+    """実行中のサーバーに接続したセッション"""
+    from contextlib import AsyncExitStack
+
+    from mcp import ClientSession
+
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+    if url.rstrip("/").endswith("/sse"):
+        from mcp.client.sse import sse_client
+
+        connect = functools.partial(sse_client, url, headers=headers)
+    else:
+        try:
+            from mcp.client.streamable_http import streamablehttp_client
+        except ImportError:
+            raise SystemExit("Streamable HTTP requires mcp>=1.8; use the /sse endpoint")
+        connect = functools.partial(streamablehttp_client, url, headers=headers)
+
+    async with AsyncExitStack() as stack:
+        sessions = []
+        for _ in range(clients):
+            streams = await stack.enter_async_context(connect())
+            session = await stack.enter_async_context(ClientSession(streams[0], streams[1]))
+            await session.initialize()
+            sessions.append(session)
+        yield {"sessions": sessions, "robot": None}
+
+
+def summarize(samples: Sequence[Sample], elapsed: float, lag: Sequence[float]) -> Dict[str, Any]:
+    """操作ごとと全体のスループット・レイテンシー・エラー率"""
+    def summary(group: Sequence[Sample]) -> Dict[str, Any]:
+        errors = sum(1 for sample in group if not sample.ok)
+        return {
+            "requests": len(group),
+            "throughput_rps": round(len(group) / elapsed, 1) if elapsed > 0 else 0.0,
+            "error_rate": round(errors / len(group), 4) if group else 0.0,
+            **percentiles([sample.latency for sample in group if sample.ok]),
+        }
+
+    targets = sorted({sample.target for sample in samples})
+    return {
+        "elapsed_sec": round(elapsed, 2),
+        "total": summary(samples),
+        "operations": {target: summary([s for s in samples if s.target == target]) for target in targets},
+        "event_loop_lag": percentiles(lag),
+    }
+
+
+async def run_benchmark(
+    operations: Sequence[Operation],
+    clients: int = 8,
+    duration_sec: float = 10.0,
+    url: str = "",
+    api_key: str = "",
+    robot_latency_sec: float = 0.005,
+    replay_path: str = "",
+    replay_speed: float = 1.0,
+    think_sec: float = 0.0,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """負荷をかけて結果をまとめる
+
+    プロセス内のサーバーの場合、イベントループの遅れはサーバーのループの遅れ、
+    実行中のサーバーの場合はベンチマーク側のループの遅れ。
+    """
+    if url:
+        sessions = remote_sessions(url, clients, api_key)
+    else:
+        sessions = in_process_sessions(clients, robot_latency_sec, replay_path, replay_speed)
+    async with sessions as connected:
+        samples: List[Sample] = []
+        lag: List[float] = []
+        stop = asyncio.Event()
+        monitor = asyncio.ensure_future(measure_loop_lag(lag, stop))
+        started = time.perf_counter()
+        deadline = started + duration_sec
+        await asyncio.gather(*(
+            run_client(session, operations, deadline, samples, seed + i, think_sec)
+            for i, session in enumerate(connected["sessions"])
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await monitor
+        report = summarize(samples, elapsed, lag)
+        report.update(
+            clients=clients,
+            target=url or ("in-process (replay)" if replay_path else "in-process (synthetic robot)"),
+        )
+        robot = connected["robot"]
+        if hasattr(robot, "stats"):
+            report["replay"] = robot.stats()
+        elif robot is not None:
+            report["robot_calls"] = robot.calls
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """結果の表"""
+    lines = [
+        f"target: {report['target']}  clients: {report['clients']}  elapsed: {report['elapsed_sec']}s",
+        f"{'operation':<32}{'req':>8}{'rps':>9}{'err%':>8}{'p50ms':>9}{'p90ms':>9}{'p99ms':>9}{'maxms':>9}",
+    ]
+    rows = list(report["operations"].items()) + [("TOTAL", report["total"])]
+    for name, row in rows:
+        values = [row[key] for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+        lines.append(
+            f"{name[:31]:<32}{row['requests']:>8}{row['throughput_rps']:>9}{row['error_rate'] * 100:>8.2f}"
+            + "".join(f"{'-' if v is None else v:>9}" for v in values)
+        )
+    lag = report["event_loop_lag"]
+    lines.append(f"event loop lag: p50={lag['p50_ms']}ms p99={lag['p99_ms']}ms max={lag['max_ms']}ms")
+    if "replay" in report:
+        lines.append(f"replay: {report['replay']}")
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """コマンドライン引数の解析"""
+    parser = argparse.ArgumentParser(description="Load generator for the Kachaka MCP server")
+    parser.add_argument("--clients", type=int, default=8, help="同時に接続するMCPクライアントの数")
+    parser.add_argument("--duration", type=float, default=10.0, help="負荷をかける秒数")
+    parser.add_argument(
+        "--url",
+        default="",
+        help="実行中のサーバーのURL（例: http://127.0.0.1:8000/sse、省略時はプロセス内のサーバー）",
+    )
+    parser.add_argument("--api-key", default="", help="実行中のサーバーのAPIキー")
+    parser.add_argument(
+        "--op",
+        action="append",
+        default=[],
+        help='操作 "TARGET[=JSON_ARGS][@WEIGHT]"（繰り返し指定、例: robot://status@4、'
+             'estimate_travel={"destination":"kitchen"}@1）',
+    )
+    parser.add_argument("--robot-latency-ms", type=float, default=5.0, help="偽のロボットの応答時間（ミリ秒）")
+    parser.add_argument("--replay", default="", help="偽のロボットの代わりに再生する gRPC の記録")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="記録を再生する速さ（0 の場合は待たない）")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="クライアントが操作の間に待つ時間（ミリ秒）")
+    parser.add_argument("--seed", type=int, default=0, help="操作を選ぶ乱数のシード")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    parser.add_argument("--log-level", default="WARNING", help="サーバーのログレベル")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list] = None) -> None:
+    """メイン関数"""
+    args = parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level.upper())
+    # MCP のリクエストごとのログも抑える
+    logging.getLogger("mcp").setLevel(args.log_level.upper())
+    try:
+        operations = [Operation.parse(spec) for spec in args.op or DEFAULT_MIX]
+    except ValueError as e:
+        raise SystemExit(f"Invalid --op: {e}")
+    report = asyncio.run(run_benchmark(
+        operations,
+        clients=max(1, args.clients),
+        duration_sec=args.duration,
+        url=args.url,
+        api_key=args.api_key,
+        robot_latency_sec=args.robot_latency_ms / 1000.0,
+        replay_path=args.replay,
+        replay_speed=args.replay_speed,
+        think_sec=args.think_ms / 1000.0,
+        seed=args.seed,
+    ))
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
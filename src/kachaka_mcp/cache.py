@@ -0,0 +1,81 @@
+"""
+Caching utilities for Kachaka MCP Server.
+
+This module provides a small TTL cache shared by all sessions. Concurrent
+requests for the same key are coalesced into a single robot call.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """有効期限付きのキャッシュ（同じキーの同時読み込みは1回にまとめる）"""
+
+    def __init__(self, default_ttl_sec: float = 30.0):
+        """初期化
+
+        Args:
+            default_ttl_sec: デフォルトの有効期限（秒）
+        """
+        self.default_ttl_sec = default_ttl_sec
+        self._values: Dict[Hashable, Tuple[Any, float]] = {}
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+
+    async def get(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl_sec: Optional[float] = None,
+    ) -> Tuple[Any, bool]:
+        """キャッシュから値を取得し、期限切れであれば読み込む
+
+        Args:
+            key: キャッシュのキー
+            loader: 値を読み込むコルーチンを返す関数
+            ttl_sec: 有効期限（Noneの場合はデフォルト）
+
+        Returns:
+            値と、キャッシュから返したかどうか
+        """
+        ttl_sec = self.default_ttl_sec if ttl_sec is None else ttl_sec
+        cached = self._values.get(key)
+        if cached is not None and time.monotonic() - cached[1] < ttl_sec:
+            return cached[0], True
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            # 待機者がいなくなっても例外が未処理として報告されないようにする
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._pending[key] = task
+        # 呼び出し元のタイムアウトで他の待機者の読み込みを中断しない
+        return await asyncio.shield(task), False
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """値を読み込んでキャッシュに保存"""
+        try:
+            value = await loader()
+            self._values[key] = (value, time.monotonic())
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    def peek(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """期限に関係なくキャッシュの値と経過秒数を返す"""
+        cached = self._values.get(key)
+        if cached is None:
+            return None
+        return cached[0], time.monotonic() - cached[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """値をキャッシュに保存"""
+        self._values[key] = (value, time.monotonic())
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """キャッシュを無効化（keyがNoneの場合はすべて）"""
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
@@ -0,0 +1,111 @@
+"""
+Camera frame change detection for Kachaka MCP Server.
+
+This module reduces each JPEG frame to a small grayscale signature in a
+worker thread and remembers the last frame sent to every session, so that
+polling an idle camera returns a short "unchanged" note instead of another
+near-identical image.
+"""
+
+import asyncio
+import io
+import time
+import weakref
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+
+# 署名の大きさ（幅, 高さ）
+SIGNATURE_SIZE = (32, 24)
+
+
+def frame_signature(data: bytes) -> np.ndarray:
+    """JPEG画像を縮小したグレースケールの署名
+
+    JPEG のデコード時に DCT のスケーリング（draft）を使うため、
+    元の解像度でデコードするより大幅に速い。
+    """
+    image = PILImage.open(io.BytesIO(data))
+    image.draft("L", (SIGNATURE_SIZE[0] * 4, SIGNATURE_SIZE[1] * 4))
+    image = image.convert("L").resize(SIGNATURE_SIZE, PILImage.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """2つの署名の平均絶対差（0〜255）
+
+    画面全体の明るさの変化（露出の調整）は差から除く。
+    """
+    a = a - a.mean()
+    b = b - b.mean()
+    return float(np.abs(a - b).mean())
+
+
+def format_time(timestamp: float) -> str:
+    """時刻を ISO 8601 形式に変換"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+class FrameChangeDetector:
+    """セッションとカメラごとに最後に送った画像を覚え、変化がなければ送信を省略する"""
+
+    def __init__(self, threshold: float = 4.0):
+        """初期化
+
+        Args:
+            threshold: 変化とみなす署名の平均絶対差（0〜255）
+        """
+        self.threshold = threshold
+        # セッションが終了したら記録も消えるように弱参照で保持する
+        self._sessions: "weakref.WeakKeyDictionary[Any, Dict[str, Tuple[np.ndarray, float]]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._default: Dict[str, Tuple[np.ndarray, float]] = {}
+
+    def _records(self, session: Optional[Any]) -> Dict[str, Tuple[np.ndarray, float]]:
+        if session is None:
+            return self._default
+        return self._sessions.setdefault(session, {})
+
+    async def check(
+        self,
+        session: Optional[Any],
+        camera: str,
+        data: bytes,
+        force: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """画像を送るべきかを判定
+
+        Args:
+            session: セッション（None の場合は全体で1つとして扱う）
+            camera: カメラの名前
+            data: JPEG画像
+            force: Trueの場合は変化に関係なく送る
+
+        Returns:
+            送信を省略する場合はその説明、送る場合は None
+        """
+        records = self._records(session)
+        try:
+            signature = await asyncio.to_thread(frame_signature, data)
+        except Exception:
+            # 署名が計算できない画像はそのまま送る
+            records.pop(camera, None)
+            return None
+
+        previous = records.get(camera)
+        if previous is not None and not force:
+            difference = frame_difference(previous[0], signature)
+            if difference < self.threshold:
+                return {
+                    "camera": camera,
+                    "unchanged": True,
+                    "since": format_time(previous[1]),
+                    "difference": round(difference, 2),
+                    "hint": f"Read sensors://camera/{camera}/full to get the frame anyway",
+                }
+        records[camera] = (signature, time.time())
+        return None
@@ -0,0 +1,413 @@
+"""
+Shared command-completion watcher for Kachaka MCP Server.
+
+This module starts robot commands without blocking on them and follows
+their completion with a single polling loop per robot. Every caller waiting
+for a command id awaits a future that the loop resolves, and the polling
+interval adapts to the expected completion time of the pending commands:
+slow during long trips, fast around the moment a command should finish.
+"""
+
+import asyncio
+import itertools
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+from .journal import note_command_result
+from .tracing import span
+
+
+# 最近完了したコマンドの結果を保持する数（開始直後に完了したコマンドの取りこぼしを防ぐ）
+MAX_RECENT_RESULTS = 64
+
+# 所要時間の見積もりから完了を待つ期限を決める係数と余裕（秒）
+WAIT_TIMEOUT_FACTOR = 3.0
+WAIT_TIMEOUT_MARGIN_SEC = 30.0
+
+
+@dataclass
+class CommandWaiter:
+    """完了を待っているコマンド"""
+    command_id: str
+    order: int
+    started_at: float
+    expected_at: Optional[float]
+    future: asyncio.Future = field(repr=False)
+    deadline: float = 0.0
+
+
+class CommandWatcher:
+    """1台のロボットのコマンドの完了を1つのループで監視し、待っている呼び出しに通知する"""
+
+    def __init__(
+        self,
+        client,
+        min_interval_sec: float = 0.2,
+        max_interval_sec: float = 2.0,
+        default_interval_sec: float = 0.5,
+        timeout_sec: float = 600.0,
+    ):
+        """初期化
+
+        Args:
+            client: Kachaka APIクライアント
+            min_interval_sec: 完了の予定時刻の前後で確認する間隔（秒）
+            max_interval_sec: 完了の予定時刻まで時間がある場合に確認する間隔（秒）
+            default_interval_sec: 所要時間の見積もりがないコマンドを確認する間隔（秒）
+            timeout_sec: 所要時間の見積もりがないコマンドの完了を待つ最大の秒数
+        """
+        self.client = client
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.default_interval_sec = default_interval_sec
+        self.timeout_sec = timeout_sec
+        self.polls = 0
+        self._waiters: Dict[str, CommandWaiter] = {}
+        self._results: "OrderedDict[str, pb2.Result]" = OrderedDict()
+        self._last_id: Optional[str] = None
+        self._order = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def pending(self) -> List[str]:
+        """完了を待っているコマンドのID（開始順）"""
+        return [w.command_id for w in sorted(self._waiters.values(), key=lambda w: w.order)]
+
+    def interval(self, now: Optional[float] = None) -> float:
+        """次に確認するまでの秒数
+
+        完了の予定時刻までの残り時間（予定時刻を過ぎた場合は超過した時間）の
+        半分を min_interval_sec と max_interval_sec の範囲に収め、待っている
+        コマンドのうち最も短いものを使う。
+        """
+        now = time.monotonic() if now is None else now
+        intervals = [
+            self.default_interval_sec if w.expected_at is None else abs(w.expected_at - now) / 2.0
+            for w in self._waiters.values()
+        ]
+        value = min(intervals, default=self.max_interval_sec)
+        return min(max(value, self.min_interval_sec), self.max_interval_sec)
+
+    async def start(
+        self,
+        command: pb2.Command,
+        *,
+        expected_sec: Optional[float] = None,
+        estimate: Optional[Callable[[], Awaitable[Optional[float]]]] = None,
+        cancel_all: bool = True,
+        tts_on_success: str = "",
+        title: str = "",
+    ) -> Tuple[pb2.Result, Optional[asyncio.Future]]:
+        """コマンドを開始し、完了を待つ Future を登録する
+
+        Args:
+            command: 開始するコマンド
+            expected_sec: 所要時間の見積もり（秒）
+            estimate: 所要時間を見積もるコルーチンを返す関数（コマンドを送った後に
+                バックグラウンドで実行し、見積もれた時点で確認の間隔に反映する）
+
+        Returns:
+            開始の結果と、完了時に結果が設定される Future（開始に失敗した場合は None）
+        """
+        request = pb2.StartCommandRequest(
+            command=command,
+            cancel_all=cancel_all,
+            tts_on_success=tts_on_success,
+            title=title,
+        )
+        response = await self.client.stub.StartCommand(request)
+        if not response.result.success:
+            return response.result, None
+        future = self.watch(response.command_id, expected_sec)
+        if estimate is not None and not future.done():
+            asyncio.ensure_future(self._estimate(response.command_id, estimate))
+        return response.result, future
+
+    async def _estimate(self, command_id: str, estimate: Callable[[], Awaitable[Optional[float]]]) -> None:
+        """開始したコマンドの所要時間を見積もり、完了の予定時刻を設定する"""
+        try:
+            expected_sec = await estimate()
+        except Exception as e:
+            logger.debug(f"No duration estimate for command {command_id}: {e}")
+            return
+        waiter = self._waiters.get(command_id)
+        if expected_sec is None or waiter is None:
+            return
+        waiter.expected_at = waiter.started_at + max(expected_sec, 0.0)
+        waiter.deadline = self._deadline(waiter.started_at, expected_sec)
+        if self._wake is not None:
+            self._wake.set()
+
+    def watch(self, command_id: str, expected_sec: Optional[float] = None) -> asyncio.Future:
+        """コマンドの完了を待つ Future（同じコマンドを待つ呼び出しは同じ Future を共有する）"""
+        waiter = self._waiters.get(command_id)
+        if waiter is not None:
+            return waiter.future
+        future = asyncio.get_running_loop().create_future()
+        result = self._results.get(command_id)
+        if result is not None:
+            future.set_result(result)
+            return future
+        now = time.monotonic()
+        self._waiters[command_id] = CommandWaiter(
+            command_id,
+            next(self._order),
+            now,
+            None if expected_sec is None else now + max(expected_sec, 0.0),
+            future,
+            self._deadline(now, expected_sec),
+        )
+        if self._task is None or self._task.done():
+            # イベントはループに結び付くため、監視を開始するたびに作る
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        self._wake.set()
+        return future
+
+    def _deadline(self, started_at: float, expected_sec: Optional[float]) -> float:
+        """完了を待つ期限（見積もりがあれば見積もりから、なければ timeout_sec から決める）"""
+        if expected_sec is None:
+            return started_at + self.timeout_sec
+        return started_at + max(expected_sec, 0.0) * WAIT_TIMEOUT_FACTOR + WAIT_TIMEOUT_MARGIN_SEC
+
+    async def run(self, command: pb2.Command, *, expected_sec: Optional[float] = None, **kwargs) -> pb2.Result:
+        """コマンドを開始して完了を待つ（kachaka_client の wait_for_completion=True の代わり）
+
+        呼び出し元がキャンセルされても、監視は他の呼び出しのために続ける。
+        """
+        result, future = await self.start(command, expected_sec=expected_sec, **kwargs)
+        if future is not None:
+            with span("wait_for_completion", "wait") as waiting:
+                if expected_sec is not None:
+                    waiting.set(expected_sec=round(expected_sec, 1))
+                result = await asyncio.shield(future)
+        note_command_result(result)
+        return result
+
+    async def _run(self) -> None:
+        """待っているコマンドがある間だけ最後のコマンドの結果を確認する"""
+        while self._waiters:
+            try:
+                response = await self.client.stub.GetLastCommandResult(pb2.GetRequest())
+                self.polls += 1
+                if response.command_id and response.command_id != self._last_id:
+                    self._last_id = response.command_id
+                    await self._complete(response.command_id, response.result)
+                await self._expire(time.monotonic())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Command result polling failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval())
+            except asyncio.TimeoutError:
+                pass
+
+    def _remember(self, command_id: str, result: pb2.Result) -> None:
+        """完了したコマンドの結果を保持する"""
+        self._results[command_id] = result
+        while len(self._results) > MAX_RECENT_RESULTS:
+            self._results.popitem(last=False)
+
+    async def _running_command_id(self) -> Optional[str]:
+        """ロボットが実行中のコマンドのID（実行中でなければ空文字列、取得できなければ None）"""
+        try:
+            response = await self.client.stub.GetCommandState(pb2.GetRequest())
+        except Exception as e:
+            logger.debug(f"Could not read command state: {e}")
+            return None
+        running = (pb2.CommandState.COMMAND_STATE_RUNNING, pb2.CommandState.COMMAND_STATE_PENDING)
+        return response.command_id if response.state in running else ""
+
+    async def _resolve_missed(self, waiters: List[CommandWaiter], fail_missing: bool) -> None:
+        """結果を取りこぼしたコマンドの結果を履歴から補う
+
+        fail_missing が True の場合は履歴にないコマンドを失敗として通知し、
+        False の場合は待ち続ける。
+        """
+        histories = {}
+        try:
+            histories = {history.id: history for history in await self.client.get_history_list()}
+        except Exception as e:
+            logger.warning(f"Could not read command history: {e}")
+            if not fail_missing:
+                return
+        for w in waiters:
+            history = histories.get(w.command_id)
+            if history is None and not fail_missing:
+                continue
+            self._waiters.pop(w.command_id, None)
+            if history is not None:
+                missed = pb2.Result(success=history.success, error_code=history.error_code)
+            else:
+                logger.warning(f"Result of command {w.command_id} was not observed; reporting it as failed")
+                missed = pb2.Result(success=False)
+            self._remember(w.command_id, missed)
+            if not w.future.done():
+                w.future.set_result(missed)
+
+    async def _complete(self, command_id: str, result: pb2.Result) -> None:
+        """コマンドの完了を通知する
+
+        ロボットはコマンドを開始順に実行するため、後から開始したコマンドが
+        完了した時点で、それより前のコマンドも終わっている。確認の間に
+        完了した（結果を取りこぼした）コマンドの結果は履歴から探す。
+        待っていないコマンド（他のクライアントが開始したコマンドなど）が
+        完了した場合も、それに中断されたコマンドがないか履歴を確認する。
+        """
+        self._remember(command_id, result)
+        waiter = self._waiters.pop(command_id, None)
+        if waiter is None:
+            if not self._waiters:
+                return
+            running = await self._running_command_id()
+            if running is None:
+                return
+            # 実行中のコマンドはまだ終わっていない
+            await self._resolve_missed(
+                [w for w in self._waiters.values() if w.command_id != running], fail_missing=False
+            )
+            return
+        if not waiter.future.done():
+            waiter.future.set_result(result)
+
+        earlier = [w for w in self._waiters.values() if w.order < waiter.order]
+        if earlier:
+            await self._resolve_missed(earlier, fail_missing=True)
+
+    async def _expire(self, now: float) -> None:
+        """期限を過ぎても完了しないコマンドを確認する
+
+        ロボットがまだ実行中であれば期限を延ばし、そうでなければ履歴の結果
+        （履歴にない場合は失敗）を通知する。
+        """
+        expired = [w for w in self._waiters.values() if now >= w.deadline]
+        if not expired:
+            return
+        running = await self._running_command_id()
+        if running is None:
+            return
+        finished = []
+        for w in expired:
+            if w.command_id == running:
+                w.deadline = now + self.timeout_sec
+            else:
+                logger.warning(f"Command {w.command_id} did not report completion in time")
+                finished.append(w)
+        if finished:
+            await self._resolve_missed(finished, fail_missing=True)
+
+    def stop(self) -> None:
+        """監視を停止し、待っている呼び出しをキャンセルする"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for waiter in self._waiters.values():
+            waiter.future.cancel()
+        self._waiters.clear()
+
+    # kachaka_client のコマンドと同じ引数で開始して完了を待つ
+    # 場所・棚は resolve_name で解決したIDを受け取る（kachaka_api のリゾルバーは
+    # 見つからない場合に標準出力に書き込み、stdio トランスポートの通信を壊すため使わない）
+
+    async def move_to_location(self, location_id: str, **kwargs) -> pb2.Result:
+        return await self.run(
+            pb2.Command(move_to_location_command=pb2.MoveToLocationCommand(target_location_id=location_id)),
+            **kwargs,
+        )
+
+    async def move_to_pose(self, x: float, y: float, yaw: float, **kwargs) -> pb2.Result:
+        return await self.run(pb2.Command(move_to_pose_command=pb2.MoveToPoseCommand(x=x, y=y, yaw=yaw)), **kwargs)
+
+    async def return_home(self, **kwargs) -> pb2.Result:
+        return await self.run(pb2.Command(return_home_command=pb2.ReturnHomeCommand()), **kwargs)
+
+    async def move_forward(self, distance_meter: float, speed: float = 0.0, **kwargs) -> pb2.Result:
+        return await self.run(
+            pb2.Command(move_forward_command=pb2.MoveForwardCommand(distance_meter=distance_meter, speed=speed)),
+            **kwargs,
+        )
+
+    async def rotate_in_place(self, angle_radian: float, **kwargs) -> pb2.Result:
+        return await self.run(
+            pb2.Command(rotate_in_place_command=pb2.RotateInPlaceCommand(angle_radian=angle_radian)), **kwargs
+        )
+
+    async def move_shelf(self, shelf_id: str, location_id: str, **kwargs) -> pb2.Result:
+        return await self.run(
+            pb2.Command(move_shelf_command=pb2.MoveShelfCommand(
+                target_shelf_id=shelf_id, destination_location_id=location_id
+            )),
+            **kwargs,
+        )
+
+    async def return_shelf(self, shelf_id: str = "", **kwargs) -> pb2.Result:
+        return await self.run(
+            pb2.Command(return_shelf_command=pb2.ReturnShelfCommand(target_shelf_id=shelf_id)), **kwargs
+        )
+
+    async def dock_shelf(self, **kwargs) -> pb2.Result:
+        return await self.run(pb2.Command(dock_shelf_command=pb2.DockShelfCommand()), **kwargs)
+
+    async def undock_shelf(self, **kwargs) -> pb2.Result:
+        return await self.run(pb2.Command(undock_shelf_command=pb2.UndockShelfCommand()), **kwargs)
+
+    async def dock_any_shelf_with_registration(
+        self, location_id: str, dock_forward: bool = False, **kwargs
+    ) -> pb2.Result:
+        return await self.run(
+            pb2.Command(dock_any_shelf_with_registration_command=pb2.DockAnyShelfWithRegistrationCommand(
+                target_location_id=location_id, dock_forward=dock_forward
+            )),
+            **kwargs,
+        )
+
+    async def speak(self, text: str, **kwargs) -> pb2.Result:
+        return await self.run(pb2.Command(speak_command=pb2.SpeakCommand(text=text)), **kwargs)
+
+    async def lock(self, duration_sec: float, **kwargs) -> pb2.Result:
+        kwargs.setdefault("expected_sec", duration_sec)
+        return await self.run(pb2.Command(lock_command=pb2.LockCommand(duration_sec=duration_sec)), **kwargs)
+
+
+async def expected_duration(
+    context,
+    waypoints: Sequence[Union[str, Tuple[float, float]]],
+    extra_sec: float = 0.0,
+) -> Optional[float]:
+    """ロボットの現在位置から経由地を順に回る所要時間の見積もり（秒）
+
+    コマンドの完了を確認する間隔の調整に使う（CommandWatcher.start の estimate として
+    コマンドを送った後に呼ぶ）。経路長の推定モデルがまだない場合や、距離場を
+    計算済みでない区間がある場合は計算せずに None を返し、既定の間隔で確認させる。
+    """
+    from .travel import resolve_place
+
+    model = context.travel_model
+    if model is None:
+        return None
+    try:
+        pose = await context.kachaka_client.get_robot_pose()
+        points = [(pose.x, pose.y)]
+        for point in waypoints:
+            points.append((await resolve_place(context, point))[1] if isinstance(point, str) else point)
+
+        legs = list(zip(points, points[1:]))
+        if not all(model.has_field_for(a, b) for a, b in legs):
+            return None
+        total = 0.0
+        for a, b in legs:
+            length = model.path_length(a, b)
+            total += math.hypot(b[0] - a[0], b[1] - a[1]) if length is None else length
+        return total / model.speed + extra_sec
+    except Exception as e:
+        logger.debug(f"No duration estimate for command: {e}")
+        return None
@@ -0,0 +1,408 @@
+"""
+Task dispatcher for multi-robot sites.
+
+This module keeps pose, battery and command-state snapshots for every robot
+in the fleet, assigns each shelf or location task to the idle robot with the
+best score (travel distance to the pickup and battery level), and queues
+tasks until a robot becomes free when every robot is busy.
+"""
+
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+from .journal import format_arguments
+from .lifecycle import ShuttingDown
+
+
+@dataclass
+class RobotSnapshot:
+    """ロボットの状態のスナップショット"""
+    name: str
+    pose: Optional[Tuple[float, float, float]] = None
+    battery: Optional[float] = None
+    power_status: str = ""
+    command_running: bool = False
+    updated_at: float = 0.0
+    error: str = ""
+
+    def to_dict(self, dispatching: bool = False) -> Dict[str, Any]:
+        """辞書に変換"""
+        return {
+            "name": self.name,
+            "pose": None if self.pose is None else {"x": self.pose[0], "y": self.pose[1], "yaw": self.pose[2]},
+            "battery": self.battery,
+            "power_status": self.power_status,
+            "command_running": self.command_running,
+            "dispatching": dispatching,
+            "age_sec": round(time.monotonic() - self.updated_at, 1) if self.updated_at else None,
+            "error": self.error,
+        }
+
+
+@dataclass
+class DispatchTask:
+    """割り当てるタスク"""
+    id: str
+    kind: str
+    location: str
+    shelf: str = ""
+    status: str = "queued"
+    robot: str = ""
+    message: str = ""
+    score: Optional[float] = None
+    created_at: float = field(default_factory=time.time)
+    done: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書に変換"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "shelf": self.shelf,
+            "location": self.location,
+            "status": self.status,
+            "robot": self.robot,
+            "message": self.message,
+            "score": None if self.score is None else round(self.score, 2),
+        }
+
+
+class Dispatcher:
+    """最も条件の良い空いているロボットにタスクを割り当てる"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: このサーバーの KachakaMCPContext（フリートが空の場合はこのロボットだけを使う）
+        """
+        self.context = context
+        config = context.config
+        self.min_battery = config.dispatch_min_battery
+        self.battery_weight_m = config.dispatch_battery_weight_m
+        self.snapshot_ttl_sec = config.dispatch_snapshot_ttl_sec
+        self.poll_interval_sec = config.dispatch_poll_interval_sec
+        self.history = config.dispatch_history
+        self.snapshots: Dict[str, RobotSnapshot] = {}
+        self.tasks: Dict[str, DispatchTask] = {}
+        self.queue: Deque[DispatchTask] = deque()
+        self._dispatching: Dict[str, str] = {}
+        self._ids = itertools.count(1)
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> List[str]:
+        """タスクを実行中のロボットの名前"""
+        return list(self._dispatching)
+
+    def robot_names(self) -> List[str]:
+        """ロボットの名前（フリートが設定されていない場合は "local" だけ）"""
+        return self.context.fleet.select() or ["local"]
+
+    def robot_context(self, name: str):
+        """ロボットのコンテキスト"""
+        if name == "local" and not self.context.fleet.robots:
+            return self.context
+        return self.context.fleet.context(name)
+
+    async def _snapshot(self, name: str) -> RobotSnapshot:
+        """ロボットの状態を取得"""
+        snapshot = RobotSnapshot(name)
+        try:
+            client = self.robot_context(name).kachaka_client
+            pose, (battery, status), (state, _) = await asyncio.wait_for(
+                asyncio.gather(
+                    client.get_robot_pose(),
+                    client.get_battery_info(),
+                    client.get_command_state(),
+                ),
+                self.context.config.fleet_timeout_sec,
+            )
+            snapshot.pose = (pose.x, pose.y, pose.theta)
+            snapshot.battery = float(battery)
+            snapshot.power_status = pb2.PowerSupplyStatus.Name(status)
+            snapshot.command_running = state in (
+                pb2.CommandState.COMMAND_STATE_RUNNING,
+                pb2.CommandState.COMMAND_STATE_PENDING,
+            )
+        except Exception as e:
+            snapshot.error = str(e) or type(e).__name__
+        snapshot.updated_at = time.monotonic()
+        return snapshot
+
+    async def refresh(self, max_age_sec: Optional[float] = None) -> Dict[str, RobotSnapshot]:
+        """古くなったスナップショットを並行して更新する"""
+        max_age_sec = self.snapshot_ttl_sec if max_age_sec is None else max_age_sec
+        now = time.monotonic()
+        stale = [
+            name for name in self.robot_names()
+            if name not in self.snapshots or now - self.snapshots[name].updated_at >= max_age_sec
+        ]
+        for snapshot in await asyncio.gather(*(self._snapshot(name) for name in stale)):
+            self.snapshots[snapshot.name] = snapshot
+        return self.snapshots
+
+    def is_available(self, name: str) -> bool:
+        """タスクを割り当てられるかどうか"""
+        snapshot = self.snapshots.get(name)
+        return (
+            snapshot is not None
+            and not snapshot.error
+            and name not in self._dispatching
+            and not snapshot.command_running
+            and snapshot.battery is not None
+            and snapshot.battery >= self.min_battery
+        )
+
+    async def _pickup_point(self, context, task: DispatchTask) -> Optional[Tuple[float, float]]:
+        """最初に向かう位置（棚の位置、または移動先の場所）。ロボットのマップにない場合は None"""
+        from .resolver import resolve_name
+        from .world import get_locations, get_shelves
+
+        location = await resolve_name(context, task.location, "location")
+        if not location.found:
+            return None
+        items, _ = await get_locations(context)
+        target_id = location.entry.id
+        if task.kind == "move_shelf":
+            shelf = await resolve_name(context, task.shelf, "shelf")
+            if not shelf.found:
+                return None
+            items, _ = await get_shelves(context)
+            target_id = shelf.entry.id
+        for item in items:
+            if item.id == target_id:
+                return item.pose.x, item.pose.y
+        return None
+
+    async def score(self, name: str, task: DispatchTask) -> Optional[float]:
+        """ロボットのスコア（小さいほど良い、割り当てられない場合は None）
+
+        最初に向かう位置までの経路長（メートル、地図が使えない場合は直線距離）に、
+        電池残量が少ないほど大きくなるペナルティを加える。
+        """
+        from .travel import get_travel_model
+
+        snapshot = self.snapshots[name]
+        context = self.robot_context(name)
+        target = await self._pickup_point(context, task)
+        if target is None:
+            return None
+        start = snapshot.pose[:2]
+        distance = None
+        try:
+            model = await get_travel_model(context)
+            distance = await asyncio.to_thread(model.path_length, start, target)
+        except Exception as e:
+            logger.debug(f"No map-based estimate for {name}: {e}")
+        if distance is None:
+            distance = math.hypot(target[0] - start[0], target[1] - start[1])
+        return distance + self.battery_weight_m * (1.0 - snapshot.battery / 100.0)
+
+    async def _select(self, task: DispatchTask) -> Tuple[Optional[str], Optional[float], bool]:
+        """タスクを割り当てるロボットを選ぶ
+
+        空いているかどうかはスコアを計算した後に待たずに確認するため、呼び出し側が
+        すぐに _start すれば、並行して割り当てたタスクと同じロボットを選ぶことはない。
+
+        Returns:
+            ロボットの名前とスコア、いずれかのロボットが実行できるタスクかどうか
+        """
+        await self.refresh()
+        candidates = []
+        feasible = False
+        for name in self.robot_names():
+            snapshot = self.snapshots.get(name)
+            if snapshot is None or snapshot.error or snapshot.pose is None:
+                continue
+            try:
+                score = await self.score(name, task)
+            except Exception as e:
+                logger.warning(f"Could not score {name} for task {task.id}: {e}")
+                continue
+            if score is None:
+                continue
+            feasible = True
+            candidates.append((score, name))
+        # スコアの計算中に他のタスクが使い始めたロボットを除く（ここから _start までは await しない）
+        candidates = [(score, name) for score, name in candidates if self.is_available(name)]
+        if not candidates:
+            return None, None, feasible
+        score, name = min(candidates)
+        return name, score, True
+
+    async def submit(self, kind: str, location: str, shelf: str = "") -> DispatchTask:
+        """タスクを割り当てる（すべてのロボットが使用中の場合は待ち行列に入れる）
+
+        どのロボットのマップにも棚・場所がない場合は "rejected" になる。
+
+        Raises:
+            ValueError: タスクの種類が不正な場合
+        """
+        if kind not in ("move_shelf", "move_to_location"):
+            raise ValueError(f"Unknown task kind '{kind}' (use move_shelf or move_to_location)")
+        if kind == "move_shelf" and not shelf:
+            raise ValueError("move_shelf requires a shelf")
+        if self.context.lifecycle.draining:
+            raise ShuttingDown("dispatch_task")
+
+        self._prune()
+        task = DispatchTask(f"task-{next(self._ids)}", kind, location, shelf)
+        task.done = asyncio.get_running_loop().create_future()
+        self.tasks[task.id] = task
+
+        name, score, feasible = await self._select(task)
+        if not feasible:
+            task.status = "rejected"
+            task.message = "No robot knows this shelf/location or all robots are unreachable"
+            task.done.set_result(task)
+            return task
+        if name is None:
+            self.queue.append(task)
+            self._ensure_pump()
+        else:
+            self._start(task, name, score)
+        return task
+
+    def _prune(self) -> None:
+        """終了したタスクを古いものから削除し、dispatch_history 件だけを残す"""
+        finished = [task_id for task_id, task in self.tasks.items() if task.status not in ("queued", "running")]
+        for task_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.tasks[task_id]
+
+    def _start(self, task: DispatchTask, name: str, score: Optional[float]) -> None:
+        """タスクをロボットで実行する"""
+        task.status, task.robot, task.score = "running", name, score
+        self._dispatching[name] = task.id
+        logger.info(f"Dispatching {task.id} ({task.kind}) to {name}, score={score}")
+        self.context.lifecycle.spawn(self._run(task, name), f"dispatch:{task.id}")
+
+    async def _run(self, task: DispatchTask, name: str) -> None:
+        """タスクを実行して結果を記録する
+
+        直接のツール呼び出しと同じく、経路がふさがれている場合や電池が持たない場合は
+        実行せずに "rejected" にする。
+        """
+        from .battery import BatteryRefused, battery_gated
+        from .local_map import route_gate
+        from .resolver import resolve_name
+
+        context = self.robot_context(name)
+        watcher = context.command_watcher
+        started = time.time()
+        error_code = 0
+        try:
+            # 同じ名前の場所・棚が複数あってもずれないよう、解決したIDで送る
+            location = (await resolve_name(context, task.location, "location")).entry.id
+            shelf = (await resolve_name(context, task.shelf, "shelf")).entry.id if task.kind == "move_shelf" else ""
+            waypoints = [shelf, location] if shelf else [location]
+            description = f"{task.kind} {task.id}"
+            overhead = context.config.battery_shelf_overhead_sec if shelf else 0.0
+            refusal = await route_gate(context, waypoints, description)
+            if refusal:
+                task.status, task.message = "rejected", refusal
+                return
+            # 電池の確認は重複の抑制の中で行い、実行中の同じコマンドには判定せずに結び付く
+            if shelf:
+                result = await context.command_deduplicator.run(
+                    "move_shelf",
+                    (shelf, location),
+                    lambda: battery_gated(
+                        context, waypoints, description, lambda: watcher.move_shelf(shelf, location), overhead
+                    ),
+                )
+                context.cache.invalidate("shelves")
+            else:
+                result = await context.command_deduplicator.run(
+                    "move_to_location",
+                    (location,),
+                    lambda: battery_gated(
+                        context, waypoints, description, lambda: watcher.move_to_location(location), overhead
+                    ),
+                )
+            task.status = "succeeded" if result.success else "failed"
+            task.message = "" if result.success else f"Error code {result.error_code}"
+            error_code = 0 if result.success else result.error_code
+        except BatteryRefused as e:
+            task.status, task.message = "rejected", e.message
+        except Exception as e:
+            logger.error(f"Error running {task.id} on {name}: {e}")
+            task.status, task.message = "failed", str(e)
+        finally:
+            self._record(task, name, started, error_code)
+            self._dispatching.pop(name, None)
+            # 次のタスクの割り当てには最新の状態を使う
+            self.snapshots.pop(name, None)
+            if not task.done.done():
+                task.done.set_result(task)
+            if self.queue:
+                self._ensure_pump()
+
+    def _record(self, task: DispatchTask, name: str, started: float, error_code: int) -> None:
+        """実行したタスクをジャーナルに記録する（ロボットごとの所要時間の集計用）"""
+        if not self.context.config.journal_enabled:
+            return
+        try:
+            self.context.journal.append(
+                f"dispatch:{task.kind}",
+                name,
+                "dispatcher",
+                format_arguments({"location": task.location, "shelf": task.shelf}),
+                "succeeded" if task.status == "succeeded" else "failed",
+                error_code,
+                time.time() - started,
+            )
+        except Exception as e:
+            logger.warning(f"Could not write command journal: {e}")
+
+    def _ensure_pump(self) -> None:
+        """待ち行列のタスクを割り当てるループを起動する"""
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = self.context.lifecycle.spawn(self._pump(), "dispatch-queue")
+
+    async def _pump(self) -> None:
+        """待ち行列が空になるまで、空いたロボットにタスクを割り当てる"""
+        while self.queue:
+            task = self.queue[0]
+            name, score, feasible = await self._select(task)
+            if name is not None:
+                self.queue.popleft()
+                self._start(task, name, score)
+                continue
+            if not feasible:
+                self.queue.popleft()
+                task.status = "rejected"
+                task.message = "No robot can run this task anymore"
+                task.done.set_result(task)
+                continue
+            await asyncio.sleep(self.poll_interval_sec)
+
+    def cancel(self, task_id: str) -> bool:
+        """待ち行列のタスクを取り消す（実行中のタスクは取り消さない）"""
+        task = self.tasks.get(task_id)
+        if task is None or task.status != "queued":
+            return False
+        self.queue.remove(task)
+        task.status = "cancelled"
+        task.done.set_result(task)
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        """ロボットとタスクの状態"""
+        return {
+            "robots": [
+                self.snapshots[name].to_dict(name in self._dispatching)
+                for name in self.robot_names()
+                if name in self.snapshots
+            ],
+            "queue": [task.id for task in self.queue],
+            "tasks": [task.to_dict() for task in self.tasks.values()],
+        }
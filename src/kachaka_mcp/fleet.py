@@ -0,0 +1,192 @@
+"""
+Fleet operations for Kachaka MCP Server.
+
+This module fans one operation out to every configured robot host with a
+concurrency limit and a per-robot timeout, and aggregates the results so a
+rollout across the fleet is a single MCP call.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+# ロボットごとの操作（ロボットのコンテキストと引数を受け取り、成否とメッセージを返す）
+FleetOperation = Callable[..., Awaitable[Tuple[bool, str]]]
+
+
+def _error_message(error: Exception) -> str:
+    """例外を短いメッセージに変換（gRPC のエラーはステータスと詳細だけにする）"""
+    code, details = getattr(error, "code", None), getattr(error, "details", None)
+    if callable(code) and callable(details):
+        return f"{code().name}: {details()}"
+    return str(error)
+
+
+def _result_message(result) -> Tuple[bool, str]:
+    """pb2.Result を成否とメッセージに変換"""
+    if result.success:
+        return True, "OK"
+    return False, f"Error code {result.error_code}"
+
+
+async def _switch_map(context, map_id: str) -> Tuple[bool, str]:
+    result = await context.kachaka_client.switch_map(map_id)
+    context.cache.invalidate()
+    return _result_message(result)
+
+
+async def _set_speaker_volume(context, volume: int) -> Tuple[bool, str]:
+    return _result_message(await context.kachaka_client.set_speaker_volume(volume))
+
+
+async def _set_auto_homing_enabled(context, enable: bool) -> Tuple[bool, str]:
+    return _result_message(await context.kachaka_client.set_auto_homing_enabled(enable))
+
+
+async def _return_home(context) -> Tuple[bool, str]:
+    return _result_message(await context.command_watcher.return_home())
+
+
+async def _speak(context, text: str) -> Tuple[bool, str]:
+    return _result_message(await context.command_watcher.speak(text))
+
+
+async def _cancel_command(context) -> Tuple[bool, str]:
+    result, _ = await context.kachaka_client.cancel_command()
+    return _result_message(result)
+
+
+async def _import_map(context, target_file_path: str, force: bool = False) -> Tuple[bool, str]:
+    from .mapstore import import_map_from_file
+
+    result = await import_map_from_file(
+        context, target_file_path, force=force, chunk_size=context.config.map_chunk_size
+    )
+    if result["skipped"]:
+        return True, f"Already on robot as {result['map_id']}; skipped transfer"
+    context.cache.invalidate()
+    if result["success"]:
+        return True, f"Imported as {result['map_id']}"
+    return False, f"Error code {result['error_code']}"
+
+
+# ブロードキャストできる操作
+FLEET_OPERATIONS: Dict[str, FleetOperation] = {
+    "switch_map": _switch_map,
+    "set_speaker_volume": _set_speaker_volume,
+    "set_auto_homing_enabled": _set_auto_homing_enabled,
+    "return_home": _return_home,
+    "speak": _speak,
+    "cancel_command": _cancel_command,
+    "import_map": _import_map,
+}
+
+
+class Fleet:
+    """設定されたロボットの集合"""
+
+    def __init__(
+        self,
+        robots: Dict[str, str],
+        context_factory: Callable[[str], Any],
+        concurrency: int = 8,
+        timeout_sec: float = 30.0,
+    ):
+        """初期化
+
+        Args:
+            robots: ロボットの名前からホスト（IPアドレス:ポート）への対応
+            context_factory: ホストからロボットのコンテキストを作成する関数
+            concurrency: 同時に操作するロボットの数
+            timeout_sec: ロボットごとのタイムアウト（秒）
+        """
+        self.robots = dict(robots)
+        self.concurrency = max(1, concurrency)
+        self.timeout_sec = timeout_sec
+        self._context_factory = context_factory
+        self._contexts: Dict[str, Any] = {}
+
+    def context(self, name: str):
+        """ロボットのコンテキスト（初回に作成し、以降は接続を再利用する）"""
+        context = self._contexts.get(name)
+        if context is None:
+            context = self._context_factory(self.robots[name])
+            self._contexts[name] = context
+        return context
+
+    def connected(self) -> Dict[str, Any]:
+        """作成済みのロボットのコンテキスト"""
+        return dict(self._contexts)
+
+    def select(self, names: Optional[List[str]] = None) -> List[str]:
+        """操作するロボットの名前（省略時はすべて）
+
+        Raises:
+            KeyError: 設定されていないロボットの名前が含まれる場合
+        """
+        if not names:
+            return sorted(self.robots)
+        unknown = [name for name in names if name not in self.robots]
+        if unknown:
+            raise KeyError(f"Unknown robots: {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+
+    async def broadcast(
+        self,
+        operation: str,
+        arguments: Optional[Dict[str, Any]] = None,
+        robots: Optional[List[str]] = None,
+        timeout_sec: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """操作をロボットに並行して実行し、結果をまとめる
+
+        Args:
+            operation: 操作の名前（FLEET_OPERATIONS のキー）
+            arguments: 操作の引数
+            robots: 操作するロボットの名前（省略時はすべて）
+            timeout_sec: ロボットごとのタイムアウト（秒、省略時は設定値）
+
+        Returns:
+            集計とロボットごとの結果
+        """
+        if operation not in FLEET_OPERATIONS:
+            raise ValueError(
+                f"Unknown fleet operation '{operation}' (available: {', '.join(sorted(FLEET_OPERATIONS))})"
+            )
+        function = FLEET_OPERATIONS[operation]
+        arguments = arguments or {}
+        timeout_sec = timeout_sec or self.timeout_sec
+        names = self.select(robots)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+
+        async def run(name: str) -> Dict[str, Any]:
+            async with semaphore:
+                begin = time.monotonic()
+                entry = {"robot": name, "host": self.robots[name]}
+                try:
+                    success, message = await asyncio.wait_for(
+                        function(self.context(name), **arguments), timeout_sec
+                    )
+                    entry.update(success=success, message=message)
+                except asyncio.TimeoutError:
+                    entry.update(success=False, message=f"Timed out after {timeout_sec}s")
+                except Exception as e:
+                    message = _error_message(e)
+                    logger.warning(f"Fleet {operation} failed on {name}: {message}")
+                    entry.update(success=False, message=f"Error: {message}")
+                entry["elapsed_sec"] = round(time.monotonic() - begin, 3)
+                return entry
+
+        results = await asyncio.gather(*(run(name) for name in names))
+        succeeded = sum(1 for entry in results if entry["success"])
+        return {
+            "operation": operation,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_sec": round(time.monotonic() - started, 3),
+            "results": results,
+        }
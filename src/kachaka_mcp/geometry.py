@@ -0,0 +1,268 @@
+"""
+Map coordinate transforms for Kachaka MCP Server.
+
+This module converts points and poses between map (world) coordinates and
+pixels of the `map://current` image in batches, and renders an annotated
+map with the robot, locations, shelves and arbitrary points drawn on it.
+"""
+
+import asyncio
+import io
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image as PILImage, ImageDraw
+
+
+# これより少ない点数では NumPy を使わずに変換する（配列の生成の方が高くつくため）
+_NUMPY_MIN_POINTS = 32
+
+
+class MapTransform:
+    """マップ座標と地図画像のピクセル座標の変換
+
+    kachaka_api.util.geometry.MapImage2DGeometry と同じ規約で、
+    ピクセル (u, v) はピクセルの中心を表し、v は画像の下向きに増える。
+    向きを含む場合、画像上の角度は u 軸から v 軸に向かって測る。
+    """
+
+    def __init__(
+        self,
+        resolution: float,
+        origin: Tuple[float, float, float],
+        width: int,
+        height: int,
+        map_id: str = "",
+    ):
+        """初期化
+
+        Args:
+            resolution: 1ピクセルの大きさ（メートル）
+            origin: 画像の左下の角のマップ座標 (x, y, theta)
+            width: 画像の幅（ピクセル）
+            height: 画像の高さ（ピクセル）
+            map_id: マップID
+        """
+        self.resolution = float(resolution)
+        self.origin = tuple(float(v) for v in origin)
+        self.width = int(width)
+        self.height = int(height)
+        self.map_id = map_id
+
+        x, y, theta = self.origin
+        c, s = math.cos(theta), math.sin(theta)
+        r = self.resolution
+        self.pixel_to_world_matrix = np.array([
+            [c * r, s * r, x + c * r * 0.5 - s * r * (self.height - 0.5)],
+            [s * r, -c * r, y + s * r * 0.5 + c * r * (self.height - 0.5)],
+            [0.0, 0.0, 1.0],
+        ])
+        self.world_to_pixel_matrix = np.linalg.inv(self.pixel_to_world_matrix)
+
+    @classmethod
+    def from_png_map(cls, png_map, map_id: str = "") -> "MapTransform":
+        """get_png_map() の結果のメタデータから作成"""
+        origin = png_map.origin
+        return cls(
+            png_map.resolution,
+            (origin.x, origin.y, origin.theta),
+            png_map.width,
+            png_map.height,
+            map_id,
+        )
+
+    def metadata(self) -> Dict[str, Any]:
+        """変換に使うメタデータ"""
+        return {
+            "map_id": self.map_id,
+            "resolution": self.resolution,
+            "origin": {"x": self.origin[0], "y": self.origin[1], "theta": self.origin[2]},
+            "width": self.width,
+            "height": self.height,
+        }
+
+    @staticmethod
+    def _apply(matrix: np.ndarray, points: Sequence[Sequence[float]]) -> np.ndarray:
+        """点 (N x 2) または姿勢 (N x 3) に変換行列を適用"""
+        if not isinstance(points, np.ndarray) and len(points) < _NUMPY_MIN_POINTS:
+            (a, b, tx), (c, d, ty) = matrix[0].tolist(), matrix[1].tolist()
+            rows = []
+            for p in points:
+                x, y = float(p[0]), float(p[1])
+                row = [a * x + b * y + tx, c * x + d * y + ty]
+                if len(p) > 2:
+                    yaw = float(p[2])
+                    dx, dy = math.cos(yaw), math.sin(yaw)
+                    row.append(math.atan2(c * dx + d * dy, a * dx + b * dy))
+                rows.append(row)
+            width = max((len(row) for row in rows), default=2)
+            return np.array(rows, dtype=np.float64).reshape(-1, width)
+
+        points = np.asarray(points, dtype=np.float64)
+        points = points.reshape(-1, points.shape[-1] if points.ndim > 1 else 2)
+        linear, offset = matrix[:2, :2], matrix[:2, 2]
+        result = np.empty_like(points)
+        result[:, :2] = points[:, :2] @ linear.T + offset
+        if points.shape[1] > 2:
+            heading = np.stack([np.cos(points[:, 2]), np.sin(points[:, 2])], axis=1) @ linear.T
+            result[:, 2] = np.arctan2(heading[:, 1], heading[:, 0])
+        return result
+
+    def world_to_pixel(self, points: Sequence[Sequence[float]]) -> np.ndarray:
+        """マップ座標 (x, y[, yaw]) の配列をピクセル座標 (u, v[, angle]) に変換"""
+        return self._apply(self.world_to_pixel_matrix, points)
+
+    def pixel_to_world(self, pixels: Sequence[Sequence[float]]) -> np.ndarray:
+        """ピクセル座標 (u, v[, angle]) の配列をマップ座標 (x, y[, yaw]) に変換"""
+        return self._apply(self.pixel_to_world_matrix, pixels)
+
+    def contains(self, pixels: np.ndarray) -> np.ndarray:
+        """ピクセル座標が画像の範囲内かどうか"""
+        cells = np.rint(np.asarray(pixels, dtype=np.float64).reshape(-1, np.shape(pixels)[-1])[:, :2])
+        return (
+            (cells[:, 0] >= 0) & (cells[:, 0] < self.width)
+            & (cells[:, 1] >= 0) & (cells[:, 1] < self.height)
+        )
+
+
+# 注釈の色
+_ROBOT_COLOR = (220, 40, 40)
+_LOCATION_COLOR = (30, 110, 220)
+_SHELF_COLOR = (240, 140, 20)
+_POINT_COLOR = (150, 40, 200)
+
+
+def render_annotated_map(
+    png_data: bytes,
+    transform: MapTransform,
+    robot_pose: Optional[Tuple[float, float, float]] = None,
+    locations: Sequence[Tuple[str, float, float]] = (),
+    shelves: Sequence[Tuple[str, float, float]] = (),
+    points: Sequence[Sequence[float]] = (),
+    max_size: int = 1024,
+) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """ロボット・場所・棚・任意の点を描き込んだ地図画像を作成
+
+    名前は画像に描かず（フォントによっては日本語が描けないため）、
+    各マーカーの横に番号を描いて、番号と名前の対応を凡例として返す。
+
+    Args:
+        png_data: 地図画像（PNG）
+        transform: 座標変換
+        robot_pose: ロボットの姿勢 (x, y, yaw)
+        locations: 場所の (名前, x, y)
+        shelves: 棚の (名前, x, y)
+        points: 任意の点 (x, y)
+        max_size: 画像の長辺のピクセル数の上限（0の場合は縮小しない）
+
+    Returns:
+        PNG画像と凡例
+    """
+    image = PILImage.open(io.BytesIO(png_data)).convert("RGB")
+    scale = 1.0
+    if max_size > 0 and max(image.size) > max_size:
+        scale = max_size / max(image.size)
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            PILImage.Resampling.BILINEAR,
+        )
+    draw = ImageDraw.Draw(image)
+    marker = max(3, round(0.12 / transform.resolution * scale))
+
+    def to_image(xy: Sequence[Sequence[float]]) -> np.ndarray:
+        # ピクセルの中心を基準にした座標を縮小後の画像の座標に変換
+        return (transform.world_to_pixel(np.asarray(xy, dtype=np.float64).reshape(-1, 2)) + 0.5) * scale
+
+    legend: List[Dict[str, Any]] = []
+    groups = [
+        ("location", locations, _LOCATION_COLOR, draw.ellipse),
+        ("shelf", shelves, _SHELF_COLOR, draw.rectangle),
+        ("point", [("", *p[:2]) for p in points], _POINT_COLOR, draw.ellipse),
+    ]
+    for kind, items, color, shape in groups:
+        if not len(items):
+            continue
+        positions = to_image([(x, y) for _, x, y in items])
+        for (name, x, y), (u, v) in zip(items, positions):
+            label = len(legend) + 1
+            shape([u - marker, v - marker, u + marker, v + marker], outline=color, width=2)
+            draw.text((u + marker + 1, v - marker - 1), str(label), fill=color)
+            entry = {"label": label, "kind": kind, "x": round(x, 3), "y": round(y, 3)}
+            if name:
+                entry["name"] = name
+            legend.append(entry)
+
+    if robot_pose is not None:
+        x, y, yaw = robot_pose
+        (u, v), = to_image([(x, y)])
+        (hu, hv), = to_image([(x + 0.4 * math.cos(yaw), y + 0.4 * math.sin(yaw))])
+        draw.ellipse([u - marker * 1.5, v - marker * 1.5, u + marker * 1.5, v + marker * 1.5], fill=_ROBOT_COLOR)
+        draw.line([(u, v), (hu, hv)], fill=_ROBOT_COLOR, width=3)
+        legend.append({"label": "robot", "kind": "robot", "x": round(x, 3), "y": round(y, 3), "yaw": round(yaw, 3)})
+
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue(), legend
+
+
+async def get_png_map(context):
+    """現在のマップ画像をマップIDごとにキャッシュして取得
+
+    Returns:
+        get_png_map() の結果とマップID
+    """
+    client = context.kachaka_client
+    map_id, _ = await context.cache.get("current_map_id", client.get_current_map_id)
+    png_map, _ = await context.cache.get(("png_map", map_id), client.get_png_map, math.inf)
+    return png_map, map_id
+
+
+async def get_map_transform(context) -> MapTransform:
+    """現在のマップの座標変換を取得"""
+    png_map, map_id = await get_png_map(context)
+    return MapTransform.from_png_map(png_map, map_id)
+
+
+async def build_annotated_map(
+    context,
+    show_robot: bool = True,
+    show_locations: bool = True,
+    show_shelves: bool = True,
+    points: Sequence[Sequence[float]] = (),
+    max_size: int = 1024,
+) -> Tuple[bytes, List[Dict[str, Any]], MapTransform]:
+    """現在のマップに注釈を描き込んだ画像を作成
+
+    Returns:
+        PNG画像、凡例、座標変換
+    """
+    from .world import get_locations, get_shelves
+
+    png_map, map_id = await get_png_map(context)
+    transform = MapTransform.from_png_map(png_map, map_id)
+
+    robot_pose = None
+    if show_robot:
+        pose = await context.kachaka_client.get_robot_pose()
+        robot_pose = (pose.x, pose.y, pose.theta)
+    locations = []
+    if show_locations:
+        items, _ = await get_locations(context)
+        locations = [(item.name, item.pose.x, item.pose.y) for item in items]
+    shelves = []
+    if show_shelves:
+        items, _ = await get_shelves(context)
+        shelves = [(item.name, item.pose.x, item.pose.y) for item in items]
+
+    image, legend = await asyncio.to_thread(
+        render_annotated_map,
+        png_map.data,
+        transform,
+        robot_pose,
+        locations,
+        shelves,
+        points,
+        max_size,
+    )
+    return image, legend, transform
@@ -0,0 +1,139 @@
+"""
+Idempotency and duplicate-command suppression for Kachaka MCP Server.
+
+This module keeps a short-lived table of recent robot commands so that a
+retried tool call attaches to the in-flight or completed command instead of
+resubmitting it to the robot.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+
+from .auth import ANONYMOUS_KEY, current_api_key
+
+
+# 現在位置からの相対的なコマンド（同時に2回呼ばれた場合は2回動かす意図の可能性がある）
+RELATIVE_COMMANDS = frozenset({"move_forward", "rotate_in_place"})
+
+
+class IdempotencyKeyReused(Exception):
+    """同じ冪等キーが別の引数のコマンドに使われた"""
+
+    def __init__(self, tool_name: str, idempotency_key: str):
+        self.tool_name = tool_name
+        self.idempotency_key = idempotency_key
+        super().__init__(
+            f"Idempotency key '{idempotency_key}' was already used for {tool_name} with different arguments"
+        )
+
+
+@dataclass
+class CommandEntry:
+    """コマンドテーブルのエントリ"""
+    task: asyncio.Task
+    args: Tuple[Any, ...]
+    created_at: float
+    expires_at: Optional[float] = None
+
+
+class CommandDeduplicator:
+    """最近のコマンドを保持し、同じコマンドの再送を抑制する
+
+    - 冪等キーが指定された場合、TTLの間は同じAPIキー・同じキーの呼び出しを
+      実行中または完了済みのコマンドに結び付ける。引数が異なる場合は
+      IdempotencyKeyReused を送出する。
+    - 冪等キーがない場合でも、同じツール・同じ引数のコマンドが
+      実行中であれば、そのコマンドに結び付ける。ただし相対的なコマンド
+      （RELATIVE_COMMANDS）は結び付けずに実行する。
+    """
+
+    def __init__(
+        self,
+        ttl_sec: float = 600.0,
+        spawn: Optional[Callable[[Coroutine, str], asyncio.Task]] = None,
+    ):
+        """初期化
+
+        Args:
+            ttl_sec: 完了したコマンドの結果を保持する秒数
+            spawn: コマンドのタスクを開始する関数（LifecycleManager.spawn など、省略した場合は追跡しない）
+        """
+        self.ttl_sec = ttl_sec
+        self._spawn = spawn or (lambda coro, name: asyncio.ensure_future(coro))
+        self._entries: Dict[Tuple[str, Hashable], CommandEntry] = {}
+
+    def _purge(self, now: float) -> None:
+        """期限切れのエントリを削除"""
+        expired = [
+            key for key, entry in self._entries.items()
+            if entry.expires_at is not None and entry.expires_at <= now
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def _on_done(self, key: Tuple[str, Hashable], keep: bool, task: asyncio.Task) -> None:
+        """コマンド完了時にエントリの保持期限を設定"""
+        entry = self._entries.get(key)
+        if entry is None or entry.task is not task:
+            return
+        # 例外で終わったコマンドはロボットに届いていない可能性があるため再送を許可する
+        if not keep or task.cancelled() or task.exception() is not None:
+            del self._entries[key]
+            return
+        entry.expires_at = time.monotonic() + self.ttl_sec
+
+    async def run(
+        self,
+        tool_name: str,
+        args: Tuple[Any, ...],
+        factory: Callable[[], Awaitable[Any]],
+        idempotency_key: str = "",
+    ) -> Any:
+        """コマンドを実行する（同じコマンドがあればその結果を待つ）
+
+        呼び出し元がキャンセルされても、ロボットへのコマンドは実行を続ける。
+
+        Args:
+            tool_name: ツール名
+            args: コマンドの引数
+            factory: コマンドを実行するコルーチンを返す関数
+            idempotency_key: 冪等キー（空文字列の場合は実行中の重複のみ抑制）
+
+        Returns:
+            コマンドの結果
+
+        Raises:
+            IdempotencyKeyReused: 同じ冪等キーが別の引数のコマンドに使われた場合
+        """
+        now = time.monotonic()
+        self._purge(now)
+
+        if idempotency_key:
+            # 別のクライアントの同じキーと取り違えないよう、APIキーごとに分ける
+            api_key = current_api_key.get() or ANONYMOUS_KEY
+            key = (tool_name, ("key", api_key, idempotency_key))
+        elif tool_name in RELATIVE_COMMANDS:
+            # 相対的なコマンドは重複とみなさずに実行する
+            return await asyncio.shield(self._spawn(factory(), f"command:{tool_name}"))
+        else:
+            key = (tool_name, ("args", args))
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.args != args:
+                raise IdempotencyKeyReused(tool_name, idempotency_key)
+            state = "completed" if entry.task.done() else "in-flight"
+            logger.info(f"Attaching {tool_name} to {state} command (key={key[1]})")
+        else:
+            task = self._spawn(factory(), f"command:{tool_name}")
+            entry = CommandEntry(task=task, args=args, created_at=now)
+            self._entries[key] = entry
+            task.add_done_callback(
+                lambda t, key=key, keep=bool(idempotency_key): self._on_done(key, keep, t)
+            )
+
+        return await asyncio.shield(entry.task)
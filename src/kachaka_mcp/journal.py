@@ -0,0 +1,484 @@
+"""
+Append-only command journal for Kachaka MCP Server.
+
+This module records every tool invocation (tool, robot, caller, arguments,
+duration, outcome) as a fixed-size binary record. Repeated strings are
+interned into a per-segment string table, and segments are rotated by size
+so that the journal stays bounded. Records are appended in order of their
+finish time, which lets the reader binary-search a time window and skip
+segments that cannot match without scanning the whole journal.
+"""
+
+import contextvars
+import hashlib
+import json
+import struct
+import threading
+import time
+import urllib.parse
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .auth import ANONYMOUS_KEY, AdminRequired, RateLimitExceeded, current_api_key
+from .lifecycle import ShuttingDown
+from .recorder import parse_time
+
+
+# レコードファイルのヘッダー（マジック、セグメントの通し番号）
+RECORD_HEADER = struct.Struct("<8sQ")
+RECORD_MAGIC = b"KCMDJRN1"
+
+# 1回の呼び出しのレコード（文字列は文字列表の番号）
+JOURNAL_RECORD = np.dtype([
+    ("finished_at", "<f8"),
+    ("duration", "<f4"),
+    ("tool", "<u4"),
+    ("robot", "<u4"),
+    ("caller", "<u4"),
+    ("arguments", "<u4"),
+    ("outcome", "u1"),
+    ("error_code", "<i4"),
+])
+
+# 文字列表のエントリー（長さ + UTF-8）
+STRING_LENGTH = struct.Struct("<H")
+
+OUTCOMES = ("succeeded", "failed", "error", "refused")
+
+# 引数として記録しない項目（呼び出しごとに異なり、集計の役に立たないもの）
+IGNORED_ARGUMENTS = ("idempotency_key", "ctx")
+
+MAX_ARGUMENTS_LENGTH = 256
+
+# 実行中の呼び出しのエントリー（コマンドの結果を記録するため）
+_current_entry: contextvars.ContextVar[Optional["JournalEntry"]] = contextvars.ContextVar(
+    "current_journal_entry", default=None
+)
+
+
+def caller_name(api_key: Optional[str] = None) -> str:
+    """呼び出し元の名前（APIキーそのものは記録せず、ハッシュの先頭を使う）"""
+    api_key = api_key or current_api_key.get()
+    if not api_key or api_key == ANONYMOUS_KEY:
+        return ANONYMOUS_KEY
+    return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+def format_arguments(arguments: Dict[str, Any]) -> str:
+    """記録する引数（キーの順に並べた JSON、長い場合は切り詰める）"""
+    kept = {k: v for k, v in sorted(arguments.items()) if k not in IGNORED_ARGUMENTS and v not in ("", None)}
+    text = json.dumps(kept, ensure_ascii=False, separators=(",", ":"), default=str)
+    return text if len(text) <= MAX_ARGUMENTS_LENGTH else text[:MAX_ARGUMENTS_LENGTH - 1] + "…"
+
+
+def parse_filters(query: str) -> Dict[str, Any]:
+    """リソースのURIで指定した条件（"tool=move_shelf&since=2026-10-01T09:00&outcome=failed" の形式）
+
+    since / until は UNIX時刻または ISO 8601 形式の時刻。
+
+    Raises:
+        ValueError: 不明な条件・解釈できない値の場合
+    """
+    filters: Dict[str, Any] = {}
+    for key, value in urllib.parse.parse_qsl(query, keep_blank_values=False, strict_parsing=bool(query)):
+        if key in ("since", "until"):
+            filters[key] = parse_time(value)
+        elif key == "limit":
+            filters[key] = int(value)
+        elif key in ("tool", "robot", "outcome", "caller"):
+            filters[key] = value
+        else:
+            raise ValueError(f"Unknown filter '{key}' (use since, until, tool, robot, outcome, caller, limit)")
+    return filters
+
+
+def note_command_result(result) -> None:
+    """実行中の呼び出しで完了したロボットのコマンドの結果を記録する"""
+    entry = _current_entry.get()
+    if entry is not None and not result.success:
+        entry.error_code = result.error_code or entry.error_code or -1
+
+
+@dataclass
+class JournalEntry:
+    """記録中の呼び出し"""
+    tool: str
+    robot: str
+    caller: str
+    arguments: str
+    started_at: float = field(default_factory=time.time)
+    error_code: int = 0
+    output: str = ""
+
+    def finish(self, result: Any) -> None:
+        """ツールの戻り値を記録する（MCPのコンテンツの場合は最初のテキスト）"""
+        if isinstance(result, str):
+            self.output = result
+            return
+        for content in result or ():
+            text = getattr(content, "text", None)
+            if text is not None:
+                self.output = text
+                return
+
+    def outcome(self, error: Optional[BaseException] = None) -> str:
+        """呼び出しの結果の分類"""
+        if isinstance(error, (ShuttingDown, RateLimitExceeded, AdminRequired)):
+            return "refused"
+        if error is not None:
+            return "error"
+        text = self.output.lstrip()
+        if text.startswith("Error"):
+            return "error"
+        if text.startswith(("Failed", "Refused")) or self.error_code:
+            return "failed"
+        if text.startswith("{"):
+            try:
+                if json.loads(text).get("success") is False:
+                    return "failed"
+            except (ValueError, AttributeError):
+                pass
+        return "succeeded"
+
+
+class JournalSegment:
+    """ジャーナルの1つのセグメント（レコードファイルと文字列表）"""
+
+    def __init__(self, root: Path, sequence: int):
+        self.sequence = sequence
+        self.record_path = root / f"{sequence:08d}.rec"
+        self.string_path = root / f"{sequence:08d}.str"
+
+    def read_strings(self) -> List[str]:
+        """文字列表を読む（書き込み途中の末尾は無視する）"""
+        strings: List[str] = []
+        try:
+            data = self.string_path.read_bytes()
+        except FileNotFoundError:
+            return strings
+        offset = 0
+        while offset + STRING_LENGTH.size <= len(data):
+            (length,) = STRING_LENGTH.unpack_from(data, offset)
+            end = offset + STRING_LENGTH.size + length
+            if end > len(data):
+                break
+            strings.append(data[offset + STRING_LENGTH.size:end].decode("utf-8", "replace"))
+            offset = end
+        return strings
+
+    def records(self) -> np.ndarray:
+        """レコード（ファイルのメモリマップ、書き込み途中の末尾は無視する）"""
+        size = self.record_path.stat().st_size - RECORD_HEADER.size
+        count = max(size, 0) // JOURNAL_RECORD.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=JOURNAL_RECORD)
+        return np.memmap(self.record_path, dtype=JOURNAL_RECORD, mode="r", offset=RECORD_HEADER.size, shape=(count,))
+
+    def remove(self) -> None:
+        """セグメントのファイルを削除する"""
+        self.record_path.unlink(missing_ok=True)
+        self.string_path.unlink(missing_ok=True)
+
+
+class CommandJournal:
+    """ツールの呼び出しの追記専用のジャーナル
+
+    ディスクの使用量はおよそ segments * segment_bytes（と文字列表）を超えない。
+    ファイルは最初の記録のときに開く。
+    """
+
+    def __init__(self, root, segment_bytes: int = 4 * 1024 * 1024, segments: int = 8):
+        """初期化
+
+        Args:
+            root: 保存先のディレクトリ
+            segment_bytes: 1つのセグメントのレコードファイルの最大のバイト数
+            segments: 保持するセグメントの数
+        """
+        self.root = Path(root).expanduser()
+        self.segment_bytes = segment_bytes
+        self.segments = max(2, segments)
+        self.written = 0
+        self._lock = threading.Lock()
+        self._segment: Optional[JournalSegment] = None
+        self._records = None
+        self._strings = None
+        self._size = 0
+        self._ids: Dict[str, int] = {}
+        self._last_time = 0.0
+        # 書き終わったセグメントの文字列表（変更されないため読み込みを使い回す）
+        self._string_cache: Dict[int, List[str]] = {}
+
+    def _list_segments(self) -> List[JournalSegment]:
+        """ディスク上のセグメント（古い順）"""
+        if not self.root.exists():
+            return []
+        sequences = sorted(int(path.stem) for path in self.root.glob("*.rec") if path.stem.isdigit())
+        return [JournalSegment(self.root, sequence) for sequence in sequences]
+
+    def _open(self, segment: JournalSegment) -> None:
+        """追記するセグメントを開く（書き込み途中で止まったレコードは捨てる）"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        fresh = not segment.record_path.exists()
+        self._records = open(segment.record_path, "a+b")
+        if fresh or segment.record_path.stat().st_size < RECORD_HEADER.size:
+            self._records.truncate(0)
+            self._records.write(RECORD_HEADER.pack(RECORD_MAGIC, segment.sequence))
+            self._size = 0
+        else:
+            size = segment.record_path.stat().st_size - RECORD_HEADER.size
+            self._size = size // JOURNAL_RECORD.itemsize * JOURNAL_RECORD.itemsize
+            self._records.truncate(RECORD_HEADER.size + self._size)
+            records = segment.records()
+            if len(records):
+                self._last_time = max(self._last_time, float(records["finished_at"][-1]))
+        self._records.flush()
+        strings = segment.read_strings()
+        self._strings = open(segment.string_path, "a+b")
+        self._strings.truncate(sum(STRING_LENGTH.size + len(s.encode("utf-8")) for s in strings))
+        self._ids = {s: i for i, s in enumerate(strings)}
+        self._segment = segment
+
+    def _close_files(self) -> None:
+        for f in (self._records, self._strings):
+            if f is not None:
+                f.close()
+        self._records = self._strings = None
+
+    def _rotate(self) -> None:
+        """新しいセグメントに切り替え、古いセグメントを削除する"""
+        sequence = self._segment.sequence + 1 if self._segment is not None else 1
+        self._close_files()
+        self._open(JournalSegment(self.root, sequence))
+        existing = self._list_segments()
+        for segment in existing[:-self.segments]:
+            segment.remove()
+            self._string_cache.pop(segment.sequence, None)
+
+    def _intern(self, text: str) -> int:
+        """文字列表の番号（なければ追加する）"""
+        index = self._ids.get(text)
+        if index is None:
+            data = text.encode("utf-8")[:0xFFFF]
+            self._strings.write(STRING_LENGTH.pack(len(data)) + data)
+            self._strings.flush()
+            index = self._ids[text] = len(self._ids)
+        return index
+
+    def append(
+        self,
+        tool: str,
+        robot: str,
+        caller: str,
+        arguments: str,
+        outcome: str,
+        error_code: int = 0,
+        duration: float = 0.0,
+        finished_at: Optional[float] = None,
+    ) -> None:
+        """1回の呼び出しを記録する
+
+        完了時刻は単調増加にそろえる（時計が戻っても二分探索できるようにする）。
+        """
+        with self._lock:
+            if self._segment is None:
+                existing = self._list_segments()
+                if existing:
+                    self._open(existing[-1])
+                else:
+                    self._rotate()
+            if self._size >= self.segment_bytes:
+                self._rotate()
+            finished_at = max(time.time() if finished_at is None else finished_at, self._last_time)
+            self._last_time = finished_at
+            record = np.array([(
+                finished_at,
+                duration,
+                self._intern(tool),
+                self._intern(robot),
+                self._intern(caller),
+                self._intern(arguments),
+                OUTCOMES.index(outcome),
+                error_code,
+            )], dtype=JOURNAL_RECORD)
+            self._records.write(record.tobytes())
+            self._records.flush()
+            self._size += JOURNAL_RECORD.itemsize
+            self.written += 1
+
+    @asynccontextmanager
+    async def track(self, tool: str, arguments: Dict[str, Any], robot: str) -> AsyncIterator[JournalEntry]:
+        """ツールの呼び出しを記録する（戻り値は entry.finish で渡す）"""
+        entry = JournalEntry(tool, robot, caller_name(), format_arguments(arguments))
+        token = _current_entry.set(entry)
+        error: Optional[BaseException] = None
+        try:
+            yield entry
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_entry.reset(token)
+            try:
+                self.append(
+                    entry.tool,
+                    entry.robot,
+                    entry.caller,
+                    entry.arguments,
+                    entry.outcome(error),
+                    entry.error_code,
+                    time.time() - entry.started_at,
+                )
+            except Exception as e:
+                logger.warning(f"Could not write command journal: {e}")
+
+    def _segment_strings(self, segment: JournalSegment) -> List[str]:
+        """セグメントの文字列表（書き込み中のセグメントは毎回読む）"""
+        with self._lock:
+            active = self._segment is not None and segment.sequence == self._segment.sequence
+        if active:
+            return segment.read_strings()
+        strings = self._string_cache.get(segment.sequence)
+        if strings is None:
+            strings = self._string_cache[segment.sequence] = segment.read_strings()
+        return strings
+
+    def query(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        tool: Optional[str] = None,
+        robot: Optional[str] = None,
+        outcome: Optional[str] = None,
+        caller: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """条件に合う呼び出し（新しい順）
+
+        時刻の範囲は完了時刻で二分探索し、範囲外のセグメントや、ツール・ロボットの
+        名前が文字列表にないセグメントは読まない。
+
+        Raises:
+            ValueError: 結果の分類が不正な場合
+        """
+        if outcome is not None and outcome not in OUTCOMES:
+            raise ValueError(f"Unknown outcome '{outcome}' (use {', '.join(OUTCOMES)})")
+        results: List[Dict[str, Any]] = []
+        for segment, records, strings in self._matching(since, until, tool, robot, outcome, caller):
+            for record in records[::-1]:
+                results.append(self._to_dict(record, strings))
+                if limit and len(results) >= limit:
+                    return results
+        return results
+
+    def durations(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        tool: Optional[str] = None,
+        robot: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """ツールと引数（ルート）ごとの所要時間の集計（成功した呼び出しのみ）"""
+        groups: Dict[Tuple[str, str], List[np.ndarray]] = {}
+        for segment, records, strings in self._matching(since, until, tool, robot, "succeeded", None):
+            for (tool_id, arguments_id) in {(int(t), int(a)) for t, a in zip(records["tool"], records["arguments"])}:
+                selected = records["duration"][(records["tool"] == tool_id) & (records["arguments"] == arguments_id)]
+                groups.setdefault((strings[tool_id], strings[arguments_id]), []).append(np.asarray(selected))
+        summary = []
+        for (tool_name, arguments), chunks in groups.items():
+            values = np.concatenate(chunks).astype(float)
+            summary.append({
+                "tool": tool_name,
+                "arguments": arguments,
+                "count": int(len(values)),
+                "mean_sec": round(float(values.mean()), 2),
+                "median_sec": round(float(np.median(values)), 2),
+                "max_sec": round(float(values.max()), 2),
+            })
+        summary.sort(key=lambda item: (-item["count"], item["tool"], item["arguments"]))
+        return summary
+
+    def _matching(
+        self,
+        since: Optional[float],
+        until: Optional[float],
+        tool: Optional[str],
+        robot: Optional[str],
+        outcome: Optional[str],
+        caller: Optional[str],
+    ):
+        """条件に合うレコードをセグメントごとに返す（新しいセグメントから）"""
+        for segment in reversed(self._list_segments()):
+            try:
+                records = segment.records()
+            except FileNotFoundError:
+                continue
+            if len(records) == 0:
+                continue
+            times = records["finished_at"]
+            if until is not None and times[0] > until:
+                continue
+            if since is not None and times[-1] < since:
+                # これより古いセグメントも範囲外
+                break
+            lo = int(np.searchsorted(times, since, "left")) if since is not None else 0
+            hi = int(np.searchsorted(times, until, "right")) if until is not None else len(records)
+            if lo >= hi:
+                continue
+            strings = self._segment_strings(segment)
+            mask = np.ones(hi - lo, dtype=bool)
+            window = records[lo:hi]
+            skip = False
+            for column, value in (("tool", tool), ("robot", robot), ("caller", caller)):
+                if value is None:
+                    continue
+                if value not in strings:
+                    skip = True
+                    break
+                mask &= window[column] == strings.index(value)
+            if skip:
+                continue
+            if outcome is not None:
+                mask &= window["outcome"] == OUTCOMES.index(outcome)
+            if mask.any():
+                yield segment, np.array(window[mask]), strings
+
+    @staticmethod
+    def _to_dict(record, strings: Sequence[str]) -> Dict[str, Any]:
+        duration = float(record["duration"])
+        finished_at = float(record["finished_at"])
+        return {
+            "started_at": round(finished_at - duration, 3),
+            "duration_sec": round(duration, 3),
+            "tool": strings[record["tool"]],
+            "robot": strings[record["robot"]],
+            "caller": strings[record["caller"]],
+            "arguments": strings[record["arguments"]],
+            "outcome": OUTCOMES[record["outcome"]],
+            "error_code": int(record["error_code"]),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """ジャーナルの大きさ"""
+        segments = self._list_segments()
+        return {
+            "segments": len(segments),
+            "bytes": sum(
+                path.stat().st_size
+                for segment in segments
+                for path in (segment.record_path, segment.string_path)
+                if path.exists()
+            ),
+            "capacity_bytes": self.segment_bytes * self.segments,
+        }
+
+    def close(self) -> None:
+        """ファイルを閉じる（次の記録で開き直す）"""
+        with self._lock:
+            self._close_files()
+            self._segment = None
@@ -0,0 +1,87 @@
+"""
+Laser scan summaries for Kachaka MCP Server.
+
+This module condenses a raw laser scan into the nearest obstacle per angular
+sector so that an LLM gets a small, token-efficient view of its surroundings.
+"""
+
+import math
+from typing import Any, Dict, Sequence
+
+import numpy as np
+
+
+def summarize_scan(
+    ranges: Sequence[float],
+    angle_min: float,
+    angle_increment: float,
+    range_min: float,
+    range_max: float,
+    sectors: int = 8,
+    free_distance: float = 1.0,
+) -> Dict[str, Any]:
+    """レーザースキャンを角度セクターごとの最近傍障害物に要約する
+
+    セクター0は正面（角度0）を中心とし、反時計回りに並ぶ。
+    NaN や range_min 未満の値は無視し、inf や range_max 超過は
+    反射なし（障害物なし）として扱う。
+
+    Args:
+        ranges: 距離の配列（メートル）
+        angle_min: 最初のビームの角度（ラジアン）
+        angle_increment: ビーム間の角度（ラジアン）
+        range_min: 有効な最小距離（メートル）
+        range_max: 有効な最大距離（メートル）
+        sectors: セクター数
+        free_distance: この距離より遠い場合に空いているとみなす（メートル）
+
+    Returns:
+        要約結果
+    """
+    sectors = max(int(sectors), 1)
+    width = 2.0 * math.pi / sectors
+
+    r = np.asarray(ranges, dtype=np.float64)
+    angles = angle_min + angle_increment * np.arange(r.size)
+    index = (np.floor(np.mod(angles + width / 2.0, 2.0 * math.pi) / width).astype(np.intp)) % sectors
+
+    hit = np.isfinite(r) & (r >= range_min) & (r <= range_max)
+    # 反射なしのビームも、そのセクターを観測したことになる
+    observed = hit | (np.isposinf(r) | (np.isfinite(r) & (r > range_max)))
+
+    nearest = np.full(sectors, np.inf)
+    np.minimum.at(nearest, index[hit], r[hit])
+    beams = np.bincount(index[observed], minlength=sectors)
+
+    result_sectors = []
+    free_directions = []
+    for i in range(sectors):
+        center_deg = round(math.degrees(i * width), 1)
+        if center_deg > 180.0:
+            center_deg = round(center_deg - 360.0, 1)
+        if beams[i] == 0:
+            status = "unobserved"
+            distance = None
+        else:
+            distance = None if math.isinf(nearest[i]) else round(float(nearest[i]), 2)
+            status = "free" if distance is None or distance > free_distance else "blocked"
+        if status == "free":
+            free_directions.append(center_deg)
+        result_sectors.append({"center_deg": center_deg, "nearest_m": distance, "status": status})
+
+    closest = None
+    if hit.any():
+        i = int(np.argmin(np.where(hit, r, np.inf)))
+        closest = {
+            "distance_m": round(float(r[i]), 2),
+            "angle_deg": round(math.degrees(math.atan2(math.sin(angles[i]), math.cos(angles[i]))), 1),
+        }
+
+    return {
+        "sectors": result_sectors,
+        "nearest": closest,
+        "free_directions_deg": free_directions,
+        "free_distance_m": free_distance,
+        "valid_beams": int(hit.sum()),
+        "total_beams": int(r.size),
+    }
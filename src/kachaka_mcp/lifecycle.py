@@ -0,0 +1,339 @@
+"""
+Server lifecycle management for Kachaka MCP Server.
+
+This module tracks in-flight tool calls and background tasks and performs a
+graceful shutdown: new motion commands are refused, running commands are
+given a deadline to finish, and whatever is still running afterwards is
+either cancelled on the robot or handed over to the next server process
+through a state file. gRPC channels are closed and counters are written to
+disk on the way out.
+"""
+
+import asyncio
+import fnmatch
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import grpc
+from kachaka_api.aio import KachakaApiClient
+from kachaka_api.generated.kachaka_api_pb2_grpc import KachakaApiStub
+from kachaka_api.util.layout import ShelfLocationResolver
+from loguru import logger
+
+
+class ShuttingDown(Exception):
+    """終了処理中のため新しいモーションコマンドを受け付けない"""
+
+    def __init__(self, name: str):
+        self.name = name
+        super().__init__(f"Server is shutting down; {name} was not started. Retry on the restarted server.")
+
+
+@dataclass
+class InFlightCall:
+    """実行中のツール呼び出し"""
+    name: str
+    motion: bool
+    started_at: float
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {"name": self.name, "motion": self.motion, "running_sec": round(now - self.started_at, 1)}
+
+
+class ChannelKachakaApiClient(KachakaApiClient):
+    """gRPC チャネルへの参照を channel に保持する Kachaka APIクライアント
+
+    kachaka_api のクライアントはコンストラクタで作成したチャネルを公開しないため、
+    親クラスのコンストラクタは呼ばずに、閉じられるチャネルを1つだけ作成する
+    （親クラスのコンストラクタはスタブとリゾルバを設定するだけ）。
+    """
+
+    def __init__(self, target: str = "100.94.1.1:26400") -> None:
+        if target.count(":") != 1:
+            raise ValueError(f"Invalid target: {target}")
+        self.channel = grpc.aio.insecure_channel(target)
+        self.stub = KachakaApiStub(self.channel)
+        self.resolver = ShelfLocationResolver()
+
+
+def connect_client(target: str) -> ChannelKachakaApiClient:
+    """Kachaka APIクライアントを作成する（close_client でチャネルを閉じられる）"""
+    return ChannelKachakaApiClient(target)
+
+
+async def close_client(client) -> bool:
+    """Kachaka APIクライアントの gRPC チャネルを閉じる（connect_client で作成した場合）
+
+    Returns:
+        チャネルを閉じた場合は True
+    """
+    channel = getattr(client, "channel", None)
+    if not isinstance(channel, grpc.aio.Channel):
+        return False
+    # close() は実行中の呼び出しをキャンセルしてから閉じる
+    await channel.close()
+    return True
+
+
+class LifecycleManager:
+    """ツール呼び出しとバックグラウンドタスクの追跡と、終了処理"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        self.draining = False
+        self.started_at = time.time()
+        self.counters: Dict[str, int] = {"tool_calls": 0, "refused_while_draining": 0}
+        self._calls: Dict[int, InFlightCall] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._shutdown: Optional[asyncio.Task] = None
+        self._resumed = False
+
+    def is_motion(self, name: str) -> bool:
+        """終了処理中に受け付けないツールかどうか"""
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.context.config.shutdown_refused_tools)
+
+    @asynccontextmanager
+    async def call(self, name: str) -> AsyncIterator[None]:
+        """ツール呼び出しを追跡する（終了処理中はモーションコマンドを拒否する）
+
+        Raises:
+            ShuttingDown: 終了処理中にモーションコマンドが呼ばれた場合
+        """
+        motion = self.is_motion(name)
+        if self.draining and motion:
+            self.counters["refused_while_draining"] += 1
+            raise ShuttingDown(name)
+        self.counters["tool_calls"] += 1
+        entry = InFlightCall(name, motion, time.monotonic(), asyncio.current_task())
+        key = id(entry)
+        self._calls[key] = entry
+        try:
+            yield
+        finally:
+            del self._calls[key]
+
+    def spawn(self, coro, name: str = "") -> asyncio.Task:
+        """バックグラウンドタスクを開始して追跡する（終了処理でキャンセルされる）"""
+        task = asyncio.ensure_future(coro)
+        if name:
+            task.set_name(name)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def robots(self) -> Dict[str, Any]:
+        """コマンドを送った可能性のあるロボットのコンテキスト（ホストごと）"""
+        fleet = self.context.fleet
+        contexts = {self.context.config.kachaka_host: self.context}
+        for name, robot_context in fleet.connected().items():
+            contexts.setdefault(fleet.robots[name], robot_context)
+        return contexts
+
+    def pending_commands(self) -> List[Dict[str, Any]]:
+        """完了を待っているロボットのコマンド"""
+        return [
+            {"host": host, "command_id": command_id}
+            for host, robot_context in self.robots().items()
+            for command_id in robot_context.command_watcher.pending
+        ]
+
+    def status(self) -> Dict[str, Any]:
+        """実行中の処理の一覧"""
+        now = time.monotonic()
+        return {
+            "draining": self.draining,
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "in_flight_calls": [call.to_dict(now) for call in self._calls.values()],
+            "pending_commands": self.pending_commands(),
+            "background_tasks": sorted(task.get_name() for task in self._background if not task.done()),
+            "dispatch_queue": [task.id for task in self.context.dispatcher.queue],
+            "counters": dict(self.counters),
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        """終了時に保存する各部のカウンター"""
+        context = self.context
+        occupancy = context.local_map.occupancy
+        statuses: Dict[str, int] = {}
+        for task in context.dispatcher.tasks.values():
+            statuses[task.status] = statuses.get(task.status, 0) + 1
+        return {
+            **self.counters,
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "command_polls": sum(c.command_watcher.polls for c in self.robots().values()),
+            "object_memory_frames": context.object_memory.frames,
+            "local_map_scans": occupancy.scans if occupancy is not None else 0,
+            "local_map_skipped_scans": context.local_map.skipped,
+            "camera_frames_dropped": context.camera_recorder.dropped,
+            "trace_spans": context.tracer.recorded,
+            "dispatch_tasks": statuses,
+        }
+
+    async def _wait_for_work(self, deadline: float) -> bool:
+        """実行中のモーションコマンドとロボットのコマンドの完了を待つ
+
+        Returns:
+            期限までにすべて完了した場合は True
+        """
+        while True:
+            calls = [c.task for c in self._calls.values() if c.motion and c.task is not None and not c.task.done()]
+            if not calls and not self.context.dispatcher.running and not self.pending_commands():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(min(0.2, max(deadline - time.monotonic(), 0.0)))
+
+    async def shutdown(self, drain_sec: Optional[float] = None, on_timeout: Optional[str] = None) -> Dict[str, Any]:
+        """終了処理（複数回呼ばれても1回だけ実行する）
+
+        Args:
+            drain_sec: 実行中のコマンドの完了を待つ最大の秒数（None の場合は設定値）
+            on_timeout: 期限までに完了しなかったコマンドの扱い（cancel: ロボットのコマンドを
+                キャンセルする、detach: 状態ファイルに記録して次のサーバーに引き継ぐ）
+
+        Returns:
+            終了処理の結果
+        """
+        if self._shutdown is None:
+            self._shutdown = asyncio.ensure_future(self._run_shutdown(drain_sec, on_timeout))
+        return await asyncio.shield(self._shutdown)
+
+    async def _run_shutdown(self, drain_sec: Optional[float], on_timeout: Optional[str]) -> Dict[str, Any]:
+        context = self.context
+        config = context.config
+        drain_sec = config.shutdown_drain_sec if drain_sec is None else drain_sec
+        on_timeout = on_timeout or config.shutdown_timeout_action
+        started = time.monotonic()
+        self.draining = True
+        logger.info(f"Shutting down: draining in-flight commands for up to {drain_sec:.0f}s")
+
+        # 待ち行列のタスクは開始しない
+        for task in list(context.dispatcher.queue):
+            context.dispatcher.cancel(task.id)
+
+        # センサーの定期的な取得は待たずに止める
+        context.object_memory.stop()
+        context.local_map.stop()
+        context.battery_monitor.stop()
+        context.camera_recorder.stop()
+        if context.profiler.running:
+            context.profiler.stop()
+
+        drained = await self._wait_for_work(started + drain_sec)
+        detached: List[Dict[str, Any]] = []
+        if not drained:
+            pending = self.pending_commands()
+            if on_timeout == "cancel":
+                for host, robot_context in self.robots().items():
+                    if robot_context.command_watcher.pending:
+                        try:
+                            await robot_context.kachaka_client.cancel_command()
+                            logger.warning(f"Cancelled running command on {host} at shutdown")
+                        except Exception as e:
+                            logger.error(f"Could not cancel command on {host}: {e}")
+                # キャンセルの結果を受け取るまで少し待つ
+                await self._wait_for_work(time.monotonic() + config.command_poll_max_sec * 2)
+            else:
+                detached = pending
+                logger.warning(f"Handing over {len(detached)} running command(s) to the next server process")
+
+        # 残った呼び出しとバックグラウンドタスクをキャンセルする
+        remaining = [c.task for c in self._calls.values() if c.task is not None and not c.task.done()]
+        remaining += [task for task in self._background if not task.done()]
+        current = asyncio.current_task()
+        for task in remaining:
+            if task is not current:
+                task.cancel()
+
+        for robot_context in self.robots().values():
+            robot_context.command_watcher.stop()
+        context.camera_recorder.close()
+        context.journal.close()
+        context.tracer.close()
+        if context.traffic_recorder is not None:
+            context.traffic_recorder.close()
+
+        report = {
+            "drained": drained,
+            "drain_sec": round(time.monotonic() - started, 1),
+            "cancelled_calls": len(remaining),
+            "detached_commands": detached,
+        }
+        self.write_state(report)
+
+        closed = 0
+        for robot_context in self.robots().values():
+            closed += await close_client(robot_context.kachaka_client)
+        logger.info(f"Shutdown complete: {report}, closed {closed} channel(s)")
+        return report
+
+    def write_state(self, report: Dict[str, Any]) -> None:
+        """引き継ぐコマンドとカウンターを状態ファイルに書き込む（一時ファイルから置き換える）"""
+        path = Path(self.context.config.shutdown_state_path).expanduser()
+        state = {"stopped_at": time.time(), **report, "metrics": self.metrics()}
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2))
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"Could not write shutdown state: {e}")
+
+    def resume(self) -> int:
+        """前のサーバーが引き継いだコマンドの完了を追跡する（起動後に1回だけ）
+
+        Returns:
+            追跡を再開したコマンドの数
+        """
+        if self._resumed:
+            return 0
+        self._resumed = True
+        path = Path(self.context.config.shutdown_state_path).expanduser()
+        try:
+            state = json.loads(path.read_text())
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable shutdown state: {e}")
+            return 0
+
+        robots = self.robots()
+        fleet = self.context.fleet
+        resumed = 0
+        for entry in state.get("detached_commands", []):
+            host, command_id = entry.get("host"), entry.get("command_id")
+            robot_context = robots.get(host)
+            if robot_context is None:
+                name = next((n for n, h in fleet.robots.items() if h == host), None)
+                if name is None:
+                    logger.warning(f"Cannot resume command {command_id}: unknown robot {host}")
+                    continue
+                robot_context = fleet.context(name)
+            future = robot_context.command_watcher.watch(command_id)
+            future.add_done_callback(
+                lambda f, host=host, command_id=command_id: f.cancelled() or logger.info(
+                    f"Handed-over command {command_id} on {host} finished: "
+                    f"success={f.result().success}, error_code={f.result().error_code}"
+                )
+            )
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed tracking {resumed} command(s) handed over by the previous server")
+        # 引き継ぎは1回限り（カウンターは残す）
+        state["detached_commands"] = []
+        try:
+            path.write_text(json.dumps(state, ensure_ascii=False, indent=2))
+        except Exception as e:
+            logger.debug(f"Could not update shutdown state: {e}")
+        return resumed
@@ -0,0 +1,456 @@
+"""
+Laser-based local map for Kachaka MCP Server.
+
+This module projects laser scans into map coordinates using the robot pose,
+fuses them into a log-odds occupancy grid aligned with the current map, and
+compares the result with the static map so that new obstacles (and the
+corridors they cut) are reported as a short list of regions. Routes can be
+checked against those obstacles before a shelf is moved into them.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .occupancy import FREE, OCCUPIED, OccupancyGrid
+from .travel import TravelModel, clearance_transform
+
+
+# 姿勢の取得の間にこれ以上動いた場合はスキャンを統合しない（ぶれを避ける）
+MAX_TRANSLATION_PER_SCAN = 0.1
+MAX_ROTATION_PER_SCAN = 0.1
+
+_NEIGHBOURS_8 = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def scan_endpoints(
+    pose: Tuple[float, float, float],
+    ranges: Sequence[float],
+    angle_min: float,
+    angle_increment: float,
+    range_min: float,
+    range_max: float,
+    max_range: float = 4.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """レーザースキャンのビームの終点をマップ座標に変換
+
+    NaN や range_min 未満の値は無視する。反射なし（inf や range_max 超過）の
+    ビームと max_range より遠いビームは max_range までを空きとして扱う。
+
+    Returns:
+        終点の配列 (N, 2) と、終点が障害物かどうかの配列 (N,)
+    """
+    r = np.asarray(ranges, dtype=np.float64)
+    angles = angle_min + angle_increment * np.arange(r.size) + pose[2]
+    limit = min(range_max, max_range)
+    valid = ~np.isnan(r) & (r >= range_min)
+    hit = valid & (r <= limit)
+    length = np.where(hit, r, limit)[valid]
+    angles = angles[valid]
+    ends = np.column_stack([pose[0] + length * np.cos(angles), pose[1] + length * np.sin(angles)])
+    return ends, hit[valid]
+
+
+def label_regions(mask: np.ndarray) -> List[np.ndarray]:
+    """8近傍で連結した領域ごとのセル (row, col) の配列"""
+    remaining = set(map(tuple, np.argwhere(mask).tolist()))
+    regions = []
+    while remaining:
+        seed = remaining.pop()
+        cells = [seed]
+        queue = deque([seed])
+        while queue:
+            row, col = queue.popleft()
+            for dr, dc in _NEIGHBOURS_8:
+                cell = (row + dr, col + dc)
+                if cell in remaining:
+                    remaining.remove(cell)
+                    cells.append(cell)
+                    queue.append(cell)
+        regions.append(np.asarray(cells, dtype=np.int64))
+    return regions
+
+
+def border_components(mask: np.ndarray) -> int:
+    """窓の外周に接する連結領域の数（窓を通り抜ける通路の数の目安）"""
+    border = np.zeros_like(mask)
+    border[0, :] = border[-1, :] = border[:, 0] = border[:, -1] = True
+    count = 0
+    for region in label_regions(mask):
+        if border[region[:, 0], region[:, 1]].any():
+            count += 1
+    return count
+
+
+class LaserOccupancy:
+    """静的な地図に合わせたレーザースキャンの対数オッズ占有格子"""
+
+    def __init__(
+        self,
+        grid: OccupancyGrid,
+        hit: float = 0.9,
+        miss: float = -0.4,
+        limit: float = 4.0,
+        occupied: float = 2.0,
+        robot_radius: float = 0.2,
+        tolerance: float = 0.1,
+        max_age: float = 0.0,
+    ):
+        """初期化
+
+        Args:
+            grid: 静的な占有格子地図
+            hit: 障害物を観測したセルに加える対数オッズ
+            miss: ビームが通過したセルに加える対数オッズ
+            limit: 対数オッズの絶対値の上限（古い観測を新しい観測で上書きできるようにする）
+            occupied: 障害物とみなす対数オッズ
+            robot_radius: ロボットの半径（通路がふさがれたかの判定に使う、メートル）
+            tolerance: 静的な障害物からこの距離以内の観測は地図の障害物とみなす（自己位置の誤差、メートル）
+            max_age: 最後に観測してからこの秒数を過ぎた障害物は無視する（0 の場合は無視しない）
+        """
+        self.grid = grid
+        self.map_id = grid.map_id
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.occupied = occupied
+        self.max_age = max_age
+        self.log_odds = np.zeros(grid.data.shape, dtype=np.float32)
+        self.last_hit = np.zeros(grid.data.shape, dtype=np.float64)
+        self.scans = 0
+
+        resolution = grid.resolution
+        self.radius_cells = robot_radius / resolution
+        tolerance_cells = tolerance / resolution
+        static_occupied = grid.data == OCCUPIED
+        # 静的な障害物の近くは新しい障害物として報告しない
+        self._candidate = (grid.data == FREE) & (
+            clearance_transform(static_occupied, int(math.ceil(tolerance_cells)) + 1) > tolerance_cells
+        )
+        # 静的な地図でロボットが通れるセル
+        free = grid.data == FREE
+        self.navigable = free & (
+            clearance_transform(~free, int(math.ceil(self.radius_cells)) + 1) > self.radius_cells
+        )
+
+    def _to_cells(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """マップ座標をセルの平坦化した番号に変換（地図の外は除く）"""
+        pixels = np.rint(self.grid.world_to_pixel(points)).astype(np.int64)
+        cols, rows = pixels[:, 0], pixels[:, 1]
+        inside = (rows >= 0) & (rows < self.grid.height) & (cols >= 0) & (cols < self.grid.width)
+        return rows[inside] * self.grid.width + cols[inside], inside
+
+    def integrate(
+        self,
+        pose: Tuple[float, float, float],
+        ranges: Sequence[float],
+        angle_min: float,
+        angle_increment: float,
+        range_min: float,
+        range_max: float,
+        max_range: float = 4.0,
+        now: Optional[float] = None,
+    ) -> int:
+        """スキャンを1つ統合する
+
+        ビームに沿って地図の解像度の間隔でセルを標本化し、通過したセルは
+        空き、終点のセルは障害物として対数オッズを更新する（1スキャンで
+        同じセルを更新するのは1回だけ）。
+
+        Returns:
+            更新したセルの数
+        """
+        now = time.time() if now is None else now
+        ends, hit = scan_endpoints(pose, ranges, angle_min, angle_increment, range_min, range_max, max_range)
+        if not len(ends):
+            return 0
+        origin = np.asarray(pose[:2], dtype=np.float64)
+        step = self.grid.resolution
+        lengths = np.hypot(*(ends - origin).T)
+        counts = np.maximum(np.ceil(lengths / step).astype(np.int64), 1)
+        ray = np.repeat(np.arange(len(ends)), counts)
+        # 各ビームの中での標本の番号（終点の手前まで）
+        offsets = np.arange(ray.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = (offsets / counts[ray])[:, None]
+        samples = origin + (ends[ray] - origin) * t
+
+        flat = self.log_odds.reshape(-1)
+        last_hit = self.last_hit.reshape(-1)
+        hit_cells, _ = self._to_cells(ends[hit])
+        hit_cells = np.unique(hit_cells)
+        free_cells, _ = self._to_cells(samples)
+        free_cells = np.setdiff1d(free_cells, hit_cells)
+        flat[free_cells] += self.miss
+        flat[hit_cells] += self.hit
+        last_hit[hit_cells] = now
+        touched = np.concatenate([free_cells, hit_cells])
+        flat[touched] = np.clip(flat[touched], -self.limit, self.limit)
+        self.scans += 1
+        return int(touched.size)
+
+    def obstacle_mask(self, now: Optional[float] = None) -> np.ndarray:
+        """静的な地図では空きなのに障害物が観測されたセル
+
+        通過するビームがなく対数オッズが下がらないセル（ロボットが離れた場所など）も、
+        最後に観測してから max_age 秒を過ぎたら障害物とみなさない。
+        """
+        mask = (self.log_odds >= self.occupied) & self._candidate
+        if self.max_age > 0:
+            now = time.time() if now is None else now
+            mask &= self.last_hit >= now - self.max_age
+        return mask
+
+    def changes(
+        self,
+        min_cells: int = 3,
+        corridor_margin: float = 1.0,
+        now: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """静的な地図にない障害物の領域
+
+        領域の周囲 corridor_margin の窓の中で、ロボットが通れるセルの
+        窓の外周に接する連結領域が障害物によって増えた場合（通り抜けられた
+        通路が分断された場合）は blocks_corridor を True にする。
+
+        Args:
+            min_cells: 報告する領域の最小のセル数（ノイズを除く）
+            corridor_margin: 通路の分断を調べる窓の余白（メートル）
+            now: 現在時刻（テスト用）
+
+        Returns:
+            大きい順の領域の一覧
+        """
+        now = time.time() if now is None else now
+        mask = self.obstacle_mask(now)
+        resolution = self.grid.resolution
+        margin = int(math.ceil(self.radius_cells + corridor_margin / resolution))
+        radius = self.radius_cells
+        height, width = mask.shape
+
+        results = []
+        for cells in label_regions(mask):
+            if len(cells) < min_cells:
+                continue
+            (r0, c0), (r1, c1) = cells.min(axis=0), cells.max(axis=0)
+            window = (
+                slice(max(r0 - margin, 0), min(r1 + margin + 1, height)),
+                slice(max(c0 - margin, 0), min(c1 + margin + 1, width)),
+            )
+            before = self.navigable[window]
+            after = before & (clearance_transform(mask[window], int(math.ceil(radius)) + 1) > radius)
+            blocked = border_components(after) > border_components(before)
+
+            points = self.grid.pixel_to_world(cells[:, ::-1])
+            lo, hi = points.min(axis=0), points.max(axis=0)
+            center = points.mean(axis=0)
+            odds = float(self.log_odds[cells[:, 0], cells[:, 1]].max())
+            results.append({
+                "x": round(float(center[0]), 2),
+                "y": round(float(center[1]), 2),
+                "size_m": [round(float(hi[0] - lo[0] + resolution), 2), round(float(hi[1] - lo[1] + resolution), 2)],
+                "area_m2": round(len(cells) * resolution ** 2, 3),
+                "confidence": round(1.0 - 1.0 / (1.0 + math.exp(odds)), 2),
+                "last_seen_sec_ago": round(now - float(self.last_hit[cells[:, 0], cells[:, 1]].max()), 1),
+                "blocks_corridor": bool(blocked),
+            })
+        results.sort(key=lambda region: -region["area_m2"])
+        return results
+
+    def blocked_grid(self, now: Optional[float] = None) -> OccupancyGrid:
+        """新しい障害物を書き込んだ占有格子地図（経路の判定用）"""
+        data = self.grid.data.copy()
+        data[self.obstacle_mask(now)] = OCCUPIED
+        return OccupancyGrid(data, self.grid.resolution, self.grid.origin, self.grid.map_id)
+
+
+class LocalMapAggregator:
+    """レーザースキャンを定期的に取得してローカルマップに統合する"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        self.interval_sec = context.config.local_map_interval_sec
+        self.occupancy: Optional[LaserOccupancy] = None
+        self.skipped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._blocked_model: Optional[Tuple[bytes, TravelModel]] = None
+
+    async def _occupancy(self) -> LaserOccupancy:
+        """現在のマップのローカルマップ（マップが変わった場合は作り直す）"""
+        from .travel import get_occupancy_grid
+
+        grid = await get_occupancy_grid(self.context)
+        if self.occupancy is None or self.occupancy.grid is not grid:
+            config = self.context.config
+            self.occupancy = await asyncio.to_thread(
+                LaserOccupancy,
+                grid,
+                robot_radius=config.robot_radius,
+                tolerance=config.local_map_tolerance_m,
+                max_age=config.local_map_max_age_sec,
+            )
+            self._blocked_model = None
+        return self.occupancy
+
+    async def sample(self) -> int:
+        """スキャンを1つ取得して統合する
+
+        スキャンの前後で姿勢を取得し、その間に大きく動いていた場合は
+        統合しない。
+
+        Returns:
+            更新したセルの数
+        """
+        client = self.context.kachaka_client
+        occupancy = await self._occupancy()
+        before, scan = await asyncio.gather(client.get_robot_pose(), client.get_ros_laser_scan())
+        after = await client.get_robot_pose()
+        rotation = abs(math.atan2(math.sin(after.theta - before.theta), math.cos(after.theta - before.theta)))
+        if math.hypot(after.x - before.x, after.y - before.y) > MAX_TRANSLATION_PER_SCAN or rotation > MAX_ROTATION_PER_SCAN:
+            self.skipped += 1
+            return 0
+        theta = before.theta + math.atan2(math.sin(after.theta - before.theta), math.cos(after.theta - before.theta)) / 2
+        pose = ((before.x + after.x) / 2, (before.y + after.y) / 2, theta)
+        return await asyncio.to_thread(
+            occupancy.integrate,
+            pose,
+            scan.ranges,
+            scan.angle_min,
+            scan.angle_increment,
+            scan.range_min,
+            scan.range_max,
+            self.context.config.local_map_max_range_m,
+        )
+
+    def start(self) -> None:
+        """定期的な取得を開始（開始済みの場合は何もしない）"""
+        if self.interval_sec > 0 and (self._task is None or self._task.done()):
+            self._task = self.context.lifecycle.spawn(self._run(), "local-map")
+
+    def stop(self) -> None:
+        """定期的な取得を停止"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        """一定の間隔で取得する"""
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.debug(f"Local map sampling failed: {e}")
+            await asyncio.sleep(self.interval_sec)
+
+    async def changes(self) -> Dict[str, Any]:
+        """静的な地図との差分の要約"""
+        occupancy = await self._occupancy()
+        config = self.context.config
+        regions = await asyncio.to_thread(
+            occupancy.changes, config.local_map_min_cells, config.local_map_corridor_margin_m
+        )
+        return {
+            "map_id": occupancy.map_id,
+            "scans": occupancy.scans,
+            "new_obstacles": regions,
+            "blocked_corridors": sum(region["blocks_corridor"] for region in regions),
+        }
+
+    async def _blocked_travel_model(self, occupancy: LaserOccupancy) -> Optional[TravelModel]:
+        """新しい障害物を反映した経路長推定モデル（障害物がなければ None）
+
+        障害物のセルが変わらない間は作り直さない。
+        """
+        now = time.time()
+        mask = occupancy.obstacle_mask(now)
+        if not mask.any():
+            return None
+        key = np.packbits(mask).tobytes()
+        if self._blocked_model is None or self._blocked_model[0] != key:
+            config = self.context.config
+            model = await asyncio.to_thread(
+                TravelModel, occupancy.blocked_grid(now), config.robot_radius, config.travel_cell_size, config.travel_speed
+            )
+            self._blocked_model = (key, model)
+        return self._blocked_model[1]
+
+    async def check_route(self, waypoints: Sequence[Tuple[float, float]]) -> Dict[str, Any]:
+        """ロボットの現在位置から経由地を順に回る経路が新しい障害物でふさがれていないかを判定
+
+        Returns:
+            区間ごとの静的な地図と観測後の経路長、および blocked（静的な地図では
+            到達できるのに観測後は到達できない区間がある）
+        """
+        from .travel import get_travel_model
+
+        occupancy = await self._occupancy()
+        static = await get_travel_model(self.context)
+        observed = await self._blocked_travel_model(occupancy)
+        pose = await self.context.kachaka_client.get_robot_pose()
+        points = [(pose.x, pose.y), *waypoints]
+
+        legs = []
+        for a, b in zip(points, points[1:]):
+            before = await asyncio.to_thread(static.path_length, a, b)
+            after = before if observed is None else await asyncio.to_thread(observed.path_length, a, b)
+            legs.append({
+                "from": [round(a[0], 2), round(a[1], 2)],
+                "to": [round(b[0], 2), round(b[1], 2)],
+                "static_path_m": None if before is None else round(before, 2),
+                "observed_path_m": None if after is None else round(after, 2),
+                "blocked": before is not None and after is None,
+            })
+        return {
+            "blocked": any(leg["blocked"] for leg in legs),
+            "legs": legs,
+            "scans": occupancy.scans,
+        }
+
+
+async def route_gate(context, waypoints: List[Any], description: str) -> Optional[str]:
+    """モーション・棚コマンドの前に経路が新しい障害物でふさがれていないかを確認する
+
+    Args:
+        context: KachakaMCPContext
+        waypoints: 順に向かう位置、または場所・棚の名前・ID
+        description: 説明に使うタスクの内容
+
+    Returns:
+        実行しない場合はその理由、実行してよい場合は None
+    """
+    from .travel import resolve_place
+
+    if not context.config.local_map_route_check:
+        return None
+    local_map = context.local_map
+    if local_map.occupancy is None or not local_map.occupancy.scans:
+        return None
+    try:
+        points = [
+            (await resolve_place(context, point))[1] if isinstance(point, str) else point
+            for point in waypoints
+        ]
+        check = await local_map.check_route(points)
+    except Exception as e:
+        # 判定できない場合はコマンドを止めない
+        logger.warning(f"Route check skipped: {e}")
+        return None
+    if not check["blocked"]:
+        return None
+    leg = next(leg for leg in check["legs"] if leg["blocked"])
+    message = (
+        f"Refused: cannot {description}; the route from {tuple(leg['from'])} to {tuple(leg['to'])} "
+        f"is blocked by obstacles the laser sees but the map does not. "
+        f"Read sensors://laser/changes for the blocking regions."
+    )
+    logger.warning(message)
+    return message
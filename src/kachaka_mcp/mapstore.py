@@ -0,0 +1,310 @@
+"""
+Content-addressed map store for Kachaka MCP Server.
+
+This module streams map exports and imports in chunks with progress
+reporting, keeps exported maps in a local store keyed by their SHA-256, and
+remembers which robot already holds which map so that re-importing identical
+data can be skipped.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+
+# 進捗の通知先（転送済みのバイト数、全体のバイト数）
+ProgressCallback = Callable[[int, Optional[int]], Awaitable[None]]
+
+
+def hash_file(path, chunk_size: int = 1024 * 1024) -> str:
+    """ファイルの SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ファイルのハッシュのキャッシュ（パス、更新時刻、大きさ -> SHA-256）
+_digest_cache: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(path, chunk_size: int = 1024 * 1024) -> str:
+    """ファイルの SHA-256（更新されていなければ前回の値を返す）
+
+    同じファイルを複数のロボットにインポートする場合に何度も読まないようにする。
+    """
+    stat = os.stat(path)
+    key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+    digest = _digest_cache.get(key)
+    if digest is None:
+        digest = hash_file(path, chunk_size)
+        _digest_cache[key] = digest
+    return digest
+
+
+class MapStore:
+    """ハッシュをキーにしたマップファイルの保存場所
+
+    root/objects/<sha256>.kmap にマップファイルを、root/index.json に
+    ロボット（シリアル番号）ごとのハッシュとマップIDの対応を保存する。
+    索引の読み書きはスレッドから呼ばれるため、読み込みから書き込みまでを排他する。
+    """
+
+    def __init__(self, root):
+        """初期化
+
+        Args:
+            root: 保存先のディレクトリ
+        """
+        self.root = Path(root).expanduser()
+        self.objects = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self._lock = threading.Lock()
+
+    def _load_index(self) -> Dict[str, Any]:
+        """索引を読み込む"""
+        if not self.index_path.exists():
+            return {"robots": {}}
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        """索引を書き込む（途中で中断しても壊れないように置き換える）"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".index-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def object_path(self, digest: str) -> Path:
+        """ハッシュに対応するマップファイルのパス"""
+        return self.objects / f"{digest}.kmap"
+
+    def has(self, digest: str) -> bool:
+        """マップファイルを保存済みかどうか"""
+        return self.object_path(digest).exists()
+
+    def temp_file(self):
+        """保存先と同じディレクトリの一時ファイル（(fd, path)）"""
+        self.objects.mkdir(parents=True, exist_ok=True)
+        return tempfile.mkstemp(dir=self.objects, prefix=".partial-")
+
+    def commit(self, tmp_path, digest: str) -> Path:
+        """一時ファイルをハッシュの名前で保存（保存済みの場合は破棄）"""
+        path = self.object_path(digest)
+        if path.exists():
+            os.unlink(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        return path
+
+    def add_chunks(self, chunks, digest: str) -> Path:
+        """受け取ったデータを書き込んで保存（保存済みの場合は書き込まない）"""
+        if self.has(digest):
+            return self.object_path(digest)
+        fd, tmp = self.temp_file()
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+            return self.commit(tmp, digest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def add_file(self, source, digest: str) -> Path:
+        """既存のファイルをコピーして保存"""
+        if self.has(digest):
+            return self.object_path(digest)
+        fd, tmp = self.temp_file()
+        os.close(fd)
+        shutil.copyfile(source, tmp)
+        return self.commit(tmp, digest)
+
+    def lookup(self, robot: str, digest: str) -> Optional[str]:
+        """ロボットにあるハッシュのマップのマップID"""
+        with self._lock:
+            return self._load_index()["robots"].get(robot, {}).get(digest)
+
+    def record(self, robot: str, digest: str, map_id: str) -> None:
+        """ロボットにハッシュのマップがあることを記録"""
+        with self._lock:
+            index = self._load_index()
+            maps = index["robots"].setdefault(robot, {})
+            # 同じマップIDの古い対応は削除する
+            for key in [k for k, v in maps.items() if v == map_id]:
+                del maps[key]
+            maps[digest] = map_id
+            self._save_index(index)
+
+    def forget(self, robot: str, digest: str) -> None:
+        """ロボットにハッシュのマップがあるという記録を削除"""
+        with self._lock:
+            index = self._load_index()
+            if index["robots"].get(robot, {}).pop(digest, None) is not None:
+                self._save_index(index)
+
+
+def copy_if_changed(source, output: Path, digest: str) -> bool:
+    """出力先に同じ内容のファイルがなければコピーする
+
+    Returns:
+        コピーした場合は True
+    """
+    if output.exists() and hash_file(output) == digest:
+        return False
+    shutil.copyfile(source, output)
+    return True
+
+
+def locate_map_file(store: MapStore, target_file_path: str) -> Tuple[Path, int]:
+    """インポートするファイルのパスと大きさ（ファイルがなければ保存先のハッシュとみなす）"""
+    path = Path(target_file_path).expanduser()
+    if not path.exists() and store.has(target_file_path):
+        path = store.object_path(target_file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"Map file not found: {target_file_path}")
+    return path, path.stat().st_size
+
+
+async def get_robot_id(context) -> str:
+    """マップの記録に使うロボットの識別子（シリアル番号）"""
+    serial, _ = await context.cache.get(
+        "robot_serial", context.kachaka_client.get_robot_serial_number, math.inf
+    )
+    return serial
+
+
+async def export_map_to_store(
+    context,
+    map_id: str,
+    output_file_path: str = "",
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """マップをストリームで受け取りながらハッシュを計算し、保存する
+
+    ファイルの読み書きはイベントループを止めないよう、受け取り終えてからスレッドで行う。
+
+    Args:
+        context: KachakaMCPContext
+        map_id: エクスポートするマップのID
+        output_file_path: 出力ファイルパス（空文字列の場合は保存先にだけ保存する）
+        progress: 進捗の通知先
+
+    Returns:
+        結果（success, sha256, size, path など）
+    """
+    store = context.map_store
+    client = context.kachaka_client
+    digest = hashlib.sha256()
+    chunks = []
+    received = 0
+    result = pb2.Result(success=False)
+
+    async for response in client.stub.ExportMap(pb2.ExportMapRequest(map_id=map_id)):
+        if response.HasField("middle_of_stream"):
+            chunk = response.middle_of_stream.data
+            chunks.append(chunk)
+            digest.update(chunk)
+            received += len(chunk)
+            if progress is not None:
+                await progress(received, None)
+        elif response.HasField("end_of_stream"):
+            result = response.end_of_stream.result
+    if not result.success:
+        return {"success": False, "error_code": result.error_code}
+
+    sha256 = digest.hexdigest()
+    stored = await asyncio.to_thread(store.add_chunks, chunks, sha256)
+    await asyncio.to_thread(store.record, await get_robot_id(context), sha256, map_id)
+
+    # 出力先に同じ内容のファイルがある場合は書き換えない
+    written = False
+    if output_file_path:
+        written = await asyncio.to_thread(copy_if_changed, stored, Path(output_file_path).expanduser(), sha256)
+
+    return {
+        "success": True,
+        "map_id": map_id,
+        "sha256": sha256,
+        "size": received,
+        "stored_path": str(stored),
+        "output_written": written,
+    }
+
+
+async def import_map_from_file(
+    context,
+    target_file_path: str,
+    force: bool = False,
+    chunk_size: int = 1024 * 1024,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """マップファイルをストリームでインポートする
+
+    ロボットに同じ内容のマップがあることが記録されていて、そのマップが
+    まだロボットに存在する場合は転送を省略する。
+
+    Args:
+        context: KachakaMCPContext
+        target_file_path: インポートするファイルのパス、または保存先のハッシュ
+        force: Trueの場合は記録に関係なく転送する
+        chunk_size: 1回に送るバイト数
+        progress: 進捗の通知先
+
+    Returns:
+        結果（success, skipped, map_id, sha256 など）
+    """
+    store = context.map_store
+    client = context.kachaka_client
+
+    path, total = await asyncio.to_thread(locate_map_file, store, target_file_path)
+    sha256 = await asyncio.to_thread(file_digest, path, chunk_size)
+    robot = await get_robot_id(context)
+
+    known = await asyncio.to_thread(store.lookup, robot, sha256)
+    if known and not force:
+        map_ids = {m.id for m in await client.get_map_list()}
+        if known in map_ids:
+            logger.info(f"Map {sha256[:12]} already on robot as {known}; skipping transfer")
+            return {"success": True, "skipped": True, "map_id": known, "sha256": sha256}
+        # ロボットから削除されている
+        await asyncio.to_thread(store.forget, robot, sha256)
+
+    async def chunks():
+        sent = 0
+        file = await asyncio.to_thread(open, path, "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(file.read, chunk_size)
+                if not chunk:
+                    break
+                yield pb2.ImportMapRequest(data=chunk)
+                sent += len(chunk)
+                if progress is not None:
+                    await progress(sent, total)
+        finally:
+            await asyncio.to_thread(file.close)
+
+    response = await client.stub.ImportMap(chunks())
+    if not response.result.success:
+        return {"success": False, "skipped": False, "error_code": response.result.error_code, "sha256": sha256}
+
+    await asyncio.to_thread(store.add_file, path, sha256)
+    await asyncio.to_thread(store.record, robot, sha256, response.map_id)
+    return {"success": True, "skipped": False, "map_id": response.map_id, "sha256": sha256, "size": total}
@@ -0,0 +1,395 @@
+"""
+Temporal object memory for Kachaka MCP Server.
+
+This module samples object detections together with the robot pose in the
+background, projects each detection into approximate map coordinates, merges
+repeated sightings of the same object, and answers "where did we last see a
+…" queries from memory instead of driving around to look again.
+"""
+
+import asyncio
+import itertools
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+from .spatial import SpatialIndex
+
+
+# 位置の平均に使う重みの上限（検出スコアの合計）
+MAX_WEIGHT = 10.0
+
+
+def label_name(label: int) -> str:
+    """物体のラベルの名前（"person" など）"""
+    try:
+        return pb2.ObjectLabel.Name(label).replace("OBJECT_LABEL_", "").lower()
+    except ValueError:
+        return str(label)
+
+
+@dataclass
+class Camera:
+    """前方カメラの水平方向の内部パラメータ"""
+    fx: float
+    cx: float
+    width: int
+
+    @classmethod
+    def from_camera_info(cls, info) -> "Camera":
+        """RosCameraInfo から作成"""
+        return cls(fx=info.K[0], cx=info.K[2], width=info.width)
+
+    @classmethod
+    def from_fov(cls, width: int, hfov_deg: float) -> "Camera":
+        """画像の幅と水平画角から作成"""
+        return cls(fx=width / 2 / math.tan(math.radians(hfov_deg) / 2), cx=width / 2, width=width)
+
+    def bearing(self, u: float) -> float:
+        """画像の列 u の方向（カメラ正面からの角度、左が正）"""
+        return math.atan2(self.cx - u, self.fx)
+
+    @property
+    def half_fov(self) -> float:
+        """水平画角の半分（ラジアン）"""
+        return max(abs(self.bearing(0.0)), abs(self.bearing(float(self.width))))
+
+
+def project_detection(
+    pose: Tuple[float, float, float],
+    camera: Camera,
+    detection,
+    camera_offset_m: float = 0.0,
+) -> Tuple[float, float]:
+    """検出結果をマップ座標に投影
+
+    バウンディングボックスの中心の方向に、距離の中央値だけ離れた位置とする。
+
+    Args:
+        pose: ロボットの位置と向き（x, y, theta）
+        camera: カメラの内部パラメータ
+        detection: pb2.ObjectDetection
+        camera_offset_m: ロボットの中心からカメラまでの前方向の距離（メートル）
+    """
+    x, y, theta = pose
+    u = detection.roi.x_offset + detection.roi.width / 2
+    direction = theta + camera.bearing(u)
+    cam_x = x + camera_offset_m * math.cos(theta)
+    cam_y = y + camera_offset_m * math.sin(theta)
+    return (
+        cam_x + detection.distance_median * math.cos(direction),
+        cam_y + detection.distance_median * math.sin(direction),
+    )
+
+
+@dataclass
+class RememberedObject:
+    """記憶している物体"""
+    id: str
+    label: str
+    x: float
+    y: float
+    confidence: float
+    first_seen: float
+    last_seen: float
+    sightings: int = 1
+    weight: float = 0.0
+
+    def to_dict(self, now: float, half_life_sec: float) -> Dict[str, Any]:
+        """辞書に変換（信頼度は最後に見てからの時間で減衰させる）"""
+        age = now - self.last_seen
+        return {
+            "id": self.id,
+            "label": self.label,
+            "x": round(self.x, 2),
+            "y": round(self.y, 2),
+            "confidence": round(self.confidence * 0.5 ** (age / half_life_sec), 3),
+            "sightings": self.sightings,
+            "last_seen": round(self.last_seen, 1),
+            "last_seen_sec_ago": round(age, 1),
+        }
+
+
+class ObjectMemory:
+    """物体の目撃情報を統合した記憶
+
+    同じラベルの物体が merge_radius 以内で再び検出された場合は同じ物体とみなし、
+    位置を検出スコアで重み付けした平均で更新する。カメラの視野内にあるはずなのに
+    検出されなかった物体は信頼度を下げ、一定以下になったら忘れる。
+    """
+
+    def __init__(
+        self,
+        merge_radius: float = 0.5,
+        min_score: float = 0.5,
+        miss_factor: float = 0.8,
+        forget_below: float = 0.1,
+        max_age_sec: float = 86400.0,
+        cell_size: float = 1.0,
+    ):
+        """初期化
+
+        Args:
+            merge_radius: 同じ物体とみなす距離（メートル）
+            min_score: 記憶する検出スコアの下限
+            miss_factor: 視野内で検出されなかった場合に信頼度に掛ける係数
+            forget_below: この信頼度を下回った物体は忘れる
+            max_age_sec: この秒数見ていない物体は忘れる
+            cell_size: 統合に使うグリッドのセルの大きさ（メートル）
+        """
+        self.merge_radius = merge_radius
+        self.min_score = min_score
+        self.miss_factor = miss_factor
+        self.forget_below = forget_below
+        self.max_age_sec = max_age_sec
+        self.cell_size = max(cell_size, merge_radius)
+        self.objects: Dict[str, RememberedObject] = {}
+        self.map_id: Optional[str] = None
+        self.version = 0
+        self._grid: Dict[Tuple[int, int], List[str]] = {}
+        self._ids = itertools.count(1)
+        self._index: Optional[SpatialIndex] = None
+        self._index_version = -1
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _neighbours(self, x: float, y: float) -> List[RememberedObject]:
+        """周囲のセルの物体"""
+        cx, cy = self._cell(x, y)
+        return [
+            self.objects[object_id]
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for object_id in self._grid.get((cx + dx, cy + dy), ())
+        ]
+
+    def _move(self, obj: RememberedObject, x: float, y: float) -> None:
+        """物体の位置を更新（グリッドも更新する）"""
+        old, new = self._cell(obj.x, obj.y), self._cell(x, y)
+        obj.x, obj.y = x, y
+        if old != new:
+            self._grid[old].remove(obj.id)
+            if not self._grid[old]:
+                del self._grid[old]
+            self._grid.setdefault(new, []).append(obj.id)
+
+    def _remove(self, obj: RememberedObject) -> None:
+        cell = self._cell(obj.x, obj.y)
+        self._grid[cell].remove(obj.id)
+        if not self._grid[cell]:
+            del self._grid[cell]
+        del self.objects[obj.id]
+
+    def reset(self, map_id: Optional[str] = None) -> None:
+        """記憶を消去（マップが変わった場合など）"""
+        self.objects.clear()
+        self._grid.clear()
+        self.map_id = map_id
+        self.version += 1
+
+    def observe(
+        self,
+        pose: Tuple[float, float, float],
+        camera: Camera,
+        detections: Sequence[Any],
+        now: Optional[float] = None,
+        camera_offset_m: float = 0.0,
+        max_range_m: float = 4.0,
+        ignore_labels: Sequence[str] = (),
+    ) -> List[RememberedObject]:
+        """1フレームの検出結果を記憶に統合する
+
+        Returns:
+            更新・追加した物体
+        """
+        now = time.time() if now is None else now
+        updated: List[RememberedObject] = []
+        updated_ids = set()
+        for detection in detections:
+            label = label_name(detection.label)
+            if label in ignore_labels or detection.score < self.min_score or detection.distance_median <= 0:
+                continue
+            x, y = project_detection(pose, camera, detection, camera_offset_m)
+            candidates = [
+                (math.hypot(obj.x - x, obj.y - y), obj)
+                for obj in self._neighbours(x, y)
+                if obj.label == label and obj.id not in updated_ids
+            ]
+            candidates = [(d, obj) for d, obj in candidates if d <= self.merge_radius]
+            if candidates:
+                _, obj = min(candidates, key=lambda item: item[0])
+                total = obj.weight + detection.score
+                self._move(
+                    obj,
+                    (obj.x * obj.weight + x * detection.score) / total,
+                    (obj.y * obj.weight + y * detection.score) / total,
+                )
+                # 物体が動いた場合にも追従するように重みの上限を設ける
+                obj.weight = min(total, MAX_WEIGHT)
+                obj.sightings += 1
+                obj.last_seen = now
+                obj.confidence = 1.0 - (1.0 - obj.confidence) * (1.0 - detection.score)
+            else:
+                obj = RememberedObject(
+                    f"obj-{next(self._ids)}", label, x, y, detection.score, now, now, weight=detection.score
+                )
+                self.objects[obj.id] = obj
+                self._grid.setdefault(self._cell(x, y), []).append(obj.id)
+            updated.append(obj)
+            updated_ids.add(obj.id)
+
+        # 視野内にあるはずなのに検出されなかった物体
+        rx, ry, theta = pose
+        half_fov = camera.half_fov
+        for obj in list(self.objects.values()):
+            if obj.id in updated_ids:
+                continue
+            if now - obj.last_seen > self.max_age_sec:
+                self._remove(obj)
+                continue
+            distance = math.hypot(obj.x - rx, obj.y - ry)
+            angle = math.atan2(obj.y - ry, obj.x - rx) - theta
+            angle = math.atan2(math.sin(angle), math.cos(angle))
+            if obj.label not in ignore_labels and distance <= max_range_m and abs(angle) <= half_fov * 0.8:
+                obj.confidence *= self.miss_factor
+                if obj.confidence < self.forget_below:
+                    self._remove(obj)
+        self.version += 1
+        return updated
+
+    def index(self) -> SpatialIndex:
+        """記憶している物体の空間インデックス（種類はラベル）"""
+        if self._index is None or self._index_version != self.version:
+            objects = list(self.objects.values())
+            self._index = SpatialIndex(
+                np.array([(obj.x, obj.y) for obj in objects], dtype=np.float64),
+                [obj.id for obj in objects],
+                [obj.label for obj in objects],
+                [obj.label for obj in objects],
+            )
+            self._index_version = self.version
+        return self._index
+
+    def query(
+        self,
+        label: Optional[str] = None,
+        near: Optional[Tuple[float, float]] = None,
+        radius: float = 0.0,
+        k: int = 0,
+        now: Optional[float] = None,
+        half_life_sec: float = 3600.0,
+    ) -> List[Dict[str, Any]]:
+        """記憶している物体を検索
+
+        Args:
+            label: ラベル（省略時はすべて）
+            near: 基準の位置（指定した場合は距離の昇順）
+            radius: 基準の位置からの半径（0の場合は制限なし）
+            k: 返す件数（0の場合はすべて）
+            half_life_sec: 信頼度が半分になるまでの秒数
+        """
+        now = time.time() if now is None else now
+        label = label or None
+        if near is None:
+            objects = [obj for obj in self.objects.values() if label is None or obj.label == label]
+            objects.sort(key=lambda obj: obj.last_seen, reverse=True)
+            results = [obj.to_dict(now, half_life_sec) for obj in objects]
+        else:
+            index = self.index()
+            if radius > 0:
+                hits = index.within_radius(near[0], near[1], radius, label)
+            else:
+                hits = index.nearest(near[0], near[1], k or len(index), label)
+            results = []
+            for i, distance in hits:
+                entry = self.objects[index.ids[i]].to_dict(now, half_life_sec)
+                entry["distance_m"] = round(distance, 3)
+                results.append(entry)
+        return results[:k] if k > 0 else results
+
+
+class ObjectMemoryAggregator:
+    """物体検出結果を定期的に取得して記憶に統合する"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        config = context.config
+        self.memory = ObjectMemory(
+            merge_radius=config.object_memory_merge_radius,
+            min_score=config.object_memory_min_score,
+        )
+        self.interval_sec = config.object_memory_interval_sec
+        self._camera: Optional[Camera] = None
+        self._task: Optional[asyncio.Task] = None
+        self.frames = 0
+
+    async def camera(self) -> Camera:
+        """前方カメラのパラメータ（取得できない場合は設定の画角を使う）"""
+        if self._camera is None:
+            client = self.context.kachaka_client
+            try:
+                self._camera = Camera.from_camera_info(await client.get_front_camera_ros_camera_info())
+            except Exception as e:
+                logger.debug(f"No camera info, using configured field of view: {e}")
+                self._camera = Camera.from_fov(1280, self.context.config.object_memory_camera_hfov_deg)
+        return self._camera
+
+    async def sample(self) -> int:
+        """1フレーム取得して統合する
+
+        Returns:
+            更新・追加した物体の数
+        """
+        config = self.context.config
+        client = self.context.kachaka_client
+        map_id, _ = await self.context.cache.get("current_map_id", client.get_current_map_id)
+        if map_id != self.memory.map_id:
+            self.memory.reset(map_id)
+        camera = await self.camera()
+        (_, detections), pose = await asyncio.gather(client.get_object_detection(), client.get_robot_pose())
+        updated = self.memory.observe(
+            (pose.x, pose.y, pose.theta),
+            camera,
+            detections,
+            camera_offset_m=config.object_memory_camera_offset_m,
+            max_range_m=config.object_memory_max_range_m,
+            ignore_labels=config.object_memory_ignore_labels,
+        )
+        self.frames += 1
+        return len(updated)
+
+    def start(self) -> None:
+        """定期的な取得を開始（開始済みの場合は何もしない）"""
+        if self.interval_sec > 0 and (self._task is None or self._task.done()):
+            self._task = self.context.lifecycle.spawn(self._run(), "object-memory")
+
+    def stop(self) -> None:
+        """定期的な取得を停止"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        """一定の間隔で取得する"""
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.debug(f"Object memory sampling failed: {e}")
+            await asyncio.sleep(self.interval_sec)
+
+    def query(self, **kwargs) -> List[Dict[str, Any]]:
+        """記憶している物体を検索（ObjectMemory.query の引数）"""
+        kwargs.setdefault("half_life_sec", self.context.config.object_memory_half_life_sec)
+        return self.memory.query(**kwargs)
@@ -0,0 +1,84 @@
+"""
+Occupancy grid decoding for Kachaka MCP Server.
+
+This module decodes the PNG map returned by the robot into a NumPy occupancy
+array together with its resolution and origin.
+"""
+
+import io
+from dataclasses import dataclass, field
+from typing import Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from .geometry import MapTransform
+
+
+# セルの値（ROSの OccupancyGrid と同じ規約）
+FREE = 0
+OCCUPIED = 100
+UNKNOWN = -1
+
+
+@dataclass
+class OccupancyGrid:
+    """占有格子地図
+
+    data の行0は画像の上端に対応する。
+    """
+    data: np.ndarray
+    resolution: float
+    origin: Tuple[float, float, float]
+    map_id: str = ""
+    transform: MapTransform = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.transform = MapTransform(
+            self.resolution, self.origin, self.data.shape[1], self.data.shape[0], self.map_id
+        )
+
+    @property
+    def width(self) -> int:
+        return int(self.data.shape[1])
+
+    @property
+    def height(self) -> int:
+        return int(self.data.shape[0])
+
+    @classmethod
+    def from_png_map(
+        cls,
+        png_map,
+        map_id: str = "",
+        free_threshold: int = 230,
+        occupied_threshold: int = 100,
+    ) -> "OccupancyGrid":
+        """PNG形式のマップを占有格子に変換
+
+        Args:
+            png_map: get_png_map() の結果
+            map_id: マップID
+            free_threshold: この輝度以上のピクセルを走行可能とみなす
+            occupied_threshold: この輝度未満のピクセルを障害物とみなす
+        """
+        image = PILImage.open(io.BytesIO(png_map.data)).convert("LA")
+        pixels = np.asarray(image)
+        luminance, alpha = pixels[..., 0], pixels[..., 1]
+
+        data = np.full(luminance.shape, UNKNOWN, dtype=np.int8)
+        data[luminance >= free_threshold] = FREE
+        data[luminance < occupied_threshold] = OCCUPIED
+        # 透明なピクセルは未観測
+        data[alpha == 0] = UNKNOWN
+
+        origin = png_map.origin
+        return cls(data, float(png_map.resolution), (origin.x, origin.y, origin.theta), map_id)
+
+    def pixel_to_world(self, pixels: np.ndarray) -> np.ndarray:
+        """ピクセル座標 (u, v) の配列をマップ座標 (x, y) に変換"""
+        return self.transform.pixel_to_world(np.asarray(pixels, dtype=np.float64).reshape(-1, 2))
+
+    def world_to_pixel(self, points: np.ndarray) -> np.ndarray:
+        """マップ座標 (x, y) の配列をピクセル座標 (u, v) に変換"""
+        return self.transform.world_to_pixel(np.asarray(points, dtype=np.float64).reshape(-1, 2))
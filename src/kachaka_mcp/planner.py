@@ -0,0 +1,242 @@
+"""
+Multi-stop delivery planning for Kachaka MCP Server.
+
+This module orders a batch of shelf moves so that the robot's empty travel
+between jobs is as short as possible, using a nearest-neighbour tour that is
+refined with 2-opt and Or-opt moves over a NumPy distance matrix. The
+refinement is bounded in time and runs in a worker thread so that planning
+a large batch does not stall the event loop.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+# 2点集合間の距離行列を返す関数（N x 2, M x 2 -> N x M）
+DistanceFunction = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+# 1回の計画で並べ替えるジョブの最大数（改善の1反復の計算量はジョブ数の3乗に比例する）
+MAX_PLAN_JOBS = 50
+
+
+def euclidean_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """直線距離の行列"""
+    return np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+
+
+def _path_cost(order: Sequence[int], approach: np.ndarray, between: np.ndarray) -> float:
+    """ジョブ間の空走距離の合計（最初のジョブまでの移動を含む）"""
+    order = np.asarray(order, dtype=np.intp)
+    return float(approach[order[0]] + between[order[:-1], order[1:]].sum())
+
+
+def _nearest_neighbour(approach: np.ndarray, between: np.ndarray) -> List[int]:
+    """最近傍法による初期の順序"""
+    n = len(approach)
+    visited = np.zeros(n, dtype=bool)
+    current = int(np.argmin(approach))
+    order = [current]
+    visited[current] = True
+    for _ in range(n - 1):
+        cost = np.where(visited, np.inf, between[current])
+        current = int(np.argmin(cost))
+        order.append(current)
+        visited[current] = True
+    return order
+
+
+def _neighbours(order: List[int]):
+    """2-opt（区間の反転）と Or-opt（1〜3件の区間の移動）による近傍"""
+    n = len(order)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            yield order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+    for length in (1, 2, 3):
+        for i in range(n - length + 1):
+            segment = order[i:i + length]
+            rest = order[:i] + order[i + length:]
+            for k in range(len(rest) + 1):
+                if k != i:
+                    yield rest[:k] + segment + rest[k:]
+
+
+def _improve(
+    order: List[int],
+    approach: np.ndarray,
+    between: np.ndarray,
+    max_passes: int,
+    deadline: Optional[float] = None,
+) -> List[int]:
+    """2-opt と Or-opt による順序の改善
+
+    ジョブは「棚の位置で始まり目的地で終わる」向きのある区間のため
+    区間を反転すると距離が対称に変わらない。候補ごとに全体の距離を計算する。
+    deadline（time.monotonic() の値）を過ぎた場合はその時点の最良の順序を返す。
+    """
+    best = list(order)
+    best_cost = _path_cost(best, approach, between)
+    for _ in range(max_passes):
+        improved = False
+        for candidate in _neighbours(best):
+            if deadline is not None and time.monotonic() >= deadline:
+                return best
+            cost = _path_cost(candidate, approach, between)
+            if cost < best_cost - 1e-9:
+                best, best_cost = candidate, cost
+                improved = True
+        if not improved:
+            break
+    return best
+
+
+def plan_order(
+    start: Sequence[float],
+    pickups: Sequence[Sequence[float]],
+    dropoffs: Sequence[Sequence[float]],
+    distance: Optional[DistanceFunction] = None,
+    max_passes: int = 20,
+    time_budget_sec: Optional[float] = 1.0,
+) -> Tuple[List[int], float]:
+    """ジョブの実行順序を計画する
+
+    Args:
+        start: ロボットの現在位置 (x, y)
+        pickups: 各ジョブの棚の位置 (x, y)
+        dropoffs: 各ジョブの目的地の位置 (x, y)
+        distance: 距離行列を返す関数（省略時は直線距離）
+        max_passes: 改善の最大反復回数
+        time_budget_sec: 改善に使う最大の秒数（None の場合は制限しない）
+
+    Returns:
+        ジョブのインデックスの順序と、推定される総移動距離（メートル）
+    """
+    distance = distance or euclidean_distances
+    start = np.asarray(start, dtype=np.float64).reshape(1, 2)
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    dropoffs = np.asarray(dropoffs, dtype=np.float64).reshape(-1, 2)
+    if not len(pickups):
+        return [], 0.0
+
+    # 棚を運ぶ距離は順序によらない
+    carry = float(np.diagonal(distance(pickups, dropoffs)).sum())
+    approach = distance(start, pickups)[0]
+    between = distance(dropoffs, pickups)
+
+    deadline = None if time_budget_sec is None else time.monotonic() + time_budget_sec
+    order = _nearest_neighbour(approach, between)
+    order = _improve(order, approach, between, max_passes, deadline)
+    return order, _path_cost(order, approach, between) + carry
+
+
+def route_length(
+    order: Sequence[int],
+    start: Sequence[float],
+    pickups: Sequence[Sequence[float]],
+    dropoffs: Sequence[Sequence[float]],
+    distance: Optional[DistanceFunction] = None,
+) -> float:
+    """指定した順序でジョブを実行した場合の総移動距離（メートル）"""
+    distance = distance or euclidean_distances
+    start = np.asarray(start, dtype=np.float64).reshape(1, 2)
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    dropoffs = np.asarray(dropoffs, dtype=np.float64).reshape(-1, 2)
+    if not len(order):
+        return 0.0
+    carry = float(np.diagonal(distance(pickups, dropoffs)).sum())
+    return _path_cost(order, distance(start, pickups)[0], distance(dropoffs, pickups)) + carry
+
+
+@dataclass
+class DeliveryJob:
+    """棚の配送ジョブ（名前解決済み）"""
+    shelf_name: str
+    location_name: str
+    shelf_id: str
+    location_id: str
+    pickup: Tuple[float, float]
+    dropoff: Tuple[float, float]
+
+
+async def plan_deliveries(context, jobs: List[Dict[str, str]]) -> Dict[str, Any]:
+    """棚の配送ジョブの名前を解決し、実行順序を計画する
+
+    Args:
+        context: KachakaMCPContext
+        jobs: ジョブの一覧（{"shelf": 棚の名前またはID, "location": 目的地の名前またはID}）
+
+    Returns:
+        計画（順序に並べたジョブ、推定距離）。名前が解決できない場合は errors を含む
+    """
+    from .resolver import resolve_name
+    from .world import get_locations, get_shelves
+
+    if len(jobs) > MAX_PLAN_JOBS:
+        return {"errors": [f"Too many jobs ({len(jobs)}); plan at most {MAX_PLAN_JOBS} jobs at a time"]}
+
+    locations, _ = await get_locations(context)
+    shelves, _ = await get_shelves(context)
+    poses = {item.id: (item.pose.x, item.pose.y) for item in [*locations, *shelves]}
+
+    resolved: List[DeliveryJob] = []
+    errors: List[str] = []
+    seen = set()
+    for i, job in enumerate(jobs):
+        shelf = await resolve_name(context, job.get("shelf", ""), "shelf")
+        location = await resolve_name(context, job.get("location", ""), "location")
+        if not shelf.found:
+            errors.append(f"Job {i}: {shelf.not_found_message('shelf')}")
+            continue
+        if not location.found:
+            errors.append(f"Job {i}: {location.not_found_message('location')}")
+            continue
+        # 同じ棚を複数回運ぶ場合は順序に意味があるため並べ替えられない
+        if shelf.entry.id in seen:
+            errors.append(f"Job {i}: Shelf '{shelf.entry.name}' appears in more than one job")
+            continue
+        seen.add(shelf.entry.id)
+        resolved.append(DeliveryJob(
+            shelf.entry.name,
+            location.entry.name,
+            shelf.entry.id,
+            location.entry.id,
+            poses[shelf.entry.id],
+            poses[location.entry.id],
+        ))
+
+    if errors:
+        return {"errors": errors}
+
+    # 地図上の経路長を使い、地図が使えない場合は直線距離で見積もる
+    from .travel import get_travel_model
+    try:
+        distance = (await get_travel_model(context)).distance_matrix
+        distance_model = "map"
+    except Exception as e:
+        logger.warning(f"Falling back to straight-line distances: {e}")
+        distance, distance_model = None, "straight_line"
+
+    pose = await context.kachaka_client.get_robot_pose()
+    start = (pose.x, pose.y)
+    pickups = [job.pickup for job in resolved]
+    dropoffs = [job.dropoff for job in resolved]
+
+    def plan() -> Tuple[List[int], float, float]:
+        order, planned = plan_order(start, pickups, dropoffs, distance)
+        requested = route_length(list(range(len(resolved))), start, pickups, dropoffs, distance)
+        return order, planned, requested
+
+    # 距離行列の計算（経路長の推定）と順序の改善はループを止めないよう別のスレッドで行う
+    order, planned, requested = await asyncio.to_thread(plan)
+
+    return {
+        "jobs": [resolved[i] for i in order],
+        "order": order,
+        "estimated_distance_m": round(planned, 2),
+        "requested_order_distance_m": round(requested, 2),
+        "distance_model": distance_model,
+    }
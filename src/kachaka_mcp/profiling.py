@@ -0,0 +1,263 @@
+"""
+On-demand profiling for Kachaka MCP Server.
+
+This module lets an administrator look inside the live server process:
+a sampling profiler or cProfile session bounded in time, tracemalloc
+snapshots with the top allocators (and the difference to the previous
+snapshot), and a dump of the stacks of all asyncio tasks. Profiles are
+summarized as compact text and also written to disk so they can be
+downloaded and opened with pstats or a flame graph tool.
+"""
+
+import asyncio
+import cProfile
+import io
+import linecache
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+def _frame_label(frame) -> str:
+    """フレームの表示（ファイル名:関数名）"""
+    code = frame.f_code
+    return f"{Path(code.co_filename).name}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """スレッドのスタックを一定の間隔で記録するサンプリングプロファイラー
+
+    別のスレッドから対象のスレッドの現在のフレームを読むため、対象のコードには
+    手を加えず、オーバーヘッドは間隔に応じて小さく抑えられる。
+    """
+
+    def __init__(self, thread_id: int, interval_sec: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_sec = interval_sec
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kachaka-mcp-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """フレームグラフのツールで読める折りたたみ形式（"呼び出し元;...;関数 回数"）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 25) -> str:
+        """自身で時間を使っている関数と、呼び出し先を含めた関数の上位"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        samples = max(self.samples, 1)
+        lines = [f"{self.samples} samples every {self.interval_sec * 1000:.1f}ms", "", "self%  function"]
+        lines += [f"{count * 100 / samples:5.1f}  {label}" for label, count in own.most_common(top)]
+        lines += ["", "total% function"]
+        lines += [f"{count * 100 / samples:5.1f}  {label}" for label, count in total.most_common(top)]
+        return "\n".join(lines)
+
+
+class Profiler:
+    """プロファイルのセッション・メモリのスナップショット・タスクの一覧"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        self.root = Path(context.config.profile_dir).expanduser()
+        self.mode: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self._sampler: Optional[SamplingProfiler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str = "sampling", duration_sec: float = 10.0, interval_ms: float = 5.0) -> float:
+        """プロファイルを開始する（duration_sec 後に自動的に停止する）
+
+        Returns:
+            実際の計測時間（秒、profile_max_sec で制限する）
+
+        Raises:
+            ValueError: モードが不正な場合
+            RuntimeError: 実行中のプロファイルがある場合
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}' (use {', '.join(PROFILE_MODES)})")
+        if self.running:
+            raise RuntimeError(f"A {self.mode} profile is already running")
+        duration_sec = min(max(duration_sec, 0.1), self.context.config.profile_max_sec)
+        if mode == "cprofile":
+            # cProfile は有効にしたスレッド（イベントループのスレッド）だけを計測する
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._sampler = SamplingProfiler(threading.get_ident(), max(interval_ms, 1.0) / 1000.0)
+            self._sampler.start()
+        self.mode = mode
+        self.started_at = time.time()
+        self._timer = asyncio.get_running_loop().call_later(duration_sec, self._finish)
+        logger.info(f"Started {mode} profile for {duration_sec:.1f}s")
+        return duration_sec
+
+    def stop(self, top: int = 25) -> Dict[str, Any]:
+        """プロファイルを停止して結果を返す（停止済みの場合は最後の結果）
+
+        Raises:
+            RuntimeError: プロファイルを一度も実行していない場合
+        """
+        if self.running:
+            self._finish(top)
+        if self.last_result is None:
+            raise RuntimeError("No profile has been taken")
+        return self.last_result
+
+    def _finish(self, top: int = 25) -> None:
+        """計測を止めて要約とファイルを保存する"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        mode, self.mode = self.mode, None
+        duration = time.time() - self.started_at
+        if mode == "cprofile":
+            self._cprofile.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._cprofile, stream=stream)
+            stats.sort_stats("cumulative").print_stats(top)
+            summary = stream.getvalue().strip()
+            name = self._save("prof", lambda path: stats.dump_stats(str(path)))
+            self._cprofile = None
+        else:
+            self._sampler.stop()
+            summary = self._sampler.summary(top)
+            folded = self._sampler.folded()
+            name = self._save("folded", lambda path: path.write_text(folded))
+            self._sampler = None
+        self.last_result = {"mode": mode, "duration_sec": round(duration, 1), "file": name, "summary": summary}
+        logger.info(f"Finished {mode} profile ({duration:.1f}s): {name}")
+
+    def _save(self, extension: str, write) -> str:
+        """プロファイルのファイルを保存し、古いファイルを削除する"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.{extension}"
+        write(self.root / name)
+        for old in self.files()[self.context.config.profile_keep:]:
+            (self.root / old["name"]).unlink(missing_ok=True)
+        return name
+
+    def files(self) -> List[Dict[str, Any]]:
+        """保存したプロファイル（新しい順）"""
+        if not self.root.exists():
+            return []
+        paths = sorted(
+            (p for p in self.root.iterdir() if p.suffix in (".prof", ".folded")),
+            key=lambda p: p.name,
+            reverse=True,
+        )
+        return [{"name": p.name, "bytes": p.stat().st_size} for p in paths]
+
+    def read(self, name: str) -> bytes:
+        """保存したプロファイルを読む
+
+        Raises:
+            FileNotFoundError: 保存したプロファイルの名前ではない場合
+        """
+        if name not in {f["name"] for f in self.files()}:
+            raise FileNotFoundError(f"No profile named '{name}'")
+        return (self.root / name).read_bytes()
+
+    def memory_snapshot(self, top: int = 20, group_by: str = "lineno", frames: int = 1) -> str:
+        """メモリの割り当ての上位（前回のスナップショットからの増加も含む）
+
+        トレースしていない場合はトレースを開始する（次の呼び出しから結果を返す）。
+        """
+        if group_by not in ("lineno", "filename", "traceback"):
+            raise ValueError(f"Unknown group_by '{group_by}' (use lineno, filename, traceback)")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(frames, 1))
+            self._snapshot = None
+            return f"Started tracemalloc ({max(frames, 1)} frames); call again to take a snapshot"
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced: {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)", "", "top allocators:"]
+        for stat in snapshot.statistics(group_by)[:top]:
+            lines.append(f"{stat.size / 1024:9.1f} KiB {stat.count:8d} blocks  {self._location(stat.traceback)}")
+        if self._snapshot is not None:
+            lines += ["", "growth since previous snapshot:"]
+            for stat in snapshot.compare_to(self._snapshot, group_by)[:top]:
+                if stat.size_diff:
+                    lines.append(
+                        f"{stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+8d} blocks  {self._location(stat.traceback)}"
+                    )
+        self._snapshot = snapshot
+        return "\n".join(lines)
+
+    @staticmethod
+    def _location(traceback: tracemalloc.Traceback) -> str:
+        return " <- ".join(f"{Path(frame.filename).name}:{frame.lineno}" for frame in reversed(traceback))
+
+    def stop_memory_tracing(self) -> str:
+        """メモリのトレースを停止する"""
+        if not tracemalloc.is_tracing():
+            return "tracemalloc is not running"
+        tracemalloc.stop()
+        self._snapshot = None
+        return "Stopped tracemalloc"
+
+
+def dump_tasks(stack_limit: int = 8) -> str:
+    """実行中の asyncio タスクのスタック（待っている場所）"""
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    lines = [f"{len(tasks)} tasks"]
+    for task in tasks:
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        lines.append("")
+        lines.append(f"{task.get_name()}: {name}{' (cancelling)' if task.cancelling() else ''}")
+        for frame in task.get_stack(limit=stack_limit):
+            lines.append(f"  {Path(frame.f_code.co_filename).name}:{frame.f_lineno} {frame.f_code.co_name}")
+    return "\n".join(lines)
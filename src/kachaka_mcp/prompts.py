@@ -37,6 +37,7 @@ def register_prompts(mcp: FastMCP) -> None:
 - dock_shelf: 棚にドッキング
 - undock_shelf: 棚からアンドック
 - dock_any_shelf_with_registration: 任意の棚にドッキングして登録
+- plan_and_run_deliveries: 複数の棚の移動を、移動距離が短くなる順序に並べ替えて実行
 
 システム操作ツール:
 - speak: テキストを音声で発話
@@ -53,6 +54,27 @@ def register_prompts(mcp: FastMCP) -> None:
 - export_map: マップをエクスポート
 - import_map: マップをインポート
 - set_robot_pose: ロボットの位置を設定
+- transform_points: マップ座標と地図画像のピクセル座標を一括で変換
+- render_annotated_map: ロボット・場所・棚を描き込んだ地図画像を作成
+
+ワールド情報ツール:
+- get_world_snapshot: 状態・場所・棚・物体検出・カメラ画像をまとめて取得（判断の前にまずこれを使う）
+- nearest_locations: ロボットに近い場所・棚を取得
+- within_radius: 指定した半径以内の場所・棚を取得
+- estimate_travel: 2点間の経路長と到着時間を地図から推定
+- estimate_travel_matrix: 複数の出発地と目的地の組の経路長と到着時間を地図から推定
+- find_objects: これまでに検出した物体を記憶から探す（探し回る前にまずこれを使う）
+
+フリート操作ツール:
+- list_fleet_robots: フリート操作の対象のロボットの一覧を取得
+- fleet_broadcast: 同じ操作を複数のロボットに並行して実行
+- dispatch_task: 棚・場所のタスクを最も近い空いたロボットに割り当て
+- get_dispatch_status: フリートのロボットと割り当てたタスクの状態を取得
+
+カメラ記録ツール:
+- start_camera_recording: カメラ画像のディスクへの記録を開始
+- stop_camera_recording: カメラ画像の記録を停止
+- get_camera_timelapse: 記録したカメラ画像を時刻の範囲で振り返る
 
 また、以下のリソースからロボットの状態を取得できます：
 
@@ -61,9 +83,11 @@ def register_prompts(mcp: FastMCP) -> None:
 - robot://version - ロボットのバージョン情報
 - robot://serial - シリアル番号
 - robot://command - 現在実行中のコマンド情報
+- robot://battery - 電池残量と学習した電池の消費量
 
 マップリソース:
 - map://current - 現在のマップ情報（PNG形式）
+- map://annotated - ロボット・場所・棚を描き込んだマップ画像
 - map://locations/{location_id?} - 登録された場所の情報
 - map://shelves/{shelf_id?} - 棚の情報と位置
 - map://list - 利用可能なマップのリスト
@@ -71,12 +95,18 @@ def register_prompts(mcp: FastMCP) -> None:
 センサーリソース:
 - sensors://camera/front - 前面カメラ画像
 - sensors://camera/back - 背面カメラ画像
+  （前回から変化がない場合は "unchanged" を返す。必ず画像が必要な場合は sensors://camera/front/full などを使う）
 - sensors://camera/tof - ToFカメラ画像
 - sensors://laser - レーザースキャンデータ
+- sensors://laser/summary/{sectors?} - レーザースキャンの要約（周囲の障害物と空いている方向）
 - sensors://imu - IMUデータ
 - sensors://odometry - オドメトリデータ
 - sensors://object_detection - 物体検出結果
 
+ワールド情報リソース:
+- world://snapshot - 状態・場所・棚・物体検出のまとめ
+- memory://objects - これまでに検出した物体の記憶
+
 ユーザーの指示に従って、これらのツールとリソースを使ってKachakaロボットを操作してください。
 """
             ),
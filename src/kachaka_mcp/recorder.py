@@ -0,0 +1,346 @@
+"""
+On-disk camera ring buffer for Kachaka MCP Server.
+
+This module records front/back camera frames at a fixed rate into a bounded,
+segment-based ring buffer on disk. JPEG bytes are stored as received (never
+re-encoded), and each segment keeps a memory-mapped index of frame
+timestamps and offsets so frames can be looked up by time without reading
+the data files.
+"""
+
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+
+# 索引ファイルのヘッダー（マジック、セグメントの通し番号、フレーム数）
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_MAGIC = b"KCAMIDX1"
+
+# 索引のレコード（時刻、データファイル内のオフセット、長さ）
+INDEX_RECORD = np.dtype([("time", "<f8"), ("offset", "<u8"), ("length", "<u4")])
+
+
+def parse_time(value: Any) -> float:
+    """UNIX時刻（秒）または ISO 8601 形式の時刻を UNIX時刻に変換
+
+    Raises:
+        ValueError: 解釈できない場合
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+@dataclass(frozen=True)
+class FrameRef:
+    """記録したフレームの位置"""
+    time: float
+    length: int
+    slot: int
+    sequence: int
+    index: int
+
+
+class Segment:
+    """リングバッファの1つのセグメント（データファイルと、メモリマップした索引）"""
+
+    def __init__(self, data_path: Path, index_path: Path, capacity: int):
+        """初期化（ファイルがなければ作成する）
+
+        Args:
+            data_path: JPEGを連結したデータファイル
+            index_path: 索引ファイル
+            capacity: 記録できるフレームの最大数
+        """
+        self.data_path = data_path
+        self.capacity = capacity
+        size = INDEX_HEADER.size + capacity * INDEX_RECORD.itemsize
+        fresh = not index_path.exists() or index_path.stat().st_size != size
+        with open(index_path, "a+b") as f:
+            f.truncate(size)
+        self._index_file = open(index_path, "r+b")
+        self._map = mmap.mmap(self._index_file.fileno(), size)
+        self.records = np.ndarray((capacity,), dtype=INDEX_RECORD, buffer=self._map, offset=INDEX_HEADER.size)
+        if fresh or self._map[:8] != INDEX_MAGIC:
+            self._write_header(0, 0)
+        self._data = open(data_path, "a+b")
+        # 索引に記録されていない末尾（書き込み中に停止した場合）は捨てる
+        count = self.count
+        end = int(self.records["offset"][count - 1] + self.records["length"][count - 1]) if count else 0
+        self._data.truncate(end)
+        self.size = end
+
+    def _write_header(self, sequence: int, count: int) -> None:
+        self._map[:INDEX_HEADER.size] = INDEX_HEADER.pack(INDEX_MAGIC, sequence, count)
+
+    @property
+    def sequence(self) -> int:
+        """セグメントの通し番号（新しいほど大きい）"""
+        return INDEX_HEADER.unpack_from(self._map)[1]
+
+    @property
+    def count(self) -> int:
+        """記録したフレームの数"""
+        return INDEX_HEADER.unpack_from(self._map)[2]
+
+    @property
+    def times(self) -> np.ndarray:
+        """記録したフレームの時刻（索引のメモリマップへのビュー）"""
+        return self.records["time"][:self.count]
+
+    def reset(self, sequence: int) -> None:
+        """セグメントを空にして再利用する"""
+        self._write_header(sequence, 0)
+        self._data.truncate(0)
+        self.size = 0
+
+    def append(self, timestamp: float, data: bytes) -> None:
+        """フレームを追加（データ、索引、フレーム数の順に書き、途中で止まっても壊れないようにする）"""
+        count = self.count
+        self._data.seek(self.size)
+        self._data.write(data)
+        self._data.flush()
+        self.records[count] = (timestamp, self.size, len(data))
+        self._write_header(self.sequence, count + 1)
+        self.size += len(data)
+
+    def read(self, index: int) -> bytes:
+        """フレームのJPEGを読む"""
+        record = self.records[index]
+        return os.pread(self._data.fileno(), int(record["length"]), int(record["offset"]))
+
+    def close(self) -> None:
+        """ファイルを閉じる"""
+        self.records = None
+        self._map.close()
+        self._index_file.close()
+        self._data.close()
+
+
+class FrameRing:
+    """セグメント単位で古いフレームを上書きするカメラ画像のリングバッファ
+
+    ディスクの使用量は segments * segment_bytes を超えない。
+    """
+
+    def __init__(
+        self,
+        root,
+        segments: int = 8,
+        segment_bytes: int = 32 * 1024 * 1024,
+        frames_per_segment: int = 4096,
+    ):
+        """初期化（既存の記録があれば引き継ぐ）
+
+        Args:
+            root: 保存先のディレクトリ
+            segments: セグメントの数
+            segment_bytes: 1つのセグメントの最大のバイト数
+            frames_per_segment: 1つのセグメントの最大のフレーム数
+        """
+        self.root = Path(root).expanduser()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self.segments = [
+            Segment(self.root / f"seg-{i:03d}.jpg", self.root / f"seg-{i:03d}.idx", frames_per_segment)
+            for i in range(max(2, segments))
+        ]
+        self.current = max(range(len(self.segments)), key=lambda i: self.segments[i].sequence)
+
+    def append(self, timestamp: float, data: bytes) -> None:
+        """フレームを追加（セグメントがいっぱいの場合は最も古いセグメントを再利用する）"""
+        with self._lock:
+            segment = self.segments[self.current]
+            full = segment.count >= segment.capacity or (
+                segment.count and segment.size + len(data) > self.segment_bytes
+            )
+            if full:
+                sequence = segment.sequence + 1
+                self.current = (self.current + 1) % len(self.segments)
+                segment = self.segments[self.current]
+                segment.reset(sequence)
+            elif segment.count == 0 and segment.sequence == 0:
+                segment.reset(1)
+            segment.append(timestamp, data)
+
+    def _ordered(self) -> List[int]:
+        """フレームのあるセグメント（古い順）"""
+        slots = [i for i, segment in enumerate(self.segments) if segment.count]
+        return sorted(slots, key=lambda i: self.segments[i].sequence)
+
+    def find(self, start: float, end: float) -> List[FrameRef]:
+        """時刻が start 以上 end 以下のフレーム（古い順）
+
+        セグメントは時刻順に並んでいるため、範囲に重なるセグメントの索引だけを
+        二分探索する。
+        """
+        refs: List[FrameRef] = []
+        with self._lock:
+            for slot in self._ordered():
+                segment = self.segments[slot]
+                times = segment.times
+                if times[-1] < start or times[0] > end:
+                    continue
+                lo, hi = np.searchsorted(times, start, "left"), np.searchsorted(times, end, "right")
+                records = segment.records[lo:hi]
+                refs.extend(
+                    FrameRef(float(t), int(n), slot, segment.sequence, int(lo + k))
+                    for k, (t, n) in enumerate(zip(records["time"], records["length"]))
+                )
+        return refs
+
+    def nearest(self, timestamp: float) -> Optional[FrameRef]:
+        """時刻に最も近いフレーム"""
+        best = None
+        with self._lock:
+            for slot in self._ordered():
+                segment = self.segments[slot]
+                times = segment.times
+                i = int(np.searchsorted(times, timestamp))
+                for j in (i - 1, i):
+                    if 0 <= j < len(times) and (best is None or abs(times[j] - timestamp) < abs(best.time - timestamp)):
+                        best = FrameRef(float(times[j]), int(segment.records[j]["length"]), slot, segment.sequence, j)
+        return best
+
+    def read(self, ref: FrameRef) -> Optional[bytes]:
+        """フレームのJPEGを読む（上書きされていた場合は None）"""
+        with self._lock:
+            segment = self.segments[ref.slot]
+            if segment.sequence != ref.sequence or ref.index >= segment.count:
+                return None
+            return segment.read(ref.index)
+
+    def stats(self) -> Dict[str, Any]:
+        """記録の範囲と大きさ"""
+        with self._lock:
+            slots = self._ordered()
+            frames = sum(self.segments[i].count for i in slots)
+            return {
+                "frames": frames,
+                "bytes": sum(self.segments[i].size for i in slots),
+                "start": float(self.segments[slots[0]].times[0]) if slots else None,
+                "end": float(self.segments[slots[-1]].times[-1]) if slots else None,
+                "capacity_bytes": self.segment_bytes * len(self.segments),
+            }
+
+    def close(self) -> None:
+        """ファイルを閉じる"""
+        with self._lock:
+            for segment in self.segments:
+                segment.close()
+
+
+class CameraRecorder:
+    """カメラ画像を一定の間隔でリングバッファに記録する"""
+
+    def __init__(self, context):
+        """初期化
+
+        Args:
+            context: KachakaMCPContext
+        """
+        self.context = context
+        self.rings: Dict[str, FrameRing] = {}
+        self.fps = context.config.camera_record_fps
+        self.dropped = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def ring(self, camera: str) -> FrameRing:
+        """カメラのリングバッファ（初回に開く）"""
+        if camera not in ("front", "back"):
+            raise ValueError(f"Unknown camera '{camera}' (use front or back)")
+        ring = self.rings.get(camera)
+        if ring is None:
+            config = self.context.config
+            ring = FrameRing(
+                Path(config.camera_record_dir).expanduser() / camera,
+                config.camera_record_segments,
+                config.camera_record_segment_bytes,
+            )
+            self.rings[camera] = ring
+        return ring
+
+    @property
+    def recording(self) -> List[str]:
+        """記録中のカメラ"""
+        return sorted(camera for camera, task in self._tasks.items() if not task.done())
+
+    def start(self, cameras: Optional[Sequence[str]] = None, fps: Optional[float] = None) -> None:
+        """記録を開始（記録中のカメラは間隔だけ変更する）"""
+        if fps:
+            self.fps = fps
+        for camera in cameras or self.context.config.camera_record_cameras:
+            self.ring(camera)
+            task = self._tasks.get(camera)
+            if task is None or task.done():
+                self._tasks[camera] = self.context.lifecycle.spawn(self._run(camera), f"camera-recorder:{camera}")
+
+    def stop(self) -> None:
+        """記録を停止"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _run(self, camera: str) -> None:
+        """一定の間隔でフレームを取得して記録する
+
+        書き込みはスレッドで行い、前のフレームの書き込みが終わっていない場合は
+        そのフレームを捨てる（メモリ上には各カメラ最大1フレームしか保持しない）。
+        """
+        client = self.context.kachaka_client
+        ring = self.ring(camera)
+        fetch = (
+            client.get_back_camera_ros_compressed_image if camera == "back"
+            else client.get_front_camera_ros_compressed_image
+        )
+        writing: Optional[asyncio.Future] = None
+        next_time = time.monotonic()
+        while True:
+            next_time += 1.0 / self.fps
+            try:
+                image = await fetch()
+                if writing is not None and not writing.done():
+                    self.dropped += 1
+                else:
+                    writing = asyncio.ensure_future(asyncio.to_thread(ring.append, time.time(), image.data))
+            except Exception as e:
+                logger.debug(f"Camera recording ({camera}) failed: {e}")
+            await asyncio.sleep(max(0.0, next_time - time.monotonic()))
+            next_time = max(next_time, time.monotonic() - 1.0 / self.fps)
+
+    async def frames(self, camera: str, start: float, end: float) -> List[FrameRef]:
+        """時刻の範囲のフレーム"""
+        ring = self.ring(camera)
+        return await asyncio.to_thread(ring.find, start, end)
+
+    async def read(self, camera: str, ref: FrameRef) -> Optional[bytes]:
+        """フレームのJPEG"""
+        return await asyncio.to_thread(self.ring(camera).read, ref)
+
+    async def nearest(self, camera: str, timestamp: float) -> Optional[FrameRef]:
+        """時刻に最も近いフレーム"""
+        return await asyncio.to_thread(self.ring(camera).nearest, timestamp)
+
+    def close(self) -> None:
+        """記録を停止してファイルを閉じる"""
+        self.stop()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
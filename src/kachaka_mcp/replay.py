@@ -0,0 +1,326 @@
+"""
+Record and replay of robot gRPC traffic for Kachaka MCP Server.
+
+This module wraps the gRPC stub of a Kachaka API client to capture every
+unary request/response pair together with its latency into a compact
+binary file, and provides a replay stub that serves the recorded responses
+in place of a robot, at the original or an accelerated speed. Replaying a
+recorded session makes load tests and benchmarks deterministic and lets
+server overhead be compared between versions without a robot.
+"""
+
+import asyncio
+import gzip
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Tuple
+
+import grpc
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from loguru import logger
+
+
+# ファイルのヘッダー（マジック、記録を開始したUNIX時刻）
+FILE_HEADER = struct.Struct("<8sd")
+FILE_MAGIC = b"KGRPCRC1"
+
+# メソッド名の定義（タグ、番号、名前の長さ）
+METHOD_ENTRY = struct.Struct("<cHH")
+# 呼び出し（タグ、メソッドの番号、開始からの秒数、応答までの秒数、成功したか、要求と応答の長さ）
+CALL_ENTRY = struct.Struct("<cHdf?II")
+
+METHOD_TAG = b"M"
+CALL_TAG = b"C"
+
+SERVICE = pb2.DESCRIPTOR.services_by_name["KachakaApi"]
+
+
+def _is_unary(method: str) -> bool:
+    """単項の呼び出しかどうか（ストリームの呼び出しは記録・再生しない）"""
+    descriptor = SERVICE.methods_by_name.get(method)
+    return descriptor is not None and not descriptor.server_streaming and not descriptor.client_streaming
+
+
+def response_type(method: str):
+    """メソッドの応答のメッセージの型"""
+    return getattr(pb2, SERVICE.methods_by_name[method].output_type.name)
+
+
+def _open(path: Path, mode: str) -> BinaryIO:
+    """ファイルを開く（拡張子が .gz の場合は gzip で圧縮する）"""
+    if path.suffix == ".gz":
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+@dataclass
+class RecordedCall:
+    """記録した1回の呼び出し"""
+    method: str
+    offset: float
+    latency: float
+    ok: bool
+    request: bytes
+    response: bytes
+
+    def error(self) -> grpc.aio.AioRpcError:
+        """記録したエラー（応答には "コード名:詳細" を記録している）"""
+        code_name, _, details = self.response.decode("utf-8", "replace").partition(":")
+        code = getattr(grpc.StatusCode, code_name, grpc.StatusCode.UNKNOWN)
+        return grpc.aio.AioRpcError(code, grpc.aio.Metadata(), grpc.aio.Metadata(), details)
+
+
+class TrafficRecorder:
+    """gRPC の呼び出しをファイルに追記する"""
+
+    def __init__(self, path):
+        """初期化（既存のファイルは上書きする）
+
+        Args:
+            path: 記録するファイル（拡張子が .gz の場合は圧縮する）
+        """
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.started_at = time.time()
+        self.calls = 0
+        self._start = time.monotonic()
+        self._methods: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = _open(self.path, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, self.started_at))
+
+    def write(self, method: str, started: float, latency: float, ok: bool, request: bytes, response: bytes) -> None:
+        """1回の呼び出しを記録する
+
+        Args:
+            started: 呼び出しを開始した time.monotonic() の値
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            method_id = self._methods.get(method)
+            if method_id is None:
+                method_id = self._methods[method] = len(self._methods)
+                name = method.encode()
+                self._file.write(METHOD_ENTRY.pack(METHOD_TAG, method_id, len(name)) + name)
+            self._file.write(CALL_ENTRY.pack(
+                CALL_TAG, method_id, started - self._start, latency, ok, len(request), len(response)
+            ))
+            self._file.write(request)
+            self._file.write(response)
+            self.calls += 1
+
+    def flush(self) -> None:
+        """バッファをファイルに書き出す"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        """ファイルを閉じる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logger.info(f"Recorded {self.calls} gRPC calls to {self.path}")
+
+
+class RecordingStub:
+    """呼び出しを記録する gRPC スタブのラッパー"""
+
+    def __init__(self, stub, recorder: TrafficRecorder):
+        self._stub = stub
+        self._recorder = recorder
+
+    def __getattr__(self, method: str):
+        target = getattr(self._stub, method)
+        if not _is_unary(method):
+            return target
+        recorder = self._recorder
+
+        async def call(request, *args, **kwargs):
+            started = time.monotonic()
+            try:
+                response = await target(request, *args, **kwargs)
+            except grpc.aio.AioRpcError as e:
+                recorder.write(
+                    method, started, time.monotonic() - started, False,
+                    request.SerializeToString(deterministic=True),
+                    f"{e.code().name}:{e.details() or ''}".encode(),
+                )
+                raise
+            recorder.write(
+                method, started, time.monotonic() - started, True,
+                request.SerializeToString(deterministic=True),
+                response.SerializeToString(deterministic=True),
+            )
+            return response
+
+        return call
+
+
+def read_recording(path) -> Tuple[float, List[RecordedCall]]:
+    """記録したファイルを読む（書き込み途中の末尾は無視する）
+
+    Returns:
+        記録を開始したUNIX時刻と、呼び出し（開始順）
+
+    Raises:
+        ValueError: 記録のファイルではない場合
+    """
+    path = Path(path).expanduser()
+    with _open(path, "rb") as f:
+        data = f.read() if path.suffix != ".gz" else _read_gzip(f)
+    if len(data) < FILE_HEADER.size or data[:8] != FILE_MAGIC:
+        raise ValueError(f"{path} is not a gRPC traffic recording")
+    started_at = FILE_HEADER.unpack_from(data)[1]
+    offset = FILE_HEADER.size
+    methods: Dict[int, str] = {}
+    calls: List[RecordedCall] = []
+    while offset < len(data):
+        tag = data[offset:offset + 1]
+        if tag == METHOD_TAG and offset + METHOD_ENTRY.size <= len(data):
+            _, method_id, length = METHOD_ENTRY.unpack_from(data, offset)
+            offset += METHOD_ENTRY.size
+            methods[method_id] = data[offset:offset + length].decode()
+            offset += length
+        elif tag == CALL_TAG and offset + CALL_ENTRY.size <= len(data):
+            _, method_id, start, latency, ok, request_length, response_length = CALL_ENTRY.unpack_from(data, offset)
+            offset += CALL_ENTRY.size
+            end = offset + request_length + response_length
+            if end > len(data):
+                break
+            calls.append(RecordedCall(
+                methods[method_id], start, latency, ok,
+                data[offset:offset + request_length], data[offset + request_length:end],
+            ))
+            offset = end
+        else:
+            break
+    calls.sort(key=lambda call: call.offset)
+    return started_at, calls
+
+
+def _read_gzip(f) -> bytes:
+    """gzip のファイルを読む（書き込み途中で止まった場合は読めたところまで）"""
+    chunks = []
+    try:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except (EOFError, OSError):
+        pass
+    return b"".join(chunks)
+
+
+class ReplayStub:
+    """記録した応答を返す gRPC スタブ
+
+    要求ごとに、同じメソッド・同じ内容の要求の記録を記録順に返す。同じ内容の記録が
+    なければ、そのメソッドのまだ返していない次の記録を返し、すべて返し終わった
+    メソッドは最後の応答を繰り返す（状態のポーリングなど）。応答は記録した
+    レイテンシーを speed で割った時間だけ待ってから返す（0 の場合は待たない）。
+    """
+
+    def __init__(self, calls: List[RecordedCall], speed: float = 1.0):
+        """初期化
+
+        Args:
+            calls: 記録した呼び出し
+            speed: 再生の速さ（1.0 で記録と同じ、0 の場合は待たずに返す）
+        """
+        self.speed = speed
+        self.served = 0
+        self.misses = 0
+        self.replayed_latency_sec = 0.0
+        self._by_request: Dict[Tuple[str, bytes], Deque[int]] = defaultdict(deque)
+        self._by_method: Dict[str, Deque[int]] = defaultdict(deque)
+        self._last: Dict[str, RecordedCall] = {}
+        self._used: List[bool] = [False] * len(calls)
+        self._calls = calls
+        for index, call in enumerate(calls):
+            self._by_request[(call.method, call.request)].append(index)
+            self._by_method[call.method].append(index)
+
+    @classmethod
+    def load(cls, path, speed: float = 1.0) -> "ReplayStub":
+        """記録したファイルから作成する"""
+        return cls(read_recording(path)[1], speed)
+
+    def _take(self, queue: Deque[int]) -> Optional[RecordedCall]:
+        """まだ返していない最初の記録を取り出す"""
+        while queue:
+            index = queue.popleft()
+            if not self._used[index]:
+                self._used[index] = True
+                return self._calls[index]
+        return None
+
+    def _next(self, method: str, request: bytes) -> Optional[RecordedCall]:
+        call = self._take(self._by_request.get((method, request), deque()))
+        if call is None:
+            call = self._take(self._by_method.get(method, deque()))
+        if call is None:
+            self.misses += 1
+            call = self._last.get(method)
+        if call is not None:
+            self._last[method] = call
+        return call
+
+    def __getattr__(self, method: str):
+        if method.startswith("_") or method not in SERVICE.methods_by_name:
+            raise AttributeError(method)
+        if not _is_unary(method):
+            raise NotImplementedError(f"Streaming method {method} cannot be replayed")
+        message_type = response_type(method)
+
+        async def call(request, *args, **kwargs):
+            recorded = self._next(method, request.SerializeToString(deterministic=True))
+            if recorded is None:
+                raise grpc.aio.AioRpcError(
+                    grpc.StatusCode.UNAVAILABLE, grpc.aio.Metadata(), grpc.aio.Metadata(),
+                    f"No recorded response for {method}",
+                )
+            if self.speed > 0:
+                await asyncio.sleep(recorded.latency / self.speed)
+            self.served += 1
+            self.replayed_latency_sec += recorded.latency
+            if not recorded.ok:
+                raise recorded.error()
+            return message_type.FromString(recorded.response)
+
+        return call
+
+    def stats(self) -> Dict[str, Any]:
+        """再生した呼び出しの数と、ロボットの応答に相当する時間の合計"""
+        return {
+            "recorded": len(self._calls),
+            "served": self.served,
+            "unused": self._used.count(False),
+            "misses": self.misses,
+            "replayed_latency_sec": round(self.replayed_latency_sec, 3),
+        }
+
+
+def record_client(client, path) -> TrafficRecorder:
+    """クライアントの gRPC の呼び出しの記録を開始する（クライアントのスタブを置き換える）"""
+    recorder = TrafficRecorder(path)
+    client.stub = RecordingStub(client.stub, recorder)
+    logger.info(f"Recording gRPC traffic to {recorder.path}")
+    return recorder
+
+
+def replay_client(path, speed: float = 1.0):
+    """記録した応答を返す Kachaka API クライアント（ロボットには接続しない）"""
+    from kachaka_api.aio import KachakaApiClient
+
+    client = KachakaApiClient(target="127.0.0.1:26400")
+    client.stub = ReplayStub.load(path, speed)
+    logger.info(f"Replaying gRPC traffic from {path} at speed {speed}")
+    return client
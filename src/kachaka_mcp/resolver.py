@@ -0,0 +1,230 @@
+"""
+Name resolution for location and shelf arguments.
+
+This module resolves the names an LLM produces (with typos, full-width
+characters, katakana/hiragana differences or configured aliases) to the
+locations and shelves registered on the robot before any command is sent.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# 名前の比較で無視する文字（空白・記号）
+_IGNORED_CHARS = re.compile(r"[\s\-_・･.,、。/\\()（）「」\[\]]+")
+
+
+def normalize_name(name: str) -> str:
+    """名前を比較用に正規化する
+
+    全角・半角の統一（NFKC）、大文字・小文字の統一、
+    カタカナからひらがなへの変換、空白・記号の除去を行う。
+    """
+    text = unicodedata.normalize("NFKC", name).casefold()
+    text = "".join(
+        chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c
+        for c in text
+    )
+    return _IGNORED_CHARS.sub("", text)
+
+
+def _ngrams(text: str, n: int = 2) -> Set[str]:
+    """文字 n-gram の集合（前後に境界記号を付ける）"""
+    padded = f"^{text}$"
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+@dataclass
+class NameEntry:
+    """名前解決の対象（場所または棚）"""
+    id: str
+    name: str
+    kind: str
+    aliases: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Resolution:
+    """名前解決の結果"""
+    query: str
+    entry: Optional[NameEntry] = None
+    score: float = 0.0
+    exact: bool = False
+    suggestions: List[Tuple[NameEntry, float]] = field(default_factory=list)
+
+    @property
+    def found(self) -> bool:
+        return self.entry is not None
+
+    def not_found_message(self, kind: str) -> str:
+        """見つからなかった場合のメッセージ（候補付き）"""
+        message = f"{kind.capitalize()} '{self.query}' not found"
+        if self.suggestions:
+            candidates = ", ".join(
+                f"{entry.name} (id={entry.id}, score={score:.2f})"
+                for entry, score in self.suggestions
+            )
+            message += f". Did you mean: {candidates}?"
+        return message
+
+
+class NameIndex:
+    """正規化した名前と文字 n-gram による名前の索引"""
+
+    def __init__(self, entries: Iterable[NameEntry], threshold: float = 0.6, margin: float = 0.15):
+        """初期化
+
+        Args:
+            entries: 名前解決の対象
+            threshold: あいまい一致として採用する最低スコア
+            margin: 2番目の候補とのスコアの差がこれ未満の場合は採用しない
+        """
+        self.entries = list(entries)
+        self.threshold = threshold
+        self.margin = margin
+        self._by_id: Dict[str, int] = {}
+        self._exact: Dict[str, Set[int]] = {}
+        self._grams: Dict[str, Set[int]] = {}
+        self._keys: List[List[Tuple[str, Set[str]]]] = []
+
+        for i, entry in enumerate(self.entries):
+            self._by_id[entry.id] = i
+            keys = []
+            for key in {normalize_name(name) for name in [entry.name, *entry.aliases] if name}:
+                self._exact.setdefault(key, set()).add(i)
+                grams = _ngrams(key)
+                keys.append((key, grams))
+                for gram in grams:
+                    self._grams.setdefault(gram, set()).add(i)
+            self._keys.append(keys)
+
+    def _score(self, i: int, query: str, query_grams: Set[str]) -> float:
+        """クエリと名前（別名を含む）の最大の類似度"""
+        best = 0.0
+        for key, grams in self._keys[i]:
+            score = 2.0 * len(query_grams & grams) / (len(query_grams) + len(grams))
+            # 部分一致（「キッチン」と「キッチン前」など）は高めに評価する
+            if query and (query in key or key in query):
+                score = max(score, 0.8)
+            best = max(best, score)
+        return best
+
+    def resolve(self, query: str, kind: Optional[str] = None, limit: int = 3) -> Resolution:
+        """名前またはIDを解決する
+
+        Args:
+            query: 名前またはID
+            kind: 種類（location, shelf、Noneの場合はすべて）
+            limit: 見つからない場合に返す候補の数
+
+        Returns:
+            名前解決の結果
+        """
+        def accept(i: int) -> bool:
+            return kind is None or self.entries[i].kind == kind
+
+        # IDの完全一致
+        i = self._by_id.get(query)
+        if i is not None and accept(i):
+            return Resolution(query, self.entries[i], 1.0, exact=True)
+
+        # 正規化した名前・別名の完全一致
+        normalized = normalize_name(query)
+        matches = sorted(j for j in self._exact.get(normalized, ()) if accept(j))
+        if len(matches) == 1:
+            return Resolution(query, self.entries[matches[0]], 1.0, exact=True)
+
+        # n-gram が重なる候補だけを採点する
+        query_grams = _ngrams(normalized)
+        candidates = Counter()
+        for gram in query_grams:
+            for j in self._grams.get(gram, ()):
+                if accept(j):
+                    candidates[j] += 1
+        scored = sorted(
+            ((self._score(j, normalized, query_grams), j) for j in candidates),
+            key=lambda item: (-item[0], self.entries[item[1]].name),
+        )
+        suggestions = [(self.entries[j], score) for score, j in scored[:limit]]
+
+        if scored and len(matches) <= 1:
+            top_score, top = scored[0]
+            second_score = scored[1][0] if len(scored) > 1 else 0.0
+            if top_score >= self.threshold and top_score - second_score >= self.margin:
+                return Resolution(query, self.entries[top], top_score, suggestions=suggestions)
+
+        return Resolution(query, suggestions=suggestions)
+
+
+def build_name_index(locations, shelves, aliases: Optional[Dict[str, str]] = None, threshold: float = 0.6) -> NameIndex:
+    """場所と棚の一覧から名前の索引を作成
+
+    Args:
+        locations: 場所の一覧
+        shelves: 棚の一覧
+        aliases: 別名から名前またはIDへの対応
+        threshold: あいまい一致として採用する最低スコア
+    """
+    entries = [NameEntry(location.id, location.name, "location") for location in locations]
+    entries += [
+        NameEntry(shelf.id, shelf.name, "shelf", [n.name for n in shelf.recognizable_names])
+        for shelf in shelves
+    ]
+
+    by_name = {}
+    for entry in entries:
+        by_name.setdefault(entry.id, entry)
+        by_name.setdefault(normalize_name(entry.name), entry)
+    for alias, target in (aliases or {}).items():
+        entry = by_name.get(target) or by_name.get(normalize_name(target))
+        if entry is not None:
+            entry.aliases.append(alias)
+
+    return NameIndex(entries, threshold=threshold)
+
+
+async def get_name_index(context) -> NameIndex:
+    """キャッシュされた場所・棚から名前の索引を取得
+
+    場所・棚の一覧が再読み込みされた場合は索引を作り直し、
+    Kachaka APIクライアントの名前解決にも同じ一覧を設定する。
+    """
+    from .world import get_locations, get_shelves
+
+    locations, _ = await get_locations(context)
+    shelves, _ = await get_shelves(context)
+
+    source = context.name_index_source
+    if (
+        context.name_index is None
+        or source is None
+        or source[0] is not locations
+        or source[1] is not shelves
+    ):
+        context.name_index = build_name_index(
+            locations,
+            shelves,
+            context.config.name_aliases,
+            context.config.name_match_threshold,
+        )
+        context.name_index_source = (locations, shelves)
+        context.kachaka_client.resolver.set_locations(locations)
+        context.kachaka_client.resolver.set_shelves(shelves)
+    return context.name_index
+
+
+async def resolve_name(context, query: str, kind: str) -> Resolution:
+    """場所または棚の名前を解決する
+
+    Args:
+        context: KachakaMCPContext
+        query: 名前またはID
+        kind: 種類（location, shelf）
+    """
+    index = await get_name_index(context)
+    return index.resolve(query, kind)
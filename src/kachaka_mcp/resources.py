@@ -4,9 +4,11 @@ Resources for Kachaka MCP Server.
 This module defines the resources that are exposed by the Kachaka MCP Server.
 """
 
+import asyncio
 import json
 from typing import Dict, Any, List
 
+from kachaka_api.generated import kachaka_api_pb2 as pb2
 from mcp.server.fastmcp import FastMCP, Context, Image
 from PIL import Image as PILImage
 import io
@@ -14,6 +16,14 @@ import io
 from loguru import logger
 
 
+def current_session(mcp: FastMCP):
+    """リクエスト中のセッション（リクエストの外では None）"""
+    try:
+        return mcp.get_context().session
+    except Exception:
+        return None
+
+
 def register_resources(mcp: FastMCP) -> None:
     """リソースの登録
     
@@ -28,6 +38,12 @@ def register_resources(mcp: FastMCP) -> None:
     
     # センサーリソース
     register_sensor_resources(mcp)
+    
+    # ワールド情報リソース
+    register_world_resources(mcp)
+    
+    # 呼び出しの履歴リソース
+    register_history_resources(mcp)
 
 
 def register_robot_resources(mcp: FastMCP) -> None:
@@ -133,6 +149,28 @@ def register_robot_resources(mcp: FastMCP) -> None:
         except Exception as e:
             logger.error(f"Error getting robot command: {e}")
             return json.dumps({"error": str(e)})
+    
+    @mcp.resource("robot://battery")
+    async def get_robot_battery() -> str:
+        """電池残量と、学習した電池の消費量を取得"""
+        logger.debug("Getting battery model")
+        from kachaka_mcp.server import get_context
+        monitor = get_context().battery_monitor
+        
+        try:
+            sample = await monitor.sample()
+            monitor.start()
+            result = {
+                "percentage": sample.percentage,
+                "status": pb2.PowerSupplyStatus.Name(sample.status),
+                "policy": get_context().config.battery_policy,
+                "reserve": get_context().config.battery_reserve,
+                "model": monitor.model.to_dict(),
+            }
+            return json.dumps(result, indent=2)
+        except Exception as e:
+            logger.error(f"Error getting battery model: {e}")
+            return json.dumps({"error": str(e)})
 
 
 def register_map_resources(mcp: FastMCP) -> None:
@@ -162,6 +200,38 @@ def register_map_resources(mcp: FastMCP) -> None:
             error_img.save(img_bytes, format='PNG')
             return Image(data=img_bytes.getvalue(), format="png")
     
+    @mcp.resource("map://metadata")
+    async def get_map_metadata() -> str:
+        """現在のマップ画像の座標変換のメタデータ（解像度・原点・大きさ）を取得"""
+        logger.debug("Getting map metadata")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.geometry import get_map_transform
+        
+        try:
+            transform = await get_map_transform(get_context())
+            return json.dumps(transform.metadata())
+        except Exception as e:
+            logger.error(f"Error getting map metadata: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("map://annotated", mime_type="image/png")
+    async def get_annotated_map() -> bytes:
+        """ロボット・場所・棚を描き込んだ現在のマップ画像（PNG）を取得"""
+        logger.debug("Getting annotated map")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.geometry import build_annotated_map
+        
+        try:
+            image, _, _ = await build_annotated_map(get_context())
+            return image
+        except Exception as e:
+            logger.error(f"Error getting annotated map: {e}")
+            # エラー画像を返す
+            error_img = PILImage.new('RGB', (400, 100), color=(255, 0, 0))
+            img_bytes = io.BytesIO()
+            error_img.save(img_bytes, format='PNG')
+            return img_bytes.getvalue()
+    
     @mcp.resource("map://locations/{location_id}")
     async def get_locations(location_id: str = None) -> str:
         """登録された場所の情報を取得"""
@@ -289,47 +359,54 @@ def register_sensor_resources(mcp: FastMCP) -> None:
     Args:
         mcp: MCPサーバーインスタンス
     """
-    @mcp.resource("sensors://camera/front")
-    async def get_front_camera() -> Image:
-        """前面カメラ画像を取得"""
-        logger.debug("Getting front camera image")
-        from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+    async def get_camera_frame(camera: str, force: bool) -> bytes | str:
+        """前面・背面カメラ画像を取得
         
-        try:
-            # カメラ画像の取得
-            image = await kachaka_client.get_front_camera_ros_compressed_image()
-            
-            # 画像として返す
-            return Image(data=image.data, format="jpeg")
-        except Exception as e:
-            logger.error(f"Error getting front camera image: {e}")
-            # エラー画像を返す
-            error_img = PILImage.new('RGB', (400, 100), color=(255, 0, 0))
-            img_bytes = io.BytesIO()
-            error_img.save(img_bytes, format='PNG')
-            return Image(data=img_bytes.getvalue(), format="png")
-    
-    @mcp.resource("sensors://camera/back")
-    async def get_back_camera() -> Image:
-        """背面カメラ画像を取得"""
-        logger.debug("Getting back camera image")
+        このセッションに最後に送った画像から変化がない場合は、画像の代わりに
+        いつから変化していないかを JSON で返す。
+        """
+        logger.debug(f"Getting {camera} camera image, force={force}")
         from kachaka_mcp.server import get_context
         kachaka_client = get_context().kachaka_client 
         
         try:
             # カメラ画像の取得
-            image = await kachaka_client.get_back_camera_ros_compressed_image()
+            if camera == "back":
+                image = await kachaka_client.get_back_camera_ros_compressed_image()
+            else:
+                image = await kachaka_client.get_front_camera_ros_compressed_image()
+            
+            # 変化がなければ画像を送らない
+            unchanged = await get_context().frame_detector.check(current_session(mcp), camera, image.data, force)
+            if unchanged is not None:
+                return json.dumps(unchanged)
             
             # 画像として返す
-            return Image(data=image.data, format="jpeg")
+            return image.data
         except Exception as e:
-            logger.error(f"Error getting back camera image: {e}")
-            # エラー画像を返す
-            error_img = PILImage.new('RGB', (400, 100), color=(255, 0, 0))
-            img_bytes = io.BytesIO()
-            error_img.save(img_bytes, format='PNG')
-            return Image(data=img_bytes.getvalue(), format="png")
+            logger.error(f"Error getting {camera} camera image: {e}")
+            # テキストの応答は application/json として返す（KachakaFastMCP.read_resource）
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("sensors://camera/front", mime_type="image/jpeg")
+    async def get_front_camera() -> bytes | str:
+        """前面カメラ画像を取得（前回から変化がない場合は "unchanged" の JSON）"""
+        return await get_camera_frame("front", False)
+    
+    @mcp.resource("sensors://camera/front/full", mime_type="image/jpeg")
+    async def get_front_camera_full() -> bytes | str:
+        """前面カメラ画像を変化に関係なく取得"""
+        return await get_camera_frame("front", True)
+    
+    @mcp.resource("sensors://camera/back", mime_type="image/jpeg")
+    async def get_back_camera() -> bytes | str:
+        """背面カメラ画像を取得（前回から変化がない場合は "unchanged" の JSON）"""
+        return await get_camera_frame("back", False)
+    
+    @mcp.resource("sensors://camera/back/full", mime_type="image/jpeg")
+    async def get_back_camera_full() -> bytes | str:
+        """背面カメラ画像を変化に関係なく取得"""
+        return await get_camera_frame("back", True)
     
     @mcp.resource("sensors://camera/tof")
     async def get_tof_camera() -> Image:
@@ -381,6 +458,63 @@ def register_sensor_resources(mcp: FastMCP) -> None:
             logger.error(f"Error getting laser scan data: {e}")
             return json.dumps({"error": str(e)})
     
+    async def summarize_laser_scan(sectors: int) -> str:
+        """レーザースキャンをセクターごとの最近傍障害物に要約"""
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.laser import summarize_scan
+        context = get_context()
+        
+        try:
+            # レーザースキャンの取得
+            scan = await context.kachaka_client.get_ros_laser_scan()
+            
+            # セクターごとに要約
+            summary = summarize_scan(
+                scan.ranges,
+                scan.angle_min,
+                scan.angle_increment,
+                scan.range_min,
+                scan.range_max,
+                sectors=sectors,
+                free_distance=context.config.laser_free_distance,
+            )
+            
+            return json.dumps(summary, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error summarizing laser scan: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("sensors://laser/summary")
+    async def get_laser_summary() -> str:
+        """レーザースキャンの要約（セクターごとの最近傍障害物と空いている方向）を取得"""
+        logger.debug("Getting laser scan summary")
+        from kachaka_mcp.server import get_context
+        return await summarize_laser_scan(get_context().config.laser_summary_sectors)
+    
+    @mcp.resource("sensors://laser/summary/{sectors}")
+    async def get_laser_summary_with_sectors(sectors: str) -> str:
+        """セクター数を指定してレーザースキャンの要約を取得"""
+        logger.debug(f"Getting laser scan summary, sectors={sectors}")
+        try:
+            sector_count = int(sectors)
+        except ValueError:
+            return json.dumps({"error": f"Invalid sector count: {sectors}"})
+        return await summarize_laser_scan(min(max(sector_count, 1), 360))
+    
+    @mcp.resource("sensors://laser/changes")
+    async def get_laser_changes() -> str:
+        """蓄積したレーザースキャンと静的な地図の差分（新しい障害物の領域と、ふさがれた通路）を取得"""
+        logger.debug("Getting laser map changes")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            local_map = get_context().local_map
+            local_map.start()
+            return json.dumps(await local_map.changes(), separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error getting laser map changes: {e}")
+            return json.dumps({"error": str(e)})
+    
     @mcp.resource("sensors://imu")
     async def get_imu_data() -> str:
         """IMUデータを取得"""
@@ -491,4 +625,225 @@ def register_sensor_resources(mcp: FastMCP) -> None:
             return json.dumps(result)
         except Exception as e:
             logger.error(f"Error getting object detection results: {e}")
-            return json.dumps({"error": str(e)})
\ No newline at end of file
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("recordings://camera/{camera}")
+    async def get_camera_recording(camera: str) -> str:
+        """カメラ画像の記録の状態（記録の範囲、フレーム数、ディスク使用量）"""
+        logger.debug(f"Getting {camera} camera recording")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.camera import format_time
+        
+        try:
+            recorder = get_context().camera_recorder
+            stats = await asyncio.to_thread(recorder.ring(camera).stats)
+            for key in ("start", "end"):
+                if stats[key] is not None:
+                    stats[key] = format_time(stats[key])
+            stats.update(camera=camera, recording=camera in recorder.recording, fps=recorder.fps, dropped=recorder.dropped)
+            return json.dumps(stats)
+        except Exception as e:
+            logger.error(f"Error getting {camera} camera recording: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("recordings://camera/{camera}/frame/{timestamp}", mime_type="image/jpeg")
+    async def get_recorded_frame(camera: str, timestamp: str) -> bytes | str:
+        """指定した時刻（UNIX時刻または ISO 8601 形式）に最も近い記録したフレーム"""
+        logger.debug(f"Getting recorded {camera} frame at {timestamp}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.recorder import parse_time
+        
+        try:
+            recorder = get_context().camera_recorder
+            ref = await recorder.nearest(camera, parse_time(timestamp))
+            data = None if ref is None else await recorder.read(camera, ref)
+            if data is None:
+                return json.dumps({"error": f"No recorded {camera} frame"})
+            return data
+        except Exception as e:
+            logger.error(f"Error getting recorded {camera} frame: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("recordings://camera/{camera}/{start}/{end}")
+    async def get_recorded_frames(camera: str, start: str, end: str) -> str:
+        """時刻の範囲（UNIX時刻または ISO 8601 形式）に記録したフレームの一覧（最大1000件）"""
+        logger.debug(f"Listing recorded {camera} frames: {start} - {end}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.camera import format_time
+        from kachaka_mcp.recorder import parse_time
+        
+        try:
+            refs = await get_context().camera_recorder.frames(camera, parse_time(start), parse_time(end))
+            frames = [
+                {"timestamp": round(ref.time, 3), "time": format_time(ref.time), "bytes": ref.length}
+                for ref in refs[:1000]
+            ]
+            return json.dumps({"camera": camera, "count": len(refs), "truncated": len(refs) > 1000, "frames": frames})
+        except Exception as e:
+            logger.error(f"Error listing recorded {camera} frames: {e}")
+            return json.dumps({"error": str(e)})
+
+
+def register_world_resources(mcp: FastMCP) -> None:
+    """ワールド情報リソースの登録
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.resource("world://snapshot")
+    async def get_world_snapshot_resource() -> str:
+        """ロボットの状態・場所・棚・物体検出をまとめて取得（カメラ画像なし）"""
+        logger.debug("Getting world snapshot")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.world import build_world_snapshot
+        
+        try:
+            snapshot, _ = await build_world_snapshot(get_context(), camera="")
+            return json.dumps(snapshot, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error getting world snapshot: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("memory://objects")
+    async def get_object_memory() -> str:
+        """記憶している物体（ラベル・推定位置・最後に見た時刻・信頼度、新しい順）"""
+        logger.debug("Getting object memory")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            aggregator = get_context().object_memory
+            result = {
+                "map_id": aggregator.memory.map_id,
+                "frames": aggregator.frames,
+                "objects": aggregator.query(),
+            }
+            return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error getting object memory: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("memory://objects/{label}")
+    async def get_object_memory_by_label(label: str) -> str:
+        """指定したラベルの記憶している物体（ロボットに近い順）"""
+        logger.debug(f"Getting object memory for {label}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            pose = await get_context().kachaka_client.get_robot_pose()
+            objects = get_context().object_memory.query(label=label, near=(pose.x, pose.y))
+            return json.dumps({"label": label, "objects": objects}, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error getting object memory for {label}: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("server://lifecycle")
+    async def get_server_lifecycle() -> str:
+        """実行中のツール呼び出し・完了を待っているコマンド・終了処理中かどうか"""
+        logger.debug("Getting server lifecycle status")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            return json.dumps(get_context().lifecycle.status(), ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error getting server lifecycle status: {e}")
+            return json.dumps({"error": str(e)})
+
+
+def register_history_resources(mcp: FastMCP) -> None:
+    """呼び出しの履歴リソースの登録
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    async def query_commands(query: str) -> str:
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.journal import parse_filters
+        
+        try:
+            journal = get_context().journal
+            filters = parse_filters(query)
+            filters.setdefault("limit", 100)
+            commands = await asyncio.to_thread(journal.query, **filters)
+            return json.dumps({"count": len(commands), "commands": commands}, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error querying command history: {e}")
+            return json.dumps({"error": str(e)})
+    
+    async def summarize_durations(query: str) -> str:
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.journal import parse_filters
+        
+        try:
+            journal = get_context().journal
+            filters = {k: v for k, v in parse_filters(query).items() if k in ("since", "until", "tool", "robot")}
+            durations = await asyncio.to_thread(journal.durations, **filters)
+            return json.dumps({"durations": durations}, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error summarizing command durations: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("history://commands")
+    async def get_command_history() -> str:
+        """最近のツールの呼び出し（新しい順に最大100件）"""
+        logger.debug("Getting command history")
+        return await query_commands("")
+    
+    @mcp.resource("history://commands/{query}")
+    async def get_filtered_command_history(query: str) -> str:
+        """条件に合うツールの呼び出し（"tool=move_shelf&robot=...&outcome=failed&since=...&until=...&limit=..."）"""
+        logger.debug(f"Getting command history: {query}")
+        return await query_commands(query)
+    
+    @mcp.resource("history://durations")
+    async def get_command_durations() -> str:
+        """ツールと引数（ルート）ごとの成功した呼び出しの所要時間の集計"""
+        logger.debug("Getting command durations")
+        return await summarize_durations("")
+    
+    @mcp.resource("history://durations/{query}")
+    async def get_filtered_command_durations(query: str) -> str:
+        """条件に合う呼び出しの所要時間の集計（"tool=move_shelf&since=...&until=...&robot=..."）"""
+        logger.debug(f"Getting command durations: {query}")
+        return await summarize_durations(query)
+
+def register_admin_resources(mcp: FastMCP) -> None:
+    """管理者用のリソースの登録（admin_tools_enabled の場合のみ）
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.resource("admin://profiles")
+    async def get_profiles() -> str:
+        """保存したプロファイルの一覧（新しい順）"""
+        logger.debug("Getting profiles")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            profiler = get_context().profiler
+            return json.dumps({
+                "running": profiler.mode,
+                "profiles": [dict(f, uri=f"admin://profiles/{f['name']}") for f in profiler.files()],
+            })
+        except Exception as e:
+            logger.error(f"Error listing profiles: {e}")
+            return json.dumps({"error": str(e)})
+    
+    @mcp.resource("admin://profiles/{name}", mime_type="application/octet-stream")
+    async def get_profile(name: str) -> bytes:
+        """保存したプロファイル（.prof は pstats、.folded はフレームグラフのツールで開く）"""
+        logger.debug(f"Getting profile: {name}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            return await asyncio.to_thread(get_context().profiler.read, name)
+        except Exception as e:
+            logger.error(f"Error reading profile {name}: {e}")
+            raise
+    
+    @mcp.resource("admin://tasks")
+    async def get_tasks() -> str:
+        """実行中の asyncio タスクと待っている場所のスタック"""
+        logger.debug("Getting asyncio tasks")
+        from kachaka_mcp.profiling import dump_tasks
+        
+        return dump_tasks()
\ No newline at end of file
@@ -4,27 +4,133 @@ Kachaka MCP Server
 Main server implementation for Kachaka MCP.
 """
 
+import argparse
 import asyncio
+import time
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Optional
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Sequence
 
 from kachaka_api.aio import KachakaApiClient
 from mcp.server.fastmcp import Context, FastMCP
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 
-from .resources import register_resources
-from .tools import register_tools
+from .resources import register_admin_resources, register_resources
+from .tools import register_admin_tools, register_tools
 from .prompts import register_prompts
-from .auth import KachakaAuthProvider
-from .utils.config import load_config
+from .auth import AdminRequired, KachakaAuthProvider, RateLimiter, current_api_key, is_admin_target
+from .battery import BatteryMonitor
+from .cache import TTLCache
+from .camera import FrameChangeDetector
+from .commands import CommandWatcher
+from .dispatcher import Dispatcher
+from .fleet import Fleet
+from .idempotency import CommandDeduplicator
+from .journal import CommandJournal
+from .lifecycle import LifecycleManager, connect_client
+from .profiling import Profiler
+from .local_map import LocalMapAggregator
+from .mapstore import MapStore
+from .object_memory import ObjectMemoryAggregator
+from .recorder import CameraRecorder
+from .replay import record_client, replay_client
+from .tracing import Tracer
+from .transport import NETWORK_TRANSPORTS
+from .utils.config import KachakaMCPConfig, load_config
 
 
 # グローバル変数としてコンテキストを保存
 current_context = None
 
+# ライフスパンに入っているセッションの数
+_active_sessions = 0
+
+# Trueの場合、最後のセッションが終了してもコンテキストを保持する
+_keep_context = False
+
 class KachakaMCPContext:
     """Kachaka MCP サーバーのコンテキスト"""
-    def __init__(self, kachaka_client: KachakaApiClient):
+    def __init__(
+        self,
+        kachaka_client: KachakaApiClient,
+        config: Optional[KachakaMCPConfig] = None,
+        parent: Optional["KachakaMCPContext"] = None,
+    ):
+        """初期化
+
+        Args:
+            kachaka_client: ロボットのクライアント
+            config: 設定（省略した場合はデフォルト）
+            parent: フリートのロボットのコンテキストを作る場合はこのサーバーのコンテキスト
+                （ファイルに書き込む部品・フリート・終了処理は parent のものを共有する）
+        """
         self.kachaka_client = kachaka_client
+        self.config = config or KachakaMCPConfig()
+        # スパンの記録
+        self.tracer = parent.tracer if parent else Tracer.from_config(self.config)
+        self.tracer.instrument(kachaka_client)
+        # 最近のコマンド（冪等キー・実行中の重複の抑制）
+        self.command_deduplicator = CommandDeduplicator(
+            self.config.idempotency_ttl_sec,
+            lambda coro, name: self.lifecycle.spawn(coro, name),
+        )
+        # コマンドの完了の監視（ロボットごとに1つのループで全ての待機に通知する）
+        self.command_watcher = CommandWatcher(
+            kachaka_client,
+            self.config.command_poll_min_sec,
+            self.config.command_poll_max_sec,
+            self.config.command_poll_default_sec,
+            self.config.command_wait_timeout_sec,
+        )
+        # 場所・棚など変化の少ないデータのキャッシュ（全セッションで共有）
+        self.cache = TTLCache(self.config.cache_ttl_sec)
+        # 場所・棚の空間インデックス（キャッシュの再読み込み時に作り直す）
+        self.spatial_index = None
+        self.spatial_index_source = None
+        # 場所・棚の名前の索引（キャッシュの再読み込み時に作り直す）
+        self.name_index = None
+        self.name_index_source = None
+        # 経路長の推定モデル（マップの切り替え時に作り直す）
+        self.travel_model = None
+        self.travel_model_source = None
+        # エクスポートしたマップの保存先（ハッシュごと）
+        self.map_store = parent.map_store if parent else MapStore(self.config.map_store_dir)
+        # フリート操作の対象のロボット
+        self.fleet = parent.fleet if parent else Fleet(
+            self.config.fleet_robots,
+            self._robot_context,
+            self.config.fleet_concurrency,
+            self.config.fleet_timeout_sec,
+        )
+        # フリートのロボットへのタスクの割り当て
+        self.dispatcher = parent.dispatcher if parent else Dispatcher(self)
+        # 電池の消費量の学習とタスク前の判定
+        self.battery_monitor = BatteryMonitor(self)
+        # 物体検出結果の記憶
+        self.object_memory = ObjectMemoryAggregator(self)
+        # レーザースキャンのローカルマップ（静的な地図にない障害物の検出）
+        self.local_map = LocalMapAggregator(self)
+        # セッションごとに最後に送ったカメラ画像（変化がなければ送信を省略する）
+        self.frame_detector = FrameChangeDetector(self.config.camera_change_threshold)
+        # カメラ画像のディスクへの記録（このサーバーのロボットだけを記録する）
+        self.camera_recorder = parent.camera_recorder if parent else CameraRecorder(self)
+        # ツールの呼び出しの記録
+        self.journal = parent.journal if parent else CommandJournal(
+            self.config.journal_dir,
+            self.config.journal_segment_bytes,
+            self.config.journal_segments,
+        )
+        # 実行中の処理の追跡と終了処理（フリートのロボットのコマンドもこのサーバーの状態ファイルに引き継ぐ）
+        self.lifecycle = parent.lifecycle if parent else LifecycleManager(self)
+        # プロファイル・メモリのスナップショット（管理者用のツール）
+        self.profiler = parent.profiler if parent else Profiler(self)
+        # gRPC の呼び出しの記録（grpc_record_path を設定した場合）
+        self.traffic_recorder = None
+
+    def _robot_context(self, host: str) -> "KachakaMCPContext":
+        """フリートのロボットのコンテキスト（このサーバーのロボットであれば自身）"""
+        if host == self.config.kachaka_host:
+            return self
+        return KachakaMCPContext(connect_client(host), self.config, self)
 
 def get_context() -> KachakaMCPContext:
     """グローバル変数からコンテキストを取得し存在していなければ作成して返す"""
@@ -34,11 +140,16 @@ def get_context() -> KachakaMCPContext:
         # 設定の読み込み
         config = load_config()
     
-        # Kachaka APIクライアントの初期化
-        kachaka_client = KachakaApiClient(target=config.kachaka_host)
+        # Kachaka APIクライアントの初期化（記録した応答を再生する場合はロボットに接続しない）
+        if config.grpc_replay_path:
+            kachaka_client = replay_client(config.grpc_replay_path, config.grpc_replay_speed)
+        else:
+            kachaka_client = connect_client(config.kachaka_host)
     
         # コンテキストの作成と提供
-        context = KachakaMCPContext(kachaka_client)
+        context = KachakaMCPContext(kachaka_client, config)
+        if config.grpc_record_path:
+            context.traffic_recorder = record_client(kachaka_client, config.grpc_record_path)
         current_context = context  # グローバル変数に保存
          
     return current_context
@@ -48,14 +159,108 @@ def _reset_context() -> None:
     global current_context
     current_context = None
 
+def keep_context_alive(enabled: bool) -> None:
+    """セッションが0になってもコンテキストを保持するかどうかを設定
+
+    ネットワークトランスポートではセッションごとにライフスパンに入るため、
+    キャッシュや接続を温めたまま次のセッションに引き継ぐ。
+    """
+    global _keep_context
+    _keep_context = enabled
+
 @asynccontextmanager
 async def kachaka_lifespan(server: FastMCP) -> AsyncIterator[KachakaMCPContext]:
-    """Kachaka MCP サーバーのライフスパン管理"""
+    """Kachaka MCP サーバーのライフスパン管理
+
+    すべてのセッションは同じコンテキストを共有し、
+    最後のセッションが終了したときにだけリセットする。
+    """
+    global _active_sessions
+    _active_sessions += 1
     try:
         # コンテキストの作成と提供
-        yield get_context()
+        context = get_context()
+        # 前のサーバーが終了時に引き継いだコマンドの完了を追跡する
+        context.lifecycle.resume()
+        if context.config.object_memory_enabled:
+            context.object_memory.start()
+        if context.config.local_map_enabled:
+            context.local_map.start()
+        if context.config.camera_record_enabled:
+            context.camera_recorder.start()
+        yield context
     finally:
-        _reset_context()
+        _active_sessions -= 1
+        if _active_sessions == 0 and not _keep_context:
+            if current_context is not None:
+                await current_context.lifecycle.shutdown()
+            _reset_context()
+
+class KachakaFastMCP(FastMCP):
+    """Kachaka MCP サーバー
+
+    すべてのツール呼び出しとリソース読み込みに共通の処理
+    （管理者の確認、レート制限、実行中の呼び出しの追跡、ジャーナルへの記録、スパンの記録など）を挟むため、
+    FastMCP のディスパッチを拡張する。
+    """
+    auth_provider: Optional[KachakaAuthProvider] = None
+    rate_limiter: Optional[RateLimiter] = None
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> Sequence[Any]:
+        """ツールの呼び出し（終了処理中はロボットを動かすツールを拒否する）"""
+        started = time.perf_counter_ns()
+        context = get_context()
+        with context.tracer.span(f"tool/{name}", "tool", started, tool=name, robot=context.config.kachaka_host):
+            context.tracer.record("get_context", "dispatch", started)
+            if not context.config.journal_enabled:
+                return await self._call_tool(context, name, arguments)
+            async with context.journal.track(name, arguments, context.config.kachaka_host) as entry:
+                result = await self._call_tool(context, name, arguments)
+                entry.finish(result)
+                return result
+
+    def _check_admin(self, target: str) -> None:
+        """管理者用のツール・リソースは管理者のAPIキーでだけ使える
+
+        認証が無効な場合は admin_tools_enabled で登録したこと自体を許可とみなす。
+        """
+        if not is_admin_target(target) or self.auth_provider is None:
+            return
+        if not self.auth_provider.is_admin(current_api_key.get()):
+            raise AdminRequired(target)
+
+    async def _call_tool(self, context: KachakaMCPContext, name: str, arguments: Dict[str, Any]) -> Sequence[Any]:
+        self._check_admin(name)
+        async with context.lifecycle.call(name):
+            if self.rate_limiter is None:
+                with context.tracer.span("handler", "handler"):
+                    return await super().call_tool(name, arguments)
+            async with self.rate_limiter.limit(name):
+                with context.tracer.span("handler", "handler"):
+                    return await super().call_tool(name, arguments)
+
+    async def read_resource(self, uri: Any) -> Iterable[Any]:
+        """リソースの読み込み"""
+        started = time.perf_counter_ns()
+        tracer = get_context().tracer
+        # クエリは呼び出しごとに異なるため、スパンの名前には含めない
+        with tracer.span(f"resource/{str(uri).split('?')[0]}", "resource", started, uri=str(uri)):
+            tracer.record("get_context", "dispatch", started)
+            self._check_admin(str(uri))
+            if self.rate_limiter is None:
+                with tracer.span("handler", "handler"):
+                    return _text_as_json(await super().read_resource(uri))
+            async with self.rate_limiter.limit(str(uri)):
+                with tracer.span("handler", "handler"):
+                    return _text_as_json(await super().read_resource(uri))
+
+def _text_as_json(contents: Iterable[ReadResourceContents]) -> Iterable[ReadResourceContents]:
+    """画像リソースがテキスト（"unchanged" やエラーの JSON）を返した場合は application/json にする"""
+    return [
+        ReadResourceContents(content=c.content, mime_type="application/json")
+        if isinstance(c.content, str) and (c.mime_type or "").startswith("image/") else c
+        for c in contents
+    ]
 
 def create_server(server_name: str = None) -> FastMCP:
     """Kachaka MCP サーバーを作成"""
@@ -67,17 +272,19 @@ def create_server(server_name: str = None) -> FastMCP:
         server_name = config.server_name
     
     # MCPサーバーの作成
+    auth_provider = None
     try:
         # 認証プロバイダーを使用する場合
         if config.auth_enabled:
-            mcp = FastMCP(
+            auth_provider = KachakaAuthProvider()
+            mcp = KachakaFastMCP(
                 server_name,
                 lifespan=kachaka_lifespan,
-                auth_provider=KachakaAuthProvider(),
+                auth_provider=auth_provider,
             )
         else:
             # 認証なしの場合
-            mcp = FastMCP(
+            mcp = KachakaFastMCP(
                 server_name,
                 lifespan=kachaka_lifespan,
             )
@@ -85,28 +292,85 @@ def create_server(server_name: str = None) -> FastMCP:
         # エラーが発生した場合は、認証なしで再試行
         print(f"認証プロバイダーの初期化に失敗しました: {e}")
         print("認証なしでサーバーを起動します。")
-        mcp = FastMCP(
+        auth_provider = None
+        mcp = KachakaFastMCP(
             server_name,
             lifespan=kachaka_lifespan,
         )
-    
-    # コンテキストの作成と提供(もう一度)
-    global current_context
-    kachaka_client = KachakaApiClient(target=config.kachaka_host)
-    context = KachakaMCPContext(kachaka_client)
-    current_context = context  # グローバル変数に保存
+
+    # 認証とレート制限の設定（認証なしの場合もレート制限は有効）
+    mcp.auth_provider = auth_provider
+    if auth_provider is not None:
+        mcp.rate_limiter = auth_provider.rate_limiter
+    else:
+        mcp.rate_limiter = RateLimiter(config.rate_limits, config.rate_limit_classes)
+
+    # コンテキストは最初に必要になったときに get_context() で作成し、
+    # 以降はすべてのセッションで共有する
     
     # リソース、ツール、プロンプトの登録
     register_resources(mcp)
     register_tools(mcp)
     register_prompts(mcp)
+    if config.admin_tools_enabled:
+        register_admin_resources(mcp)
+        register_admin_tools(mcp)
     
     return mcp
 
-def main():
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """コマンドライン引数の解析"""
+    parser = argparse.ArgumentParser(description="MCP server for Kachaka robot")
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", *NETWORK_TRANSPORTS],
+        help="トランスポート（デフォルトは設定値）",
+    )
+    parser.add_argument("--host", help="ネットワークトランスポートで待ち受けるアドレス")
+    parser.add_argument("--port", type=int, help="ネットワークトランスポートで待ち受けるポート")
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        help="同時に接続できるMCPセッションの最大数（0の場合は無制限）",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        help="HTTPワーカーが同時に処理する接続数の上限",
+    )
+    parser.add_argument(
+        "--timeout-keep-alive",
+        type=int,
+        help="HTTPキープアライブのタイムアウト（秒）",
+    )
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None):
     """メイン関数"""
+    args = parse_args(argv)
+    
+    # コマンドライン引数で設定を上書き
+    config = load_config()
+    if args.transport:
+        config.transport = args.transport
+    if args.host:
+        config.bind_host = args.host
+    if args.port is not None:
+        config.bind_port = args.port
+    if args.max_sessions is not None:
+        config.max_sessions = args.max_sessions
+    if args.limit_concurrency is not None:
+        config.limit_concurrency = args.limit_concurrency
+    if args.timeout_keep_alive is not None:
+        config.timeout_keep_alive = args.timeout_keep_alive
+    
     server = create_server()
-    server.run()
+    
+    if config.transport == "stdio":
+        server.run()
+    else:
+        from .transport import run_network_server
+        run_network_server(server, config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Spatial index over locations and shelves for Kachaka MCP Server.
+
+This module buckets location and shelf poses into a uniform NumPy grid so
+that nearest-neighbour and radius queries around the robot run locally in
+microseconds instead of shipping every pose to the model.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SpatialIndex:
+    """場所と棚の位置の一様グリッドインデックス"""
+
+    def __init__(
+        self,
+        points: np.ndarray,
+        ids: Sequence[str],
+        names: Sequence[str],
+        kinds: Sequence[str],
+        cell_size: float = 1.0,
+    ):
+        """初期化
+
+        Args:
+            points: 位置の配列（N x 2、メートル）
+            ids: ID
+            names: 名前
+            kinds: 種類（location, shelf）
+            cell_size: グリッドのセルの大きさ（メートル）
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.ids = list(ids)
+        self.names = list(names)
+        self.kinds = np.asarray(kinds)
+        self.cell_size = cell_size
+
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(self.points):
+            cells = np.floor(self.points / cell_size).astype(np.int64)
+            self._min_cell = cells.min(axis=0)
+            self._max_cell = cells.max(axis=0)
+            order = np.lexsort((cells[:, 1], cells[:, 0]))
+            sorted_cells = cells[order]
+            # 同じセルの点をまとめる
+            boundaries = np.flatnonzero(np.any(np.diff(sorted_cells, axis=0) != 0, axis=1)) + 1
+            for group in np.split(order, boundaries):
+                self._cells[(int(cells[group[0], 0]), int(cells[group[0], 1]))] = group
+
+    @classmethod
+    def from_world(cls, locations, shelves, cell_size: float = 1.0) -> "SpatialIndex":
+        """場所と棚の一覧からインデックスを作成"""
+        points, ids, names, kinds = [], [], [], []
+        for kind, items in (("location", locations), ("shelf", shelves)):
+            for item in items:
+                points.append((item.pose.x, item.pose.y))
+                ids.append(item.id)
+                names.append(item.name)
+                kinds.append(kind)
+        return cls(np.array(points).reshape(-1, 2), ids, names, kinds, cell_size)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _ring(self, cx: int, cy: int, r: int) -> List[np.ndarray]:
+        """チェビシェフ距離 r のセルに含まれる点のインデックス"""
+        if r == 0:
+            group = self._cells.get((cx, cy))
+            return [] if group is None else [group]
+        groups = []
+        for ix in range(cx - r, cx + r + 1):
+            for iy in (cy - r, cy + r):
+                group = self._cells.get((ix, iy))
+                if group is not None:
+                    groups.append(group)
+        for iy in range(cy - r + 1, cy + r):
+            for ix in (cx - r, cx + r):
+                group = self._cells.get((ix, iy))
+                if group is not None:
+                    groups.append(group)
+        return groups
+
+    def _max_ring(self, cx: int, cy: int) -> int:
+        """すべてのセルを覆うのに必要なリングの数"""
+        return int(max(
+            abs(cx - self._min_cell[0]), abs(cx - self._max_cell[0]),
+            abs(cy - self._min_cell[1]), abs(cy - self._max_cell[1]),
+        ))
+
+    def _filter(self, indices: np.ndarray, kind: Optional[str]) -> np.ndarray:
+        """種類で絞り込む"""
+        if kind is None or kind == "all":
+            return indices
+        return indices[self.kinds[indices] == kind]
+
+    def nearest(
+        self, x: float, y: float, k: int = 1, kind: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        """最も近い k 個の点
+
+        Returns:
+            インデックスと距離の組（距離の昇順）
+        """
+        if not len(self.points) or k <= 0:
+            return []
+        cx, cy = int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+        query = np.array([x, y])
+
+        found_idx = np.empty(0, dtype=np.intp)
+        found_dist = np.empty(0)
+        for r in range(self._max_ring(cx, cy) + 1):
+            # 走査するセルが占有セルより大幅に多くなったら全点を対象にする
+            if (2 * r + 1) ** 2 > 4 * len(self._cells) + 8:
+                found_idx = self._filter(np.arange(len(self.points)), kind)
+                found_dist = np.hypot(*(self.points[found_idx] - query).T)
+                break
+            groups = self._ring(cx, cy, r)
+            if groups:
+                candidates = self._filter(np.concatenate(groups), kind)
+                if len(candidates):
+                    dist = np.hypot(*(self.points[candidates] - query).T)
+                    found_idx = np.concatenate([found_idx, candidates])
+                    found_dist = np.concatenate([found_dist, dist])
+            # 未探索のリングの点はすべて r * cell_size 以上離れている
+            if len(found_idx) >= k and np.partition(found_dist, k - 1)[k - 1] <= r * self.cell_size:
+                break
+
+        order = np.argsort(found_dist, kind="stable")[:k]
+        return [(int(found_idx[i]), float(found_dist[i])) for i in order]
+
+    def within_radius(
+        self, x: float, y: float, radius: float, kind: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        """半径 radius 以内の点
+
+        Returns:
+            インデックスと距離の組（距離の昇順）
+        """
+        if not len(self.points) or radius < 0:
+            return []
+        x0, x1 = math.floor((x - radius) / self.cell_size), math.floor((x + radius) / self.cell_size)
+        y0, y1 = math.floor((y - radius) / self.cell_size), math.floor((y + radius) / self.cell_size)
+        # 範囲がグリッドより広い場合はセルを走査せずに全点を対象にする
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            groups = list(self._cells.values())
+        else:
+            groups = [
+                self._cells[(ix, iy)]
+                for ix in range(x0, x1 + 1)
+                for iy in range(y0, y1 + 1)
+                if (ix, iy) in self._cells
+            ]
+        if not groups:
+            return []
+        candidates = self._filter(np.concatenate(groups), kind)
+        dist = np.hypot(*(self.points[candidates] - np.array([x, y])).T)
+        mask = dist <= radius
+        candidates, dist = candidates[mask], dist[mask]
+        order = np.argsort(dist, kind="stable")
+        return [(int(candidates[i]), float(dist[i])) for i in order]
+
+    def describe(self, index: int, distance: float) -> Dict[str, Any]:
+        """検索結果を辞書に変換"""
+        return {
+            "id": self.ids[index],
+            "name": self.names[index],
+            "kind": str(self.kinds[index]),
+            "x": round(float(self.points[index, 0]), 3),
+            "y": round(float(self.points[index, 1]), 3),
+            "distance_m": round(distance, 3),
+        }
+
+
+async def get_spatial_index(context) -> SpatialIndex:
+    """キャッシュされた場所・棚から空間インデックスを取得
+
+    場所・棚の一覧が再読み込みされた場合（マップの切り替えなどで
+    キャッシュが無効化された場合を含む）はインデックスを作り直す。
+    """
+    from .world import get_locations, get_shelves
+
+    locations, _ = await get_locations(context)
+    shelves, _ = await get_shelves(context)
+
+    # 一覧のオブジェクトそのものを保持して比較する（idは再利用されうるため）
+    source = context.spatial_index_source
+    if (
+        context.spatial_index is None
+        or source is None
+        or source[0] is not locations
+        or source[1] is not shelves
+    ):
+        context.spatial_index = SpatialIndex.from_world(
+            locations, shelves, context.config.spatial_cell_size
+        )
+        context.spatial_index_source = (locations, shelves)
+    return context.spatial_index
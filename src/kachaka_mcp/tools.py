@@ -4,11 +4,18 @@ Tools for Kachaka MCP Server.
 This module defines the tools that are exposed by the Kachaka MCP Server.
 """
 
+import asyncio
+import json
 from typing import Dict, Any, List, Optional
 
-from mcp.server.fastmcp import FastMCP, Context
+from mcp.server.fastmcp import FastMCP, Context, Image
 from loguru import logger
 
+from .battery import BatteryRefused, battery_gated
+from .commands import expected_duration
+from .local_map import route_gate
+from .resolver import resolve_name
+
 
 def register_tools(mcp: FastMCP) -> None:
     """ツールの登録
@@ -27,6 +34,15 @@ def register_tools(mcp: FastMCP) -> None:
     
     # マップ操作ツール
     register_map_tools(mcp)
+    
+    # ワールド情報ツール
+    register_world_tools(mcp)
+    
+    # フリート操作ツール
+    register_fleet_tools(mcp)
+    
+    # カメラ記録ツール
+    register_recording_tools(mcp)
 
 
 def register_movement_tools(mcp: FastMCP) -> None:
@@ -36,11 +52,12 @@ def register_movement_tools(mcp: FastMCP) -> None:
         mcp: MCPサーバーインスタンス
     """
     @mcp.tool()
-    async def move_to_location(location_name: str) -> str:
+    async def move_to_location(location_name: str, idempotency_key: str = "") -> str:
         """指定した場所にロボットを移動させる
         
         Args:
             location_name: 移動先の場所の名前またはID
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -54,16 +71,35 @@ def register_movement_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Moving to location: {location_name}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Moving to location: {location_name}")
             
-            # 移動コマンドの実行
-            result = await kachaka_client.move_to_location(
-                location_name,
-                wait_for_completion=True
+            # 場所の名前を解決（見つからない場合はロボットに送らずに候補を返す）
+            location = await resolve_name(get_context(), location_name, "location")
+            if not location.found:
+                return f"Failed to move to {location_name}: {location.not_found_message('location')}"
+            location_name, location_id = location.entry.name, location.entry.id
+            
+            # 移動コマンドの実行（完了はロボットごとの監視ループで待つ）
+            # 電池が持たない場合は実行しない（再試行は判定をやり直さずに前回のコマンドに結び付く）
+            # 同じ名前の場所が複数あってもずれないよう、解決したIDで送る
+            # 所要時間はコマンドを送った後に見積もり、完了を確認する間隔に使う
+            result = await get_context().command_deduplicator.run(
+                "move_to_location",
+                (location_id,),
+                lambda: battery_gated(
+                    get_context(),
+                    [location_id],
+                    f"move to {location_name}",
+                    lambda: command_watcher.move_to_location(
+                        location_id,
+                        estimate=lambda: expected_duration(get_context(), [location_id])
+                    ),
+                ),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -71,18 +107,21 @@ def register_movement_tools(mcp: FastMCP) -> None:
                 return f"Successfully moved to {location_name}"
             else:
                 return f"Failed to move to {location_name}: {result.message}"
+        except BatteryRefused as e:
+            return e.message
         except Exception as e:
             logger.error(f"Error moving to location: {e}")
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def move_to_pose(x: float, y: float, yaw: float) -> str:
+    async def move_to_pose(x: float, y: float, yaw: float, idempotency_key: str = "") -> str:
         """指定した座標に移動
         
         Args:
             x: X座標
             y: Y座標
             yaw: 向き（ラジアン）
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -96,16 +135,26 @@ def register_movement_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Moving to pose: x={x}, y={y}, yaw={yaw}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Moving to pose: x={x}, y={y}, yaw={yaw}")
             
-            # 移動コマンドの実行
-            result = await kachaka_client.move_to_pose(
-                x, y, yaw,
-                wait_for_completion=True
+            # 移動コマンドの実行（電池が持たない場合は実行しない）
+            result = await get_context().command_deduplicator.run(
+                "move_to_pose",
+                (x, y, yaw),
+                lambda: battery_gated(
+                    get_context(),
+                    [(x, y)],
+                    f"move to ({x}, {y})",
+                    lambda: command_watcher.move_to_pose(
+                        x, y, yaw,
+                        estimate=lambda: expected_duration(get_context(), [(x, y)])
+                    ),
+                ),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -113,14 +162,19 @@ def register_movement_tools(mcp: FastMCP) -> None:
                 return f"Successfully moved to pose: x={x}, y={y}, yaw={yaw}"
             else:
                 return f"Failed to move to pose: {result.message}"
+        except BatteryRefused as e:
+            return e.message
         except Exception as e:
             logger.error(f"Error moving to pose: {e}")
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def return_home() -> str:
+    async def return_home(idempotency_key: str = "") -> str:
         """ホームに戻る
         
+        Args:
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
+        
         Returns:
             実行結果のメッセージ
         """
@@ -133,15 +187,18 @@ def register_movement_tools(mcp: FastMCP) -> None:
         
         logger.info("Returning home")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info("Returning home")
             
             # ホームに戻るコマンドの実行
-            result = await kachaka_client.return_home(
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "return_home",
+                (),
+                lambda: command_watcher.return_home(),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -154,12 +211,13 @@ def register_movement_tools(mcp: FastMCP) -> None:
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def move_forward(distance_meter: float, speed: float = 0.0) -> str:
+    async def move_forward(distance_meter: float, speed: float = 0.0, idempotency_key: str = "") -> str:
         """指定した距離前進
         
         Args:
             distance_meter: 前進する距離（メートル）
             speed: 速度（メートル/秒）、0.0の場合はデフォルト速度
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -173,17 +231,22 @@ def register_movement_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Moving forward: distance={distance_meter}m, speed={speed}m/s")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Moving forward: distance={distance_meter}m, speed={speed}m/s")
             
             # 前進コマンドの実行
-            result = await kachaka_client.move_forward(
-                distance_meter,
-                speed=speed,
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "move_forward",
+                (distance_meter, speed),
+                lambda: command_watcher.move_forward(
+                    distance_meter,
+                    speed=speed,
+                    expected_sec=abs(distance_meter) / (speed or get_context().config.travel_speed)
+                ),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -196,11 +259,12 @@ def register_movement_tools(mcp: FastMCP) -> None:
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def rotate_in_place(angle_radian: float) -> str:
+    async def rotate_in_place(angle_radian: float, idempotency_key: str = "") -> str:
         """その場で回転
         
         Args:
             angle_radian: 回転角度（ラジアン）
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -214,16 +278,20 @@ def register_movement_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Rotating in place: angle={angle_radian}rad")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Rotating in place: angle={angle_radian}rad")
             
             # 回転コマンドの実行
-            result = await kachaka_client.rotate_in_place(
-                angle_radian,
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "rotate_in_place",
+                (angle_radian,),
+                lambda: command_watcher.rotate_in_place(
+                    angle_radian
+                ),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -271,12 +339,13 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         mcp: MCPサーバーインスタンス
     """
     @mcp.tool()
-    async def move_shelf(shelf_name: str, location_name: str) -> str:
+    async def move_shelf(shelf_name: str, location_name: str, idempotency_key: str = "") -> str:
         """棚を指定した場所に移動
         
         Args:
             shelf_name: 移動する棚の名前またはID
             location_name: 移動先の場所の名前またはID
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -290,34 +359,74 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Moving shelf {shelf_name} to location {location_name}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Moving shelf {shelf_name} to location {location_name}")
             
-            # 棚移動コマンドの実行
-            result = await kachaka_client.move_shelf(
-                shelf_name,
-                location_name,
-                wait_for_completion=True
+            # 棚と場所の名前を解決（見つからない場合はロボットに送らずに候補を返す）
+            shelf = await resolve_name(get_context(), shelf_name, "shelf")
+            if not shelf.found:
+                return f"Failed to move shelf: {shelf.not_found_message('shelf')}"
+            location = await resolve_name(get_context(), location_name, "location")
+            if not location.found:
+                return f"Failed to move shelf: {location.not_found_message('location')}"
+            shelf_name, location_name = shelf.entry.name, location.entry.name
+            shelf_id, location_id = shelf.entry.id, location.entry.id
+            
+            # レーザーで観測した新しい障害物で経路がふさがれている場合は実行しない
+            refusal = await route_gate(
+                get_context(),
+                [shelf_id, location_id],
+                f"move shelf {shelf_name} to {location_name}",
+            )
+            if refusal:
+                return refusal
+            
+            # 棚移動コマンドの実行（電池が持たない場合は実行しない、棚まで行き移動先まで運ぶ）
+            result = await get_context().command_deduplicator.run(
+                "move_shelf",
+                (shelf_id, location_id),
+                lambda: battery_gated(
+                    get_context(),
+                    [shelf_id, location_id],
+                    f"move shelf {shelf_name} to {location_name}",
+                    lambda: command_watcher.move_shelf(
+                        shelf_id,
+                        location_id,
+                        estimate=lambda: expected_duration(
+                            get_context(),
+                            [shelf_id, location_id],
+                            get_context().config.battery_shelf_overhead_sec,
+                        )
+                    ),
+                    get_context().config.battery_shelf_overhead_sec,
+                ),
+                idempotency_key,
             )
             
+            # 棚の位置が変わったため棚のキャッシュを無効化
+            get_context().cache.invalidate("shelves")
+            
             # 結果の返却
             if result.success:
                 return f"Successfully moved shelf {shelf_name} to location {location_name}"
             else:
                 return f"Failed to move shelf: {result.message}"
+        except BatteryRefused as e:
+            return e.message
         except Exception as e:
             logger.error(f"Error moving shelf: {e}")
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def return_shelf(shelf_name: str = "") -> str:
+    async def return_shelf(shelf_name: str = "", idempotency_key: str = "") -> str:
         """棚を元の場所に戻す
         
         Args:
             shelf_name: 戻す棚の名前またはID（空文字列の場合は現在持っている棚）
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -331,18 +440,33 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Returning shelf {shelf_name if shelf_name else '(current)'}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Returning shelf {shelf_name if shelf_name else '(current)'}")
             
+            # 棚の名前を解決（空文字列の場合は現在持っている棚）
+            shelf_id = ""
+            if shelf_name:
+                shelf = await resolve_name(get_context(), shelf_name, "shelf")
+                if not shelf.found:
+                    return f"Failed to return shelf: {shelf.not_found_message('shelf')}"
+                shelf_name, shelf_id = shelf.entry.name, shelf.entry.id
+            
             # 棚を戻すコマンドの実行
-            result = await kachaka_client.return_shelf(
-                shelf_name,
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "return_shelf",
+                (shelf_id,),
+                lambda: command_watcher.return_shelf(
+                    shelf_id
+                ),
+                idempotency_key,
             )
             
+            # 棚の位置が変わったため棚のキャッシュを無効化
+            get_context().cache.invalidate("shelves")
+            
             # 結果の返却
             if result.success:
                 return f"Successfully returned shelf {shelf_name if shelf_name else '(current)'}"
@@ -353,9 +477,12 @@ def register_shelf_tools(mcp: FastMCP) -> None:
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def dock_shelf() -> str:
+    async def dock_shelf(idempotency_key: str = "") -> str:
         """棚にドッキング
         
+        Args:
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
+        
         Returns:
             実行結果のメッセージ
         """
@@ -368,15 +495,18 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         
         logger.info("Docking shelf")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info("Docking shelf")
             
             # ドッキングコマンドの実行
-            result = await kachaka_client.dock_shelf(
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "dock_shelf",
+                (),
+                lambda: command_watcher.dock_shelf(),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -389,9 +519,12 @@ def register_shelf_tools(mcp: FastMCP) -> None:
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def undock_shelf() -> str:
+    async def undock_shelf(idempotency_key: str = "") -> str:
         """棚からアンドック
         
+        Args:
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
+        
         Returns:
             実行結果のメッセージ
         """
@@ -404,15 +537,18 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         
         logger.info("Undocking shelf")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info("Undocking shelf")
             
             # アンドックコマンドの実行
-            result = await kachaka_client.undock_shelf(
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "undock_shelf",
+                (),
+                lambda: command_watcher.undock_shelf(),
+                idempotency_key,
             )
             
             # 結果の返却
@@ -425,12 +561,13 @@ def register_shelf_tools(mcp: FastMCP) -> None:
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def dock_any_shelf_with_registration(location_name: str, dock_forward: bool = False) -> str:
+    async def dock_any_shelf_with_registration(location_name: str, dock_forward: bool = False, idempotency_key: str = "") -> str:
         """任意の棚にドッキングして登録
         
         Args:
             location_name: ドッキングする場所の名前またはID
             dock_forward: 前方からドッキングするかどうか
+            idempotency_key: 冪等キー（同じキーで再試行した場合、コマンドを再送せずに前回の結果を返す）
             
         Returns:
             実行結果のメッセージ
@@ -444,19 +581,32 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         
         logger.info(f"Docking any shelf at location {location_name}, dock_forward={dock_forward}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # 進捗報告の設定
             ctx.info(f"Docking any shelf at location {location_name}, dock_forward={dock_forward}")
             
+            # 場所の名前を解決（見つからない場合はロボットに送らずに候補を返す）
+            location = await resolve_name(get_context(), location_name, "location")
+            if not location.found:
+                return f"Failed to dock shelf: {location.not_found_message('location')}"
+            location_name, location_id = location.entry.name, location.entry.id
+            
             # ドッキングコマンドの実行
-            result = await kachaka_client.dock_any_shelf_with_registration(
-                location_name,
-                dock_forward,
-                wait_for_completion=True
+            result = await get_context().command_deduplicator.run(
+                "dock_any_shelf_with_registration",
+                (location_id, dock_forward),
+                lambda: command_watcher.dock_any_shelf_with_registration(
+                    location_id,
+                    dock_forward
+                ),
+                idempotency_key,
             )
             
+            # 棚の位置が変わったため棚のキャッシュを無効化
+            get_context().cache.invalidate("shelves")
+            
             # 結果の返却
             if result.success:
                 return f"Successfully docked shelf at location {location_name}"
@@ -465,6 +615,137 @@ def register_shelf_tools(mcp: FastMCP) -> None:
         except Exception as e:
             logger.error(f"Error docking shelf: {e}")
             return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def plan_and_run_deliveries(
+        jobs: List[Dict[str, str]],
+        dry_run: bool = False,
+        stop_on_failure: bool = True,
+        idempotency_key: str = "",
+    ) -> str:
+        """複数の棚の移動を、移動距離が短くなる順序に並べ替えて実行
+        
+        場所・棚の位置から移動距離を見積もり、最近傍法と2-optで実行順序を決める。
+        
+        Args:
+            jobs: ジョブの一覧（[{"shelf": 棚の名前またはID, "location": 移動先の場所の名前またはID}, ...]）
+            dry_run: Trueの場合は計画だけを返し、実行しない
+            stop_on_failure: Trueの場合は失敗したジョブ以降を実行しない
+            idempotency_key: 冪等キー（同じキーで再試行した場合、完了済みのジョブは再送しない）
+            
+        Returns:
+            実行順序とジョブごとの結果（JSON）
+        """
+        try:
+            from mcp.server.fastmcp import get_context
+            ctx = get_context()
+        except ImportError:
+            # 古いバージョンのSDKを使用している場合は、ctxを直接取得
+            ctx = mcp.get_context()
+        
+        logger.info(f"Planning {len(jobs)} deliveries, dry_run={dry_run}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.planner import plan_deliveries
+        command_watcher = get_context().command_watcher
+        
+        try:
+            # 実行順序の計画（名前が解決できない場合は何も実行しない）
+            plan = await plan_deliveries(get_context(), jobs)
+            if "errors" in plan:
+                return json.dumps({"success": False, "errors": plan["errors"]}, ensure_ascii=False)
+            
+            planned = [
+                {"shelf": job.shelf_name, "location": job.location_name}
+                for job in plan["jobs"]
+            ]
+            summary = {
+                "order": plan["order"],
+                "estimated_distance_m": plan["estimated_distance_m"],
+                "requested_order_distance_m": plan["requested_order_distance_m"],
+                "distance_model": plan["distance_model"],
+            }
+            if dry_run:
+                return json.dumps({"success": True, **summary, "jobs": planned}, ensure_ascii=False)
+            
+            # 電池が持たない場合は何も実行しない（最初のジョブの中で計画全体を判定するため、
+            # 同じ冪等キーの再試行は判定をやり直さずに実行済みのジョブに結び付く）
+            waypoints = [point for job in plan["jobs"] for point in (job.pickup, job.dropoff)]
+            
+            # ジョブを順に実行
+            results = []
+            skip_reason = "Skipped after a previous failure"
+            for step, (job, original) in enumerate(zip(plan["jobs"], plan["order"])):
+                # 終了処理中は次のジョブを始めない
+                if get_context().lifecycle.draining:
+                    skip_reason = "Skipped because the server is shutting down"
+                    break
+                ctx.info(f"Delivery {step + 1}/{len(plan['jobs'])}: moving shelf {job.shelf_name} to {job.location_name}")
+                # ジョブごとの冪等キー（元のジョブの番号で区別し、move_shelf に直接渡されたキーと衝突しないようツール名を付ける）
+                job_key = f"plan_and_run_deliveries:{idempotency_key}:{original}" if idempotency_key else ""
+                def start(job=job):
+                    return command_watcher.move_shelf(
+                        job.shelf_id,
+                        job.location_id,
+                        estimate=lambda: expected_duration(
+                            get_context(),
+                            [job.pickup, job.dropoff],
+                            get_context().config.battery_shelf_overhead_sec,
+                        )
+                    )
+                
+                def gated(start=start):
+                    return battery_gated(
+                        get_context(),
+                        waypoints,
+                        f"run {len(plan['jobs'])} deliveries",
+                        start,
+                        get_context().config.battery_shelf_overhead_sec * len(plan["jobs"]),
+                    )
+                
+                try:
+                    result = await get_context().command_deduplicator.run(
+                        "move_shelf",
+                        (job.shelf_id, job.location_id),
+                        gated if step == 0 else start,
+                        job_key,
+                    )
+                    success = result.success
+                    message = "" if success else f"Error code {result.error_code}"
+                except BatteryRefused as e:
+                    return json.dumps({"success": False, **summary, "errors": [e.message]}, ensure_ascii=False)
+                except Exception as e:
+                    logger.error(f"Error moving shelf {job.shelf_name}: {e}")
+                    success, message = False, str(e)
+                finally:
+                    # 棚の位置が変わったため棚のキャッシュを無効化
+                    get_context().cache.invalidate("shelves")
+                
+                results.append({
+                    "shelf": job.shelf_name,
+                    "location": job.location_name,
+                    "success": success,
+                    "message": message,
+                })
+                if not success and stop_on_failure:
+                    break
+            
+            # 実行しなかったジョブ
+            for job in plan["jobs"][len(results):]:
+                results.append({
+                    "shelf": job.shelf_name,
+                    "location": job.location_name,
+                    "success": False,
+                    "message": skip_reason,
+                })
+            
+            # 結果の返却
+            return json.dumps(
+                {"success": all(r["success"] for r in results), **summary, "results": results},
+                ensure_ascii=False,
+            )
+        except Exception as e:
+            logger.error(f"Error running deliveries: {e}")
+            return f"Error: {str(e)}"
 
 
 def register_system_tools(mcp: FastMCP) -> None:
@@ -485,7 +766,7 @@ def register_system_tools(mcp: FastMCP) -> None:
         """
         logger.info(f"Speaking: {text}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
        
         # from .utils.config import load_config
         # config = load_config()
@@ -502,9 +783,8 @@ def register_system_tools(mcp: FastMCP) -> None:
         
         try:
             # 発話コマンドの実行
-            result = await kachaka_client.speak(
-                text,
-                wait_for_completion=True
+            result = await command_watcher.speak(
+                text
             )
             
             # 結果の返却
@@ -576,13 +856,12 @@ def register_system_tools(mcp: FastMCP) -> None:
         """
         logger.info(f"Locking for {duration_sec} seconds")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        command_watcher = get_context().command_watcher
         
         try:
             # ロックコマンドの実行
-            result = await kachaka_client.lock(
-                duration_sec,
-                wait_for_completion=True
+            result = await command_watcher.lock(
+                duration_sec
             )
             
             # 結果の返却
@@ -724,6 +1003,9 @@ def register_map_tools(mcp: FastMCP) -> None:
             # マップの切り替え
             result = await kachaka_client.switch_map(map_id)
             
+            # マップが変わったため場所・棚のキャッシュを無効化
+            get_context().cache.invalidate()
+            
             # 結果の返却
             if result.success:
                 return f"Successfully switched to map: {map_id}"
@@ -733,57 +1015,89 @@ def register_map_tools(mcp: FastMCP) -> None:
             logger.error(f"Error switching map: {e}")
             return f"Error: {str(e)}"
     
+    def progress_reporter(ctx: Optional[Context]):
+        """転送の進捗をMCPコンテキストに通知する関数（通知の失敗で転送は止めない）"""
+        async def progress(done: int, total: Optional[int]) -> None:
+            if ctx is None:
+                return
+            try:
+                await ctx.report_progress(done, total)
+            except Exception as e:
+                logger.debug(f"Could not report progress: {e}")
+        return progress
+    
     @mcp.tool()
-    async def export_map(map_id: str, output_file_path: str) -> str:
+    async def export_map(map_id: str, output_file_path: str = "", ctx: Context = None) -> str:
         """マップをエクスポート
         
+        マップはストリームで受け取りながらハッシュ（SHA-256）を計算し、
+        ローカルの保存先にハッシュごとに保存する。
+        
         Args:
             map_id: エクスポートするマップのID
-            output_file_path: 出力ファイルパス
+            output_file_path: 出力ファイルパス（空文字列の場合は保存先にだけ保存する）
+            ctx: MCPコンテキスト
             
         Returns:
             実行結果のメッセージ
         """
-        logger.info(f"Exporting map {map_id} to {output_file_path}")
+        logger.info(f"Exporting map {map_id} to {output_file_path or 'map store'}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        from kachaka_mcp.mapstore import export_map_to_store
         
         try:
             # マップのエクスポート
-            result = await kachaka_client.export_map(map_id, output_file_path)
+            result = await export_map_to_store(get_context(), map_id, output_file_path, progress_reporter(ctx))
             
             # 結果の返却
-            if result.success:
-                return f"Successfully exported map {map_id} to {output_file_path}"
+            if result["success"]:
+                destination = output_file_path or result["stored_path"]
+                return f"Successfully exported map {map_id} to {destination} (sha256={result['sha256']}, {result['size']} bytes)"
             else:
-                return f"Failed to export map: {result.message}"
+                return f"Failed to export map: error code {result['error_code']}"
         except Exception as e:
             logger.error(f"Error exporting map: {e}")
             return f"Error: {str(e)}"
     
     @mcp.tool()
-    async def import_map(target_file_path: str) -> str:
+    async def import_map(target_file_path: str, force: bool = False, ctx: Context = None) -> str:
         """マップをインポート
         
+        ロボットに同じ内容（SHA-256が同じ）のマップがあることが分かっている場合は転送を省略する。
+        
         Args:
-            target_file_path: インポートするファイルパス
+            target_file_path: インポートするファイルパス、またはエクスポートしたマップのハッシュ
+            force: Trueの場合は同じ内容のマップがあっても転送する
+            ctx: MCPコンテキスト
             
         Returns:
             実行結果のメッセージ
         """
         logger.info(f"Importing map from {target_file_path}")
         from kachaka_mcp.server import get_context
-        kachaka_client = get_context().kachaka_client 
+        from kachaka_mcp.mapstore import import_map_from_file
         
         try:
             # マップのインポート
-            result = await kachaka_client.import_map(target_file_path)
+            result = await import_map_from_file(
+                get_context(),
+                target_file_path,
+                force=force,
+                chunk_size=get_context().config.map_chunk_size,
+                progress=progress_reporter(ctx),
+            )
             
             # 結果の返却
-            if result.success:
-                return f"Successfully imported map from {target_file_path}"
+            if result["skipped"]:
+                return f"Map already on robot as {result['map_id']} (sha256={result['sha256']}); skipped transfer"
+            
+            # マップが変わった可能性があるため場所・棚のキャッシュを無効化
+            get_context().cache.invalidate()
+            
+            if result["success"]:
+                return f"Successfully imported map from {target_file_path} as {result['map_id']} (sha256={result['sha256']})"
             else:
-                return f"Failed to import map: {result.message}"
+                return f"Failed to import map: error code {result['error_code']}"
         except Exception as e:
             logger.error(f"Error importing map: {e}")
             return f"Error: {str(e)}"
@@ -817,4 +1131,669 @@ def register_map_tools(mcp: FastMCP) -> None:
                 return f"Failed to set robot pose: {result.message}"
         except Exception as e:
             logger.error(f"Error setting robot pose: {e}")
-            return f"Error: {str(e)}"
\ No newline at end of file
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def transform_points(points: List[List[float]], direction: str = "world_to_pixel") -> str:
+        """マップ座標と地図画像（map://current）のピクセル座標を一括で変換
+        
+        Args:
+            points: 点の一覧（[[x, y], ...] または向きを含む [[x, y, yaw], ...]）
+            direction: 変換の向き（world_to_pixel, pixel_to_world）
+            
+        Returns:
+            変換した点と地図のメタデータ（JSON）
+        """
+        logger.info(f"Transforming {len(points)} points: {direction}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.geometry import get_map_transform
+        
+        try:
+            if direction not in ("world_to_pixel", "pixel_to_world"):
+                return f"Error: Unknown direction '{direction}' (use world_to_pixel or pixel_to_world)"
+            if len({len(p) for p in points}) > 1 or any(len(p) not in (2, 3) for p in points):
+                return "Error: All points must have the same number of values (2 or 3)"
+            transform = await get_map_transform(get_context())
+            
+            if direction == "world_to_pixel":
+                converted = transform.world_to_pixel(points) if points else []
+            else:
+                converted = transform.pixel_to_world(points) if points else []
+            
+            # 結果の返却
+            result = {**transform.metadata(), "direction": direction}
+            result["points"] = [[round(float(v), 4) for v in row] for row in converted]
+            if direction == "world_to_pixel" and points:
+                result["in_bounds"] = transform.contains(converted).tolist()
+            return json.dumps(result, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error transforming points: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def render_annotated_map(
+        show_robot: bool = True,
+        show_locations: bool = True,
+        show_shelves: bool = True,
+        points: Optional[List[List[float]]] = None,
+        max_size: int = 1024,
+    ) -> list:
+        """ロボット・場所・棚・任意の点を描き込んだ地図画像を作成
+        
+        マーカーの横には番号を描き、番号と名前の対応は凡例として返す。
+        
+        Args:
+            show_robot: ロボットの位置と向きを描くかどうか
+            show_locations: 場所を描くかどうか
+            show_shelves: 棚を描くかどうか
+            points: 追加で描く点（マップ座標 [[x, y], ...]）
+            max_size: 画像の長辺のピクセル数の上限（0の場合は縮小しない）
+            
+        Returns:
+            凡例（JSON）と地図画像
+        """
+        logger.info("Rendering annotated map")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.geometry import build_annotated_map
+        
+        try:
+            image, legend, transform = await build_annotated_map(
+                get_context(),
+                show_robot=show_robot,
+                show_locations=show_locations,
+                show_shelves=show_shelves,
+                points=points or [],
+                max_size=max_size,
+            )
+            
+            # 結果の返却
+            result = {**transform.metadata(), "legend": legend}
+            return [json.dumps(result, ensure_ascii=False, separators=(",", ":")), Image(data=image, format="png")]
+        except Exception as e:
+            logger.error(f"Error rendering annotated map: {e}")
+            return [f"Error: {str(e)}"]
+
+
+def register_world_tools(mcp: FastMCP) -> None:
+    """ワールド情報ツールの登録
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.tool()
+    async def get_world_snapshot(
+        timeout_sec: float = 2.0,
+        camera: str = "front",
+        thumbnail_size: int = 320,
+    ) -> list:
+        """ロボットの状態・場所・棚・物体検出・カメラ画像を1回の呼び出しでまとめて取得
+        
+        各要素は並行して取得し、失敗した要素やキャッシュから返した要素は
+        failed / cached に列挙される。
+        
+        Args:
+            timeout_sec: 要素ごとのタイムアウト（秒）
+            camera: カメラ画像（front, back、空文字列の場合は取得しない）
+            thumbnail_size: カメラ画像の長辺のピクセル数（0の場合は縮小しない）
+            
+        Returns:
+            スナップショット（JSON）とカメラ画像
+        """
+        logger.info(f"Getting world snapshot: timeout={timeout_sec}s, camera={camera}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.world import build_world_snapshot
+        
+        try:
+            snapshot, image = await build_world_snapshot(
+                get_context(),
+                timeout_sec=timeout_sec,
+                camera=camera,
+                thumbnail_size=thumbnail_size,
+                rate_limiter=getattr(mcp, "rate_limiter", None),
+            )
+            
+            # 結果の返却
+            result = [json.dumps(snapshot, separators=(",", ":"))]
+            if image is not None:
+                result.append(Image(data=image, format="jpeg"))
+            return result
+        except Exception as e:
+            logger.error(f"Error getting world snapshot: {e}")
+            return [f"Error: {str(e)}"]
+    
+    async def resolve_query_point(x: Optional[float], y: Optional[float]) -> tuple:
+        """検索の基準点（省略時はロボットの現在位置）"""
+        if x is not None and y is not None:
+            return x, y
+        from kachaka_mcp.server import get_context
+        pose = await get_context().kachaka_client.get_robot_pose()
+        return pose.x, pose.y
+    
+    @mcp.tool()
+    async def nearest_locations(
+        k: int = 3,
+        kind: str = "all",
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+    ) -> str:
+        """ロボット（または指定した座標）に近い場所・棚を取得
+        
+        Args:
+            k: 取得する件数
+            kind: 種類（all, location, shelf）
+            x: 基準点のX座標（省略時はロボットの現在位置）
+            y: 基準点のY座標（省略時はロボットの現在位置）
+            
+        Returns:
+            近い順の場所・棚（JSON）
+        """
+        logger.info(f"Finding nearest {kind}: k={k}, x={x}, y={y}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.spatial import get_spatial_index
+        
+        try:
+            index = await get_spatial_index(get_context())
+            qx, qy = await resolve_query_point(x, y)
+            
+            # 結果の返却
+            results = [index.describe(i, d) for i, d in index.nearest(qx, qy, k, kind)]
+            return json.dumps({"origin": {"x": qx, "y": qy}, "results": results}, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error finding nearest locations: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def within_radius(
+        radius: float,
+        kind: str = "all",
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+    ) -> str:
+        """ロボット（または指定した座標）から指定した半径以内の場所・棚を取得
+        
+        Args:
+            radius: 半径（メートル）
+            kind: 種類（all, location, shelf）
+            x: 基準点のX座標（省略時はロボットの現在位置）
+            y: 基準点のY座標（省略時はロボットの現在位置）
+            
+        Returns:
+            近い順の場所・棚（JSON）
+        """
+        logger.info(f"Finding {kind} within {radius}m: x={x}, y={y}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.spatial import get_spatial_index
+        
+        try:
+            index = await get_spatial_index(get_context())
+            qx, qy = await resolve_query_point(x, y)
+            
+            # 結果の返却
+            results = [index.describe(i, d) for i, d in index.within_radius(qx, qy, radius, kind)]
+            return json.dumps({"origin": {"x": qx, "y": qy}, "results": results}, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error finding locations within radius: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def estimate_travel(destination: str, origin: str = "") -> str:
+        """2点間の経路長と到着時間を地図から推定（ロボットは動かさない）
+        
+        Args:
+            destination: 目的地（場所・棚の名前またはID、または "x,y" 形式の座標）
+            origin: 出発地（同上、空文字列の場合はロボットの現在位置）
+            
+        Returns:
+            経路長・到着時間・直線距離（JSON）
+        """
+        logger.info(f"Estimating travel from {origin or 'robot'} to {destination}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.travel import get_travel_model, resolve_place
+        
+        try:
+            model = await get_travel_model(get_context())
+            origin_name, start = await resolve_place(get_context(), origin)
+            destination_name, goal = await resolve_place(get_context(), destination)
+            
+            # 結果の返却
+            estimate = await asyncio.to_thread(model.estimate, start, goal)
+            result = {"origin": origin_name, "destination": destination_name, **estimate}
+            return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error estimating travel: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def estimate_travel_matrix(origins: List[str], destinations: List[str]) -> str:
+        """複数の出発地と目的地の組の経路長と到着時間を地図から推定
+        
+        Args:
+            origins: 出発地の一覧（場所・棚の名前またはID、"x,y" 形式の座標、空文字列はロボットの現在位置）
+            destinations: 目的地の一覧（同上）
+            
+        Returns:
+            出発地ごとの経路長（メートル）と到着時間（秒）の行列（JSON、到達できない組は null）
+        """
+        logger.info(f"Estimating travel matrix: {len(origins)} x {len(destinations)}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.travel import get_travel_model, resolve_place
+        
+        try:
+            model = await get_travel_model(get_context())
+            origin_places = [await resolve_place(get_context(), query) for query in origins]
+            destination_places = [await resolve_place(get_context(), query) for query in destinations]
+            
+            # 任意の座標からの距離場はキャッシュにないため、スレッドで計算する
+            lengths = await asyncio.to_thread(
+                lambda: [[model.path_length(start, goal) for _, goal in destination_places] for _, start in origin_places]
+            )
+            distances, etas = [], []
+            for row in lengths:
+                distances.append([None if d is None else round(d, 2) for d in row])
+                etas.append([None if d is None else round(d / model.speed, 1) for d in row])
+            
+            # 結果の返却
+            result = {
+                "origins": [name for name, _ in origin_places],
+                "destinations": [name for name, _ in destination_places],
+                "path_length_m": distances,
+                "eta_sec": etas,
+            }
+            return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error estimating travel matrix: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def find_objects(
+        label: str = "",
+        k: int = 5,
+        radius: float = 0.0,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+    ) -> str:
+        """これまでに検出した物体を記憶から探す（移動せずに最後に見た位置を返す）
+        
+        Args:
+            label: 物体のラベル（person, shelf, charger, door、省略時はすべて）
+            k: 取得する件数
+            radius: 基準点からの半径（メートル、0の場合は制限なし）
+            x: 基準点のX座標（省略時はロボットの現在位置）
+            y: 基準点のY座標（省略時はロボットの現在位置）
+            
+        Returns:
+            近い順の物体（推定位置、最後に見てからの秒数、信頼度）（JSON）
+        """
+        logger.info(f"Finding remembered objects: label={label}, k={k}, radius={radius}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            aggregator = get_context().object_memory
+            aggregator.start()
+            qx, qy = await resolve_query_point(x, y)
+            results = aggregator.query(label=label, near=(qx, qy), radius=radius, k=k)
+            return json.dumps(
+                {"origin": {"x": qx, "y": qy}, "frames": aggregator.frames, "results": results},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        except Exception as e:
+            logger.error(f"Error finding remembered objects: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def check_route(destination: str, via: str = "") -> str:
+        """ロボットの現在位置からの経路が、地図にない障害物でふさがれていないかを確認（ロボットは動かさない）
+        
+        Args:
+            destination: 目的地（場所・棚の名前またはID、または "x,y" 形式の座標）
+            via: 途中で立ち寄る場所（同上、棚を運ぶ場合は棚、空文字列の場合は直行）
+            
+        Returns:
+            区間ごとの静的な地図と観測後の経路長、ふさがれているかどうか、新しい障害物の領域（JSON）
+        """
+        logger.info(f"Checking route to {destination} via {via or '-'}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.travel import resolve_place
+        
+        try:
+            local_map = get_context().local_map
+            local_map.start()
+            places = [via, destination] if via else [destination]
+            points = [(await resolve_place(get_context(), place))[1] for place in places]
+            result = await local_map.check_route(points)
+            result["new_obstacles"] = (await local_map.changes())["new_obstacles"]
+            return json.dumps(result, separators=(",", ":"))
+        except Exception as e:
+            logger.error(f"Error checking route: {e}")
+            return f"Error: {str(e)}"
+
+
+def register_fleet_tools(mcp: FastMCP) -> None:
+    """フリート操作ツールの登録
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.tool()
+    async def list_fleet_robots() -> str:
+        """フリート操作の対象のロボットと、ブロードキャストできる操作の一覧を取得
+        
+        Returns:
+            ロボットの名前とホスト、操作の一覧（JSON）
+        """
+        logger.info("Listing fleet robots")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.fleet import FLEET_OPERATIONS
+        
+        try:
+            fleet = get_context().fleet
+            result = {
+                "robots": [{"name": name, "host": fleet.robots[name]} for name in fleet.select()],
+                "operations": sorted(FLEET_OPERATIONS),
+                "concurrency": fleet.concurrency,
+                "timeout_sec": fleet.timeout_sec,
+            }
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error listing fleet robots: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def fleet_broadcast(
+        operation: str,
+        arguments: Optional[Dict[str, Any]] = None,
+        robots: Optional[List[str]] = None,
+        timeout_sec: float = 0.0,
+    ) -> str:
+        """同じ操作をフリートのロボットに並行して実行
+        
+        操作: switch_map(map_id), set_speaker_volume(volume), set_auto_homing_enabled(enable),
+        return_home(), speak(text), cancel_command(), import_map(target_file_path, force)
+        
+        Args:
+            operation: 操作の名前
+            arguments: 操作の引数（例: {"map_id": "..."}）
+            robots: 操作するロボットの名前（省略時はすべて）
+            timeout_sec: ロボットごとのタイムアウト（秒、0の場合は設定値）
+            
+        Returns:
+            成功・失敗の数とロボットごとの結果（JSON）
+        """
+        logger.info(f"Broadcasting {operation} to fleet: robots={robots or 'all'}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            result = await get_context().fleet.broadcast(operation, arguments, robots, timeout_sec or None)
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error broadcasting {operation}: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def dispatch_task(
+        kind: str,
+        location: str,
+        shelf: str = "",
+        wait: bool = True,
+        timeout_sec: float = 0.0,
+    ) -> str:
+        """フリートの中で最も近く電池残量に余裕のある空いたロボットにタスクを割り当てる
+        
+        すべてのロボットが使用中の場合は待ち行列に入れ、ロボットが空いたら割り当てる。
+        
+        Args:
+            kind: タスクの種類（"move_shelf" または "move_to_location"）
+            location: 移動先の場所の名前
+            shelf: 運ぶ棚の名前（move_shelf の場合）
+            wait: Trueの場合はタスクの完了を待つ
+            timeout_sec: 完了を待つ最大の秒数（0の場合は無制限、タイムアウトしてもタスクは続行する）
+            
+        Returns:
+            タスクの状態と割り当てたロボット（JSON）
+        """
+        logger.info(f"Dispatching {kind}: shelf={shelf}, location={location}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            task = await get_context().dispatcher.submit(kind, location, shelf)
+            if wait and not task.done.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(task.done), timeout_sec or None)
+                except asyncio.TimeoutError:
+                    pass
+            return json.dumps(task.to_dict(), ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error dispatching {kind}: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def get_dispatch_status() -> str:
+        """フリートのロボットの状態（位置・電池残量・実行中か）と、割り当てたタスクの状態を取得
+        
+        Returns:
+            ロボットの状態、待ち行列、タスクの一覧（JSON）
+        """
+        logger.info("Getting dispatch status")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            dispatcher = get_context().dispatcher
+            await dispatcher.refresh()
+            return json.dumps(dispatcher.status(), ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error getting dispatch status: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def cancel_dispatch_task(task_id: str) -> str:
+        """待ち行列のタスクを取り消す（実行中のタスクは cancel_command で中止する）
+        
+        Args:
+            task_id: タスクのID
+            
+        Returns:
+            結果メッセージ
+        """
+        logger.info(f"Cancelling dispatch task {task_id}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            if get_context().dispatcher.cancel(task_id):
+                return f"Cancelled {task_id}"
+            return f"Failed: {task_id} is not queued"
+        except Exception as e:
+            logger.error(f"Error cancelling dispatch task {task_id}: {e}")
+            return f"Error: {str(e)}"
+
+def register_recording_tools(mcp: FastMCP) -> None:
+    """カメラ記録ツールの登録
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.tool()
+    async def start_camera_recording(cameras: Optional[List[str]] = None, fps: float = 0.0) -> str:
+        """カメラ画像のディスクへの記録を開始（古いフレームから上書きする）
+        
+        Args:
+            cameras: 記録するカメラ（front, back、省略時は設定値）
+            fps: 1秒あたりのフレーム数（0の場合は設定値）
+            
+        Returns:
+            記録中のカメラと記録の範囲（JSON）
+        """
+        logger.info(f"Starting camera recording: cameras={cameras}, fps={fps}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            recorder = get_context().camera_recorder
+            recorder.start(cameras, fps or None)
+            result = {
+                "recording": recorder.recording,
+                "fps": recorder.fps,
+                "buffers": {camera: ring.stats() for camera, ring in recorder.rings.items()},
+            }
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error starting camera recording: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def stop_camera_recording() -> str:
+        """カメラ画像の記録を停止（記録したフレームは残る）
+        
+        Returns:
+            結果メッセージ
+        """
+        logger.info("Stopping camera recording")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            recorder = get_context().camera_recorder
+            cameras = recorder.recording
+            recorder.stop()
+            return f"Stopped recording: {', '.join(cameras) or 'nothing was recording'}"
+        except Exception as e:
+            logger.error(f"Error stopping camera recording: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def get_camera_timelapse(camera: str, start: str, end: str, max_frames: int = 6) -> list:
+        """記録したカメラ画像から、時刻の範囲を等間隔に間引いたフレームを取得
+        
+        配送の失敗時などにロボットが何を見ていたかを振り返るために使う。
+        
+        Args:
+            camera: カメラ（front, back）
+            start: 開始時刻（UNIX時刻または ISO 8601 形式）
+            end: 終了時刻（UNIX時刻または ISO 8601 形式）
+            max_frames: 取得する最大のフレーム数
+            
+        Returns:
+            フレームの時刻の一覧（JSON）と画像
+        """
+        logger.info(f"Getting {camera} camera timelapse: {start} - {end}")
+        from kachaka_mcp.server import get_context
+        from kachaka_mcp.camera import format_time
+        from kachaka_mcp.recorder import parse_time
+        
+        try:
+            recorder = get_context().camera_recorder
+            refs = await recorder.frames(camera, parse_time(start), parse_time(end))
+            if max_frames > 0 and len(refs) > max_frames:
+                step = (len(refs) - 1) / max(max_frames - 1, 1)
+                refs = [refs[round(i * step)] for i in range(max_frames)]
+            
+            images, times = [], []
+            for ref in refs:
+                data = await recorder.read(camera, ref)
+                if data is not None:
+                    images.append(Image(data=data, format="jpeg"))
+                    times.append(format_time(ref.time))
+            summary = {"camera": camera, "frames": times, "recorded_in_range": len(refs)}
+            return [json.dumps(summary, ensure_ascii=False), *images]
+        except Exception as e:
+            logger.error(f"Error getting camera timelapse: {e}")
+            return [f"Error: {str(e)}"]
+
+def register_admin_tools(mcp: FastMCP) -> None:
+    """管理者用のツールの登録（admin_tools_enabled の場合のみ）
+    
+    Args:
+        mcp: MCPサーバーインスタンス
+    """
+    @mcp.tool()
+    async def admin_start_profile(mode: str = "sampling", duration_sec: float = 10.0, interval_ms: float = 5.0) -> str:
+        """サーバーのプロファイルを開始（duration_sec 後に自動的に停止する）
+        
+        Args:
+            mode: sampling（スタックを一定間隔で記録、オーバーヘッドが小さい）または cprofile（すべての呼び出しを計測）
+            duration_sec: 計測時間（秒、profile_max_sec まで）
+            interval_ms: sampling の間隔（ミリ秒）
+            
+        Returns:
+            結果メッセージ
+        """
+        logger.info(f"Starting {mode} profile: duration_sec={duration_sec}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            duration_sec = get_context().profiler.start(mode, duration_sec, interval_ms)
+            return f"Started {mode} profile for {duration_sec:.1f}s; call admin_stop_profile for the result"
+        except Exception as e:
+            logger.error(f"Error starting profile: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def admin_stop_profile(top: int = 25) -> str:
+        """プロファイルを停止して結果を取得（停止済みの場合は最後の結果）
+        
+        Args:
+            top: 要約に含める関数の数
+            
+        Returns:
+            上位の関数の要約と、保存したファイルのリソースURI
+        """
+        logger.info("Stopping profile")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            result = get_context().profiler.stop(top)
+            return (
+                f"{result['mode']} profile, {result['duration_sec']}s, saved as admin://profiles/{result['file']}\n\n"
+                f"{result['summary']}"
+            )
+        except Exception as e:
+            logger.error(f"Error stopping profile: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def admin_memory_snapshot(top: int = 20, group_by: str = "lineno", frames: int = 1) -> str:
+        """メモリを割り当てている上位の場所と前回のスナップショットからの増加を取得
+        
+        最初の呼び出しでは tracemalloc を開始する（トレース中はメモリと速度のオーバーヘッドがある）。
+        
+        Args:
+            top: 表示する場所の数
+            group_by: lineno（行）、filename（ファイル）、traceback（呼び出し元を含む）
+            frames: 開始時に記録する呼び出し元のフレーム数
+            
+        Returns:
+            割り当ての上位の一覧
+        """
+        logger.info(f"Taking memory snapshot: group_by={group_by}")
+        from kachaka_mcp.server import get_context
+        
+        try:
+            return get_context().profiler.memory_snapshot(top, group_by, frames)
+        except Exception as e:
+            logger.error(f"Error taking memory snapshot: {e}")
+            return f"Error: {str(e)}"
+    
+    @mcp.tool()
+    async def admin_stop_memory_tracing() -> str:
+        """tracemalloc を停止
+        
+        Returns:
+            結果メッセージ
+        """
+        logger.info("Stopping memory tracing")
+        from kachaka_mcp.server import get_context
+        
+        return get_context().profiler.stop_memory_tracing()
+    
+    @mcp.tool()
+    async def admin_dump_tasks(stack_limit: int = 8) -> str:
+        """実行中の asyncio タスクと待っている場所のスタックを取得
+        
+        Args:
+            stack_limit: タスクごとに表示するフレームの数
+            
+        Returns:
+            タスクの一覧
+        """
+        logger.info("Dumping asyncio tasks")
+        from kachaka_mcp.profiling import dump_tasks
+        
+        return dump_tasks(stack_limit)
\ No newline at end of file
@@ -0,0 +1,536 @@
+"""
+Tracing spans for Kachaka MCP Server.
+
+This module records lightweight spans around tool calls, resource reads,
+robot gRPC calls and command completion waits, so that the time of a slow
+call can be split between MCP dispatch, the handler, requests to the robot
+and waiting for the robot. Spans are written to size-rotated files in the
+Chrome trace event format (chrome://tracing, Perfetto) and can also be
+exported to a local OpenTelemetry collector over OTLP/HTTP (JSON).
+
+Sampling is decided once per trace at its root span and inherited by all
+child spans, so an unsampled call costs one random draw and a context
+variable lookup.
+"""
+
+import contextvars
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import grpc
+from loguru import logger
+
+from .replay import SERVICE
+
+
+# スパンの種類（Chrome のトレースの cat、OTLP の span kind の決定に使う）
+ROOT_CATEGORIES = ("tool", "resource")
+CLIENT_CATEGORIES = ("grpc",)
+
+# OTLP の span kind（INTERNAL, SERVER, CLIENT）
+OTLP_KIND_INTERNAL = 1
+OTLP_KIND_SERVER = 2
+OTLP_KIND_CLIENT = 3
+
+# 記録中のファイルをディスクに書き出す間隔（秒）
+FLUSH_INTERVAL_SEC = 1.0
+
+
+class Unsampled:
+    """記録しないトレースの目印（子のスパンも記録しない）"""
+    __slots__ = ("finished",)
+
+    def __init__(self):
+        self.finished = False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+# トレースの外（トレースを無効にした場合など）で返すスパン
+NULL_SPAN = Unsampled()
+
+
+class Span:
+    """記録中のスパン"""
+    __slots__ = (
+        "tracer", "name", "category", "trace_id", "span_id", "parent_id", "thread",
+        "start_ns", "end_ns", "args", "error", "finished",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, parent: Optional["Span"], start_ns: int, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.trace_id = parent.trace_id if parent is not None else random.getrandbits(128) or 1
+        self.span_id = random.getrandbits(64) or 1
+        self.parent_id = parent.span_id if parent is not None else 0
+        # Chrome のトレースではトレースごとに1つの行（tid）に並べる
+        self.thread = parent.thread if parent is not None else next(tracer.threads)
+        self.start_ns = start_ns
+        self.end_ns = start_ns
+        self.args = args
+        self.error = ""
+        self.finished = False
+
+    def set(self, **args: Any) -> None:
+        """スパンの属性を追加する"""
+        self.args.update(args)
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end_ns - self.start_ns
+
+
+# 実行中のスパン（タスクごと）
+_current_span: contextvars.ContextVar[Any] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Any:
+    """実行中のスパン（終了したトレースの中の場合は None）"""
+    parent = _current_span.get()
+    if parent is None or parent.finished:
+        return None
+    return parent
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[Any]:
+    """実行中のトレースの子のスパン（トレースの外では記録しない）
+
+    トレーサーを持たない部分（コマンドの完了の待機など）で使う。
+    """
+    parent = current_span()
+    if not isinstance(parent, Span):
+        yield NULL_SPAN
+        return
+    with parent.tracer.span(name, category, **args) as child:
+        yield child
+
+
+class ChromeTraceWriter:
+    """Chrome のトレースイベント形式のファイルにスパンを追記する
+
+    ファイルは file_bytes ごとに切り替え、新しい files 個だけを残す。閉じたファイルは
+    JSON の配列として完結し、書き込み中のファイルも chrome://tracing や Perfetto で開ける。
+    """
+
+    def __init__(self, root, file_bytes: int = 16 * 1024 * 1024, files: int = 8):
+        """初期化（ファイルは最初の記録のときに開く）
+
+        Args:
+            root: 保存先のディレクトリ
+            file_bytes: 1つのファイルの最大のバイト数
+            files: 保持するファイルの数
+        """
+        self.root = Path(root).expanduser()
+        self.file_bytes = file_bytes
+        self.files = max(1, files)
+        self.written = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+        self._size = 0
+        self._events = 0
+        self._flushed_at = 0.0
+
+    def list_files(self) -> List[Path]:
+        """ディスク上のトレースのファイル（古い順）"""
+        if not self.root.exists():
+            return []
+        return sorted(path for path in self.root.glob("trace-*.json") if path.stem[6:].isdigit())
+
+    def _rotate(self) -> None:
+        """新しいファイルに切り替え、古いファイルを削除する"""
+        self._close_file()
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self._sequence == 0:
+            existing = self.list_files()
+            self._sequence = int(existing[-1].stem[6:]) if existing else 0
+        self._sequence += 1
+        path = self.root / f"trace-{self._sequence:08d}.json"
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[\n")
+        self._size = 2
+        self._events = 0
+        for old in self.list_files()[:-self.files]:
+            old.unlink(missing_ok=True)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+
+    def write(self, events: List[Dict[str, Any]]) -> None:
+        """イベントを追記する"""
+        with self._lock:
+            for event in events:
+                if self._file is None or self._size >= self.file_bytes:
+                    self._rotate()
+                text = json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str)
+                if self._events:
+                    text = ",\n" + text
+                self._file.write(text)
+                self._size += len(text)
+                self._events += 1
+                self.written += 1
+            now = time.monotonic()
+            if now - self._flushed_at >= FLUSH_INTERVAL_SEC:
+                self._file.flush()
+                self._flushed_at = now
+
+    def flush(self) -> None:
+        """バッファをファイルに書き出す"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        """ファイルを閉じる（次の記録で新しいファイルを開く）"""
+        with self._lock:
+            self._close_file()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """OTLP の属性の値"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """OpenTelemetry のコレクターに OTLP/HTTP（JSON）でスパンを送る
+
+    送信は別のスレッドでまとめて行い、キューがいっぱいの場合やコレクターに
+    接続できない場合はスパンを捨てる（ツールの呼び出しを待たせない）。
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        service_name: str = "kachaka-mcp",
+        batch_size: int = 512,
+        max_queue: int = 8192,
+        interval_sec: float = 1.0,
+        timeout_sec: float = 5.0,
+    ):
+        """初期化
+
+        Args:
+            endpoint: コレクターのURL（例: http://127.0.0.1:4318/v1/traces）
+            service_name: リソースの service.name
+            batch_size: 1回に送る最大のスパン数
+            max_queue: 送信を待つ最大のスパン数
+            interval_sec: 送信する間隔（秒）
+            timeout_sec: 1回の送信のタイムアウト（秒）
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval_sec = interval_sec
+        self.timeout_sec = timeout_sec
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(max_queue)
+        self._failing = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        """スパンを送信のキューに入れる"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="kachaka-mcp-otlp", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Span] = []
+            stop = False
+            deadline = time.monotonic() + self.interval_sec
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                self._send(batch)
+            if stop:
+                return
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        """OTLP の ExportTraceServiceRequest（JSON）"""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}},
+                    {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "kachaka_mcp"},
+                    "spans": [self._to_otlp(span) for span in spans],
+                }],
+            }],
+        }
+
+    @staticmethod
+    def _to_otlp(span: Span) -> Dict[str, Any]:
+        offset = span.tracer.wall_offset_ns
+        if span.category in CLIENT_CATEGORIES:
+            kind = OTLP_KIND_CLIENT
+        elif span.category in ROOT_CATEGORIES:
+            kind = OTLP_KIND_SERVER
+        else:
+            kind = OTLP_KIND_INTERNAL
+        item = {
+            "traceId": f"{span.trace_id:032x}",
+            "spanId": f"{span.span_id:016x}",
+            "name": span.name,
+            "kind": kind,
+            "startTimeUnixNano": str(span.start_ns + offset),
+            "endTimeUnixNano": str(span.end_ns + offset),
+            "attributes": [
+                {"key": "kachaka.category", "value": {"stringValue": span.category}},
+                *({"key": key, "value": _otlp_value(value)} for key, value in span.args.items()),
+            ],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            item["parentSpanId"] = f"{span.parent_id:016x}"
+        return item
+
+    def _send(self, spans: List[Span]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(self.payload(spans), default=str).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_sec) as response:
+                response.read()
+        except Exception as e:
+            self.dropped += len(spans)
+            # コレクターが止まっている間は最初の失敗だけを記録する
+            if not self._failing:
+                logger.warning(f"Could not export {len(spans)} span(s) to {self.endpoint}: {e}")
+                self._failing = True
+            return
+        if self._failing:
+            logger.info(f"Exporting spans to {self.endpoint} again")
+            self._failing = False
+        self.exported += len(spans)
+
+    def close(self, timeout_sec: float = 5.0) -> None:
+        """キューに残ったスパンを送り、送信のスレッドを停止する"""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout_sec)
+        except queue.Full:
+            pass
+        thread.join(timeout_sec)
+        self._thread = None
+
+
+class Tracer:
+    """スパンの記録（サンプリングしたトレースだけをファイルとコレクターに書き出す）"""
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        writer: Optional[ChromeTraceWriter] = None,
+        exporter: Optional[OTLPExporter] = None,
+    ):
+        """初期化
+
+        Args:
+            sample_rate: 記録するトレースの割合（0〜1）
+            writer: Chrome のトレースのファイル
+            exporter: OTLP のコレクター
+        """
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.writer = writer
+        self.exporter = exporter
+        self.enabled = self.sample_rate > 0 and (writer is not None or exporter is not None)
+        self.recorded = 0
+        self.threads = itertools.count(1)
+        self.pid = os.getpid()
+        # time.perf_counter_ns() の値を UNIX時刻（ナノ秒）に変換するためのオフセット
+        self.wall_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+    @classmethod
+    def from_config(cls, config) -> "Tracer":
+        """設定から作成する"""
+        writer = None
+        exporter = None
+        if config.trace_sample_rate > 0:
+            if config.trace_dir:
+                writer = ChromeTraceWriter(config.trace_dir, config.trace_file_bytes, config.trace_files)
+            if config.trace_otlp_endpoint:
+                exporter = OTLPExporter(config.trace_otlp_endpoint, config.server_name)
+        return cls(config.trace_sample_rate, writer, exporter)
+
+    @contextmanager
+    def span(self, name: str, category: str, started_ns: Optional[int] = None, **args: Any) -> Iterator[Any]:
+        """スパンを記録する
+
+        実行中のトレースがなければ新しいトレースを始め、sample_rate の割合で記録する。
+        記録しないトレースの子のスパンも記録しない。
+
+        Args:
+            name: スパンの名前
+            category: スパンの種類（tool, resource, dispatch, handler, grpc, wait など）
+            started_ns: 開始した time.perf_counter_ns() の値（省略した場合は現在）
+            args: スパンの属性
+        """
+        parent = current_span()
+        if parent is None:
+            if not self.enabled:
+                yield NULL_SPAN
+                return
+            if random.random() >= self.sample_rate:
+                parent = Unsampled()
+                token = _current_span.set(parent)
+                try:
+                    yield parent
+                finally:
+                    parent.finished = True
+                    _current_span.reset(token)
+                return
+        elif isinstance(parent, Unsampled):
+            yield parent
+            return
+        started_ns = time.perf_counter_ns() if started_ns is None else started_ns
+        current = Span(self, name, category, parent, started_ns, args)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            current.end_ns = time.perf_counter_ns()
+            current.finished = True
+            self._finish(current)
+
+    def record(self, name: str, category: str, started_ns: int, **args: Any) -> None:
+        """実行中のスパンの子として、started_ns から現在までのスパンを記録する"""
+        parent = current_span()
+        if not isinstance(parent, Span):
+            return
+        child = Span(self, name, category, parent, started_ns, args)
+        child.end_ns = time.perf_counter_ns()
+        child.finished = True
+        self._finish(child)
+
+    def _finish(self, span: Span) -> None:
+        self.recorded += 1
+        if self.writer is not None:
+            try:
+                self.writer.write(self.chrome_events(span))
+            except Exception as e:
+                logger.warning(f"Could not write trace: {e}")
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def chrome_events(self, span: Span) -> List[Dict[str, Any]]:
+        """Chrome のトレースイベント（完了イベントと、ルートのスパンの場合はトレースの行の名前）"""
+        events: List[Dict[str, Any]] = []
+        if not span.parent_id:
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid, "tid": span.thread,
+                "args": {"name": f"{span.name} #{span.thread}"},
+            })
+        args = dict(span.args)
+        args["trace_id"] = f"{span.trace_id:032x}"
+        if span.error:
+            args["error"] = span.error
+        events.append({
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": round((span.start_ns + self.wall_offset_ns) / 1000, 3),
+            "dur": round(span.duration_ns / 1000, 3),
+            "pid": self.pid,
+            "tid": span.thread,
+            "args": args,
+        })
+        return events
+
+    def instrument(self, client) -> None:
+        """クライアントの gRPC の呼び出しのスパンを記録する（クライアントのスタブを置き換える）"""
+        if self.enabled and not isinstance(client.stub, TracingStub):
+            client.stub = TracingStub(client.stub, self)
+
+    def stats(self) -> Dict[str, Any]:
+        """記録したスパンの数"""
+        return {
+            "sample_rate": self.sample_rate,
+            "spans": self.recorded,
+            "exported": self.exporter.exported if self.exporter is not None else 0,
+            "dropped": self.exporter.dropped if self.exporter is not None else 0,
+        }
+
+    def flush(self) -> None:
+        """ファイルのバッファを書き出す"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self) -> None:
+        """ファイルを閉じ、コレクターへの送信を終える"""
+        if self.writer is not None:
+            self.writer.close()
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class TracingStub:
+    """呼び出しのスパンを記録する gRPC スタブのラッパー（ストリームの呼び出しはそのまま）"""
+
+    def __init__(self, stub, tracer: Tracer):
+        self._stub = stub
+        self._tracer = tracer
+
+    def __getattr__(self, method: str):
+        target = getattr(self._stub, method)
+        descriptor = SERVICE.methods_by_name.get(method)
+        if descriptor is None or descriptor.server_streaming or descriptor.client_streaming:
+            # ストリームの呼び出しは待たずにイテレーターを返すため記録しない
+            return target
+        tracer = self._tracer
+
+        async def call(request, *args, **kwargs):
+            with tracer.span(f"grpc/{method}", "grpc", method=method) as current:
+                try:
+                    return await target(request, *args, **kwargs)
+                except grpc.aio.AioRpcError as e:
+                    current.set(status=e.code().name)
+                    raise
+
+        return call
@@ -0,0 +1,261 @@
+"""
+Network transports for Kachaka MCP Server.
+
+This module runs the server over SSE so that many MCP
+sessions can share one robot client context.
+"""
+
+import asyncio
+import json
+from typing import Optional
+
+from loguru import logger
+from mcp.server.fastmcp import FastMCP
+
+from .auth import current_api_key
+from .utils.config import KachakaMCPConfig
+
+
+# Streamable HTTP は mcp>=1.8 が必要なため、mcp 1.7.1 に固定している間は SSE だけを提供する
+NETWORK_TRANSPORTS = ("sse",)
+
+
+class SessionLimitMiddleware:
+    """同時セッション数を制限するASGIミドルウェア
+
+    SSE では、セッションごとに GET のストリームが
+    1本張られるため、そのストリームの数をセッション数として数える。
+    上限を超えた接続には 503 と Retry-After を返す。
+    """
+
+    def __init__(self, app, session_path: str, max_sessions: int, retry_after: int = 5):
+        """初期化
+
+        Args:
+            app: ラップするASGIアプリケーション
+            session_path: セッションのストリームを張るパス
+            max_sessions: 同時セッション数の上限（0の場合は無制限）
+            retry_after: 拒否時に返す再試行までの秒数
+        """
+        self.app = app
+        self.session_path = session_path.rstrip("/") or "/"
+        self.max_sessions = max_sessions
+        self.retry_after = retry_after
+        self.active_sessions = 0
+
+    def _is_session_stream(self, scope) -> bool:
+        """セッションのストリームを張るリクエストかどうか"""
+        if scope["type"] != "http" or scope.get("method") != "GET":
+            return False
+        path = scope.get("path", "").rstrip("/") or "/"
+        return path == self.session_path
+
+    async def __call__(self, scope, receive, send):
+        if not self._is_session_stream(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_sessions and self.active_sessions >= self.max_sessions:
+            logger.warning(f"Rejecting session: {self.active_sessions} sessions already active")
+            await self._reject(send)
+            return
+
+        self.active_sessions += 1
+        logger.debug(f"Session opened, active sessions: {self.active_sessions}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active_sessions -= 1
+            logger.debug(f"Session closed, active sessions: {self.active_sessions}")
+
+    async def _reject(self, send) -> None:
+        """セッション数超過のレスポンスを返す"""
+        await _send_json(
+            send,
+            503,
+            {"error": "Too many sessions", "max_sessions": self.max_sessions},
+            headers=[(b"retry-after", str(self.retry_after).encode())],
+        )
+
+
+class APIKeyMiddleware:
+    """APIキーを検証し、リクエストのコンテキストに設定するASGIミドルウェア
+
+    キーは Authorization: Bearer ヘッダー、X-API-Key ヘッダー、
+    または api_key クエリパラメータから取得する。
+    SSEではセッションの処理がGETリクエストのコンテキストで実行されるため、
+    セッション内のツール呼び出しにもキーが引き継がれる。
+    """
+
+    def __init__(self, app, auth_provider=None):
+        """初期化
+
+        Args:
+            app: ラップするASGIアプリケーション
+            auth_provider: 認証プロバイダー（Noneの場合は検証しない）
+        """
+        self.app = app
+        self.auth_provider = auth_provider
+
+    @staticmethod
+    def _extract_key(scope) -> Optional[str]:
+        """リクエストからAPIキーを取り出す"""
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization", b"").decode()
+        if authorization.lower().startswith("bearer "):
+            return authorization[7:].strip()
+        if b"x-api-key" in headers:
+            return headers[b"x-api-key"].decode().strip()
+
+        from urllib.parse import parse_qs
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if query.get("api_key"):
+            return query["api_key"][0]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        api_key = self._extract_key(scope)
+        if self.auth_provider is not None:
+            valid = await self.auth_provider.validate_client_credentials("", api_key or "")
+            if not valid:
+                await _send_json(send, 401, {"error": "Invalid API key"})
+                return
+
+        token = current_api_key.set(api_key)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_api_key.reset(token)
+
+
+async def _send_json(send, status: int, content: dict, headers: Optional[list] = None) -> None:
+    """JSONレスポンスを送信"""
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_network_app(mcp: FastMCP, transport: str, max_sessions: int = 0):
+    """ネットワークトランスポート用のASGIアプリケーションを作成
+
+    Args:
+        mcp: MCPサーバーインスタンス
+        transport: トランスポート（sse）
+        max_sessions: 同時セッション数の上限（0の場合は無制限）
+
+    Returns:
+        ASGIアプリケーション
+    """
+    if transport == "sse":
+        app = mcp.sse_app()
+        session_path = mcp.settings.sse_path
+    else:
+        raise ValueError(f"Unknown network transport: {transport}")
+
+    app = SessionLimitMiddleware(app, session_path, max_sessions)
+    return APIKeyMiddleware(app, getattr(mcp, "auth_provider", None))
+
+
+def create_draining_server(uvicorn_config):
+    """終了のシグナルで実行中のコマンドを待ってから停止する uvicorn サーバー
+
+    1回目のシグナルではロボットを動かすツールの受け付けを止めて終了処理を行い、
+    終わってから HTTP サーバーを停止する。終了処理中に2回目のシグナルを
+    受けた場合は待たずに停止する。
+    """
+    import uvicorn
+
+    from .server import get_context
+
+    class DrainingServer(uvicorn.Server):
+        def __init__(self, config):
+            super().__init__(config)
+            self._loop: Optional[asyncio.AbstractEventLoop] = None
+            self._draining = False
+            self._drain: Optional[asyncio.Task] = None
+
+        async def startup(self, sockets=None) -> None:
+            self._loop = asyncio.get_running_loop()
+            await super().startup(sockets)
+            # 前のサーバーが終了時に引き継いだコマンドの完了を追跡する
+            get_context().lifecycle.resume()
+
+        def handle_exit(self, sig, frame) -> None:
+            if self._loop is None or self._draining or self.should_exit:
+                super().handle_exit(sig, frame)
+                return
+            logger.info("Received shutdown signal; draining (send again to stop immediately)")
+            self._draining = True
+            self._loop.call_soon_threadsafe(self._start_drain, sig, frame)
+
+        def _start_drain(self, sig, frame) -> None:
+            self._drain = asyncio.ensure_future(self._drain_and_exit(sig, frame))
+
+        async def _drain_and_exit(self, sig, frame) -> None:
+            try:
+                await get_context().lifecycle.shutdown()
+            except Exception as e:
+                logger.error(f"Error during shutdown: {e}")
+            finally:
+                uvicorn.Server.handle_exit(self, sig, frame)
+
+    return DrainingServer(uvicorn_config)
+
+
+def run_network_server(
+    mcp: FastMCP,
+    config: KachakaMCPConfig,
+    transport: Optional[str] = None,
+) -> None:
+    """ネットワークトランスポートでサーバーを起動
+
+    すべてのセッションは同じ KachakaMCPContext を共有し、
+    サーバーの終了時にのみコンテキストを破棄する。
+
+    Args:
+        mcp: MCPサーバーインスタンス
+        config: サーバー設定
+        transport: トランスポート（Noneの場合は設定値を使用）
+    """
+    import uvicorn
+
+    from .server import _reset_context, get_context, keep_context_alive
+
+    transport = transport or config.transport
+    app = create_network_app(mcp, transport, config.max_sessions)
+
+    # セッション間でコンテキストを共有し、最初のセッションより前に接続を温めておく
+    keep_context_alive(True)
+    get_context()
+
+    logger.info(
+        f"Starting {transport} server on {config.bind_host}:{config.bind_port} "
+        f"(max_sessions={config.max_sessions or 'unlimited'})"
+    )
+    server = create_draining_server(uvicorn.Config(
+        app,
+        host=config.bind_host,
+        port=config.bind_port,
+        limit_concurrency=config.limit_concurrency,
+        timeout_keep_alive=config.timeout_keep_alive,
+        log_level=config.log_level.lower(),
+    ))
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        # uvicorn は停止後に受けたシグナルを送り直す（uvicorn.run と同じく無視する）
+        pass
+    finally:
+        keep_context_alive(False)
+        _reset_context()
@@ -0,0 +1,424 @@
+"""
+Travel estimates for Kachaka MCP Server.
+
+This module turns the occupancy grid into a coarse navigable grid (obstacles
+inflated by the robot radius using a distance transform) and caches one
+geodesic distance field per registered location and shelf, so that path
+lengths and ETAs between places are answered by a single array lookup.
+"""
+
+import asyncio
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .occupancy import FREE, OCCUPIED, OccupancyGrid
+
+
+_SQRT2 = math.sqrt(2.0)
+
+# "x,y" 形式の座標
+_POINT_PATTERN = re.compile(r"^\s*\(?\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)?\s*$")
+
+
+def clearance_transform(blocked: np.ndarray, max_distance: int) -> np.ndarray:
+    """障害物からの距離（セル数）を求める距離変換
+
+    8近傍のチャンファー距離（直交1、斜め√2）を max_distance セルまで伝播する。
+    それより遠いセルは inf になる。
+    """
+    dist = np.where(blocked, 0.0, np.inf)
+    for _ in range(max_distance):
+        padded = np.pad(dist, 1, constant_values=np.inf)
+        h, w = dist.shape
+        nearest = dist.copy()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dx == 0 and dy == 0:
+                    continue
+                step = _SQRT2 if dx and dy else 1.0
+                shifted = padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w] + step
+                np.minimum(nearest, shifted, out=nearest)
+        if np.array_equal(nearest, dist):
+            break
+        dist = nearest
+    return dist
+
+
+def geodesic_field(navigable: np.ndarray, source: Tuple[int, int]) -> np.ndarray:
+    """走行可能なセルだけを通る8近傍の経路長の場（セル数、到達できないセルは inf）
+
+    行を上から下、下から上へ順に処理し、隣の行からの直進・斜めの移動と、
+    行内の左右の移動（障害物で区切られた区間ごとの累積最小）を配列演算で
+    緩和する。変化がなくなるまで繰り返すが、隣の行が変わっていない行は飛ばす。
+    """
+    h, w = navigable.shape
+    dist = np.full((h, w), np.inf)
+    if not navigable[source]:
+        return dist
+    dist[source] = 0.0
+
+    # 区間の番号に経路長の上限より大きい値を掛けて足すことで、累積最小が
+    # 障害物を越えて伝わらないようにする（越えた値は limit 以上になる）
+    blocked = np.where(navigable, 0.0, np.inf)
+    limit = 2.0 * h * w + 1.0
+    index = np.arange(w, dtype=np.float64)
+    forward = np.cumsum(~navigable, axis=1) * limit + index
+    backward = (np.cumsum(~navigable[:, ::-1], axis=1) * limit + index)[:, ::-1]
+
+    # 行が変わるたびに version を進め、隣の行の version が前回と同じなら飛ばす
+    version = np.zeros(h, dtype=np.int64)
+    seen_above = np.zeros(h, dtype=np.int64)
+    seen_below = np.zeros(h, dtype=np.int64)
+    tick = 1
+
+    def relax(r: int, neighbour: Optional[np.ndarray]) -> None:
+        nonlocal tick
+        row = dist[r].copy()
+        if neighbour is not None:
+            np.minimum(row, neighbour + 1.0, out=row)
+            diagonal = neighbour + _SQRT2
+            np.minimum(row[1:], diagonal[:-1], out=row[1:])
+            np.minimum(row[:-1], diagonal[1:], out=row[:-1])
+        row += blocked[r]
+        right = row - forward[r]
+        np.minimum.accumulate(right, out=right)
+        right += forward[r]
+        np.minimum(row, right, out=row)
+        left = (row - backward[r])[::-1]
+        np.minimum.accumulate(left, out=left)
+        left = left[::-1] + backward[r]
+        np.minimum(row, left, out=row)
+        row[row >= limit] = np.inf
+        if (row < dist[r]).any():
+            dist[r] = row
+            tick += 1
+            version[r] = tick
+
+    relax(source[0], None)
+    while True:
+        start = tick
+        for r in range(1, h):
+            if version[r - 1] != seen_above[r]:
+                seen_above[r] = version[r - 1]
+                relax(r, dist[r - 1])
+        for r in range(h - 2, -1, -1):
+            if version[r + 1] != seen_below[r]:
+                seen_below[r] = version[r + 1]
+                relax(r, dist[r + 1])
+        if tick == start:
+            return dist
+
+
+class TravelModel:
+    """占有格子上の経路長と到着時間の推定"""
+
+    def __init__(
+        self,
+        grid: OccupancyGrid,
+        robot_radius: float = 0.2,
+        cell_size: float = 0.1,
+        speed: float = 0.3,
+        snap_distance: float = 1.0,
+        max_cached_fields: int = 64,
+    ):
+        """初期化
+
+        Args:
+            grid: 占有格子地図
+            robot_radius: ロボットの半径（メートル、障害物をこの分だけ膨張させる）
+            cell_size: 経路探索に使うグリッドのセルの大きさ（メートル）
+            speed: 到着時間の推定に使う平均速度（メートル毎秒）
+            snap_distance: 走行できない位置を最寄りの走行可能なセルに寄せる最大距離（メートル）
+            max_cached_fields: 登録済みの場所・棚以外から計算した距離場を保持する数
+        """
+        self.grid = grid
+        self.map_id = grid.map_id
+        self.speed = speed
+        self.snap_distance = snap_distance
+        self.max_cached_fields = max_cached_fields
+
+        # 地図を cell_size のブロックにまとめる（障害物を含むブロックは走行不可）
+        factor = max(1, int(round(cell_size / grid.resolution)))
+        self.factor = factor
+        self.cell_size = grid.resolution * factor
+        h = -(-grid.height // factor)
+        w = -(-grid.width // factor)
+        padded = np.full((h * factor, w * factor), OCCUPIED, dtype=np.int8)
+        padded[:grid.height, :grid.width] = grid.data
+        blocks = padded.reshape(h, factor, w, factor)
+        occupied = (blocks == OCCUPIED).any(axis=(1, 3))
+        free = (blocks == FREE).any(axis=(1, 3)) & ~occupied
+
+        # 障害物（と未観測）から robot_radius 以上離れたセルだけを走行可能とする
+        radius_cells = robot_radius / self.cell_size
+        clearance = clearance_transform(~free, int(math.ceil(radius_cells)) + 1)
+        self.navigable = free & (clearance > radius_cells)
+        self.shape = self.navigable.shape
+
+        # 番兵付きのグリッド（外周を走行不可にし、距離場はこれを平坦化したセル番号で引く）
+        self._w2 = w + 2
+        nav = np.zeros((h + 2, w + 2), dtype=bool)
+        nav[1:-1, 1:-1] = self.navigable
+        self._nav = nav
+
+        self._nav_cells = np.argwhere(self.navigable)
+        self._registered: Dict[int, np.ndarray] = {}
+        self._recent: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        # 距離場はスレッドで計算するため、キャッシュの出し入れだけを排他する
+        self._lock = threading.Lock()
+
+    def _to_cells(self, points: np.ndarray) -> np.ndarray:
+        """マップ座標を粗いグリッドのセル (row, col) に変換"""
+        pixels = self.grid.world_to_pixel(points)
+        return np.floor((pixels[:, ::-1] + 0.5) / self.factor).astype(np.int64)
+
+    def _cell_center(self, cells: np.ndarray) -> np.ndarray:
+        """セルの中心のマップ座標"""
+        pixels = (cells[:, ::-1] + 0.5) * self.factor - 0.5
+        return self.grid.pixel_to_world(pixels)
+
+    def snap(self, points: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """位置を最寄りの走行可能なセルに寄せる
+
+        Returns:
+            平坦化したセル番号（寄せられない場合は -1）と、寄せた距離（メートル）
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = self._to_cells(points)
+        flat = np.full(len(points), -1, dtype=np.int64)
+        offset = np.zeros(len(points))
+        if not len(self._nav_cells):
+            return flat, offset
+
+        rows, cols = cells[:, 0], cells[:, 1]
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        ok = inside.copy()
+        ok[inside] = self.navigable[rows[inside], cols[inside]]
+        flat[ok] = (rows[ok] + 1) * self._w2 + cols[ok] + 1
+
+        for i in np.flatnonzero(~ok):
+            d = np.hypot(*(self._nav_cells - cells[i]).T) * self.cell_size
+            j = int(np.argmin(d))
+            if d[j] <= self.snap_distance:
+                row, col = self._nav_cells[j]
+                flat[i] = (row + 1) * self._w2 + col + 1
+                offset[i] = float(np.hypot(*(self._cell_center(self._nav_cells[j:j + 1])[0] - points[i])))
+        return flat, offset
+
+    def _compute(self, source: int) -> np.ndarray:
+        """セル source からの経路長の場（メートル、到達できないセルは inf）"""
+        dist = geodesic_field(self._nav, divmod(source, self._w2))
+        return (dist.ravel() * self.cell_size).astype(np.float32)
+
+    def _remember(self, source: int, field: np.ndarray) -> None:
+        """登録済みでない距離場を最近使ったものとして保持する（古いものから捨てる）"""
+        self._recent[source] = field
+        self._recent.move_to_end(source)
+        while len(self._recent) > self.max_cached_fields:
+            self._recent.popitem(last=False)
+
+    def field(self, source: int) -> np.ndarray:
+        """セル source からの距離場（キャッシュ付き）
+
+        キャッシュにない場合は計算するため、イベントループからは
+        asyncio.to_thread 経由で呼ぶ。
+        """
+        with self._lock:
+            cached = self._registered.get(source)
+            if cached is not None:
+                return cached
+            cached = self._recent.get(source)
+            if cached is not None:
+                self._recent.move_to_end(source)
+                return cached
+        field = self._compute(source)
+        with self._lock:
+            self._remember(source, field)
+        return field
+
+    def precompute(self, points: Iterable[Sequence[float]]) -> int:
+        """登録済みの場所・棚からの距離場を事前に計算する
+
+        points に含まれなくなった位置（移動した棚の元の位置など）の距離場は
+        登録から外し、件数に上限のある最近使ったもののキャッシュに移す。
+
+        Returns:
+            新たに計算した距離場の数
+        """
+        points = list(points)
+        cells = set(int(c) for c in self.snap(points)[0] if c >= 0) if points else set()
+        registered: Dict[int, np.ndarray] = {}
+        missing = []
+        for cell in cells:
+            with self._lock:
+                field = self._registered.get(cell)
+                if field is None:
+                    field = self._recent.pop(cell, None)
+            if field is None:
+                missing.append(cell)
+            else:
+                registered[cell] = field
+        for cell in missing:
+            registered[cell] = self._compute(cell)
+        with self._lock:
+            for cell, field in self._registered.items():
+                if cell not in registered:
+                    self._remember(cell, field)
+            self._registered = registered
+        return len(missing)
+
+    def has_field(self, cell: int) -> bool:
+        """距離場が計算済みかどうか"""
+        with self._lock:
+            return cell in self._registered or cell in self._recent
+
+    def has_field_for(self, start: Sequence[float], goal: Sequence[float]) -> bool:
+        """2点間の経路長を距離場を計算せずに求められるかどうか（どちらかの点が地図の外の場合も True）"""
+        cells, _ = self.snap([start, goal])
+        if cells[0] < 0 or cells[1] < 0:
+            return True
+        return self.has_field(int(cells[0])) or self.has_field(int(cells[1]))
+
+    def path_length(self, start: Sequence[float], goal: Sequence[float]) -> Optional[float]:
+        """2点間の経路長（メートル、到達できない場合は None）"""
+        cells, offsets = self.snap([start, goal])
+        if cells[0] < 0 or cells[1] < 0:
+            return None
+        # 計算済みの距離場がある側を始点にする（経路長は対称）
+        source, target = int(cells[0]), int(cells[1])
+        if not self.has_field(source) and self.has_field(target):
+            source, target = target, source
+        length = float(self.field(source)[target])
+        if math.isinf(length):
+            return None
+        return length + float(offsets.sum())
+
+    def estimate(self, start: Sequence[float], goal: Sequence[float]) -> Dict[str, Any]:
+        """2点間の経路長と到着時間の推定"""
+        straight = float(math.hypot(goal[0] - start[0], goal[1] - start[1]))
+        length = self.path_length(start, goal)
+        return {
+            "reachable": length is not None,
+            "path_length_m": None if length is None else round(length, 2),
+            "eta_sec": None if length is None else round(length / self.speed, 1),
+            "straight_line_m": round(straight, 2),
+        }
+
+    def distance_matrix(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """経路長の行列（到達できない組は直線距離で代用する）
+
+        planner.plan_order の distance として使える。
+        """
+        a = np.asarray(a, dtype=np.float64).reshape(-1, 2)
+        b = np.asarray(b, dtype=np.float64).reshape(-1, 2)
+        result = np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+        cells_a, offsets_a = self.snap(a)
+        cells_b, offsets_b = self.snap(b)
+        valid_b = cells_b >= 0
+        for i, cell in enumerate(cells_a):
+            if cell < 0:
+                continue
+            lengths = self.field(int(cell))[cells_b[valid_b]] + offsets_a[i] + offsets_b[valid_b]
+            row = result[i, valid_b]
+            reachable = np.isfinite(lengths)
+            row[reachable] = lengths[reachable]
+            result[i, valid_b] = row
+        return result
+
+
+async def get_occupancy_grid(context) -> OccupancyGrid:
+    """現在のマップの占有格子を取得（マップIDごとに1回だけ変換する）"""
+    from .geometry import get_png_map
+
+    png_map, map_id = await get_png_map(context)
+
+    async def load() -> OccupancyGrid:
+        return await asyncio.to_thread(
+            OccupancyGrid.from_png_map,
+            png_map,
+            map_id,
+            context.config.map_free_threshold,
+            context.config.map_occupied_threshold,
+        )
+
+    grid, _ = await context.cache.get(("occupancy_grid", map_id), load, math.inf)
+    return grid
+
+
+async def get_travel_model(context) -> TravelModel:
+    """現在のマップの経路長推定モデルを取得
+
+    マップが変わった場合はモデルを作り直す。登録済みの場所・棚からの距離場は
+    バックグラウンドのスレッドで事前に計算し、完了を待たずにモデルを返す
+    （計算済みでない距離場は使うときに計算する）。
+    """
+    from .world import get_locations, get_shelves
+
+    grid = await get_occupancy_grid(context)
+    model = context.travel_model
+    if model is None or model.map_id != grid.map_id:
+        config = context.config
+        model = await asyncio.to_thread(
+            TravelModel,
+            grid,
+            config.robot_radius,
+            config.travel_cell_size,
+            config.travel_speed,
+        )
+        context.travel_model = model
+        context.travel_model_source = None
+
+    # マップか場所・棚の位置が変わったときだけ距離場を計算し直す
+    locations, _ = await get_locations(context)
+    shelves, _ = await get_shelves(context)
+    points = [(item.pose.x, item.pose.y) for item in [*locations, *shelves]]
+    source = (model.map_id, tuple((round(x, 3), round(y, 3)) for x, y in points))
+    if context.travel_model_source != source:
+        context.travel_model_source = source
+        context.lifecycle.spawn(_precompute(model, points), "travel-precompute")
+    return model
+
+
+async def _precompute(model: TravelModel, points: Sequence[Tuple[float, float]]) -> None:
+    """登録済みの場所・棚からの距離場をスレッドで計算する"""
+    try:
+        await asyncio.to_thread(model.precompute, points)
+    except Exception as e:
+        logger.warning(f"Could not precompute travel fields: {e}")
+
+
+async def resolve_place(context, query: str) -> Tuple[str, Tuple[float, float]]:
+    """場所・棚の名前、ID、"x,y" 形式の座標、空文字列（ロボットの現在位置）を位置に変換
+
+    Returns:
+        表示用の名前と位置
+
+    Raises:
+        ValueError: 名前が解決できない場合
+    """
+    from .resolver import get_name_index
+    from .world import get_locations, get_shelves
+
+    if not query.strip():
+        pose = await context.kachaka_client.get_robot_pose()
+        return "robot", (pose.x, pose.y)
+    match = _POINT_PATTERN.match(query)
+    if match:
+        return query.strip(), (float(match.group(1)), float(match.group(2)))
+
+    index = await get_name_index(context)
+    resolution = index.resolve(query)
+    if not resolution.found:
+        raise ValueError(resolution.not_found_message("place"))
+    locations, _ = await get_locations(context)
+    shelves, _ = await get_shelves(context)
+    for item in [*locations, *shelves]:
+        if item.id == resolution.entry.id:
+            return item.name, (item.pose.x, item.pose.y)
+    raise ValueError(f"Place '{query}' not found")
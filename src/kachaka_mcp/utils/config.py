@@ -5,11 +5,27 @@ Configuration management for Kachaka MCP Server.
 import os
 import json
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
 
+class RateLimitConfig(BaseModel):
+    """レート制限の設定（APIキーごと・リソース/ツールのクラスごと）"""
+    rate_per_sec: float = Field(
+        default=0.0,
+        description="1秒あたりに補充されるトークン数（0の場合はレート制限なし）"
+    )
+    burst: int = Field(
+        default=1,
+        description="バケットの容量（連続して許可するリクエスト数）"
+    )
+    max_in_flight: int = Field(
+        default=0,
+        description="同時に実行できるリクエスト数（0の場合は無制限）"
+    )
+
+
 class KachakaMCPConfig(BaseModel):
     """Kachaka MCP サーバーの設定"""
     kachaka_host: str = Field(
@@ -32,6 +48,361 @@ class KachakaMCPConfig(BaseModel):
         default_factory=list,
         description="APIキーのリスト"
     )
+    admin_api_keys: List[str] = Field(
+        default_factory=list,
+        description="管理者用のツール・リソース（admin_*, admin://）を使える APIキーのリスト"
+    )
+    admin_tools_enabled: bool = Field(
+        default=False,
+        description="プロファイルなど管理者用のツール・リソースを登録するかどうか"
+    )
+    profile_dir: str = Field(
+        default="~/.kachaka-mcp/profiles",
+        description="プロファイルの結果を保存するディレクトリ"
+    )
+    profile_max_sec: float = Field(
+        default=60.0,
+        description="1回のプロファイルの最大の計測時間（秒）"
+    )
+    profile_keep: int = Field(
+        default=10,
+        description="保持するプロファイルのファイルの数（古いものから削除する）"
+    )
+    transport: str = Field(
+        default="stdio",
+        description="トランスポート（stdio, sse）"
+    )
+    bind_host: str = Field(
+        default="127.0.0.1",
+        description="ネットワークトランスポートで待ち受けるアドレス"
+    )
+    bind_port: int = Field(
+        default=8000,
+        description="ネットワークトランスポートで待ち受けるポート"
+    )
+    max_sessions: int = Field(
+        default=32,
+        description="同時に接続できるMCPセッションの最大数（0の場合は無制限）"
+    )
+    limit_concurrency: Optional[int] = Field(
+        default=None,
+        description="HTTPワーカーが同時に処理する接続数の上限（Noneの場合は無制限）"
+    )
+    timeout_keep_alive: int = Field(
+        default=5,
+        description="HTTPキープアライブのタイムアウト（秒）"
+    )
+    rate_limits: Dict[str, RateLimitConfig] = Field(
+        default_factory=dict,
+        description="クラス（motion, camera, defaultなど）ごとのレート制限"
+    )
+    rate_limit_classes: Dict[str, str] = Field(
+        default_factory=dict,
+        description="ツール名・リソースURIのパターンからクラスへの対応（デフォルトの対応を上書き）"
+    )
+    cache_ttl_sec: float = Field(
+        default=30.0,
+        description="場所・棚などのキャッシュの有効期限（秒）"
+    )
+    laser_summary_sectors: int = Field(
+        default=8,
+        description="レーザースキャンの要約のセクター数"
+    )
+    laser_free_distance: float = Field(
+        default=1.0,
+        description="レーザースキャンの要約で空いているとみなす距離（メートル）"
+    )
+    spatial_cell_size: float = Field(
+        default=1.0,
+        description="場所・棚の空間インデックスのセルの大きさ（メートル）"
+    )
+    name_aliases: Dict[str, str] = Field(
+        default_factory=dict,
+        description="場所・棚の別名から名前またはIDへの対応"
+    )
+    name_match_threshold: float = Field(
+        default=0.6,
+        description="場所・棚の名前のあいまい一致として採用する最低スコア（0〜1）"
+    )
+    map_free_threshold: int = Field(
+        default=230,
+        description="マップ画像でこの輝度以上のピクセルを走行可能とみなす"
+    )
+    map_occupied_threshold: int = Field(
+        default=100,
+        description="マップ画像でこの輝度未満のピクセルを障害物とみなす"
+    )
+    robot_radius: float = Field(
+        default=0.2,
+        description="経路長の推定で障害物を膨張させる半径（メートル）"
+    )
+    travel_cell_size: float = Field(
+        default=0.1,
+        description="経路長の推定に使うグリッドのセルの大きさ（メートル）"
+    )
+    travel_speed: float = Field(
+        default=0.3,
+        description="到着時間の推定に使う平均速度（メートル毎秒）"
+    )
+    map_store_dir: str = Field(
+        default="~/.kachaka-mcp/maps",
+        description="エクスポートしたマップをハッシュごとに保存するディレクトリ"
+    )
+    map_chunk_size: int = Field(
+        default=1024 * 1024,
+        description="マップのインポートで1回に送るバイト数"
+    )
+    fleet_robots: Dict[str, str] = Field(
+        default_factory=dict,
+        description="フリート操作の対象のロボットの名前からホスト（IPアドレス:ポート）への対応"
+    )
+    fleet_concurrency: int = Field(
+        default=8,
+        description="フリート操作で同時に操作するロボットの数"
+    )
+    fleet_timeout_sec: float = Field(
+        default=30.0,
+        description="フリート操作のロボットごとのタイムアウト（秒）"
+    )
+    dispatch_min_battery: float = Field(
+        default=20.0,
+        description="タスクを割り当てるロボットの電池残量の下限（%）"
+    )
+    dispatch_battery_weight_m: float = Field(
+        default=10.0,
+        description="電池残量が0%の場合にロボットのスコアに加える距離（メートル、残量に比例して小さくする）"
+    )
+    dispatch_snapshot_ttl_sec: float = Field(
+        default=2.0,
+        description="タスクの割り当てに使うロボットの状態を再取得するまでの秒数"
+    )
+    dispatch_poll_interval_sec: float = Field(
+        default=2.0,
+        description="待ち行列のタスクのために空いたロボットを確認する間隔（秒）"
+    )
+    dispatch_history: int = Field(
+        default=100,
+        description="状態を保持する終了したタスクの数（古いものから削除する）"
+    )
+    battery_policy: str = Field(
+        default="warn",
+        description="電池が持たないと予測したタスクの扱い（off, warn, refuse, charge）"
+    )
+    battery_reserve: float = Field(
+        default=15.0,
+        description="タスクを終えて充電器に戻った時点で残しておく電池残量（%）"
+    )
+    battery_drain_per_metre: float = Field(
+        default=0.05,
+        description="1メートルの走行で消費する電池残量の初期値（%、サンプルから学習する）"
+    )
+    battery_drain_per_minute: float = Field(
+        default=0.1,
+        description="1分の稼働で消費する電池残量の初期値（%、サンプルから学習する）"
+    )
+    battery_charge_per_minute: float = Field(
+        default=0.5,
+        description="1分の充電で増える電池残量の初期値（%、サンプルから学習する）"
+    )
+    battery_prior_weight: float = Field(
+        default=20.0,
+        description="消費量の初期値の重み（観測数相当、大きいほど学習が遅い）"
+    )
+    battery_sample_interval_sec: float = Field(
+        default=10.0,
+        description="電池残量と位置をサンプリングする間隔（秒、0の場合はコマンドの前だけ）"
+    )
+    battery_shelf_overhead_sec: float = Field(
+        default=30.0,
+        description="棚1つのドッキングと切り離しにかかる時間の見積もり（秒）"
+    )
+    battery_charge_wait_sec: float = Field(
+        default=0.0,
+        description="battery_policy が charge の場合に充電を待つ最大の秒数（0の場合は充電器に戻るだけ）"
+    )
+    object_memory_enabled: bool = Field(
+        default=False,
+        description="セッションの開始時に物体検出結果の記憶を開始するかどうか（無効の場合は find_objects を初めて呼んだときに開始する）"
+    )
+    object_memory_interval_sec: float = Field(
+        default=1.0,
+        description="物体検出結果を取得する間隔（秒）"
+    )
+    object_memory_merge_radius: float = Field(
+        default=0.5,
+        description="同じ物体の目撃とみなす距離（メートル）"
+    )
+    object_memory_min_score: float = Field(
+        default=0.5,
+        description="記憶する物体検出のスコアの下限"
+    )
+    object_memory_max_range_m: float = Field(
+        default=4.0,
+        description="視野内で検出されなかった物体の信頼度を下げる最大の距離（メートル）"
+    )
+    object_memory_half_life_sec: float = Field(
+        default=3600.0,
+        description="最後に見てから物体の信頼度が半分になるまでの秒数"
+    )
+    object_memory_ignore_labels: List[str] = Field(
+        default_factory=lambda: ["person"],
+        description="記憶しない物体のラベル（動く物体など）"
+    )
+    object_memory_camera_hfov_deg: float = Field(
+        default=90.0,
+        description="カメラ情報が取得できない場合に使う前方カメラの水平画角（度）"
+    )
+    camera_change_threshold: float = Field(
+        default=4.0,
+        description="カメラ画像が変化したとみなす縮小画像の平均絶対差（0〜255、0の場合は常に送る）"
+    )
+    camera_record_enabled: bool = Field(
+        default=False,
+        description="セッションの開始時にカメラ画像のディスクへの記録を開始するかどうか"
+    )
+    camera_record_dir: str = Field(
+        default="~/.kachaka-mcp/recordings",
+        description="カメラ画像を記録するディレクトリ（カメラごとのサブディレクトリ）"
+    )
+    camera_record_cameras: List[str] = Field(
+        default_factory=lambda: ["front", "back"],
+        description="記録するカメラ（front, back）"
+    )
+    camera_record_fps: float = Field(
+        default=1.0,
+        description="カメラ画像を記録する1秒あたりのフレーム数"
+    )
+    camera_record_segments: int = Field(
+        default=8,
+        description="カメラごとのリングバッファのセグメントの数"
+    )
+    camera_record_segment_bytes: int = Field(
+        default=32 * 1024 * 1024,
+        description="リングバッファの1つのセグメントの最大のバイト数（ディスク使用量はカメラごとにセグメント数倍まで）"
+    )
+    object_memory_camera_offset_m: float = Field(
+        default=0.1,
+        description="ロボットの中心から前方カメラまでの距離（メートル）"
+    )
+    local_map_enabled: bool = Field(
+        default=False,
+        description="セッションの開始時にレーザースキャンのローカルマップへの統合を開始するかどうか（無効の場合は check_route などを初めて呼んだときに開始する）"
+    )
+    local_map_interval_sec: float = Field(
+        default=1.0,
+        description="レーザースキャンを取得する間隔（秒）"
+    )
+    local_map_max_range_m: float = Field(
+        default=4.0,
+        description="ローカルマップに統合するビームの最大の距離（メートル）"
+    )
+    local_map_tolerance_m: float = Field(
+        default=0.1,
+        description="静的な障害物からこの距離以内の観測は新しい障害物とみなさない（メートル）"
+    )
+    local_map_min_cells: int = Field(
+        default=3,
+        description="新しい障害物として報告する領域の最小のセル数"
+    )
+    local_map_corridor_margin_m: float = Field(
+        default=1.0,
+        description="障害物が通路をふさいでいるかを調べる範囲の余白（メートル）"
+    )
+    local_map_max_age_sec: float = Field(
+        default=300.0,
+        description="最後に観測してからこの秒数を過ぎた障害物は無視する（0の場合は無視しない）"
+    )
+    local_map_route_check: bool = Field(
+        default=False,
+        description="移動・棚コマンドの前に経路が新しい障害物でふさがれていないかを確認するかどうか"
+    )
+    idempotency_ttl_sec: float = Field(
+        default=600.0,
+        description="冪等キー付きコマンドの結果を保持する秒数"
+    )
+    command_poll_min_sec: float = Field(
+        default=0.2,
+        description="コマンドの完了の予定時刻の前後で結果を確認する間隔（秒）"
+    )
+    command_poll_max_sec: float = Field(
+        default=2.0,
+        description="コマンドの完了の予定時刻まで時間がある場合に結果を確認する間隔（秒）"
+    )
+    command_poll_default_sec: float = Field(
+        default=0.5,
+        description="所要時間が見積もれないコマンドの結果を確認する間隔（秒）"
+    )
+    command_wait_timeout_sec: float = Field(
+        default=600.0,
+        description="所要時間が見積もれないコマンドの完了を待つ最大の秒数（見積もれた場合は見積もりの3倍に30秒を加えた秒数）"
+    )
+    journal_enabled: bool = Field(
+        default=True,
+        description="ツールの呼び出しをジャーナルに記録するかどうか"
+    )
+    journal_dir: str = Field(
+        default="~/.kachaka-mcp/journal",
+        description="ジャーナルを保存するディレクトリ"
+    )
+    journal_segment_bytes: int = Field(
+        default=4 * 1024 * 1024,
+        description="ジャーナルの1つのセグメントの最大のバイト数（ディスク使用量はおよそセグメント数倍まで）"
+    )
+    journal_segments: int = Field(
+        default=8,
+        description="保持するジャーナルのセグメントの数（古いものから削除する）"
+    )
+    trace_sample_rate: float = Field(
+        default=0.0,
+        description="スパンを記録するツール呼び出し・リソース読み込みの割合（0〜1、0の場合は記録しない）"
+    )
+    trace_dir: str = Field(
+        default="~/.kachaka-mcp/traces",
+        description="Chrome のトレースイベント形式のファイルを保存するディレクトリ（空の場合はファイルに書かない）"
+    )
+    trace_file_bytes: int = Field(
+        default=16 * 1024 * 1024,
+        description="トレースの1つのファイルの最大のバイト数"
+    )
+    trace_files: int = Field(
+        default=8,
+        description="保持するトレースのファイルの数（古いものから削除する）"
+    )
+    trace_otlp_endpoint: str = Field(
+        default="",
+        description="スパンを送る OpenTelemetry のコレクターの OTLP/HTTP のURL（例: http://127.0.0.1:4318/v1/traces、空の場合は送らない）"
+    )
+    grpc_record_path: str = Field(
+        default="",
+        description="ロボットとの gRPC の呼び出しを記録するファイル（空の場合は記録しない、.gz の場合は圧縮する）"
+    )
+    grpc_replay_path: str = Field(
+        default="",
+        description="ロボットの代わりに応答を返す gRPC の記録のファイル（空の場合はロボットに接続する）"
+    )
+    grpc_replay_speed: float = Field(
+        default=1.0,
+        description="記録した応答を返す速さ（1.0 で記録と同じレイテンシー、0 の場合は待たない）"
+    )
+    shutdown_drain_sec: float = Field(
+        default=60.0,
+        description="終了時に実行中のコマンドの完了を待つ最大の秒数（0の場合は待たない）"
+    )
+    shutdown_timeout_action: str = Field(
+        default="detach",
+        description="終了時に完了しなかったコマンドの扱い（cancel: ロボットのコマンドをキャンセルする、detach: 次のサーバーに引き継ぐ）"
+    )
+    shutdown_state_path: str = Field(
+        default="~/.kachaka-mcp/shutdown-state.json",
+        description="引き継ぐコマンドとカウンターを書き込む状態ファイル"
+    )
+    shutdown_refused_tools: List[str] = Field(
+        default_factory=lambda: [
+            "move_*", "return_*", "rotate_in_place", "set_robot_velocity", "dock_*", "undock_shelf",
+            "plan_and_run_deliveries", "dispatch_task", "fleet_broadcast", "lock",
+        ],
+        description="終了処理中に受け付けないツール名のパターン（ロボットを動かすもの）"
+    )
 
 
 def load_config() -> KachakaMCPConfig:
@@ -74,6 +445,57 @@ def load_config() -> KachakaMCPConfig:
     if os.environ.get("KACHAKA_MCP_API_KEYS"):
         config.api_keys = os.environ.get("KACHAKA_MCP_API_KEYS").split(",")
     
+    if os.environ.get("KACHAKA_MCP_ADMIN_API_KEYS"):
+        config.admin_api_keys = os.environ.get("KACHAKA_MCP_ADMIN_API_KEYS").split(",")
+    
+    if os.environ.get("KACHAKA_MCP_ADMIN_TOOLS"):
+        config.admin_tools_enabled = os.environ.get("KACHAKA_MCP_ADMIN_TOOLS").lower() in ("true", "1", "yes")
+    
+    if os.environ.get("KACHAKA_MCP_TRANSPORT"):
+        config.transport = os.environ.get("KACHAKA_MCP_TRANSPORT")
+    
+    if os.environ.get("KACHAKA_MCP_BIND_HOST"):
+        config.bind_host = os.environ.get("KACHAKA_MCP_BIND_HOST")
+    
+    if os.environ.get("KACHAKA_MCP_BIND_PORT"):
+        config.bind_port = int(os.environ.get("KACHAKA_MCP_BIND_PORT"))
+    
+    if os.environ.get("KACHAKA_MCP_MAX_SESSIONS"):
+        config.max_sessions = int(os.environ.get("KACHAKA_MCP_MAX_SESSIONS"))
+    
+    if os.environ.get("KACHAKA_MCP_MAP_STORE_DIR"):
+        config.map_store_dir = os.environ.get("KACHAKA_MCP_MAP_STORE_DIR")
+    
+    if os.environ.get("KACHAKA_MCP_BATTERY_POLICY"):
+        config.battery_policy = os.environ.get("KACHAKA_MCP_BATTERY_POLICY")
+
+    if os.environ.get("KACHAKA_MCP_OBJECT_MEMORY"):
+        config.object_memory_enabled = os.environ.get("KACHAKA_MCP_OBJECT_MEMORY").lower() in ("true", "1", "yes")
+
+    if os.environ.get("KACHAKA_MCP_LOCAL_MAP"):
+        config.local_map_enabled = os.environ.get("KACHAKA_MCP_LOCAL_MAP").lower() in ("true", "1", "yes")
+    
+    if os.environ.get("KACHAKA_MCP_GRPC_RECORD"):
+        config.grpc_record_path = os.environ.get("KACHAKA_MCP_GRPC_RECORD")
+    
+    if os.environ.get("KACHAKA_MCP_GRPC_REPLAY"):
+        config.grpc_replay_path = os.environ.get("KACHAKA_MCP_GRPC_REPLAY")
+    
+    if os.environ.get("KACHAKA_MCP_GRPC_REPLAY_SPEED"):
+        config.grpc_replay_speed = float(os.environ.get("KACHAKA_MCP_GRPC_REPLAY_SPEED"))
+    
+    if os.environ.get("KACHAKA_MCP_TRACE_SAMPLE_RATE"):
+        config.trace_sample_rate = float(os.environ.get("KACHAKA_MCP_TRACE_SAMPLE_RATE"))
+    
+    if os.environ.get("KACHAKA_MCP_TRACE_OTLP_ENDPOINT"):
+        config.trace_otlp_endpoint = os.environ.get("KACHAKA_MCP_TRACE_OTLP_ENDPOINT")
+    
+    if os.environ.get("KACHAKA_MCP_FLEET_ROBOTS"):
+        # "name=host:port,name=host:port" の形式
+        config.fleet_robots = dict(
+            item.split("=", 1) for item in os.environ.get("KACHAKA_MCP_FLEET_ROBOTS").split(",") if "=" in item
+        )
+    
     return config
 
 
@@ -0,0 +1,210 @@
+"""
+World model helpers for Kachaka MCP Server.
+
+This module serializes robot data for LLM consumption, serves locations and
+shelves through the shared cache, and builds the world snapshot that gathers
+everything an agent needs in one concurrent call.
+"""
+
+import asyncio
+import io
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+from PIL import Image as PILImage
+
+
+def pose_to_dict(pose) -> Dict[str, float]:
+    """姿勢を辞書に変換"""
+    return {"x": pose.x, "y": pose.y, "yaw": pose.theta}
+
+
+def location_to_dict(location) -> Dict[str, Any]:
+    """場所を辞書に変換"""
+    return {
+        "id": location.id,
+        "name": location.name,
+        "pose": pose_to_dict(location.pose),
+        "type": str(location.type),
+    }
+
+
+def shelf_to_dict(shelf) -> Dict[str, Any]:
+    """棚を辞書に変換"""
+    return {
+        "id": shelf.id,
+        "name": shelf.name,
+        "pose": pose_to_dict(shelf.pose),
+        "home_location_id": shelf.home_location_id,
+    }
+
+
+def detection_to_dict(obj) -> Dict[str, Any]:
+    """物体検出結果を辞書に変換"""
+    return {
+        "label": int(obj.label),
+        "score": round(obj.score, 3),
+        "distance": round(obj.distance_median, 3),
+        "roi": {
+            "x": obj.roi.x_offset,
+            "y": obj.roi.y_offset,
+            "width": obj.roi.width,
+            "height": obj.roi.height,
+        },
+    }
+
+
+async def get_locations(context, ttl_sec: Optional[float] = None) -> Tuple[List[Any], bool]:
+    """場所の一覧をキャッシュ経由で取得
+
+    Returns:
+        場所の一覧と、キャッシュから返したかどうか
+    """
+    return await context.cache.get("locations", context.kachaka_client.get_locations, ttl_sec)
+
+
+async def get_shelves(context, ttl_sec: Optional[float] = None) -> Tuple[List[Any], bool]:
+    """棚の一覧をキャッシュ経由で取得
+
+    Returns:
+        棚の一覧と、キャッシュから返したかどうか
+    """
+    return await context.cache.get("shelves", context.kachaka_client.get_shelves, ttl_sec)
+
+
+def make_thumbnail(data: bytes, size: int) -> bytes:
+    """JPEG画像を縮小する（sizeは長辺のピクセル数、0の場合はそのまま）"""
+    if size <= 0:
+        return data
+    image = PILImage.open(io.BytesIO(data))
+    if max(image.size) <= size:
+        return data
+    image.thumbnail((size, size))
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=75)
+    return output.getvalue()
+
+
+async def _run_part(
+    name: str,
+    fetch: Callable[[], Awaitable[Tuple[Any, bool]]],
+    timeout_sec: float,
+    fallback: Optional[Callable[[], Optional[Tuple[Any, float]]]] = None,
+) -> Dict[str, Any]:
+    """スナップショットの1つの要素を取得する
+
+    失敗した場合、キャッシュに古い値があればそれを返す。
+    """
+    start = time.perf_counter()
+    try:
+        data, cached = await asyncio.wait_for(fetch(), timeout_sec)
+        part = {"ok": True, "cached": cached, "data": data}
+    except Exception as e:
+        error = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+        logger.warning(f"World snapshot part {name} failed: {error}")
+        stale = fallback() if fallback else None
+        if stale is not None:
+            part = {"ok": True, "cached": True, "stale_sec": round(stale[1], 1), "error": error, "data": stale[0]}
+        else:
+            part = {"ok": False, "error": error}
+    part["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return part
+
+
+async def build_world_snapshot(
+    context,
+    timeout_sec: float = 2.0,
+    camera: str = "front",
+    thumbnail_size: int = 320,
+    rate_limiter=None,
+) -> Tuple[Dict[str, Any], Optional[bytes]]:
+    """ロボットの状態・場所・棚・物体検出・カメラ画像を並行して取得
+
+    Args:
+        context: KachakaMCPContext
+        timeout_sec: 要素ごとのタイムアウト（秒）
+        camera: カメラ（front, back、空文字列の場合は取得しない）
+        thumbnail_size: サムネイルの長辺のピクセル数（0の場合は縮小しない）
+        rate_limiter: カメラ画像の取得に camera クラスのレート制限を適用する RateLimiter
+            （上限に達した場合はカメラ画像を failed にする）
+
+    Returns:
+        スナップショットと、カメラ画像（JPEG）
+    """
+    client = context.kachaka_client
+
+    async def fetch_status():
+        pose, battery_info, (command_state, command) = await asyncio.gather(
+            client.get_robot_pose(),
+            client.get_battery_info(),
+            client.get_command_state(),
+        )
+        return {
+            "pose": pose_to_dict(pose),
+            "battery": {"percentage": battery_info[0], "status": str(battery_info[1])},
+            "command_state": str(command_state),
+            "command": command.WhichOneof("command") if command else None,
+        }, False
+
+    async def fetch_locations():
+        locations, cached = await get_locations(context)
+        return [location_to_dict(location) for location in locations], cached
+
+    async def fetch_shelves():
+        shelves, cached = await get_shelves(context)
+        return [shelf_to_dict(shelf) for shelf in shelves], cached
+
+    async def fetch_detection():
+        header, objects = await client.get_object_detection()
+        return [detection_to_dict(obj) for obj in objects], False
+
+    async def fetch_camera():
+        if rate_limiter is not None:
+            # sensors://camera/* のリソースと同じ枠を使う
+            async with rate_limiter.limit(f"sensors://camera/{camera}"):
+                return await fetch_image()
+        return await fetch_image()
+
+    async def fetch_image():
+        if camera == "back":
+            image = await client.get_back_camera_ros_compressed_image()
+        else:
+            image = await client.get_front_camera_ros_compressed_image()
+        # 画像の縮小はイベントループを止めないようにスレッドで行う
+        return await asyncio.to_thread(make_thumbnail, image.data, thumbnail_size), False
+
+    def cached_part(key: str, serialize: Callable[[Any], Dict[str, Any]]):
+        def fallback():
+            stale = context.cache.peek(key)
+            if stale is None:
+                return None
+            return [serialize(item) for item in stale[0]], stale[1]
+        return fallback
+
+    parts = {
+        "status": _run_part("status", fetch_status, timeout_sec),
+        "locations": _run_part("locations", fetch_locations, timeout_sec, cached_part("locations", location_to_dict)),
+        "shelves": _run_part("shelves", fetch_shelves, timeout_sec, cached_part("shelves", shelf_to_dict)),
+        "object_detection": _run_part("object_detection", fetch_detection, timeout_sec),
+    }
+    if camera:
+        parts["camera"] = _run_part("camera", fetch_camera, timeout_sec)
+
+    start = time.perf_counter()
+    results = dict(zip(parts.keys(), await asyncio.gather(*parts.values())))
+
+    image = None
+    camera_part = results.get("camera")
+    if camera_part and camera_part["ok"]:
+        image = camera_part.pop("data")
+        camera_part["data"] = {"camera": camera, "bytes": len(image)}
+
+    snapshot = {
+        "timestamp": time.time(),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        "failed": [name for name, part in results.items() if not part["ok"]],
+        "cached": [name for name, part in results.items() if part.get("cached")],
+        "parts": results,
+    }
+    return snapshot, image
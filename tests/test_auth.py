@@ -0,0 +1,72 @@
+"""
+Tests for authentication and rate limiting.
+"""
+
+import asyncio
+import unittest
+
+from kachaka_mcp.auth import RateLimiter, RateLimitExceeded, current_api_key
+from kachaka_mcp.utils.config import RateLimitConfig
+
+
+class TestRateLimiter(unittest.TestCase):
+    """レート制限のテスト"""
+
+    def test_classify(self):
+        """ツール名・リソースURIがクラスに分類されること"""
+        limiter = RateLimiter({}, {"speak": "audio"})
+        self.assertEqual(limiter.classify("move_shelf"), "motion")
+        self.assertEqual(limiter.classify("plan_and_run_deliveries"), "motion")
+        self.assertEqual(limiter.classify("fleet_broadcast"), "motion")
+        self.assertEqual(limiter.classify("dispatch_task"), "motion")
+        self.assertEqual(limiter.classify("sensors://camera/front"), "camera")
+        self.assertEqual(limiter.classify("speak"), "audio")
+        self.assertEqual(limiter.classify("robot://status"), "default")
+
+        # 設定のパターンはデフォルトのパターンより優先する
+        limiter = RateLimiter({}, {"move_shelf": "shelf"})
+        self.assertEqual(limiter.classify("move_shelf"), "shelf")
+        self.assertEqual(limiter.classify("move_to_location"), "motion")
+
+    def test_token_bucket(self):
+        """バーストを超えたリクエストが再試行までの時間付きで拒否されること"""
+        limiter = RateLimiter({"camera": RateLimitConfig(rate_per_sec=0.5, burst=2)})
+
+        async def run():
+            for _ in range(2):
+                async with limiter.limit("sensors://camera/front", api_key="a"):
+                    pass
+            with self.assertRaises(RateLimitExceeded) as cm:
+                async with limiter.limit("sensors://camera/front", api_key="a"):
+                    pass
+            self.assertGreater(cm.exception.retry_after, 0.0)
+            self.assertLessEqual(cm.exception.retry_after, 2.0)
+
+            # 他のキーには影響しない
+            async with limiter.limit("sensors://camera/front", api_key="b"):
+                pass
+
+        asyncio.run(run())
+
+    def test_max_in_flight(self):
+        """同時実行数の上限を超えたリクエストが拒否されること"""
+        limiter = RateLimiter({"motion": RateLimitConfig(max_in_flight=1)})
+
+        async def run():
+            token = current_api_key.set("agent-1")
+            try:
+                async with limiter.limit("move_shelf"):
+                    with self.assertRaises(RateLimitExceeded):
+                        async with limiter.limit("move_to_location"):
+                            pass
+                # 完了後は再び実行できる
+                async with limiter.limit("move_to_location"):
+                    pass
+            finally:
+                current_api_key.reset(token)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests for the battery model.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.battery import BatteryModel, BatteryRefused, BatterySample, battery_gate, battery_gated
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+DISCHARGING = pb2.PowerSupplyStatus.POWER_SUPPLY_STATUS_DISCHARGING
+CHARGING = pb2.PowerSupplyStatus.POWER_SUPPLY_STATUS_CHARGING
+
+
+class TestBatteryModel(unittest.TestCase):
+    """電池の消費量の学習のテスト"""
+
+    def test_learns_drain_rates(self):
+        """走行距離と時間あたりの消費量を学習すること"""
+        model = BatteryModel(per_metre=0.05, per_minute=0.1, prior_weight=1.0)
+        battery, x = 100.0, 0.0
+        for step in range(200):
+            # 30秒ごとに 0〜6 メートル走行する（真の値は 0.2%/m、0.3%/分）
+            distance = (step % 4) * 2.0
+            x += distance
+            battery -= 0.2 * distance + 0.3 * 0.5
+            model.add_sample(BatterySample(step * 30.0, battery, (x, 0.0), DISCHARGING))
+
+        per_metre, per_minute = model.rates
+        self.assertAlmostEqual(per_metre, 0.2, delta=0.02)
+        self.assertAlmostEqual(per_minute, 0.3, delta=0.02)
+        self.assertAlmostEqual(model.predict(100.0, 600.0), 23.0, delta=1.0)
+
+    def test_ignores_charging_gaps_and_jumps(self):
+        """充電中・間隔の空いたサンプル・自己位置の修正を消費量の学習に使わないこと"""
+        model = BatteryModel(per_metre=0.05, per_minute=0.1)
+        model.add_sample(BatterySample(0.0, 50.0, (0.0, 0.0), CHARGING))
+        model.add_sample(BatterySample(60.0, 51.0, (0.0, 0.0), CHARGING))
+        model.add_sample(BatterySample(5000.0, 40.0, (0.0, 0.0), DISCHARGING))
+        model.add_sample(BatterySample(5010.0, 40.0, (100.0, 0.0), DISCHARGING))
+
+        self.assertEqual(model.samples, 1)
+        self.assertEqual(model.distance_m, 0.0)
+        self.assertGreater(model.charge_per_minute, 0.5)
+        # 学習していない間は初期値に近い
+        self.assertAlmostEqual(model.rates[0], 0.05, places=2)
+
+
+class TestBatteryGate(unittest.TestCase):
+    """タスク前の電池残量の判定のテスト"""
+
+    def make_context(self, battery, policy="refuse"):
+        client = MagicMock()
+        client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=0.0, y=0.0))
+        client.get_battery_info = AsyncMock(return_value=(battery, DISCHARGING))
+        client.get_current_map_id = AsyncMock(side_effect=RuntimeError("no map"))
+        client.get_locations = AsyncMock(return_value=[
+            pb2.Location(id="C", name="充電器", pose=pb2.Pose(x=0.0, y=0.0), type=pb2.LocationType.LOCATION_TYPE_CHARGER),
+        ])
+        client.stub.StartCommand = AsyncMock(
+            return_value=pb2.StartCommandResponse(result=pb2.Result(success=True), command_id="home")
+        )
+        client.stub.GetLastCommandResult = AsyncMock(
+            return_value=pb2.GetLastCommandResultResponse(command_id="home", result=pb2.Result(success=True))
+        )
+        config = KachakaMCPConfig(battery_policy=policy, battery_sample_interval_sec=0.0)
+        return KachakaMCPContext(client, config)
+
+    def test_refuses_long_task_on_low_battery(self):
+        """電池が持たないタスクは説明付きで拒否し、持つタスクは許可すること"""
+        # 往復200メートル: 0.05%/m * 200 + 0.1%/分 * 約11分 ≒ 11%
+        context = self.make_context(20.0)
+        refusal = asyncio.run(battery_gate(context, [(100.0, 0.0)], "move to far"))
+        self.assertIn("Battery too low to move to far", refusal)
+        self.assertIn("Charge to", refusal)
+        self.assertIsNone(asyncio.run(battery_gate(context, [(5.0, 0.0)], "move to near")))
+
+        context = self.make_context(90.0)
+        self.assertIsNone(asyncio.run(battery_gate(context, [(100.0, 0.0)], "move to far")))
+
+    def test_charge_policy_returns_home(self):
+        """charge の場合は先に充電器に戻ること"""
+        context = self.make_context(20.0, policy="charge")
+        message = asyncio.run(battery_gate(context, [(100.0, 0.0)], "move to far"))
+        self.assertIn("Returned to the charger", message)
+        request = context.kachaka_client.stub.StartCommand.await_args.args[0]
+        self.assertTrue(request.command.HasField("return_home_command"))
+
+        context = self.make_context(20.0, policy="warn")
+        self.assertIsNone(asyncio.run(battery_gate(context, [(100.0, 0.0)], "move to far")))
+
+    def test_idempotent_retry_is_not_refused(self):
+        """同じ冪等キーの再試行は判定をやり直さずに結び付き、拒否したコマンドは記録に残らないこと"""
+        context = self.make_context(90.0)
+        started = []
+
+        async def command():
+            started.append(True)
+            await asyncio.sleep(0.05)
+            return pb2.Result(success=True)
+
+        def run(key):
+            return context.command_deduplicator.run(
+                "move_to_pose",
+                (100.0, 0.0, 0.0),
+                lambda: battery_gated(context, [(100.0, 0.0)], "move to far", command),
+                key,
+            )
+
+        async def scenario():
+            first = asyncio.ensure_future(run("k1"))
+            await asyncio.sleep(0.01)
+            # 実行中に電池残量が下がっても、再試行は同じコマンドに結び付く
+            context.kachaka_client.get_battery_info.return_value = (20.0, DISCHARGING)
+            retry = await run("k1")
+            with self.assertRaises(BatteryRefused):
+                await run("k2")
+            context.kachaka_client.get_battery_info.return_value = (90.0, DISCHARGING)
+            charged = await run("k2")
+            return await first, retry, charged
+
+        first, retry, charged = asyncio.run(scenario())
+        self.assertTrue(first.success and retry.success and charged.success)
+        self.assertEqual(len(started), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
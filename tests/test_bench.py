@@ -0,0 +1,45 @@
+"""
+Tests for the MCP load generator.
+"""
+
+import asyncio
+import unittest
+
+from kachaka_mcp import server as server_module
+from kachaka_mcp.bench import Operation, run_benchmark
+
+
+class TestBench(unittest.TestCase):
+    """負荷生成のテスト"""
+
+    def tearDown(self):
+        server_module._reset_context()
+        server_module.keep_context_alive(False)
+
+    def test_parse_operation(self):
+        """操作の指定を解釈すること"""
+        resource = Operation.parse("history://commands/tool=move_shelf@2.5")
+        self.assertEqual((resource.target, resource.weight, resource.is_resource), ("history://commands/tool=move_shelf", 2.5, True))
+        tool = Operation.parse('estimate_travel={"destination":"kitchen@2F"}')
+        self.assertEqual((tool.target, tool.arguments, tool.weight), ("estimate_travel", {"destination": "kitchen@2F"}, 1.0))
+        with self.assertRaises(ValueError):
+            Operation.parse("robot://battery@0")
+
+    def test_in_process_benchmark(self):
+        """プロセス内のサーバーに複数のクライアントで負荷をかけて集計すること"""
+        operations = [Operation.parse("robot://battery@3"), Operation.parse("unknown_tool")]
+        report = asyncio.run(run_benchmark(operations, clients=3, duration_sec=0.3, robot_latency_sec=0.001))
+        battery = report["operations"]["robot://battery"]
+        self.assertGreater(battery["requests"], 0)
+        self.assertEqual(battery["error_rate"], 0.0)
+        self.assertIsNotNone(battery["p99_ms"])
+        self.assertEqual(report["operations"]["unknown_tool"]["error_rate"], 1.0)
+        self.assertEqual(report["total"]["requests"], battery["requests"] + report["operations"]["unknown_tool"]["requests"])
+        self.assertGreater(report["robot_calls"], 0)
+        self.assertIsNotNone(report["event_loop_lag"]["max_ms"])
+        # コンテキストを残さない
+        self.assertIsNone(server_module.current_context)
+
+
+if __name__ == '__main__':
+    unittest.main()
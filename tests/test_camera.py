@@ -0,0 +1,104 @@
+"""
+Tests for camera frame change detection.
+"""
+
+import asyncio
+import io
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from PIL import Image as PILImage
+
+from kachaka_mcp.camera import FrameChangeDetector
+
+
+def jpeg(box_x: int, brightness: int = 0, quality: int = 85, seed: int = 0) -> bytes:
+    """箱が1つ写った室内風の画像（センサーノイズ付き）"""
+    rng = np.random.default_rng(seed)
+    image = np.full((480, 640, 3), 120 + brightness, dtype=np.int16)
+    image[300:, :] = 80 + brightness
+    image[200:320, box_x:box_x + 120] = 220 + brightness
+    image += rng.integers(-6, 7, image.shape, dtype=np.int16)
+    output = io.BytesIO()
+    PILImage.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+class TestFrameChangeDetector(unittest.TestCase):
+    """カメラ画像の変化の検出のテスト"""
+
+    def test_skips_unchanged_frames(self):
+        """ノイズや露出の違いだけの画像は省略し、物が動いたら送ること"""
+        detector = FrameChangeDetector(threshold=4.0)
+        session = MagicMock()
+
+        async def run():
+            first = await detector.check(session, "front", jpeg(100))
+            noisy = await detector.check(session, "front", jpeg(100, brightness=8, quality=60, seed=1))
+            moved = await detector.check(session, "front", jpeg(300, seed=2))
+            forced = await detector.check(session, "front", jpeg(300, seed=3), force=True)
+            # 他のセッション・カメラには関係しない
+            other = await detector.check(MagicMock(), "front", jpeg(300))
+            back = await detector.check(session, "back", jpeg(300))
+            return first, noisy, moved, forced, other, back
+
+        first, noisy, moved, forced, other, back = asyncio.run(run())
+        self.assertIsNone(first)
+        self.assertTrue(noisy["unchanged"])
+        self.assertIn("since", noisy)
+        self.assertIsNone(moved)
+        self.assertIsNone(forced)
+        self.assertIsNone(other)
+        self.assertIsNone(back)
+
+    def test_camera_resource(self):
+        """カメラのリソースが JPEG を返し、変化がなければ小さな JSON を返すこと"""
+        from kachaka_mcp import server
+
+        data = jpeg(100)
+        client = MagicMock()
+        client.get_front_camera_ros_compressed_image = AsyncMock(
+            return_value=pb2.RosCompressedImage(data=data, format="jpeg")
+        )
+        with patch.dict("os.environ", {"KACHAKA_HOST": "127.0.0.1:26400"}):
+            mcp = server.create_server()
+        server.current_context = server.KachakaMCPContext(client)
+
+        async def run():
+            return [
+                (await mcp.read_resource(uri))[0]
+                for uri in ("sensors://camera/front", "sensors://camera/front", "sensors://camera/front/full")
+            ]
+
+        try:
+            full, unchanged, forced = asyncio.run(run())
+        finally:
+            server._reset_context()
+        self.assertEqual(full.content, data)
+        self.assertEqual(full.mime_type, "image/jpeg")
+        self.assertTrue(json.loads(unchanged.content)["unchanged"])
+        self.assertEqual(unchanged.mime_type, "application/json")
+        self.assertEqual(forced.content, data)
+
+    def test_camera_resource_error_is_json(self):
+        """カメラ画像の取得に失敗した場合は application/json のエラーを返すこと"""
+        from kachaka_mcp import server
+
+        client = MagicMock()
+        client.get_back_camera_ros_compressed_image = AsyncMock(side_effect=RuntimeError("offline"))
+        with patch.dict("os.environ", {"KACHAKA_HOST": "127.0.0.1:26400"}):
+            mcp = server.create_server()
+        server.current_context = server.KachakaMCPContext(client)
+        try:
+            result = asyncio.run(mcp.read_resource("sensors://camera/back"))[0]
+        finally:
+            server._reset_context()
+        self.assertEqual(json.loads(result.content), {"error": "offline"})
+        self.assertEqual(result.mime_type, "application/json")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+"""
+Tests for the shared command-completion watcher.
+"""
+
+import asyncio
+import contextlib
+import io
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.commands import CommandWatcher, expected_duration
+
+
+class FakeRobot:
+    """StartCommand・GetLastCommandResult・GetCommandState だけを持つロボット"""
+
+    def __init__(self):
+        self.last = pb2.GetLastCommandResultResponse(command_id="old", result=pb2.Result(success=True))
+        self.state = pb2.GetCommandStateResponse(state=pb2.CommandState.COMMAND_STATE_UNSPECIFIED)
+        self.started = 0
+        self.client = MagicMock()
+        self.client.stub.StartCommand = AsyncMock(side_effect=self.start_command)
+        self.client.stub.GetLastCommandResult = AsyncMock(side_effect=lambda request: self.last)
+        self.client.stub.GetCommandState = AsyncMock(side_effect=lambda request: self.state)
+        self.client.get_history_list = AsyncMock(return_value=[])
+
+    async def start_command(self, request):
+        self.started += 1
+        if request.command.HasField("lock_command"):
+            return pb2.StartCommandResponse(result=pb2.Result(success=False, error_code=10001))
+        return pb2.StartCommandResponse(result=pb2.Result(success=True), command_id=f"c{self.started}")
+
+    def finish(self, command_id, success=True, error_code=0):
+        self.last = pb2.GetLastCommandResultResponse(
+            command_id=command_id, result=pb2.Result(success=success, error_code=error_code)
+        )
+
+
+class TestCommandWatcher(unittest.TestCase):
+    """コマンドの完了の監視のテスト"""
+
+    def test_many_waiters_share_one_poll_loop(self):
+        """同じコマンドを待つ多数の呼び出しを1つのループで通知すること"""
+        robot = FakeRobot()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, default_interval_sec=0.01)
+
+        async def run():
+            result, future = await watcher.start(pb2.Command(return_home_command=pb2.ReturnHomeCommand()))
+            waiters = [asyncio.ensure_future(watcher.watch("c1")) for _ in range(50)]
+            await asyncio.sleep(0.1)
+            robot.finish("c1", success=False, error_code=14606)
+            results = await asyncio.wait_for(asyncio.gather(future, *waiters), 1.0)
+            # 完了した後に待ち始めても結果を返す
+            late = await watcher.watch("c1")
+            return results, late
+
+        results, late = asyncio.run(run())
+        self.assertEqual({r.error_code for r in results}, {14606})
+        self.assertEqual(late.error_code, 14606)
+        # 呼び出しごとではなく、ループの間隔ごとに確認する
+        self.assertLess(robot.client.stub.GetLastCommandResult.await_count, 30)
+        self.assertEqual(watcher.pending, [])
+
+    def test_adaptive_interval(self):
+        """完了の予定時刻の前後では短く、離れている場合は長く確認すること"""
+        robot = FakeRobot()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.2, max_interval_sec=2.0, default_interval_sec=0.5)
+
+        async def run():
+            watcher.watch("trip", expected_sec=60.0)
+            far = watcher.interval()
+            near = watcher.interval(now=watcher._waiters["trip"].expected_at - 0.1)
+            overdue = watcher.interval(now=watcher._waiters["trip"].expected_at + 100.0)
+            watcher.watch("speech")
+            unknown = watcher.interval()
+            watcher.stop()
+            return far, near, overdue, unknown
+
+        far, near, overdue, unknown = asyncio.run(run())
+        self.assertEqual((far, near, overdue, unknown), (2.0, 0.2, 2.0, 0.5))
+
+    def test_estimate_after_start(self):
+        """所要時間の見積もりはコマンドを送った後に行い、見積もれた時点で予定時刻を設定すること"""
+        robot = FakeRobot()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, max_interval_sec=0.05, default_interval_sec=0.01)
+        started = []
+
+        async def estimate():
+            started.append(robot.started)
+            return 30.0
+
+        async def run():
+            _, future = await watcher.start(pb2.Command(return_home_command=pb2.ReturnHomeCommand()), estimate=estimate)
+            await asyncio.sleep(0.02)
+            waiter = watcher._waiters["c1"]
+            expected = waiter.expected_at - waiter.started_at
+            robot.finish("c1")
+            await asyncio.wait_for(future, 1.0)
+            return expected
+
+        self.assertEqual(asyncio.run(run()), 30.0)
+        self.assertEqual(started, [1])
+
+    def test_no_estimate_without_precomputed_fields(self):
+        """経路長の推定モデルや計算済みの距離場がない場合は計算せずに None を返すこと"""
+        context = MagicMock()
+        context.kachaka_client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=0.0, y=0.0))
+        context.travel_model = None
+        self.assertIsNone(asyncio.run(expected_duration(context, [(1.0, 0.0)])))
+
+        context.travel_model = MagicMock(speed=0.5)
+        context.travel_model.has_field_for.return_value = False
+        self.assertIsNone(asyncio.run(expected_duration(context, [(1.0, 0.0)])))
+        context.travel_model.path_length.assert_not_called()
+
+        context.travel_model.has_field_for.return_value = True
+        context.travel_model.path_length.return_value = 2.0
+        self.assertEqual(asyncio.run(expected_duration(context, [(1.0, 0.0)], 1.0)), 5.0)
+
+    def test_recovers_missed_results_from_history(self):
+        """確認の間に完了したコマンドの結果を履歴から補うこと"""
+        robot = FakeRobot()
+        robot.client.get_history_list.return_value = [pb2.History(id="c1", success=False, error_code=10253)]
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, default_interval_sec=0.01)
+
+        async def run():
+            first = asyncio.ensure_future(watcher.run(pb2.Command(return_home_command=pb2.ReturnHomeCommand())))
+            await asyncio.sleep(0.02)
+            second = asyncio.ensure_future(watcher.run(pb2.Command(speak_command=pb2.SpeakCommand(text="hi"))))
+            await asyncio.sleep(0.02)
+            # 1つ目の結果は確認する前に2つ目の結果で上書きされる
+            robot.finish("c2")
+            failed = await watcher.run(pb2.Command(lock_command=pb2.LockCommand(duration_sec=1.0)))
+            return await asyncio.wait_for(asyncio.gather(first, second), 1.0), failed
+
+        (first, second), failed = asyncio.run(run())
+        self.assertEqual((first.success, first.error_code), (False, 10253))
+        self.assertTrue(second.success)
+        # 開始に失敗したコマンドは待たない
+        self.assertEqual(failed.error_code, 10001)
+
+    def test_sends_resolved_ids_without_resolver(self):
+        """解決済みのIDをそのまま送り、標準出力に何も書かないこと（stdio の通信を壊さない）"""
+        from kachaka_api.util.layout import ShelfLocationResolver
+
+        robot = FakeRobot()
+        robot.client.resolver = ShelfLocationResolver()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, default_interval_sec=0.01)
+
+        async def run():
+            moves = [
+                watcher.move_shelf("S01", "L01"),
+                watcher.return_shelf(""),
+                watcher.dock_any_shelf_with_registration("L02"),
+            ]
+            for i, move in enumerate(moves, 1):
+                task = asyncio.ensure_future(move)
+                await asyncio.sleep(0.02)
+                robot.finish(f"c{i}")
+                await asyncio.wait_for(task, 1.0)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            asyncio.run(run())
+        self.assertEqual(stdout.getvalue(), "")
+        commands = [call.args[0].command for call in robot.client.stub.StartCommand.await_args_list]
+        self.assertEqual(
+            (commands[0].move_shelf_command.target_shelf_id, commands[0].move_shelf_command.destination_location_id),
+            ("S01", "L01"),
+        )
+        self.assertEqual(commands[1].return_shelf_command.target_shelf_id, "")
+        self.assertEqual(commands[2].dock_any_shelf_with_registration_command.target_location_id, "L02")
+
+    def test_resolves_waiters_preempted_by_unknown_command(self):
+        """待っていないコマンドに中断されたコマンドの結果を履歴から補うこと"""
+        robot = FakeRobot()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, default_interval_sec=0.01)
+
+        async def run():
+            _, future = await watcher.start(pb2.Command(return_home_command=pb2.ReturnHomeCommand()))
+            await asyncio.sleep(0.02)
+            # 他のクライアントのコマンドが c1 を中断し、c1 の結果は確認する前に上書きされる
+            robot.client.get_history_list.return_value = [pb2.History(id="c1", success=False, error_code=10001)]
+            robot.finish("external")
+            return await asyncio.wait_for(future, 1.0)
+
+        result = asyncio.run(run())
+        self.assertEqual((result.success, result.error_code), (False, 10001))
+        self.assertEqual(watcher.pending, [])
+
+    def test_wait_times_out(self):
+        """期限を過ぎてもロボットが実行していないコマンドは失敗として通知し、実行中なら待ち続けること"""
+        robot = FakeRobot()
+        watcher = CommandWatcher(robot.client, min_interval_sec=0.01, default_interval_sec=0.01, timeout_sec=0.05)
+
+        async def run():
+            _, future = await watcher.start(pb2.Command(return_home_command=pb2.ReturnHomeCommand()))
+            robot.state = pb2.GetCommandStateResponse(
+                state=pb2.CommandState.COMMAND_STATE_RUNNING, command_id="c1"
+            )
+            await asyncio.sleep(0.15)
+            running = future.done()
+            robot.state = pb2.GetCommandStateResponse(state=pb2.CommandState.COMMAND_STATE_UNSPECIFIED)
+            return running, await asyncio.wait_for(future, 1.0)
+
+        running, result = asyncio.run(run())
+        self.assertFalse(running)
+        self.assertFalse(result.success)
+        self.assertEqual(watcher.pending, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Tests for the fleet task dispatcher.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from kachaka_api.util.layout import ShelfLocationResolver
+
+from kachaka_mcp.fleet import Fleet
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+ROBOTS = {
+    # 名前: (位置, 電池残量)
+    "near": ((1.0, 0.0), 90.0),
+    "far": ((8.0, 0.0), 100.0),
+    "low": ((0.5, 0.0), 10.0),
+}
+
+
+class TestDispatcher(unittest.TestCase):
+    """タスク割り当てのテスト"""
+
+    def setUp(self):
+        self.config = KachakaMCPConfig(
+            fleet_robots={name: f"{name}:26400" for name in ROBOTS},
+            dispatch_poll_interval_sec=0.01,
+            dispatch_snapshot_ttl_sec=0.0,
+            command_poll_min_sec=0.01,
+            command_poll_default_sec=0.01,
+        )
+        self.contexts = {}
+        self.running = {}
+        for name, ((x, y), battery) in ROBOTS.items():
+            self.contexts[f"{name}:26400"] = self.make_context(name, x, y, battery)
+        self.context = KachakaMCPContext(MagicMock(), self.config)
+        self.context.fleet = Fleet(self.config.fleet_robots, self.contexts.__getitem__)
+        self.dispatcher = self.context.dispatcher
+
+    def make_context(self, name, x, y, battery):
+        """ロボットのコンテキスト（マップは使えないので直線距離で評価する）"""
+        client = MagicMock()
+        client.resolver = ShelfLocationResolver()
+        client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=x, y=y))
+        client.get_battery_info = AsyncMock(return_value=(battery, pb2.PowerSupplyStatus.POWER_SUPPLY_STATUS_DISCHARGING))
+        client.get_current_map_id = AsyncMock(side_effect=RuntimeError("no map"))
+        client.get_locations = AsyncMock(return_value=[
+            pb2.Location(id="L01", name="キッチン", pose=pb2.Pose(x=5.0, y=0.0)),
+        ])
+        client.get_shelves = AsyncMock(return_value=[
+            pb2.Shelf(id="S01", name="本棚", pose=pb2.Pose(x=0.0, y=0.0)),
+        ])
+
+        async def get_command_state():
+            if self.running.get(name):
+                return pb2.CommandState.COMMAND_STATE_RUNNING, None
+            return pb2.CommandState.COMMAND_STATE_UNSPECIFIED, None
+
+        client.get_command_state = AsyncMock(side_effect=get_command_state)
+
+        # コマンドはゲートが開くまで実行中になり、完了すると最後の結果が変わる
+        last = pb2.GetLastCommandResultResponse()
+
+        async def finish(command_id):
+            await self.gates[name].wait()
+            self.running[name] = False
+            last.command_id, last.result.success = command_id, True
+
+        async def start_command(request):
+            self.running[name] = True
+            command_id = f"{name}-{len(self.running)}-{id(request)}"
+            asyncio.ensure_future(finish(command_id))
+            return pb2.StartCommandResponse(result=pb2.Result(success=True), command_id=command_id)
+
+        client.stub.StartCommand = AsyncMock(side_effect=start_command)
+        client.stub.GetLastCommandResult = AsyncMock(side_effect=lambda request: pb2.GetLastCommandResultResponse(
+            command_id=last.command_id, result=last.result
+        ))
+        return KachakaMCPContext(client, self.config)
+
+    def test_assigns_nearest_and_queues(self):
+        """近く電池残量に余裕のある空いたロボットに割り当て、空いていなければ待たせること"""
+        async def scenario():
+            self.gates = {name: asyncio.Event() for name in ROBOTS}
+            first = await self.dispatcher.submit("move_shelf", "キッチン", "本棚")
+            second = await self.dispatcher.submit("move_shelf", "キッチン", "本棚")
+            third = await self.dispatcher.submit("move_shelf", "キッチン", "本棚")
+            states = (first.robot, second.robot, third.status)
+
+            # 最初のロボットが空くと待ち行列のタスクを割り当てる
+            self.gates["near"].set()
+            await asyncio.wait_for(asyncio.gather(first.done, third.done), 1.0)
+            self.gates["far"].set()
+            await asyncio.wait_for(second.done, 1.0)
+            return states, first, third
+
+        (first_robot, second_robot, third_status), first, third = asyncio.run(scenario())
+        # 電池残量の少ないロボットは近くても使わない
+        self.assertEqual(first_robot, "near")
+        self.assertEqual(second_robot, "far")
+        self.assertEqual(third_status, "queued")
+        self.assertEqual(first.status, "succeeded")
+        self.assertEqual(third.robot, "near")
+        self.assertEqual(third.status, "succeeded")
+
+    def test_concurrent_submits_use_different_robots(self):
+        """同時に割り当てたタスクが同じロボットを選ばないこと"""
+        async def scenario():
+            self.gates = {name: asyncio.Event() for name in ROBOTS}
+            tasks = await asyncio.gather(*(
+                self.dispatcher.submit("move_shelf", "キッチン", "本棚") for _ in range(3)
+            ))
+            states = [(task.robot, task.status) for task in tasks]
+            for gate in self.gates.values():
+                gate.set()
+            await asyncio.wait_for(asyncio.gather(*(task.done for task in tasks)), 1.0)
+            return states
+
+        states = asyncio.run(scenario())
+        running = sorted(robot for robot, status in states if status == "running")
+        self.assertEqual(running, ["far", "near"])
+        self.assertEqual(sorted(status for _, status in states), ["queued", "running", "running"])
+
+    def test_rejects_unknown_and_cancels(self):
+        """どのロボットにもない棚は拒否し、待ち行列のタスクは取り消せること"""
+        async def scenario():
+            self.gates = {name: asyncio.Event() for name in ROBOTS}
+            rejected = await self.dispatcher.submit("move_shelf", "キッチン", "存在しない棚")
+            tasks = [await self.dispatcher.submit("move_shelf", "キッチン", "本棚") for _ in range(3)]
+            cancelled = self.dispatcher.cancel(tasks[2].id)
+            status = self.dispatcher.status()
+            for gate in self.gates.values():
+                gate.set()
+            await asyncio.wait_for(asyncio.gather(tasks[0].done, tasks[1].done), 1.0)
+            return rejected, tasks, cancelled, status
+
+        rejected, tasks, cancelled, status = asyncio.run(scenario())
+        self.assertEqual(rejected.status, "rejected")
+        self.assertTrue(cancelled)
+        self.assertEqual(tasks[2].status, "cancelled")
+        self.assertEqual(status["queue"], [])
+        robots = {robot["name"]: robot for robot in status["robots"]}
+        self.assertTrue(robots["near"]["dispatching"])
+        with self.assertRaises(ValueError):
+            asyncio.run(self.dispatcher.submit("teleport", "キッチン"))
+
+    def test_battery_gate_and_history(self):
+        """直接のツール呼び出しと同じく電池の確認で拒否し、終了したタスクは上限まで残すこと"""
+        self.dispatcher.history = 2
+
+        async def scenario():
+            self.gates = {name: asyncio.Event() for name in ROBOTS}
+            gate = AsyncMock(return_value="Refused: not enough battery")
+            with patch("kachaka_mcp.battery.battery_gate", gate):
+                task = await self.dispatcher.submit("move_shelf", "キッチン", "本棚")
+                await asyncio.wait_for(task.done, 1.0)
+            for _ in range(3):
+                await self.dispatcher.submit("move_shelf", "キッチン", "存在しない棚")
+            return task, gate
+
+        task, gate = asyncio.run(scenario())
+        self.assertEqual((task.status, task.message), ("rejected", "Refused: not enough battery"))
+        self.assertEqual(gate.await_args.args[1], ["S01", "L01"])
+        self.contexts["near:26400"].kachaka_client.stub.StartCommand.assert_not_awaited()
+        # 新しいタスクを受け付けるときに、終了したタスクを古いものから削除する
+        self.assertEqual(len(self.dispatcher.tasks), 3)
+        self.assertNotIn(task.id, self.dispatcher.tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Tests for fleet operations.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.fleet import Fleet
+
+
+class TestFleet(unittest.TestCase):
+    """フリート操作のテスト"""
+
+    def setUp(self):
+        self.running = 0
+        self.max_running = 0
+        self.clients = {}
+
+        def make_context(host):
+            async def set_speaker_volume(volume):
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+                try:
+                    # robot-03 は応答しない
+                    await asyncio.sleep(10 if host == "10.0.0.3:26400" else 0.01)
+                finally:
+                    self.running -= 1
+                return pb2.Result(success=host != "10.0.0.2:26400", error_code=101)
+
+            client = MagicMock()
+            client.set_speaker_volume = AsyncMock(side_effect=set_speaker_volume)
+            self.clients[host] = client
+            context = MagicMock()
+            context.kachaka_client = client
+            return context
+
+        robots = {f"robot-{i:02d}": f"10.0.0.{i}:26400" for i in range(1, 31)}
+        self.fleet = Fleet(robots, make_context, concurrency=4, timeout_sec=0.2)
+
+    def test_broadcast(self):
+        """並列数を守り、ロボットごとの結果をまとめること"""
+        result = asyncio.run(self.fleet.broadcast("set_speaker_volume", {"volume": 5}))
+
+        self.assertEqual(result["succeeded"], 28)
+        self.assertEqual(result["failed"], 2)
+        self.assertLessEqual(self.max_running, 4)
+        by_robot = {entry["robot"]: entry for entry in result["results"]}
+        self.assertEqual(by_robot["robot-02"]["message"], "Error code 101")
+        self.assertIn("Timed out", by_robot["robot-03"]["message"])
+        # 30台でも数秒以内に終わる
+        self.assertLess(result["elapsed_sec"], 2.0)
+        self.clients["10.0.0.1:26400"].set_speaker_volume.assert_awaited_with(5)
+
+    def test_selected_robots(self):
+        """指定したロボットだけを操作し、接続を再利用すること"""
+        asyncio.run(self.fleet.broadcast("set_speaker_volume", {"volume": 1}, ["robot-05"]))
+        result = asyncio.run(self.fleet.broadcast("set_speaker_volume", {"volume": 2}, ["robot-05"]))
+        self.assertEqual([entry["robot"] for entry in result["results"]], ["robot-05"])
+        self.assertEqual(len(self.clients), 1)
+        self.assertEqual(self.clients["10.0.0.5:26400"].set_speaker_volume.await_count, 2)
+
+    def test_errors(self):
+        """未知の操作やロボットはエラーにすること"""
+        with self.assertRaises(ValueError):
+            asyncio.run(self.fleet.broadcast("restart_robot"))
+        with self.assertRaises(KeyError):
+            asyncio.run(self.fleet.broadcast("return_home", robots=["robot-99"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for map coordinate transforms.
+"""
+
+import io
+import math
+import unittest
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from kachaka_api.util.geometry import MapImage2DGeometry
+from PIL import Image as PILImage
+
+from kachaka_mcp.geometry import MapTransform, render_annotated_map
+
+
+class TestMapTransform(unittest.TestCase):
+    """座標変換のテスト"""
+
+    def setUp(self):
+        self.png_map = pb2.Map(
+            resolution=0.05,
+            width=300,
+            height=200,
+            origin=pb2.Pose(x=-4.0, y=1.5, theta=-0.7),
+        )
+        self.transform = MapTransform.from_png_map(self.png_map, "map-1")
+
+    def test_matches_kachaka_api(self):
+        """姿勢の変換が kachaka_api の MapImage2DGeometry と一致すること"""
+        geometry = MapImage2DGeometry(self.png_map)
+        poses = [pb2.Pose(x=1.0, y=2.0, theta=0.3), pb2.Pose(x=-3.0, y=0.5, theta=2.9)]
+        result = self.transform.world_to_pixel([[p.x, p.y, p.theta] for p in poses])
+        for pose, (u, v, angle) in zip(poses, result):
+            matrix = geometry.calculate_robot_pose_matrix_in_pixel(pose)
+            np.testing.assert_allclose((u, v), matrix[:2, 2], atol=1e-9)
+            # 画像上の向きは行列の1列目（ロボットの前方）の方向
+            self.assertAlmostEqual(angle, math.atan2(matrix[1, 0], matrix[0, 0]))
+
+    def test_numpy_path_matches_small_path(self):
+        """点数によらず同じ結果になること"""
+        rng = np.random.default_rng(0)
+        poses = np.column_stack([rng.uniform(-5, 5, (100, 2)), rng.uniform(-math.pi, math.pi, 100)])
+        large = self.transform.world_to_pixel(poses)
+        small = self.transform.world_to_pixel(poses[:5].tolist())
+        np.testing.assert_allclose(small, large[:5])
+        np.testing.assert_allclose(self.transform.pixel_to_world(large), poses, atol=1e-9)
+
+    def test_contains(self):
+        """画像の範囲内かどうかを判定すること"""
+        pixels = np.array([[0.0, 0.0], [299.4, 199.4], [-0.6, 10.0], [10.0, 200.0]])
+        self.assertEqual(self.transform.contains(pixels).tolist(), [True, True, False, False])
+
+
+class TestRenderAnnotatedMap(unittest.TestCase):
+    """注釈付きの地図画像のテスト"""
+
+    def test_render(self):
+        """縮小した画像と凡例を返すこと"""
+        buffer = io.BytesIO()
+        PILImage.new("L", (400, 200), 244).save(buffer, "PNG")
+        transform = MapTransform(0.05, (0.0, 0.0, 0.0), 400, 200)
+
+        image, legend = render_annotated_map(
+            buffer.getvalue(),
+            transform,
+            robot_pose=(1.0, 1.0, 0.0),
+            locations=[("キッチン", 2.0, 3.0)],
+            shelves=[("Shelf A", 5.0, 1.0)],
+            points=[[10.0, 5.0]],
+            max_size=200,
+        )
+
+        self.assertEqual(PILImage.open(io.BytesIO(image)).size, (200, 100))
+        self.assertEqual([entry["label"] for entry in legend], [1, 2, 3, "robot"])
+        self.assertEqual(legend[0]["name"], "キッチン")
+        self.assertEqual(legend[2]["kind"], "point")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests for idempotent robot commands.
+"""
+
+import asyncio
+import unittest
+
+from kachaka_mcp.auth import current_api_key
+from kachaka_mcp.idempotency import CommandDeduplicator, IdempotencyKeyReused
+
+
+class TestCommandDeduplicator(unittest.TestCase):
+    """重複コマンド抑制のテスト"""
+
+    def test_retry_attaches_to_in_flight_and_completed(self):
+        """同じ冪等キーの再試行がコマンドを再送しないこと"""
+        calls = []
+
+        async def command():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        async def run():
+            dedup = CommandDeduplicator(ttl_sec=60)
+            first = asyncio.create_task(dedup.run("move_shelf", ("S1", "L1"), command, "k1"))
+            await asyncio.sleep(0)
+            # クライアント側のタイムアウトで最初の呼び出しがキャンセルされる
+            first.cancel()
+            retried = await dedup.run("move_shelf", ("S1", "L1"), command, "k1")
+            completed = await dedup.run("move_shelf", ("S1", "L1"), command, "k1")
+            return retried, completed
+
+        retried, completed = asyncio.run(run())
+        self.assertEqual((retried, completed), ("done", "done"))
+        self.assertEqual(len(calls), 1)
+
+    def test_duplicate_without_key(self):
+        """冪等キーがない場合は実行中の重複のみ抑制すること"""
+        calls = []
+
+        async def command():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def run():
+            dedup = CommandDeduplicator()
+            results = await asyncio.gather(
+                dedup.run("return_home", (), command),
+                dedup.run("return_home", (), command),
+            )
+            # 完了後は新しいコマンドとして実行する
+            results.append(await dedup.run("return_home", (), command))
+            return results
+
+        self.assertEqual(asyncio.run(run()), [1, 1, 2])
+
+    def test_failed_command_can_be_resubmitted(self):
+        """例外で終わったコマンドは再送できること"""
+        calls = []
+
+        async def command():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("unavailable")
+            return "done"
+
+        async def run():
+            dedup = CommandDeduplicator()
+            with self.assertRaises(ConnectionError):
+                await dedup.run("move_to_location", ("L1",), command, "k2")
+            return await dedup.run("move_to_location", ("L1",), command, "k2")
+
+        self.assertEqual(asyncio.run(run()), "done")
+
+    def test_key_reused_with_other_arguments(self):
+        """同じ冪等キーを別の引数に使った場合はエラーにし、APIキーが異なれば別のキーとして扱うこと"""
+        calls = []
+
+        async def command():
+            calls.append(1)
+            return len(calls)
+
+        async def run():
+            dedup = CommandDeduplicator()
+            await dedup.run("move_to_location", ("L1",), command, "k3")
+            with self.assertRaises(IdempotencyKeyReused):
+                await dedup.run("move_to_location", ("L2",), command, "k3")
+            current_api_key.set("other-client")
+            return await dedup.run("move_to_location", ("L2",), command, "k3")
+
+        self.assertEqual(asyncio.run(run()), 2)
+
+    def test_relative_commands_are_not_joined(self):
+        """冪等キーがない相対的なコマンドは実行中でも結び付けないこと"""
+        calls = []
+
+        async def command():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def run():
+            dedup = CommandDeduplicator()
+            return await asyncio.gather(
+                dedup.run("move_forward", (0.5, 0.0), command),
+                dedup.run("move_forward", (0.5, 0.0), command),
+            )
+
+        self.assertEqual(asyncio.run(run()), [2, 2])
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
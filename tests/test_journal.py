@@ -0,0 +1,113 @@
+"""
+Tests for the command journal.
+"""
+
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.journal import JOURNAL_RECORD, CommandJournal, note_command_result, parse_filters
+from kachaka_mcp.lifecycle import ShuttingDown
+
+
+class TestCommandJournal(unittest.TestCase):
+    """ジャーナルのテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_query_filters_and_rotation(self):
+        """条件で絞り込み、サイズでセグメントを切り替えて古いものを削除すること"""
+        journal = CommandJournal(self.root, segment_bytes=JOURNAL_RECORD.itemsize * 10, segments=3)
+        for i in range(45):
+            journal.append(
+                "move_shelf" if i % 3 else "speak",
+                "robot-a" if i % 2 else "robot-b",
+                "anonymous",
+                '{"location_name":"kitchen","shelf_name":"S1"}',
+                "failed" if i % 5 == 0 else "succeeded",
+                duration=float(i),
+                finished_at=1000.0 + i,
+            )
+        journal.close()
+
+        # 新しい3セグメント（10件 + 10件 + 5件）だけが残る
+        self.assertEqual(journal.stats()["segments"], 3)
+        self.assertEqual(len(journal.query(limit=0)), 25)
+
+        # ファイルを開き直して読める
+        reopened = CommandJournal(self.root, segment_bytes=JOURNAL_RECORD.itemsize * 10, segments=3)
+        window = reopened.query(since=1020.0, until=1029.0, tool="move_shelf", robot="robot-a", limit=0)
+        self.assertEqual([int(r["duration_sec"]) for r in window], [29, 25, 23])
+        self.assertEqual(window[0]["started_at"], 1000.0)
+        failed = reopened.query(outcome="failed", limit=2)
+        self.assertEqual([int(r["duration_sec"]) for r in failed], [40, 35])
+        self.assertEqual(reopened.query(tool="dock_shelf"), [])
+
+        # 時計が戻っても完了時刻の順序を保つ
+        reopened.append("speak", "robot-a", "anonymous", "{}", "succeeded", finished_at=10.0)
+        self.assertEqual(reopened.query(limit=1)[0]["started_at"], 1044.0)
+
+    def test_ignores_partial_record(self):
+        """書き込み途中で止まったレコードを無視して追記を続けること"""
+        journal = CommandJournal(self.root)
+        journal.append("speak", "robot-a", "anonymous", "{}", "succeeded", finished_at=1.0)
+        journal.close()
+        record_file = next(self.root.glob("*.rec"))
+        with open(record_file, "ab") as f:
+            f.write(b"\x01\x02\x03")
+        journal = CommandJournal(self.root)
+        journal.append("return_home", "robot-a", "anonymous", "{}", "succeeded", finished_at=2.0)
+        self.assertEqual([r["tool"] for r in journal.query()], ["return_home", "speak"])
+
+    def test_durations_per_route(self):
+        """ツールと引数（ルート）ごとに成功した呼び出しの所要時間を集計すること"""
+        journal = CommandJournal(self.root)
+        for duration, route, outcome in [
+            (30.0, "kitchen", "succeeded"), (50.0, "kitchen", "succeeded"),
+            (20.0, "office", "succeeded"), (5.0, "office", "failed"),
+        ]:
+            journal.append("move_shelf", "robot-a", "anonymous", route, outcome, duration=duration)
+        durations = {d["arguments"]: d for d in journal.durations(tool="move_shelf")}
+        self.assertEqual((durations["kitchen"]["count"], durations["kitchen"]["mean_sec"]), (2, 40.0))
+        self.assertEqual((durations["office"]["count"], durations["office"]["max_sec"]), (1, 20.0))
+
+    def test_track_outcomes(self):
+        """呼び出しの結果をツールの戻り値・コマンドの結果・例外から分類すること"""
+        journal = CommandJournal(self.root)
+
+        async def run():
+            async with journal.track("move_shelf", {"shelf_name": "S1", "idempotency_key": "k"}, "robot-a") as entry:
+                note_command_result(pb2.Result(success=False, error_code=14606))
+                entry.finish("Moved")
+            async with journal.track("speak", {"text": "hi"}, "robot-a") as entry:
+                entry.finish("Successfully spoke: hi")
+            with self.assertRaises(ShuttingDown):
+                async with journal.track("return_home", {}, "robot-a"):
+                    raise ShuttingDown("return_home")
+
+        asyncio.run(run())
+        records = journal.query()
+        self.assertEqual([(r["tool"], r["outcome"], r["error_code"]) for r in records], [
+            ("return_home", "refused", 0), ("speak", "succeeded", 0), ("move_shelf", "failed", 14606),
+        ])
+        # 冪等キーは記録しない
+        self.assertEqual(records[-1]["arguments"], '{"shelf_name":"S1"}')
+
+    def test_parse_filters(self):
+        """リソースのURIの条件を解釈すること"""
+        filters = parse_filters("tool=move_shelf&since=1700000000&limit=5")
+        self.assertEqual(filters, {"tool": "move_shelf", "since": 1700000000.0, "limit": 5})
+        with self.assertRaises(ValueError):
+            parse_filters("route=kitchen")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Tests for laser scan summaries.
+"""
+
+import math
+import unittest
+
+from kachaka_mcp.laser import summarize_scan
+
+
+class TestLaserSummary(unittest.TestCase):
+    """レーザースキャン要約のテスト"""
+
+    def test_sectors(self):
+        """セクターごとの最近傍距離と空いている方向を返すこと"""
+        n = 360
+        ranges = [5.0] * n
+        # 正面（0度付近）に0.5mの障害物
+        ranges[180] = 0.5
+        # 左（90度付近）は反射なし・無効値
+        ranges[270] = float("inf")
+        ranges[271] = float("nan")
+        summary = summarize_scan(
+            ranges,
+            angle_min=-math.pi,
+            angle_increment=2 * math.pi / n,
+            range_min=0.1,
+            range_max=10.0,
+            sectors=4,
+        )
+
+        front, left, back, right = summary["sectors"]
+        self.assertEqual(front["center_deg"], 0.0)
+        self.assertEqual(front["nearest_m"], 0.5)
+        self.assertEqual(front["status"], "blocked")
+        self.assertEqual(left["center_deg"], 90.0)
+        self.assertEqual(left["status"], "free")
+        self.assertEqual(right["center_deg"], -90.0)
+        self.assertEqual(summary["free_directions_deg"], [90.0, 180.0, -90.0])
+        self.assertEqual(summary["nearest"], {"distance_m": 0.5, "angle_deg": 0.0})
+        self.assertEqual(summary["valid_beams"], n - 2)
+
+    def test_unobserved_sector(self):
+        """ビームのないセクターは unobserved になること"""
+        summary = summarize_scan(
+            [float("inf")] * 90,
+            angle_min=-math.pi / 4,
+            angle_increment=math.pi / 2 / 90,
+            range_min=0.1,
+            range_max=10.0,
+            sectors=4,
+        )
+        statuses = [sector["status"] for sector in summary["sectors"]]
+        self.assertEqual(statuses, ["free", "unobserved", "unobserved", "unobserved"])
+        self.assertIsNone(summary["nearest"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Tests for server lifecycle management.
+"""
+
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import grpc
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.lifecycle import ShuttingDown, close_client, connect_client
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+class FakeRobot:
+    """StartCommand と GetLastCommandResult だけを持つロボット"""
+
+    def __init__(self):
+        self.last = pb2.GetLastCommandResultResponse(command_id="old", result=pb2.Result(success=True))
+        self.started = 0
+        self.client = MagicMock()
+        self.client.stub.StartCommand = AsyncMock(side_effect=self.start_command)
+        self.client.stub.GetLastCommandResult = AsyncMock(side_effect=lambda request: self.last)
+        self.client.get_history_list = AsyncMock(return_value=[])
+        self.client.cancel_command = AsyncMock(side_effect=self.cancel_command)
+
+    async def start_command(self, request):
+        self.started += 1
+        return pb2.StartCommandResponse(result=pb2.Result(success=True), command_id=f"c{self.started}")
+
+    async def cancel_command(self):
+        self.finish(f"c{self.started}", success=False, error_code=10253)
+        return pb2.Result(success=True), pb2.Command()
+
+    def finish(self, command_id, success=True, error_code=0):
+        self.last = pb2.GetLastCommandResultResponse(
+            command_id=command_id, result=pb2.Result(success=success, error_code=error_code)
+        )
+
+
+class TestLifecycleManager(unittest.TestCase):
+    """終了処理のテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_path = Path(self.tmp.name) / "state.json"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_context(self, robot, **kwargs):
+        config = KachakaMCPConfig(
+            shutdown_state_path=str(self.state_path),
+            command_poll_min_sec=0.01,
+            command_poll_max_sec=0.05,
+            command_poll_default_sec=0.01,
+            **kwargs,
+        )
+        return KachakaMCPContext(robot.client, config)
+
+    def test_refuses_motion_while_draining(self):
+        """終了処理中はロボットを動かすツールだけを拒否し、実行中の呼び出しを待つこと"""
+        robot = FakeRobot()
+        context = self.make_context(robot, shutdown_drain_sec=5.0)
+        lifecycle = context.lifecycle
+
+        async def run():
+            async def move():
+                async with lifecycle.call("move_shelf"):
+                    return await context.command_watcher.return_home()
+
+            trip = asyncio.ensure_future(move())
+            await asyncio.sleep(0.05)
+            status = lifecycle.status()
+            shutdown = asyncio.ensure_future(lifecycle.shutdown())
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ShuttingDown):
+                async with lifecycle.call("move_to_location"):
+                    pass
+            async with lifecycle.call("get_dispatch_status"):
+                pass
+            with self.assertRaises(ShuttingDown):
+                await context.dispatcher.submit("move_to_location", "kitchen")
+            robot.finish("c1")
+            return status, await trip, await shutdown
+
+        status, result, report = asyncio.run(run())
+        self.assertEqual([call["name"] for call in status["in_flight_calls"]], ["move_shelf"])
+        self.assertEqual(status["pending_commands"], [{"host": context.config.kachaka_host, "command_id": "c1"}])
+        self.assertTrue(result.success)
+        self.assertTrue(report["drained"])
+        self.assertEqual(lifecycle.counters["refused_while_draining"], 1)
+        state = json.loads(self.state_path.read_text())
+        self.assertEqual(state["detached_commands"], [])
+        self.assertEqual(state["metrics"]["tool_calls"], 2)
+
+    def test_hands_over_unfinished_commands(self):
+        """期限までに完了しなかったコマンドを状態ファイルに残し、次のサーバーが追跡すること"""
+        robot = FakeRobot()
+        context = self.make_context(robot, shutdown_drain_sec=0.1, shutdown_timeout_action="detach")
+
+        async def stop_old_server():
+            trip = asyncio.ensure_future(context.command_watcher.return_home())
+            await asyncio.sleep(0.02)
+            report = await context.lifecycle.shutdown()
+            await asyncio.gather(trip, return_exceptions=True)
+            return report
+
+        report = asyncio.run(stop_old_server())
+        self.assertFalse(report["drained"])
+        self.assertEqual([c["command_id"] for c in report["detached_commands"]], ["c1"])
+        robot.client.cancel_command.assert_not_awaited()
+
+        new_context = self.make_context(robot)
+
+        async def start_new_server():
+            self.assertEqual(new_context.lifecycle.resume(), 1)
+            # 引き継ぎは1回だけ
+            self.assertEqual(new_context.lifecycle.resume(), 0)
+            future = new_context.command_watcher.watch("c1")
+            robot.finish("c1", success=False, error_code=14606)
+            return await asyncio.wait_for(future, 1.0)
+
+        result = asyncio.run(start_new_server())
+        self.assertEqual(result.error_code, 14606)
+        self.assertEqual(json.loads(self.state_path.read_text())["detached_commands"], [])
+
+    def test_cancels_unfinished_commands(self):
+        """cancel の場合は期限までに完了しなかったコマンドをロボットでキャンセルすること"""
+        robot = FakeRobot()
+        context = self.make_context(robot, shutdown_drain_sec=0.1, shutdown_timeout_action="cancel")
+
+        async def run():
+            trip = asyncio.ensure_future(context.command_watcher.return_home())
+            await asyncio.sleep(0.02)
+            report = await context.lifecycle.shutdown()
+            return report, await trip
+
+        report, result = asyncio.run(run())
+        robot.client.cancel_command.assert_awaited_once()
+        self.assertEqual(report["detached_commands"], [])
+        self.assertEqual(result.error_code, 10253)
+
+    def test_tracks_and_cancels_background_tasks(self):
+        """定期的な取得とコマンドのタスクを追跡し、終了処理でキャンセルすること"""
+        robot = FakeRobot()
+        context = self.make_context(robot, shutdown_drain_sec=0.0)
+
+        async def run():
+            context.local_map.start()
+            command = asyncio.ensure_future(
+                context.command_deduplicator.run("speak", ("hello",), lambda: asyncio.sleep(60))
+            )
+            await asyncio.sleep(0.01)
+            status = context.lifecycle.status()
+            report = await context.lifecycle.shutdown()
+            await asyncio.gather(command, return_exceptions=True)
+            return status, report
+
+        status, report = asyncio.run(run())
+        self.assertEqual(status["background_tasks"], ["command:speak", "local-map"])
+        self.assertEqual(report["cancelled_calls"], 2)
+        self.assertEqual(context.lifecycle.status()["background_tasks"], [])
+
+
+    def test_closes_channel(self):
+        """connect_client で作成したクライアントのチャネルを閉じ終えてから戻ること"""
+        async def run():
+            with patch("grpc.aio.insecure_channel", wraps=grpc.aio.insecure_channel) as insecure_channel:
+                client = connect_client("127.0.0.1:26400")
+            closed = await close_client(client)
+            with self.assertRaises(grpc.aio.UsageError):
+                await client.stub.GetRobotPose(pb2.GetRequest())
+            return insecure_channel.call_count, closed, await close_client(MagicMock())
+
+        # 閉じられないチャネルを作らない
+        self.assertEqual(asyncio.run(run()), (1, True, False))
+
+    def test_fleet_contexts_share_process_components(self):
+        """フリートのロボットのコンテキストはファイルに書き込む部品と終了処理を共有すること"""
+        context = self.make_context(
+            FakeRobot(),
+            kachaka_host="10.0.0.1:26400",
+            fleet_robots={"robot-01": "10.0.0.1:26400", "robot-02": "10.0.0.2:26400"},
+            journal_dir=str(Path(self.tmp.name) / "journal"),
+        )
+
+        async def run():
+            robot = context.fleet.context("robot-02")
+            await close_client(robot.kachaka_client)
+            return robot
+
+        robot = asyncio.run(run())
+        self.assertIs(context.fleet.context("robot-01"), context)
+        for name in ("journal", "tracer", "camera_recorder", "lifecycle", "profiler", "map_store", "fleet", "dispatcher"):
+            self.assertIs(getattr(robot, name), getattr(context, name), name)
+        self.assertIsNot(robot.command_watcher, context.command_watcher)
+        self.assertIsNot(robot.cache, context.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Tests for the laser-based local map.
+"""
+
+import asyncio
+import io
+import math
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from PIL import Image as PILImage
+
+from kachaka_mcp.local_map import LaserOccupancy, label_regions, scan_endpoints
+from kachaka_mcp.occupancy import OccupancyGrid
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.travel import TravelModel
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+def make_png_map(pixels: np.ndarray, resolution=0.05) -> pb2.Map:
+    """輝度の配列からPNG形式のマップを作成"""
+    buffer = io.BytesIO()
+    PILImage.fromarray(pixels.astype(np.uint8)).save(buffer, "PNG")
+    return pb2.Map(
+        data=buffer.getvalue(),
+        resolution=resolution,
+        width=pixels.shape[1],
+        height=pixels.shape[0],
+        origin=pb2.Pose(x=0.0, y=0.0, theta=0.0),
+    )
+
+
+def walled_room() -> np.ndarray:
+    """10m x 5m の部屋（中央に下側だけ通れる壁がある）"""
+    pixels = np.full((100, 200), 244)
+    pixels[:3, :] = pixels[-3:, :] = 0
+    pixels[:, :3] = pixels[:, -3:] = 0
+    pixels[:70, 98:102] = 0
+    return pixels
+
+
+BEAMS = 360
+ANGLE_MIN = -math.pi
+ANGLE_INCREMENT = 2 * math.pi / BEAMS
+
+
+def simulate_scan(grid: OccupancyGrid, pose, boxes=()) -> np.ndarray:
+    """地図の障害物と箱 (x0, y0, x1, y1) に対するレーザースキャン"""
+    distances = np.arange(0.05, 8.0, 0.01)
+    ranges = []
+    for angle in ANGLE_MIN + ANGLE_INCREMENT * np.arange(BEAMS) + pose[2]:
+        points = np.column_stack([
+            pose[0] + distances * math.cos(angle), pose[1] + distances * math.sin(angle)
+        ])
+        pixels = np.rint(grid.world_to_pixel(points)).astype(int)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < grid.width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < grid.height)
+        blocked = ~inside
+        blocked[inside] = grid.data[pixels[inside, 1], pixels[inside, 0]] == 100
+        for x0, y0, x1, y1 in boxes:
+            blocked |= (points[:, 0] >= x0) & (points[:, 0] <= x1) & (points[:, 1] >= y0) & (points[:, 1] <= y1)
+        hits = np.flatnonzero(blocked)
+        ranges.append(distances[hits[0]] if len(hits) else math.inf)
+    return np.asarray(ranges)
+
+
+class TestLaserOccupancy(unittest.TestCase):
+    """ローカルマップのテスト"""
+
+    def setUp(self):
+        # 中央の壁の下側（y が 0.15〜1.5 m）だけが通れる部屋
+        self.grid = OccupancyGrid.from_png_map(make_png_map(walled_room()), "map-1")
+
+    def integrate(self, occupancy, pose, boxes, scans=3):
+        ranges = simulate_scan(self.grid, pose, boxes)
+        for _ in range(scans):
+            occupancy.integrate(pose, ranges, ANGLE_MIN, ANGLE_INCREMENT, 0.05, 20.0, 6.0, now=100.0)
+
+    def test_scan_endpoints(self):
+        """ビームの終点をロボットの姿勢に合わせて投影し、反射なしは空きとして扱うこと"""
+        ends, hit = scan_endpoints((1.0, 2.0, math.pi / 2), [1.0, math.inf, math.nan], 0.0, math.pi / 2, 0.05, 10.0, 4.0)
+        self.assertEqual(hit.tolist(), [True, False])
+        np.testing.assert_allclose(ends, [[1.0, 3.0], [-3.0, 2.0]], atol=1e-9)
+
+    def test_static_map_has_no_changes(self):
+        """地図どおりの観測では何も報告しないこと"""
+        occupancy = LaserOccupancy(self.grid)
+        self.integrate(occupancy, (2.5, 1.0, 0.0), [])
+        self.assertEqual(occupancy.changes(now=100.0), [])
+
+    def test_reports_obstacles_and_blocked_corridor(self):
+        """新しい障害物を領域として報告し、通路をふさいでいるものを区別すること"""
+        occupancy = LaserOccupancy(self.grid)
+        doorway = (4.7, 0.1, 5.0, 1.6)
+        open_floor = (2.0, 3.0, 2.3, 3.3)
+        self.integrate(occupancy, (2.5, 1.0, 0.0), [doorway, open_floor])
+
+        regions = occupancy.changes(now=110.0)
+        self.assertEqual(len(regions), 2)
+        blocking = [region for region in regions if region["blocks_corridor"]]
+        self.assertEqual(len(blocking), 1)
+        self.assertAlmostEqual(blocking[0]["x"], 4.7, delta=0.1)
+        self.assertAlmostEqual(blocking[0]["y"], 0.85, delta=0.2)
+        self.assertEqual(blocking[0]["last_seen_sec_ago"], 10.0)
+
+        # 障害物を書き込んだ地図では壁の向こうに行けない
+        static = TravelModel(self.grid)
+        observed = TravelModel(occupancy.blocked_grid())
+        self.assertIsNotNone(static.path_length((2.5, 1.0), (7.5, 1.0)))
+        self.assertIsNone(observed.path_length((2.5, 1.0), (7.5, 1.0)))
+
+        # 障害物がなくなれば空きの観測で消える
+        self.integrate(occupancy, (2.5, 1.0, 0.0), [], scans=10)
+        self.assertEqual(occupancy.changes(now=120.0), [])
+
+    def test_old_obstacles_age_out(self):
+        """最後に観測してから max_age 秒を過ぎた障害物は報告しないこと"""
+        occupancy = LaserOccupancy(self.grid, max_age=60.0)
+        self.integrate(occupancy, (2.5, 1.0, 0.0), [(2.0, 3.0, 2.3, 3.3)])
+        self.assertEqual(len(occupancy.changes(now=150.0)), 1)
+        # 通過するビームがなく対数オッズが下がらなくても、古い観測は無視する
+        self.assertEqual(occupancy.changes(now=161.0), [])
+        np.testing.assert_array_equal(occupancy.blocked_grid(now=161.0).data, self.grid.data)
+
+    def test_label_regions(self):
+        """8近傍で連結したセルを1つの領域にまとめること"""
+        mask = np.zeros((5, 5), dtype=bool)
+        mask[0, 0] = mask[1, 1] = mask[4, 4] = True
+        self.assertEqual(sorted(len(region) for region in label_regions(mask)), [1, 2])
+
+
+class TestLocalMapAggregator(unittest.TestCase):
+    """ローカルマップの取得のテスト"""
+
+    def test_skips_scans_while_turning(self):
+        """スキャン中に大きく回転した場合は統合しないこと"""
+        grid = OccupancyGrid.from_png_map(make_png_map(walled_room()), "map-1")
+        client = MagicMock()
+        client.get_current_map_id = AsyncMock(return_value="map-1")
+        client.get_png_map = AsyncMock(return_value=make_png_map(walled_room()))
+        client.get_ros_laser_scan = AsyncMock(return_value=pb2.RosLaserScan(
+            ranges=simulate_scan(grid, (2.5, 1.0, 0.0)).tolist(),
+            angle_min=ANGLE_MIN,
+            angle_increment=ANGLE_INCREMENT,
+            range_min=0.05,
+            range_max=20.0,
+        ))
+        client.get_robot_pose = AsyncMock(side_effect=[
+            pb2.Pose(x=2.5, y=1.0, theta=0.0), pb2.Pose(x=2.5, y=1.0, theta=0.5),
+            pb2.Pose(x=2.5, y=1.0, theta=0.0), pb2.Pose(x=2.5, y=1.0, theta=0.0),
+        ])
+        local_map = KachakaMCPContext(client, KachakaMCPConfig()).local_map
+
+        async def run():
+            return [await local_map.sample(), await local_map.sample(), await local_map.changes()]
+
+        turning, still, changes = asyncio.run(run())
+        self.assertEqual(turning, 0)
+        self.assertGreater(still, 0)
+        self.assertEqual((local_map.skipped, changes["scans"], changes["new_obstacles"]), (1, 1, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
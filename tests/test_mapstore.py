@@ -0,0 +1,124 @@
+"""
+Tests for the content-addressed map store.
+"""
+
+import asyncio
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.cache import TTLCache
+from kachaka_mcp.mapstore import MapStore, export_map_to_store, import_map_from_file
+
+
+class FakeStub:
+    """マップの転送だけを持つ gRPC スタブ"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.imported = []
+
+    def ExportMap(self, request):
+        async def stream():
+            for i in range(0, len(self.data), 4):
+                yield pb2.ExportMapResponse(middle_of_stream=pb2.ExportMapResponse.MiddleOfStream(data=self.data[i:i + 4]))
+            yield pb2.ExportMapResponse(end_of_stream=pb2.ExportMapResponse.EndOfStream(result=pb2.Result(success=True)))
+        return stream()
+
+    async def ImportMap(self, requests):
+        data = b"".join([request.data async for request in requests])
+        self.imported.append(data)
+        return pb2.ImportMapResponse(result=pb2.Result(success=True), map_id=f"imported-{len(self.imported)}")
+
+
+class TestMapStore(unittest.TestCase):
+    """マップの保存先のテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.data = b"kachaka map data" * 10
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+        self.stub = FakeStub(self.data)
+        client = MagicMock()
+        client.stub = self.stub
+        client.get_robot_serial_number = AsyncMock(return_value="BKP40HD1T")
+        client.get_map_list = AsyncMock(return_value=[])
+        self.context = MagicMock()
+        self.context.kachaka_client = client
+        self.context.cache = TTLCache(30.0)
+        self.context.map_store = MapStore(self.root / "store")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_export_hashes_and_stores(self):
+        """エクスポートしたマップをハッシュごとに保存し、進捗を通知すること"""
+        progress = []
+
+        async def report(done, total):
+            progress.append(done)
+
+        output = self.root / "map.kmap"
+        result = asyncio.run(export_map_to_store(self.context, "map-1", str(output), report))
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["sha256"], self.digest)
+        self.assertEqual(output.read_bytes(), self.data)
+        self.assertEqual(self.context.map_store.object_path(self.digest).read_bytes(), self.data)
+        self.assertEqual(self.context.map_store.lookup("BKP40HD1T", self.digest), "map-1")
+        self.assertEqual(progress[-1], len(self.data))
+        self.assertEqual(len(progress), len(self.data) // 4)
+
+        # 同じ内容であれば出力先を書き換えない
+        again = asyncio.run(export_map_to_store(self.context, "map-1", str(output)))
+        self.assertFalse(again["output_written"])
+
+    def test_import_skips_known_map(self):
+        """ロボットに同じ内容のマップがある場合は転送を省略すること"""
+        path = self.root / "map.kmap"
+        path.write_bytes(self.data)
+        progress = []
+
+        async def report(done, total):
+            progress.append((done, total))
+
+        first = asyncio.run(import_map_from_file(self.context, str(path), chunk_size=64, progress=report))
+        self.assertFalse(first["skipped"])
+        self.assertEqual(self.stub.imported, [self.data])
+        self.assertEqual(progress[-1], (len(self.data), len(self.data)))
+
+        self.context.kachaka_client.get_map_list.return_value = [pb2.MapListEntry(id="imported-1")]
+        # ハッシュを指定しても保存先から読み込める
+        second = asyncio.run(import_map_from_file(self.context, self.digest))
+        self.assertTrue(second["skipped"])
+        self.assertEqual(second["map_id"], "imported-1")
+        self.assertEqual(len(self.stub.imported), 1)
+
+        # ロボットから削除された場合や force の場合は転送する
+        self.context.kachaka_client.get_map_list.return_value = []
+        third = asyncio.run(import_map_from_file(self.context, str(path)))
+        self.assertFalse(third["skipped"])
+        forced = asyncio.run(import_map_from_file(self.context, str(path), force=True))
+        self.assertFalse(forced["skipped"])
+        self.assertEqual(len(self.stub.imported), 3)
+
+    def test_concurrent_records_are_kept(self):
+        """複数のロボットへの同時のインポートで記録が失われないこと"""
+        store = self.context.map_store
+        robots = [f"robot-{i}" for i in range(16)]
+
+        async def run():
+            await asyncio.gather(*(asyncio.to_thread(store.record, robot, self.digest, "map-1") for robot in robots))
+
+        asyncio.run(run())
+        self.assertEqual([store.lookup(robot, self.digest) for robot in robots], ["map-1"] * len(robots))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests for the temporal object memory.
+"""
+
+import asyncio
+import math
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.object_memory import Camera, ObjectMemory, project_detection
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+CAMERA = Camera.from_fov(1280, 90.0)
+
+
+def detection(label, u, distance, score=0.9, width=40):
+    """画像の列 u を中心とする検出結果"""
+    return pb2.ObjectDetection(
+        label=label,
+        roi=pb2.RegionOfInterest(x_offset=int(u - width / 2), y_offset=100, width=width, height=80),
+        score=score,
+        distance_median=distance,
+    )
+
+
+class TestObjectMemory(unittest.TestCase):
+    """物体の記憶のテスト"""
+
+    def test_projection(self):
+        """画像の中心・左端の検出をロボットの向きに合わせて投影すること"""
+        x, y = project_detection((1.0, 2.0, math.pi / 2), CAMERA, detection(pb2.OBJECT_LABEL_SHELF, 640, 2.0))
+        self.assertAlmostEqual(x, 1.0, places=6)
+        self.assertAlmostEqual(y, 4.0, places=6)
+        # 左端は 45 度左
+        x, y = project_detection((0.0, 0.0, 0.0), CAMERA, detection(pb2.OBJECT_LABEL_SHELF, 0, math.sqrt(2), width=0))
+        self.assertAlmostEqual(x, 1.0, places=6)
+        self.assertAlmostEqual(y, 1.0, places=6)
+
+    def test_merges_sightings_and_queries(self):
+        """繰り返しの目撃を1つの物体にまとめ、ラベルと位置で検索できること"""
+        memory = ObjectMemory(merge_radius=0.5)
+        # 異なる位置から同じ棚を見る（(3, 0) にある）
+        memory.observe((0.0, 0.0, 0.0), CAMERA, [detection(pb2.OBJECT_LABEL_SHELF, 640, 3.0)], now=100.0)
+        memory.observe((3.0, -2.0, math.pi / 2), CAMERA, [detection(pb2.OBJECT_LABEL_SHELF, 640, 2.1)], now=110.0)
+        memory.observe(
+            (0.0, 0.0, math.pi),
+            CAMERA,
+            [detection(pb2.OBJECT_LABEL_DOOR, 640, 2.0), detection(pb2.OBJECT_LABEL_PERSON, 600, 1.0)],
+            now=120.0,
+            ignore_labels=["person"],
+        )
+
+        self.assertEqual(len(memory.objects), 2)
+        shelves = memory.query(label="shelf", now=120.0)
+        self.assertEqual(len(shelves), 1)
+        self.assertEqual(shelves[0]["sightings"], 2)
+        self.assertAlmostEqual(shelves[0]["x"], 3.0, delta=0.1)
+        self.assertEqual(shelves[0]["last_seen_sec_ago"], 10.0)
+
+        nearest = memory.query(near=(-1.5, 0.0), k=1, now=120.0)
+        self.assertEqual(nearest[0]["label"], "door")
+        self.assertAlmostEqual(nearest[0]["distance_m"], 0.5, delta=0.01)
+        self.assertEqual(memory.query(near=(3.0, 0.0), radius=1.0, label="door", now=120.0), [])
+
+    def test_forgets_objects_missing_from_view(self):
+        """視野内で繰り返し検出されなかった物体を忘れること"""
+        memory = ObjectMemory()
+        memory.observe((0.0, 0.0, 0.0), CAMERA, [detection(pb2.OBJECT_LABEL_SHELF, 640, 2.0, score=0.6)], now=0.0)
+        # 後ろを向いている間は信頼度を下げない
+        memory.observe((0.0, 0.0, math.pi), CAMERA, [], now=1.0)
+        self.assertAlmostEqual(memory.query(now=1.0, half_life_sec=math.inf)[0]["confidence"], 0.6)
+        for step in range(20):
+            memory.observe((0.0, 0.0, 0.0), CAMERA, [], now=2.0 + step)
+        self.assertEqual(memory.objects, {})
+
+    def test_aggregator_resets_on_map_change(self):
+        """マップが変わった場合は記憶を消去すること"""
+        client = MagicMock()
+        client.get_current_map_id = AsyncMock(return_value="map-1")
+        client.get_front_camera_ros_camera_info = AsyncMock(side_effect=RuntimeError("no camera"))
+        client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=0.0, y=0.0, theta=0.0))
+        client.get_object_detection = AsyncMock(
+            return_value=(pb2.RosHeader(), [detection(pb2.OBJECT_LABEL_CHARGER, 640, 1.0)])
+        )
+        context = KachakaMCPContext(client, KachakaMCPConfig(cache_ttl_sec=0.0))
+        aggregator = context.object_memory
+
+        self.assertEqual(asyncio.run(aggregator.sample()), 1)
+        self.assertEqual(aggregator.query(label="charger")[0]["x"], 1.1)
+        client.get_current_map_id.return_value = "map-2"
+        client.get_object_detection.return_value = (pb2.RosHeader(), [])
+        asyncio.run(aggregator.sample())
+        self.assertEqual(aggregator.memory.map_id, "map-2")
+        self.assertEqual(aggregator.query(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Tests for the delivery planner.
+"""
+
+import asyncio
+import itertools
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.cache import TTLCache
+from kachaka_mcp.planner import MAX_PLAN_JOBS, plan_deliveries, plan_order, route_length
+
+
+class TestPlanOrder(unittest.TestCase):
+    """実行順序の計画のテスト"""
+
+    def test_close_to_brute_force(self):
+        """少数のジョブでは総当たりの最適解に近い順序を返すこと"""
+        rng = np.random.default_rng(1)
+        for _ in range(20):
+            start = rng.uniform(-10, 10, size=2)
+            pickups = rng.uniform(-10, 10, size=(6, 2))
+            dropoffs = rng.uniform(-10, 10, size=(6, 2))
+            order, cost = plan_order(start, pickups, dropoffs)
+
+            self.assertEqual(sorted(order), list(range(6)))
+            self.assertAlmostEqual(cost, route_length(order, start, pickups, dropoffs))
+            best = min(
+                route_length(p, start, pickups, dropoffs)
+                for p in itertools.permutations(range(6))
+            )
+            self.assertLessEqual(cost, best * 1.1)
+            self.assertLessEqual(cost, route_length(range(6), start, pickups, dropoffs) + 1e-9)
+
+    def test_chain(self):
+        """目的地が次の棚の位置になる場合はその順に並べること"""
+        start = (0.0, 0.0)
+        pickups = [(3.0, 0.0), (1.0, 0.0), (2.0, 0.0)]
+        dropoffs = [(4.0, 0.0), (2.0, 0.0), (3.0, 0.0)]
+        order, cost = plan_order(start, pickups, dropoffs)
+        self.assertEqual(order, [1, 2, 0])
+        self.assertAlmostEqual(cost, 4.0)
+
+    def test_empty(self):
+        """ジョブがない場合"""
+        self.assertEqual(plan_order((0.0, 0.0), [], []), ([], 0.0))
+
+    def test_time_budget(self):
+        """改善は時間の上限で打ち切り、その時点の順序を返すこと"""
+        rng = np.random.default_rng(1)
+        pickups = rng.uniform(0, 20, (MAX_PLAN_JOBS, 2))
+        dropoffs = rng.uniform(0, 20, (MAX_PLAN_JOBS, 2))
+        started = time.monotonic()
+        order, cost = plan_order((0.0, 0.0), pickups, dropoffs, time_budget_sec=0.1)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(sorted(order), list(range(MAX_PLAN_JOBS)))
+        self.assertAlmostEqual(cost, route_length(order, (0.0, 0.0), pickups, dropoffs))
+
+
+class TestPlanDeliveries(unittest.TestCase):
+    """配送計画のテスト"""
+
+    def setUp(self):
+        client = MagicMock()
+        client.get_locations = AsyncMock(side_effect=lambda: [
+            pb2.Location(id="L01", name="Kitchen", pose=pb2.Pose(x=10.0, y=0.0)),
+            pb2.Location(id="L02", name="Bedroom", pose=pb2.Pose(x=2.0, y=0.0)),
+        ])
+        client.get_shelves = AsyncMock(side_effect=lambda: [
+            pb2.Shelf(id="S01", name="Shelf A", pose=pb2.Pose(x=9.0, y=0.0)),
+            pb2.Shelf(id="S02", name="Shelf B", pose=pb2.Pose(x=1.0, y=0.0)),
+        ])
+        client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=0.0, y=0.0))
+        self.context = MagicMock()
+        self.context.kachaka_client = client
+        self.context.cache = TTLCache(30.0)
+        self.context.config.name_aliases = {}
+        self.context.config.name_match_threshold = 0.6
+        self.context.name_index = None
+        self.context.name_index_source = None
+
+    def test_reorders_jobs(self):
+        """近い棚から運ぶ順序に並べ替えること"""
+        plan = asyncio.run(plan_deliveries(self.context, [
+            {"shelf": "Shelf A", "location": "Kitchen"},
+            {"shelf": "S02", "location": "bedroom"},
+        ]))
+        self.assertEqual(plan["order"], [1, 0])
+        self.assertEqual([job.shelf_name for job in plan["jobs"]], ["Shelf B", "Shelf A"])
+        self.assertEqual(plan["jobs"][0].location_name, "Bedroom")
+        self.assertEqual([(job.shelf_id, job.location_id) for job in plan["jobs"]], [("S02", "L02"), ("S01", "L01")])
+        self.assertLess(plan["estimated_distance_m"], plan["requested_order_distance_m"])
+
+    def test_errors(self):
+        """名前が解決できない場合や同じ棚が重複する場合はエラーを返すこと"""
+        plan = asyncio.run(plan_deliveries(self.context, [
+            {"shelf": "Shelf A", "location": "Garage"},
+            {"shelf": "Shelf B", "location": "Kitchen"},
+            {"shelf": "Shelf B", "location": "Bedroom"},
+        ]))
+        self.assertEqual(len(plan["errors"]), 2)
+        self.assertIn("Location 'Garage' not found", plan["errors"][0])
+        self.assertIn("more than one job", plan["errors"][1])
+
+    def test_too_many_jobs(self):
+        """ジョブが多すぎる場合は計画しないこと"""
+        jobs = [{"shelf": "Shelf A", "location": "Kitchen"}] * (MAX_PLAN_JOBS + 1)
+        plan = asyncio.run(plan_deliveries(self.context, jobs))
+        self.assertIn("Too many jobs", plan["errors"][0])
+        self.context.kachaka_client.get_shelves.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests for on-demand profiling and the admin tools.
+"""
+
+import asyncio
+import pstats
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from kachaka_mcp.auth import AdminRequired, KachakaAuthProvider, current_api_key
+from kachaka_mcp.profiling import Profiler
+from kachaka_mcp.resources import register_admin_resources
+from kachaka_mcp.server import KachakaFastMCP, _reset_context
+
+
+def busy_work(seconds):
+    """イベントループのスレッドを占有する処理"""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    """プロファイラーのテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        config = SimpleNamespace(profile_dir=self.tmp.name, profile_max_sec=0.5, profile_keep=2)
+        self.profiler = Profiler(SimpleNamespace(config=config))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sampling_profile_stops_by_itself(self):
+        """計測時間を上限で制限し、時間が来たら自動的に停止して要約を保存すること"""
+        async def run():
+            duration = self.profiler.start("sampling", duration_sec=30.0, interval_ms=1.0)
+            with self.assertRaises(RuntimeError):
+                self.profiler.start("cprofile")
+            busy_work(0.2)
+            await asyncio.sleep(duration + 0.1)
+            return duration
+
+        self.assertEqual(asyncio.run(run()), 0.5)
+        self.assertFalse(self.profiler.running)
+        result = self.profiler.stop()
+        self.assertIn("busy_work", result["summary"])
+        folded = self.profiler.read(result["file"]).decode()
+        self.assertIn("test_profiling.py:busy_work", folded)
+        with self.assertRaises(FileNotFoundError):
+            self.profiler.read("../" + result["file"])
+
+    def test_cprofile_keeps_latest_files(self):
+        """cProfile の結果は pstats で読め、古いファイルは profile_keep 個を超えたら削除すること"""
+        async def run():
+            for _ in range(3):
+                self.profiler.start("cprofile", duration_sec=10.0)
+                busy_work(0.01)
+                result = self.profiler.stop(top=5)
+            return result
+
+        result = asyncio.run(run())
+        self.assertIn("busy_work", result["summary"])
+        self.assertEqual([f["name"] for f in self.profiler.files()][0], result["file"])
+        self.assertEqual(len(self.profiler.files()), 2)
+        stats = pstats.Stats(str(Path(self.tmp.name) / result["file"]))
+        self.assertTrue(any(func[2] == "busy_work" for func in stats.stats))
+
+    def test_memory_snapshot_diff(self):
+        """最初の呼び出しでトレースを開始し、以降は上位の割り当てと前回からの増加を返すこと"""
+        try:
+            self.assertIn("Started tracemalloc", self.profiler.memory_snapshot())
+            self.assertIn("top allocators", self.profiler.memory_snapshot(top=5))
+            retained = [bytearray(1024) for _ in range(1000)]
+            report = self.profiler.memory_snapshot(top=5)
+            self.assertIn("growth since previous snapshot", report)
+            self.assertIn("test_profiling.py", report.split("growth since previous snapshot")[1])
+            del retained
+        finally:
+            self.assertEqual(self.profiler.stop_memory_tracing(), "Stopped tracemalloc")
+
+
+class TestAdminAccess(unittest.TestCase):
+    """管理者用のリソースの認可のテスト"""
+
+    def test_admin_key_required(self):
+        """認証が有効な場合、管理者のAPIキーでだけ読めること"""
+        env = {"KACHAKA_MCP_API_KEYS": "user-key", "KACHAKA_MCP_ADMIN_API_KEYS": "admin-key"}
+        with patch.dict("os.environ", env):
+            auth_provider = KachakaAuthProvider()
+        mcp = KachakaFastMCP("test")
+        mcp.auth_provider = auth_provider
+        self.addCleanup(_reset_context)
+        register_admin_resources(mcp)
+
+        async def read(api_key):
+            token = current_api_key.set(api_key)
+            try:
+                return await mcp.read_resource("admin://tasks")
+            finally:
+                current_api_key.reset(token)
+
+        with self.assertRaises(AdminRequired):
+            asyncio.run(read("user-key"))
+        contents = asyncio.run(read("admin-key"))
+        self.assertIn("tasks", contents[0].content)
+        self.assertTrue(asyncio.run(auth_provider.validate_client_credentials("", "admin-key")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests for the on-disk camera ring buffer.
+"""
+
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.recorder import FrameRing, parse_time
+from kachaka_mcp.server import KachakaMCPContext
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+def frame(i: int) -> bytes:
+    """フレームの代わりのバイト列（長さを変える）"""
+    return b"\xff\xd8" + bytes([i % 256]) * (100 + i % 7) + b"\xff\xd9"
+
+
+class TestFrameRing(unittest.TestCase):
+    """リングバッファのテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bounded_and_searchable(self):
+        """ディスク使用量を超えたら古いセグメントから上書きし、時刻で検索できること"""
+        ring = FrameRing(self.root, segments=3, segment_bytes=1000)
+        for i in range(100):
+            ring.append(1000.0 + i, frame(i))
+
+        stats = ring.stats()
+        self.assertLessEqual(stats["bytes"], 3000)
+        self.assertEqual(stats["end"], 1099.0)
+        # 古いフレームは上書きされている
+        self.assertEqual(ring.find(1000.0, 1010.0), [])
+
+        refs = ring.find(1090.0, 1095.5)
+        self.assertEqual([ref.time for ref in refs], [1090.0 + i for i in range(6)])
+        self.assertEqual(ring.read(refs[2]), frame(92))
+        self.assertEqual(ring.nearest(1094.6).time, 1095.0)
+
+        # 上書きされたフレームは読めない
+        old = ring.find(stats["start"], stats["start"])[0]
+        for i in range(100, 130):
+            ring.append(1000.0 + i, frame(i))
+        self.assertIsNone(ring.read(old))
+        ring.close()
+
+    def test_reopen(self):
+        """再起動後も記録を引き継ぐこと"""
+        ring = FrameRing(self.root, segments=4, segment_bytes=500)
+        for i in range(20):
+            ring.append(2000.0 + i, frame(i))
+        ring.close()
+
+        ring = FrameRing(self.root, segments=4, segment_bytes=500)
+        self.assertEqual(ring.find(2019.0, 2019.0)[0].time, 2019.0)
+        ring.append(2020.0, frame(20))
+        self.assertEqual(ring.read(ring.nearest(2020.0)), frame(20))
+        self.assertEqual(ring.stats()["frames"], len(ring.find(0.0, 3000.0)))
+        ring.close()
+
+    def test_parse_time(self):
+        """UNIX時刻と ISO 8601 形式を受け付けること"""
+        self.assertEqual(parse_time("1700000000.5"), 1700000000.5)
+        self.assertEqual(parse_time("2023-11-14T22:13:20Z"), 1700000000.0)
+
+
+class TestCameraRecorder(unittest.TestCase):
+    """カメラ画像の記録のテスト"""
+
+    def test_records_raw_frames(self):
+        """取得したJPEGをそのまま記録すること"""
+        with tempfile.TemporaryDirectory() as tmp:
+            client = MagicMock()
+            client.get_front_camera_ros_compressed_image = AsyncMock(
+                side_effect=[pb2.RosCompressedImage(data=frame(i)) for i in range(1000)]
+            )
+            config = KachakaMCPConfig(camera_record_dir=tmp, camera_record_fps=50.0)
+            recorder = KachakaMCPContext(client, config).camera_recorder
+
+            async def run():
+                recorder.start(["front"])
+                await asyncio.sleep(0.2)
+                recorder.stop()
+                refs = await recorder.frames("front", 0.0, 1e12)
+                return refs, await recorder.read("front", refs[0])
+
+            refs, first = asyncio.run(run())
+            recorder.close()
+            self.assertGreaterEqual(len(refs), 3)
+            self.assertEqual(first, frame(0))
+            with self.assertRaises(ValueError):
+                recorder.ring("tof")
+
+
+if __name__ == '__main__':
+    unittest.main()
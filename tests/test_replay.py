@@ -0,0 +1,101 @@
+"""
+Tests for recording and replaying robot gRPC traffic.
+"""
+
+import asyncio
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import grpc
+from kachaka_api.aio import KachakaApiClient
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.replay import ReplayStub, read_recording, record_client, replay_client
+
+
+class FakeStub:
+    """応答を順に返すロボットのスタブ"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.poses = iter([pb2.Pose(x=1.0), pb2.Pose(x=2.0)])
+
+    async def GetRobotPose(self, request):
+        await asyncio.sleep(self.latency)
+        return pb2.GetRobotPoseResponse(pose=next(self.poses))
+
+    async def GetBatteryInfo(self, request):
+        raise grpc.aio.AioRpcError(
+            grpc.StatusCode.DEADLINE_EXCEEDED, grpc.aio.Metadata(), grpc.aio.Metadata(), "timeout"
+        )
+
+
+class TestTrafficReplay(unittest.TestCase):
+    """gRPC の記録と再生のテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, name, latency=0.0):
+        path = Path(self.tmp.name) / name
+
+        async def run():
+            client = KachakaApiClient(target="127.0.0.1:26400")
+            client.stub = FakeStub(latency)
+            recorder = record_client(client, path)
+            poses = [await client.get_robot_pose(), await client.get_robot_pose()]
+            with self.assertRaises(grpc.aio.AioRpcError):
+                await client.get_battery_info()
+            recorder.close()
+            return poses
+
+        return path, asyncio.run(run())
+
+    def test_replays_recorded_session(self):
+        """記録した応答とエラーを同じ順序で返し、記録を使い切ったら最後の応答を繰り返すこと"""
+        for name in ("session.bin", "session.bin.gz"):
+            path, recorded = self.record(name)
+            _, calls = read_recording(path)
+            self.assertEqual([call.method for call in calls], ["GetRobotPose", "GetRobotPose", "GetBatteryInfo"])
+
+            async def run():
+                client = replay_client(path, speed=0)
+                poses = [await client.get_robot_pose() for _ in range(3)]
+                with self.assertRaises(grpc.aio.AioRpcError) as raised:
+                    await client.get_battery_info()
+                return poses, raised.exception.code(), client.stub.stats()
+
+            poses, code, stats = asyncio.run(run())
+            self.assertEqual([pose.x for pose in poses], [pose.x for pose in recorded] + [2.0])
+            self.assertEqual(code, grpc.StatusCode.DEADLINE_EXCEEDED)
+            self.assertEqual((stats["served"], stats["misses"], stats["unused"]), (4, 1, 0))
+
+    def test_accelerated_replay(self):
+        """記録したレイテンシーを速さで割った時間だけ待つこと"""
+        path, _ = self.record("slow.bin", latency=0.2)
+        stub = ReplayStub.load(path, speed=10.0)
+
+        async def run():
+            started = time.monotonic()
+            await stub.GetRobotPose(pb2.GetRequest())
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(run())
+        self.assertLess(elapsed, 0.1)
+        self.assertGreaterEqual(stub.stats()["replayed_latency_sec"], 0.2)
+
+    def test_truncated_recording(self):
+        """書き込み途中で止まった記録は読めたところまで再生すること"""
+        path, _ = self.record("cut.bin")
+        path.write_bytes(path.read_bytes()[:-3])
+        _, calls = read_recording(path)
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Tests for location and shelf name resolution.
+"""
+
+import unittest
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.resolver import build_name_index, normalize_name
+
+
+class TestNameResolution(unittest.TestCase):
+    """名前解決のテスト"""
+
+    def setUp(self):
+        locations = [
+            pb2.Location(id="L01", name="キッチン"),
+            pb2.Location(id="L02", name="Living Room"),
+            pb2.Location(id="L03", name="Bedroom"),
+            pb2.Location(id="L04", name="Bathroom"),
+        ]
+        shelves = [
+            pb2.Shelf(id="S01", name="本棚", recognizable_names=[pb2.RecognizableName(name="ほんだな")]),
+            pb2.Shelf(id="S02", name="Snack Shelf"),
+        ]
+        self.index = build_name_index(locations, shelves, {"kitchen": "キッチン"})
+
+    def test_normalize(self):
+        """全角・半角、カタカナ・ひらがな、大文字・小文字を区別しないこと"""
+        self.assertEqual(normalize_name("ｷｯﾁﾝ"), normalize_name("きっちん"))
+        self.assertEqual(normalize_name("Ｌｉｖｉｎｇ　Ｒｏｏｍ"), "livingroom")
+
+    def test_exact(self):
+        """ID・正規化した名前・別名で解決できること"""
+        self.assertEqual(self.index.resolve("L03", "location").entry.id, "L03")
+        self.assertEqual(self.index.resolve("living-room", "location").entry.id, "L02")
+        self.assertEqual(self.index.resolve("Kitchen", "location").entry.id, "L01")
+        self.assertEqual(self.index.resolve("ホンダナ", "shelf").entry.id, "S01")
+
+    def test_fuzzy(self):
+        """綴りの誤りを解決し、曖昧な場合は候補を返すこと"""
+        resolution = self.index.resolve("Livng Rom", "location")
+        self.assertEqual(resolution.entry.id, "L02")
+        self.assertFalse(resolution.exact)
+
+        # Bedroom と Bathroom のどちらとも取れる場合は解決しない
+        resolution = self.index.resolve("Bdroom", "location")
+        self.assertTrue(resolution.found)
+        ambiguous = self.index.resolve("B room", "location")
+        self.assertFalse(ambiguous.found)
+        self.assertEqual({entry.id for entry, _ in ambiguous.suggestions[:2]}, {"L03", "L04"})
+        self.assertIn("Did you mean", ambiguous.not_found_message("location"))
+
+    def test_kind(self):
+        """種類が異なる対象には解決しないこと"""
+        self.assertFalse(self.index.resolve("S02", "location").found)
+        self.assertEqual(self.index.resolve("snack shelf", "shelf").entry.id, "S02")
+
+
+if __name__ == '__main__':
+    unittest.main()
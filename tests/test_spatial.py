@@ -0,0 +1,82 @@
+"""
+Tests for the spatial index.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp.cache import TTLCache
+from kachaka_mcp.spatial import SpatialIndex, get_spatial_index
+
+
+class TestSpatialIndex(unittest.TestCase):
+    """空間インデックスのテスト"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.points = rng.uniform(-20, 20, size=(200, 2))
+        self.kinds = ["location" if i % 3 else "shelf" for i in range(200)]
+        self.index = SpatialIndex(
+            self.points,
+            [f"id{i}" for i in range(200)],
+            [f"name{i}" for i in range(200)],
+            self.kinds,
+            cell_size=2.0,
+        )
+
+    def brute_force(self, x, y, kind=None):
+        """総当たりでの距離順"""
+        dist = np.hypot(self.points[:, 0] - x, self.points[:, 1] - y)
+        order = [i for i in np.argsort(dist, kind="stable") if kind is None or self.kinds[i] == kind]
+        return order, dist
+
+    def test_nearest_matches_brute_force(self):
+        """最近傍検索が総当たりと一致すること"""
+        for x, y in [(0.0, 0.0), (19.5, -19.5), (100.0, 3.0), (-7.3, 12.1)]:
+            for kind in (None, "shelf"):
+                order, _ = self.brute_force(x, y, kind)
+                result = [i for i, _ in self.index.nearest(x, y, k=5, kind=kind)]
+                self.assertEqual(result, order[:5])
+
+    def test_within_radius_matches_brute_force(self):
+        """半径検索が総当たりと一致すること"""
+        for radius in (0.5, 3.0, 50.0):
+            order, dist = self.brute_force(1.0, -2.0)
+            expected = [i for i in order if dist[i] <= radius]
+            result = [i for i, _ in self.index.within_radius(1.0, -2.0, radius)]
+            self.assertEqual(result, expected)
+
+    def test_rebuilt_when_cache_reloads(self):
+        """場所・棚のキャッシュが再読み込みされたらインデックスを作り直すこと"""
+        client = MagicMock()
+        # ロボットは呼び出しごとに新しい一覧を返す
+        client.get_locations = AsyncMock(side_effect=lambda: [
+            pb2.Location(id="L01", name="Kitchen", pose=pb2.Pose(x=1.0, y=0.0)),
+        ])
+        client.get_shelves = AsyncMock(side_effect=lambda: [])
+        context = MagicMock()
+        context.kachaka_client = client
+        context.cache = TTLCache(30.0)
+        context.config.spatial_cell_size = 1.0
+        context.spatial_index = None
+        context.spatial_index_source = None
+
+        async def run():
+            first = await get_spatial_index(context)
+            second = await get_spatial_index(context)
+            context.cache.invalidate()
+            third = await get_spatial_index(context)
+            return first, second, third
+
+        first, second, third = asyncio.run(run())
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertEqual(first.describe(0, 1.0)["name"], "Kitchen")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+"""
+Tests for tracing spans.
+"""
+
+import asyncio
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import grpc
+from kachaka_api.aio import KachakaApiClient
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+from kachaka_mcp import server as server_module
+from kachaka_mcp.tracing import ChromeTraceWriter, OTLPExporter, Tracer, span
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+class FakeStub:
+    """ロボットのスタブ"""
+
+    async def GetRobotPose(self, request):
+        await asyncio.sleep(0.01)
+        return pb2.GetRobotPoseResponse(pose=pb2.Pose(x=1.0))
+
+    async def GetBatteryInfo(self, request):
+        raise grpc.aio.AioRpcError(
+            grpc.StatusCode.UNAVAILABLE, grpc.aio.Metadata(), grpc.aio.Metadata(), "offline"
+        )
+
+
+def read_events(root):
+    """トレースのファイルの完了イベント（古い順）"""
+    events = []
+    for path in sorted(Path(root).glob("trace-*.json")):
+        events += [e for e in json.loads(path.read_text()) if e["ph"] == "X"]
+    return events
+
+
+class TestTracer(unittest.TestCase):
+    """スパンの記録のテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_nested_spans_share_trace(self):
+        """子のスパンが同じトレース・同じ行に記録され、gRPC の呼び出しとエラーも記録すること"""
+        tracer = Tracer(1.0, ChromeTraceWriter(self.tmp.name))
+
+        async def run():
+            # チャンネルはイベントループに結び付くため、ループの中で作る
+            client = KachakaApiClient(target="127.0.0.1:26400")
+            client.stub = FakeStub()
+            tracer.instrument(client)
+            tracer.instrument(client)
+            with tracer.span("tool/get_pose", "tool", tool="get_pose"):
+                await client.stub.GetRobotPose(pb2.GetRequest())
+                with span("wait_for_completion", "wait"):
+                    await asyncio.sleep(0.01)
+            try:
+                await client.stub.GetBatteryInfo(pb2.GetRequest())
+            except grpc.aio.AioRpcError:
+                pass
+
+        asyncio.run(run())
+        tracer.close()
+
+        events = read_events(self.tmp.name)
+        by_name = {e["name"]: e for e in events}
+        self.assertEqual(
+            [e["name"] for e in events],
+            ["grpc/GetRobotPose", "wait_for_completion", "tool/get_pose", "grpc/GetBatteryInfo"],
+        )
+        root = by_name["tool/get_pose"]
+        for name in ("grpc/GetRobotPose", "wait_for_completion"):
+            self.assertEqual(by_name[name]["tid"], root["tid"])
+            self.assertEqual(by_name[name]["args"]["trace_id"], root["args"]["trace_id"])
+            self.assertGreaterEqual(by_name[name]["ts"], root["ts"])
+        self.assertGreaterEqual(by_name["grpc/GetRobotPose"]["dur"], 10000)
+        failed = by_name["grpc/GetBatteryInfo"]
+        self.assertNotEqual(failed["tid"], root["tid"])
+        self.assertEqual(failed["args"]["status"], "UNAVAILABLE")
+        self.assertEqual(failed["args"]["error"], "AioRpcError")
+
+    def test_sampling_is_decided_per_trace(self):
+        """記録しないトレースの子のスパンは記録せず、トレースの外では何もしないこと"""
+        tracer = Tracer(0.5, ChromeTraceWriter(self.tmp.name))
+
+        for _ in range(200):
+            with tracer.span("tool/speak", "tool"):
+                with tracer.span("handler", "handler"):
+                    pass
+        with span("wait_for_completion", "wait"):
+            pass
+        tracer.close()
+
+        events = read_events(self.tmp.name)
+        roots = [e for e in events if e["name"] == "tool/speak"]
+        handlers = [e for e in events if e["name"] == "handler"]
+        self.assertEqual(len(roots), len(handlers))
+        self.assertEqual(len(events), tracer.recorded)
+        self.assertTrue(20 < len(roots) < 180)
+
+        disabled = Tracer(0.0, ChromeTraceWriter(Path(self.tmp.name) / "off"))
+        self.assertFalse(disabled.enabled)
+        with disabled.span("tool/speak", "tool") as current:
+            current.set(ignored=True)
+        self.assertEqual(disabled.recorded, 0)
+        self.assertFalse((Path(self.tmp.name) / "off").exists())
+
+    def test_background_task_starts_new_trace(self):
+        """トレースの中で開始したタスクのスパンは、トレースの終了後は新しいトレースになること"""
+        tracer = Tracer(1.0, ChromeTraceWriter(self.tmp.name))
+
+        async def run():
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def poll():
+                started.set()
+                await release.wait()
+                with tracer.span("grpc/GetLastCommandResult", "grpc"):
+                    pass
+
+            with tracer.span("tool/move_shelf", "tool"):
+                task = asyncio.ensure_future(poll())
+                await started.wait()
+            release.set()
+            await task
+
+        asyncio.run(run())
+        tracer.close()
+
+        # ルートのスパンは release.set() の前に閉じるため、先に書かれる
+        root, poll = read_events(self.tmp.name)
+        self.assertEqual(root["name"], "tool/move_shelf")
+        self.assertNotEqual(poll["tid"], root["tid"])
+        self.assertNotEqual(poll["args"]["trace_id"], root["args"]["trace_id"])
+
+    def test_rotation_keeps_latest_files(self):
+        """ファイルをサイズで切り替え、閉じたファイルは JSON として読め、古いものは削除すること"""
+        writer = ChromeTraceWriter(self.tmp.name, file_bytes=2000, files=3)
+        tracer = Tracer(1.0, writer)
+        for i in range(100):
+            with tracer.span(f"tool/t{i}", "tool"):
+                pass
+        tracer.close()
+
+        files = writer.list_files()
+        self.assertEqual(len(files), 3)
+        for path in files:
+            self.assertTrue(json.loads(path.read_text()))
+        self.assertEqual(read_events(self.tmp.name)[-1]["name"], "tool/t99")
+
+        # 再起動後は続きの番号のファイルに書く
+        tracer = Tracer(1.0, ChromeTraceWriter(self.tmp.name, file_bytes=2000, files=3))
+        with tracer.span("tool/after", "tool"):
+            pass
+        tracer.close()
+        latest = ChromeTraceWriter(self.tmp.name).list_files()[-1]
+        self.assertGreater(latest.name, files[-1].name)
+
+
+class TestOTLPExporter(unittest.TestCase):
+    """OTLP のコレクターへの送信のテスト"""
+
+    def test_exports_batches_to_collector(self):
+        """スパンを OTLP/HTTP の JSON で送り、親子関係と属性を保つこと"""
+        received = []
+
+        class Collector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                received.append((self.path, self.headers["Content-Type"], json.loads(body)))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        collector = HTTPServer(("127.0.0.1", 0), Collector)
+        thread = threading.Thread(target=collector.serve_forever, daemon=True)
+        thread.start()
+        try:
+            endpoint = f"http://127.0.0.1:{collector.server_port}/v1/traces"
+            exporter = OTLPExporter(endpoint, "test-robot", interval_sec=0.05)
+            tracer = Tracer(1.0, exporter=exporter)
+            with tracer.span("tool/move_shelf", "tool", tool="move_shelf"):
+                with tracer.span("grpc/StartCommand", "grpc", method="StartCommand"):
+                    pass
+            tracer.close()
+        finally:
+            collector.shutdown()
+            collector.server_close()
+
+        self.assertEqual(exporter.exported, 2)
+        path, content_type, payload = received[0]
+        self.assertEqual((path, content_type), ("/v1/traces", "application/json"))
+        resource = payload["resourceSpans"][0]
+        self.assertIn(
+            {"key": "service.name", "value": {"stringValue": "test-robot"}},
+            resource["resource"]["attributes"],
+        )
+        grpc_span, tool_span = resource["scopeSpans"][0]["spans"]
+        self.assertEqual(grpc_span["parentSpanId"], tool_span["spanId"])
+        self.assertEqual(grpc_span["traceId"], tool_span["traceId"])
+        self.assertNotIn("parentSpanId", tool_span)
+        self.assertEqual((tool_span["kind"], grpc_span["kind"]), (2, 3))
+        self.assertIn({"key": "tool", "value": {"stringValue": "move_shelf"}}, tool_span["attributes"])
+        self.assertLessEqual(int(tool_span["startTimeUnixNano"]), int(grpc_span["startTimeUnixNano"]))
+
+    def test_drops_spans_when_collector_is_down(self):
+        """コレクターに接続できない場合はスパンを捨てて処理を続けること"""
+        exporter = OTLPExporter("http://127.0.0.1:9/v1/traces", interval_sec=0.01, timeout_sec=0.5)
+        tracer = Tracer(1.0, exporter=exporter)
+        with tracer.span("tool/speak", "tool"):
+            pass
+        tracer.close()
+        self.assertEqual((exporter.exported, exporter.dropped), (0, 1))
+
+
+class TestServerSpans(unittest.TestCase):
+    """ツール呼び出しのスパンのテスト"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        server_module._reset_context()
+
+    def tearDown(self):
+        server_module._reset_context()
+        self.tmp.cleanup()
+
+    def test_tool_call_is_split_into_phases(self):
+        """ツール呼び出しをコンテキストの取得・ハンドラー・gRPC の呼び出しに分けて記録すること"""
+        config = KachakaMCPConfig(trace_sample_rate=1.0, trace_dir=self.tmp.name, journal_enabled=False)
+        client = MagicMock()
+        client.stub = FakeStub()
+        context = server_module.KachakaMCPContext(client, config)
+        server_module.current_context = context
+        mcp = server_module.KachakaFastMCP("test")
+
+        @mcp.tool()
+        async def get_pose() -> str:
+            response = await server_module.get_context().kachaka_client.stub.GetRobotPose(pb2.GetRequest())
+            return str(response.pose.x)
+
+        asyncio.run(mcp.call_tool("get_pose", {}))
+        context.tracer.close()
+
+        events = read_events(self.tmp.name)
+        self.assertEqual(
+            [e["name"] for e in events],
+            ["get_context", "grpc/GetRobotPose", "handler", "tool/get_pose"],
+        )
+        self.assertEqual(len({e["tid"] for e in events}), 1)
+        self.assertEqual(events[-1]["args"]["tool"], "get_pose")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests for network transports.
+"""
+
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+from kachaka_mcp import server as server_module
+from kachaka_mcp.transport import SessionLimitMiddleware
+
+
+class TestSharedContext(unittest.TestCase):
+    """セッション間のコンテキスト共有のテスト"""
+
+    def setUp(self):
+        server_module._reset_context()
+        server_module.keep_context_alive(False)
+
+    def tearDown(self):
+        server_module._reset_context()
+        server_module.keep_context_alive(False)
+
+    def test_sessions_share_context(self):
+        """複数セッションが同じコンテキストを共有し、最後の終了時にリセットされること"""
+        async def run():
+            async with server_module.kachaka_lifespan(None) as first:
+                async with server_module.kachaka_lifespan(None) as second:
+                    self.assertIs(first, second)
+                # 1つ目のセッションが残っている間は保持される
+                self.assertIs(server_module.current_context, first)
+            self.assertIsNone(server_module.current_context)
+
+        with patch("kachaka_mcp.server.KachakaApiClient", MagicMock()):
+            asyncio.run(run())
+
+    def test_keep_context_alive(self):
+        """keep_context_alive の場合、セッションが0になってもコンテキストを保持すること"""
+        async def run():
+            async with server_module.kachaka_lifespan(None) as context:
+                pass
+            self.assertIs(server_module.current_context, context)
+
+        server_module.keep_context_alive(True)
+        with patch("kachaka_mcp.server.KachakaApiClient", MagicMock()):
+            asyncio.run(run())
+
+
+class TestSessionLimitMiddleware(unittest.TestCase):
+    """同時セッション数制限のテスト"""
+
+    def test_rejects_over_limit(self):
+        """上限を超えたセッションに503を返すこと"""
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+
+        async def run():
+            middleware = SessionLimitMiddleware(app, "/sse", max_sessions=1)
+            scope = {"type": "http", "method": "GET", "path": "/sse"}
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            first = asyncio.create_task(middleware(scope, None, send))
+            await asyncio.sleep(0)
+            self.assertEqual(middleware.active_sessions, 1)
+
+            await middleware(scope, None, send)
+            self.assertEqual(sent[0]["status"], 503)
+            self.assertIn((b"retry-after", b"5"), sent[0]["headers"])
+
+            release.set()
+            await first
+            self.assertEqual(middleware.active_sessions, 0)
+
+            # セッション以外のリクエストは数えない
+            await middleware({"type": "http", "method": "POST", "path": "/messages/"}, None, send)
+            self.assertEqual(middleware.active_sessions, 0)
+            self.assertEqual(len(sent), 2)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+Tests for occupancy grid decoding and travel estimates.
+"""
+
+import asyncio
+import io
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from kachaka_api.util.geometry import MapImage2DGeometry
+from PIL import Image as PILImage
+
+from kachaka_mcp.cache import TTLCache
+from kachaka_mcp.occupancy import FREE, OCCUPIED, UNKNOWN, OccupancyGrid
+from kachaka_mcp.travel import TravelModel, get_travel_model
+from kachaka_mcp.utils.config import KachakaMCPConfig
+
+
+def make_png_map(pixels: np.ndarray, resolution=0.05, origin=(0.0, 0.0, 0.0)) -> pb2.Map:
+    """輝度の配列からPNG形式のマップを作成"""
+    buffer = io.BytesIO()
+    PILImage.fromarray(pixels.astype(np.uint8)).save(buffer, "PNG")
+    return pb2.Map(
+        data=buffer.getvalue(),
+        resolution=resolution,
+        width=pixels.shape[1],
+        height=pixels.shape[0],
+        origin=pb2.Pose(x=origin[0], y=origin[1], theta=origin[2]),
+    )
+
+
+def walled_room() -> np.ndarray:
+    """10m x 5m の部屋（中央に下側だけ通れる壁がある）"""
+    pixels = np.full((100, 200), 244)
+    pixels[:3, :] = pixels[-3:, :] = 0
+    pixels[:, :3] = pixels[:, -3:] = 0
+    pixels[:70, 98:102] = 0
+    return pixels
+
+
+class TestOccupancyGrid(unittest.TestCase):
+    """占有格子のテスト"""
+
+    def test_decode(self):
+        """輝度から走行可能・障害物・未観測を判定すること"""
+        pixels = np.array([[244, 0, 200]])
+        grid = OccupancyGrid.from_png_map(make_png_map(pixels), "map-1")
+        self.assertEqual(grid.data.tolist(), [[FREE, OCCUPIED, UNKNOWN]])
+        self.assertEqual((grid.width, grid.height, grid.map_id), (3, 1, "map-1"))
+
+    def test_transform_matches_kachaka_api(self):
+        """座標変換が kachaka_api の MapImage2DGeometry と一致すること"""
+        png_map = make_png_map(walled_room(), origin=(-3.0, 2.0, 0.4))
+        grid = OccupancyGrid.from_png_map(png_map)
+        geometry = MapImage2DGeometry(png_map)
+        pixels = np.array([[0.0, 0.0], [12.0, 34.0], [199.0, 99.0]])
+        for pixel, world in zip(pixels, grid.pixel_to_world(pixels)):
+            expected = geometry.calculate_robot_pose_matrix_from_pixel(tuple(pixel))[:2, 2]
+            np.testing.assert_allclose(world, expected)
+        np.testing.assert_allclose(grid.world_to_pixel(grid.pixel_to_world(pixels)), pixels, atol=1e-9)
+
+
+class TestTravelModel(unittest.TestCase):
+    """経路長の推定のテスト"""
+
+    def setUp(self):
+        self.grid = OccupancyGrid.from_png_map(make_png_map(walled_room()))
+        self.model = TravelModel(self.grid, robot_radius=0.2, cell_size=0.1, speed=0.5)
+
+    def test_path_around_wall(self):
+        """壁を回り込む経路長を返すこと"""
+        start, goal = (2.5, 3.0), (7.5, 3.0)
+        self.assertEqual(self.model.precompute([start]), 1)
+        estimate = self.model.estimate(start, goal)
+        self.assertTrue(estimate["reachable"])
+        self.assertEqual(estimate["straight_line_m"], 5.0)
+        # 壁の下端（y=1.5付近）を回り込むため直線距離より長い
+        self.assertGreater(estimate["path_length_m"], 6.0)
+        self.assertLess(estimate["path_length_m"], 7.5)
+        self.assertAlmostEqual(estimate["eta_sec"], estimate["path_length_m"] / 0.5, places=0)
+        # 経路長は対称
+        self.assertAlmostEqual(self.model.path_length(goal, start), self.model.path_length(start, goal), places=4)
+
+    def test_moved_points_leave_registered_fields(self):
+        """登録から外れた位置の距離場は件数に上限のあるキャッシュに移ること"""
+        model = TravelModel(self.grid, robot_radius=0.2, cell_size=0.1, max_cached_fields=2)
+        shelves = [(2.5, 3.0), (2.5, 4.0), (2.5, 2.0)]
+        self.assertEqual(model.precompute(shelves), 3)
+        # 棚が移動すると古い位置の距離場は登録から外れる
+        for i in range(5):
+            shelves = [(7.5, 3.0 + 0.5 * i)]
+            model.precompute(shelves)
+            self.assertEqual(len(model._registered), 1)
+            self.assertLessEqual(len(model._recent), 2)
+        # 戻ってきた位置は計算し直さずに登録する
+        self.assertEqual(model.precompute([(7.5, 4.5), (7.5, 5.0)]), 0)
+
+    def test_unreachable(self):
+        """地図の外や閉じた領域には到達できないこと"""
+        self.assertFalse(self.model.estimate((2.5, 3.0), (50.0, 50.0))["reachable"])
+        pixels = walled_room()
+        pixels[:, 98:102] = 0
+        model = TravelModel(OccupancyGrid.from_png_map(make_png_map(pixels)))
+        self.assertIsNone(model.path_length((2.5, 3.0), (7.5, 3.0)))
+
+    def test_snap_near_wall(self):
+        """壁際の位置は走行可能なセルに寄せること"""
+        length = self.model.path_length((0.2, 2.5), (2.0, 2.5))
+        self.assertIsNotNone(length)
+        self.assertAlmostEqual(length, 1.8, delta=0.2)
+
+    def test_distance_matrix(self):
+        """距離行列が path_length と一致すること"""
+        points = np.array([[2.5, 3.0], [7.5, 3.0], [5.0, 0.5]])
+        matrix = self.model.distance_matrix(points, points)
+        for i in range(3):
+            for j in range(3):
+                self.assertAlmostEqual(matrix[i, j], self.model.path_length(points[i], points[j]), places=3)
+
+
+class TestGetTravelModel(unittest.TestCase):
+    """経路長の推定モデルのキャッシュのテスト"""
+
+    def setUp(self):
+        self.kitchen = [2.5, 3.0]
+        client = MagicMock()
+        client.get_current_map_id = AsyncMock(return_value="map-1")
+        client.get_png_map = AsyncMock(return_value=make_png_map(walled_room()))
+        client.get_locations = AsyncMock(side_effect=lambda: [
+            pb2.Location(id="L01", name="Kitchen", pose=pb2.Pose(x=self.kitchen[0], y=self.kitchen[1])),
+        ])
+        client.get_shelves = AsyncMock(side_effect=lambda: [])
+        self.client = client
+        self.tasks = []
+        context = MagicMock()
+        context.kachaka_client = client
+        context.config = KachakaMCPConfig()
+        context.cache = TTLCache(30.0)
+        context.travel_model = None
+        context.travel_model_source = None
+        context.lifecycle.spawn.side_effect = lambda coro, name="": self.tasks.append(asyncio.ensure_future(coro))
+        self.context = context
+
+    def test_decoded_once_per_map(self):
+        """同じマップでは1回だけ変換し、マップが変わったら作り直すこと"""
+        async def run():
+            first = await get_travel_model(self.context)
+            second = await get_travel_model(self.context)
+            await asyncio.gather(*self.tasks)
+            self.client.get_current_map_id.return_value = "map-2"
+            self.context.cache.invalidate("current_map_id")
+            third = await get_travel_model(self.context)
+            await asyncio.gather(*self.tasks)
+            return first, second, third
+
+        first, second, third = asyncio.run(run())
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertEqual(third.map_id, "map-2")
+        self.assertEqual(self.client.get_png_map.await_count, 2)
+        self.assertEqual(len(first._registered), 1)
+
+    def test_precompute_keyed_on_poses(self):
+        """一覧を読み込み直しても位置が同じなら計算し直さず、待たずにモデルを返すこと"""
+        async def run():
+            model = await get_travel_model(self.context)
+            # 事前の計算はバックグラウンドで行う
+            pending = not self.tasks[0].done()
+            await asyncio.gather(*self.tasks)
+            for key in ("locations", "shelves"):
+                self.context.cache.invalidate(key)
+            await get_travel_model(self.context)
+            unchanged = len(self.tasks)
+            self.kitchen[0] = 7.5
+            for key in ("locations", "shelves"):
+                self.context.cache.invalidate(key)
+            await get_travel_model(self.context)
+            await asyncio.gather(*self.tasks)
+            return model, pending, unchanged
+
+        model, pending, unchanged = asyncio.run(run())
+        self.assertTrue(pending)
+        self.assertEqual(unchanged, 1)
+        self.assertEqual(len(self.tasks), 2)
+        self.assertTrue(model.has_field(int(model.snap([(7.5, 3.0)])[0][0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
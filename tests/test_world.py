@@ -0,0 +1,99 @@
+"""
+Tests for the world snapshot.
+"""
+
+import asyncio
+import io
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from PIL import Image as PILImage
+
+from kachaka_mcp.auth import RateLimiter
+from kachaka_mcp.cache import TTLCache
+from kachaka_mcp.utils.config import RateLimitConfig
+from kachaka_mcp.world import build_world_snapshot
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    """テスト用のJPEG画像を作成"""
+    output = io.BytesIO()
+    PILImage.new("RGB", (width, height), color=(0, 128, 255)).save(output, format="JPEG")
+    return output.getvalue()
+
+
+def make_context():
+    """テスト用のコンテキストを作成"""
+    client = MagicMock()
+    client.get_robot_pose = AsyncMock(return_value=pb2.Pose(x=1.0, y=2.0, theta=0.5))
+    client.get_battery_info = AsyncMock(return_value=(80.0, pb2.POWER_SUPPLY_STATUS_DISCHARGING))
+    client.get_command_state = AsyncMock(return_value=(pb2.COMMAND_STATE_UNSPECIFIED, None))
+    client.get_locations = AsyncMock(return_value=[
+        pb2.Location(id="L01", name="Kitchen", pose=pb2.Pose(x=3.0, y=0.0)),
+    ])
+    client.get_shelves = AsyncMock(return_value=[
+        pb2.Shelf(id="S01", name="Shelf A", pose=pb2.Pose(x=0.0, y=1.0), home_location_id="L01"),
+    ])
+    client.get_front_camera_ros_compressed_image = AsyncMock(
+        return_value=pb2.RosCompressedImage(format="jpeg", data=make_jpeg(640, 480))
+    )
+
+    async def slow_detection():
+        await asyncio.sleep(1.0)
+
+    client.get_object_detection = slow_detection
+
+    context = MagicMock()
+    context.kachaka_client = client
+    context.cache = TTLCache(30.0)
+    return context
+
+
+class TestWorldSnapshot(unittest.TestCase):
+    """ワールドスナップショットのテスト"""
+
+    def test_snapshot(self):
+        """要素を並行して取得し、失敗とキャッシュを記録すること"""
+        context = make_context()
+
+        async def run():
+            first, image = await build_world_snapshot(context, timeout_sec=0.05, thumbnail_size=160)
+            second, _ = await build_world_snapshot(context, timeout_sec=0.05, camera="")
+            return first, image, second
+
+        first, image, second = asyncio.run(run())
+
+        self.assertEqual(first["parts"]["status"]["data"]["pose"], {"x": 1.0, "y": 2.0, "yaw": 0.5})
+        self.assertEqual(first["parts"]["locations"]["data"][0]["name"], "Kitchen")
+        self.assertEqual(first["failed"], ["object_detection"])
+        self.assertEqual(first["parts"]["object_detection"]["error"], "timeout")
+        self.assertEqual(first["cached"], [])
+        self.assertEqual(PILImage.open(io.BytesIO(image)).size, (160, 120))
+
+        # 場所と棚は2回目はキャッシュから返す
+        self.assertEqual(sorted(second["cached"]), ["locations", "shelves"])
+        self.assertNotIn("camera", second["parts"])
+        context.kachaka_client.get_locations.assert_awaited_once()
+
+    def test_camera_rate_limit(self):
+        """カメラ画像の取得に camera クラスのレート制限を適用すること"""
+        context = make_context()
+        limiter = RateLimiter({"camera": RateLimitConfig(rate_per_sec=0.1, burst=1)})
+
+        async def run():
+            first, image = await build_world_snapshot(context, timeout_sec=0.05, rate_limiter=limiter)
+            second, rejected = await build_world_snapshot(context, timeout_sec=0.05, rate_limiter=limiter)
+            return first, image, second, rejected
+
+        first, image, second, rejected = asyncio.run(run())
+        self.assertIsNotNone(image)
+        self.assertIsNone(rejected)
+        self.assertNotIn("camera", first["failed"])
+        self.assertIn("camera", second["failed"])
+        self.assertIn("Rate limit exceeded for camera", second["parts"]["camera"]["error"])
+        context.kachaka_client.get_front_camera_ros_compressed_image.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()